@@ -0,0 +1,278 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # WCI-RULES model: benchmarks
+#
+# Times key steps of the model, using the online data input file & CIR or local copies in a folder,
+# and compares with stored baselines (from an earlier run on the same computer).
+#
+# Note: the files bundled in folder 'data' are for model version 1.0, which the current model can't read;
+# they're rejected as --data-dir. Use the online files, or a folder with files for the current model version.
+#
+# Benchmarks:
+# * load_input_files: read data input file & CIR
+# * hindcast_default: process_allowance_supply_CA_QC, with default settings (all auctions sell out)
+# * hindcast_custom_auctions: process_allowance_supply_CA_QC, with many years in which auctions don't sell out
+# * supply_demand_calculations: for default run
+# * create_export_df: for default run
+#
+# For each benchmark, reports runtime (median & min over repeats) and peak memory (Python allocations, using tracemalloc).
+#
+# Usage (from the folder containing WCI_RULES_model.py):
+# * python WCI_RULES_benchmarks.py --data-dir online: run all benchmarks, compare with baseline (if any)
+# * python WCI_RULES_benchmarks.py --data-dir online --save-baseline: run all benchmarks, save results as new baseline
+# * python WCI_RULES_benchmarks.py --data-dir online --only hindcast_default --repeat 3
+# * python WCI_RULES_benchmarks.py --data-dir data/synthetic_hist_2016Q4: use synthetic input files
+#   (see WCI_RULES_synthetic_inputs.py); baselines are stored separately for each data folder
+
+# In[ ]:
+
+
+import os
+import sys
+import time
+import json
+import argparse
+import statistics
+import tracemalloc
+
+BASELINE_PATH = f"{os.path.dirname(os.path.abspath(__file__))}/data/benchmark_baseline.json"
+
+# a benchmark is flagged as slower (or using more memory) if it exceeds its baseline by more than this fraction
+REGRESSION_TOLERANCE = 0.10
+
+
+# ## Functions: Benchmark scenarios
+# * bench_load_input_files
+# * bench_hindcast_default
+# * bench_hindcast_custom_auctions
+# * bench_supply_demand_calculations
+# * bench_create_export_df
+# * restore_default_run
+
+# In[ ]:
+
+
+def restore_default_run(model):
+    """
+    Resets user settings & scenario objects to the default run (all auctions sell out).
+
+    Used before & after each benchmark, so that each starts from the same state.
+    """
+    model.prmt.years_not_sold_out = ()
+    model.prmt.fract_not_sold = float(0)
+
+    model.scenario_CA.snaps_end = model.prmt.CA_snaps_end_default_run_end
+    model.scenario_QC.snaps_end = model.prmt.QC_snaps_end_default_run_end
+    model.scenario_CA.snaps_CIR = model.prmt.CA_snaps_end_default_run_CIR
+    model.scenario_QC.snaps_CIR = model.prmt.QC_snaps_end_default_run_CIR
+# end of restore_default_run
+
+
+def bench_load_input_files(model):
+    model.load_input_files()
+# end of bench_load_input_files
+
+
+def bench_hindcast_default(model):
+    # force full hindcast, instead of using saved default run
+    model.prmt.saved_auction_run_default = False
+    try:
+        model.process_allowance_supply_CA_QC()
+    finally:
+        model.prmt.saved_auction_run_default = True
+# end of bench_hindcast_default
+
+
+def bench_hindcast_custom_auctions(model):
+    # heavy scenario: auctions in every projection year have unsold allowances
+    model.prmt.years_not_sold_out = tuple(range(2020, 2030+1))
+    model.prmt.fract_not_sold = 0.5
+
+    model.prmt.saved_auction_run_default = False
+    try:
+        model.process_allowance_supply_CA_QC()
+    finally:
+        model.prmt.saved_auction_run_default = True
+# end of bench_hindcast_custom_auctions
+
+
+def bench_supply_demand_calculations(model):
+    model.supply_demand_calculations()
+# end of bench_supply_demand_calculations
+
+
+def bench_create_export_df(model):
+    model.create_export_df()
+# end of bench_create_export_df
+
+
+BENCHMARKS = {
+    'load_input_files': bench_load_input_files,
+    'hindcast_default': bench_hindcast_default,
+    'hindcast_custom_auctions': bench_hindcast_custom_auctions,
+    'supply_demand_calculations': bench_supply_demand_calculations,
+    'create_export_df': bench_create_export_df,
+}
+
+
+# ## Functions: Benchmark runner
+# * set_data_dir
+# * import_model
+# * run_benchmark
+# * compare_with_baseline
+# * main
+
+# In[ ]:
+
+
+def set_data_dir(data_dir):
+    """
+    Sets the data the model reads (must be before model is imported); returns label for baselines.
+
+    data_dir is 'online' (model's default: online versions of input files), or a folder with 
+    data_input_file.xlsx & CIR_file.xlsx (see WCI_RULES_model.use_bundled_data).
+
+    Raises ValueError for the files bundled in folder 'data', which are for model version 1.0.
+    """
+    bundled_dir = f"{os.path.dirname(os.path.abspath(__file__))}/data"
+
+    if data_dir == 'online':
+        os.environ.pop('WCI_RULES_DATA', None)
+        return('online')
+    elif data_dir == 'bundled' or os.path.abspath(data_dir) == bundled_dir:
+        raise ValueError("input files bundled in folder 'data' are for model version 1.0, "
+                         "which the current model can't read; use --data-dir online, "
+                         "or a folder with input files for the current model version")
+    else:
+        # model reads local data, instead of online versions (see WCI_RULES_model.use_bundled_data)
+        os.environ['WCI_RULES_DATA'] = os.path.abspath(data_dir)
+        return(os.path.basename(os.path.abspath(data_dir)))
+# end of set_data_dir
+
+
+def import_model():
+    """
+    Imports the model (which runs initialization & default run) and waits for the default run to finish.
+
+    Returns the model module and the time taken (cold start), in seconds.
+    """
+    t0 = time.perf_counter()
+
+    import WCI_RULES_model as model
+    model.finish_default_run()
+
+    cold_start = time.perf_counter() - t0
+
+    return(model, cold_start)
+# end of import_model
+
+
+def run_benchmark(model, name, repeat):
+    """
+    Runs one benchmark repeat times; returns dict with runtimes (seconds) & peak memory (MB).
+    """
+    runtimes = []
+    peak_mem = 0
+
+    for i in range(repeat):
+        restore_default_run(model)
+
+        tracemalloc.start()
+        t0 = time.perf_counter()
+        try:
+            BENCHMARKS[name](model)
+        finally:
+            runtimes += [time.perf_counter() - t0]
+            peak_mem = max(peak_mem, tracemalloc.get_traced_memory()[1] / 1e6)
+            tracemalloc.stop()
+            restore_default_run(model)
+
+    result = {'runtime_median': statistics.median(runtimes),
+              'runtime_min': min(runtimes),
+              'peak_mem_MB': peak_mem,
+              'repeat': repeat}
+
+    return(result)
+# end of run_benchmark
+
+
+def compare_with_baseline(results, baseline):
+    """
+    Prints table of results, with ratio to baseline for runtime & peak memory.
+
+    Returns list of benchmarks that regressed (by more than REGRESSION_TOLERANCE).
+    """
+    regressions = []
+
+    print(f"{'benchmark':<28} {'median (s)':>11} {'min (s)':>9} {'peak (MB)':>10} {'vs. baseline':>24}")
+    for name, result in results.items():
+        line = (f"{name:<28} {result['runtime_median']:>11.2f} {result['runtime_min']:>9.2f} "
+                f"{result['peak_mem_MB']:>10.1f}")
+
+        if name in baseline:
+            runtime_ratio = result['runtime_median'] / baseline[name]['runtime_median']
+            mem_ratio = result['peak_mem_MB'] / baseline[name]['peak_mem_MB']
+            line += f"   time x{runtime_ratio:.2f}, mem x{mem_ratio:.2f}"
+
+            if runtime_ratio > 1 + REGRESSION_TOLERANCE or mem_ratio > 1 + REGRESSION_TOLERANCE:
+                regressions += [name]
+                line += "  <-- slower"
+        else:
+            line += "   (no baseline)"
+
+        print(line)
+
+    return(regressions)
+# end of compare_with_baseline
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks for WCI-RULES model.")
+    parser.add_argument('--only', nargs='+', choices=list(BENCHMARKS.keys()), default=list(BENCHMARKS.keys()))
+    parser.add_argument('--repeat', type=int, default=1)
+    parser.add_argument('--save-baseline', action='store_true')
+    parser.add_argument('--data-dir', required=True,
+                        help="'online' (online input files), or folder with data_input_file.xlsx & CIR_file.xlsx "
+                             "for the current model version")
+    args = parser.parse_args()
+
+    # (must be set before model is imported)
+    try:
+        data_label = set_data_dir(args.data_dir)
+    except ValueError as error:
+        parser.error(str(error))
+
+    model, cold_start = import_model()
+    print(f"cold start (import, initialization & default run): {cold_start:.2f} s")
+    print(f"data input file version: {model.prmt.data_input_file_version}; run_tests: {model.prmt.run_tests}")
+
+    results = {}
+    for name in args.only:
+        results[name] = run_benchmark(model, name, args.repeat)
+
+    # baselines are stored for each data folder
+    if os.path.exists(BASELINE_PATH):
+        with open(BASELINE_PATH) as f:
+            baselines = json.load(f)
+    else:
+        baselines = {}
+    baseline = baselines.get(data_label, {})
+
+    print(f"data: {data_label}")
+    regressions = compare_with_baseline(results, baseline)
+
+    if args.save_baseline == True:
+        baseline.update(results)
+        baselines[data_label] = baseline
+        with open(BASELINE_PATH, 'w') as f:
+            json.dump(baselines, f, indent=1)
+        print(f"saved baseline to {BASELINE_PATH}")
+        regressions = []
+
+    return(1 if regressions != [] else 0)
+# end of main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,521 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # WCI-RULES model: golden-output regression harness
+#
+# Records reference ("golden") outputs of the model for a matrix of scenarios,
+# and compares the outputs of any engine implementation against them.
+#
+# Outputs recorded for each scenario:
+# * snaps_end: ledger at the end of each quarter, for CA & QC
+# * step_digests: totals by acct_name & status of the ledger returned by each step
+#   (each fn in prmt.profile_step_fns), for each call, in order
+# * supply_ann, bank_cumul, unsold_auct_hold_cur_sum
+# * reserve metrics: reserve_accts, reserve_sales_excl_PCU, PCU_sales_cumul
+# * government holding metrics: gov_holding, gov_plus_private
+# * CP_metrics: compliance period metrics (from compile_compliance_period_metrics_for_export)
+# * export_df
+# * CIR_reconciliation: model vs. historical CIRs, for all quarters, accounts & vintages (from reconcile_snaps_vs_CIR)
+# * ledger_compaction: settings of end-of-quarter compaction (see compact_ledger), which change the row layout
+#   of snaps_end for terminal accounts; if golden outputs were recorded with different settings (or before
+#   compaction was added), snaps_end of both are folded the same way before comparing (see fold_terminal_rows)
+#
+# When an engine's outputs differ from the golden outputs, the report is localized to
+# the first quarter in which snaps_end diverge, and (if the engine runs the same steps)
+# the first step (rule) whose ledger diverges.
+#
+# An engine is any module with the same interface as WCI_RULES_model (default); see option --engine.
+#
+# Usage (from the folder containing WCI_RULES_model.py):
+# * python WCI_RULES_golden_outputs.py --data-dir online --record: run all scenarios, save outputs as golden outputs
+# * python WCI_RULES_golden_outputs.py --data-dir online: run all scenarios, compare with golden outputs
+# * python WCI_RULES_golden_outputs.py --data-dir online --only default unsold_2020_2030_50pct --exact
+# * python WCI_RULES_golden_outputs.py --data-dir online --engine WCI_RULES_model_fast --tolerance 1e-6
+# * python WCI_RULES_golden_outputs.py --data-dir data/synthetic_hist_2016Q4: use synthetic input files
+#   (see WCI_RULES_synthetic_inputs.py); golden outputs are stored separately for each data folder
+#
+# --data-dir is 'online' (online versions of input files) or a folder with input files for the current model version;
+# the files bundled in folder 'data' are for model version 1.0, which the current model can't read, and are rejected.
+#
+# Golden outputs are not committed (they're large pickles, specific to the input files & pandas version; 
+# data/golden_outputs is gitignored). Before the first comparison, record them once from a known-good commit:
+#   git checkout <known-good commit> && python WCI_RULES_golden_outputs.py --data-dir online --record
+#   git checkout <commit to test> && python WCI_RULES_golden_outputs.py --data-dir online
+# Without golden outputs, each scenario is reported as failing ("no golden outputs").
+
+# In[ ]:
+
+
+import os
+import sys
+import argparse
+import importlib
+
+import pandas as pd
+
+GOLDEN_DIR = f"{os.path.dirname(os.path.abspath(__file__))}/data/golden_outputs"
+
+# default absolute tolerance for numerical comparisons (units: MMTCO2e)
+DEFAULT_TOLERANCE = 1e-9
+
+
+# ## Functions: Scenarios
+# * apply_scenario
+# * restore_default_settings
+
+# In[ ]:
+
+
+# each scenario sets user settings that otherwise come from the user interface
+# (keys not specified keep their default values)
+SCENARIOS = {
+    'default': {},
+    'unsold_2020_2030_50pct': {'years_not_sold_out': tuple(range(2020, 2030+1)), 'fract_not_sold': 0.5},
+    'unsold_2022_2024_25pct': {'years_not_sold_out': (2022, 2023, 2024), 'fract_not_sold': 0.25},
+    'unsold_2026_100pct': {'years_not_sold_out': (2026,), 'fract_not_sold': 1.0},
+    'emissions_high_offsets_full': {'em_pct_CA': 0.01, 'em_pct_QC': 0.01, 'off_pct_of_limit': 1.0},
+    'emissions_low_offsets_none': {'em_pct_CA': -0.05, 'em_pct_QC': -0.05, 'off_pct_of_limit': 0.0},
+    'unsold_2021_2025_50pct_emissions_low': {'years_not_sold_out': (2021, 2022, 2023, 2024, 2025),
+                                             'fract_not_sold': 0.5,
+                                             'em_pct_CA': -0.04, 'em_pct_QC': -0.04},
+}
+
+
+def apply_scenario(model, settings):
+    """
+    Sets user settings for scenario, in prmt & in widgets read by the model.
+
+    Uses the simple tabs for emissions & offsets, and the custom tab for auctions (if years_not_sold_out specified).
+    """
+    model.prmt.years_not_sold_out = settings.get('years_not_sold_out', ())
+    model.prmt.fract_not_sold = float(settings.get('fract_not_sold', 0))
+
+    if model.prmt.years_not_sold_out != ():
+        model.auction_tabs.selected_index = 1
+    else:
+        model.auction_tabs.selected_index = 0
+
+    model.emissions_tabs.selected_index = 0
+    model.em_pct_CA_simp.slider.value = settings.get('em_pct_CA', -0.02)
+    model.em_pct_QC_simp.slider.value = settings.get('em_pct_QC', -0.02)
+
+    model.offsets_tabs.selected_index = 0
+    model.off_pct_of_limit_CAQC.slider.value = settings.get(
+        'off_pct_of_limit', model.prmt.offset_rate_fract_of_limit_default)
+# end of apply_scenario
+
+
+def restore_default_settings(model):
+    """
+    Resets user settings & scenario objects to the default run (all auctions sell out).
+    """
+    apply_scenario(model, {})
+
+    model.scenario_CA.snaps_end = model.prmt.CA_snaps_end_default_run_end
+    model.scenario_QC.snaps_end = model.prmt.QC_snaps_end_default_run_end
+    model.scenario_CA.snaps_CIR = model.prmt.CA_snaps_end_default_run_CIR
+    model.scenario_QC.snaps_CIR = model.prmt.QC_snaps_end_default_run_CIR
+# end of restore_default_settings
+
+
+# ## Functions: Recording outputs
+# * step_digest_wrapper
+# * run_scenario
+# * golden_path
+# * save_golden_outputs
+# * load_golden_outputs
+
+# In[ ]:
+
+
+def step_digest_wrapper(model, fn, digests):
+    """
+    Returns version of fn that appends a digest of the ledger it returns to the list digests.
+
+    Digest is the ledger's totals by juris, acct_name & status (with quarter & step),
+    which is enough to find the first step at which two engines diverge.
+    """
+    def digested_step(*args, **kwargs):
+        result = fn(*args, **kwargs)
+
+        # process_QC returns tuple (scenario_QC, all_accts_QC); use last df returned
+        ledgers = [obj for obj in (result if isinstance(result, tuple) else (result,))
+                   if isinstance(obj, pd.DataFrame) and 'quant' in obj.columns]
+        if ledgers != []:
+            totals = ledgers[-1].groupby(level=['juris', 'acct_name', 'status'])['quant'].sum()
+            digests.append({'quarter': str(model.cq.date), 'step': fn.__name__, 'totals': totals})
+
+        return(result)
+
+    digested_step.__wrapped__ = fn
+    return(digested_step)
+# end of step_digest_wrapper
+
+
+def run_scenario(model, settings):
+    """
+    Runs full model (auctions & supply-demand calculations) for scenario settings; returns dict of outputs.
+    """
+    restore_default_settings(model)
+    apply_scenario(model, settings)
+
+    # wrap step functions, to record step digests
+    # (model fns call each other through module globals, so replacing module attributes is enough)
+    digests = []
+    for fn_name in model.prmt.profile_step_fns:
+        if hasattr(model, fn_name):
+            setattr(model, fn_name, step_digest_wrapper(model, getattr(model, fn_name), digests))
+
+    # force full run, instead of using saved default run
+    # (with snaps_end for all quarters, and snaps_CIR for all quarters for reconcile_snaps_vs_CIR; 
+    # by default, only quarters used by metrics are kept; see snapshot_policy_for_outputs)
+    snapshot_outputs = model.prmt.snapshot_outputs
+    model.prmt.snapshot_outputs = snapshot_outputs + ['snaps_end', 'snaps_CIR']
+    model.prmt.saved_auction_run_default = False
+    try:
+        model.process_allowance_supply_CA_QC()
+    finally:
+        model.prmt.saved_auction_run_default = True
+        model.prmt.snapshot_outputs = snapshot_outputs
+        for fn_name in model.prmt.profile_step_fns:
+            fn = getattr(model, fn_name, None)
+            if hasattr(fn, '__wrapped__'):
+                setattr(model, fn_name, fn.__wrapped__)
+
+    # also runs create_export_df
+    model.supply_demand_calculations()
+    
+    CIR_reconciliation = model.reconcile_snaps_vs_CIR()
+
+    outputs = {
+        'snaps_end_CA': [snap.copy() for snap in model.scenario_CA.snaps_end],
+        'snaps_end_QC': [snap.copy() for snap in model.scenario_QC.snaps_end],
+        'step_digests': digests,
+        'supply_ann': model.prmt.supply_ann.copy(),
+        'bank_cumul': model.prmt.bank_cumul.copy(),
+        'unsold_auct_hold_cur_sum': model.prmt.unsold_auct_hold_cur_sum.copy(),
+        'reserve_accts': model.prmt.reserve_accts.copy(),
+        'reserve_sales_excl_PCU': model.prmt.reserve_sales_excl_PCU.copy(),
+        'PCU_sales_cumul': model.prmt.PCU_sales_cumul.copy(),
+        'gov_holding': model.prmt.gov_holding.copy(),
+        'gov_plus_private': model.prmt.gov_plus_private.copy(),
+        'CP_metrics': model.compile_compliance_period_metrics_for_export(),
+        'export_df': model.prmt.export_df.copy(),
+        'CIR_reconciliation': CIR_reconciliation[['model', 'CIR', 'residual']].copy(),
+        'ledger_compaction': ledger_compaction_settings(model),
+    }
+
+    restore_default_settings(model)
+
+    return(outputs)
+# end of run_scenario
+
+
+def golden_path(data_label, scenario):
+    return(f"{GOLDEN_DIR}/{data_label}/{scenario}.pkl")
+# end of golden_path
+
+
+def save_golden_outputs(outputs, data_label, scenario):
+    path = golden_path(data_label, scenario)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.to_pickle(outputs, path)
+    return(path)
+# end of save_golden_outputs
+
+
+def load_golden_outputs(data_label, scenario):
+    path = golden_path(data_label, scenario)
+    if os.path.exists(path):
+        return(pd.read_pickle(path))
+    else:
+        return(None)
+# end of load_golden_outputs
+
+
+# ## Functions: Comparing outputs
+# * ledger_compaction_settings
+# * fold_terminal_rows
+# * diff_frames
+# * first_divergent_quarter
+# * first_divergent_step
+# * compare_outputs
+
+# In[ ]:
+
+
+def ledger_compaction_settings(model):
+    """
+    Returns settings of the model that change the row layout of snaps_end (see compact_ledger).
+    """
+    return({'ledger_compaction': getattr(model.prmt, 'ledger_compaction', 'off'),
+            'ledger_compaction_min_ratio': getattr(model.prmt, 'ledger_compaction_min_ratio', None)})
+# end of ledger_compaction_settings
+
+
+def fold_terminal_rows(model, snaps):
+    """
+    Returns copies of snaps with rows in terminal accounts folded as compact_ledger does,
+    so that ledgers recorded with & without compaction can be compared row by row.
+
+    Only rows in prmt.ledger_terminal_accts change; totals are unchanged.
+    """
+    folded = []
+    for snap in snaps:
+        snap_q = snap['snap_q'].iat[0]
+        terminal_mask = snap.index.get_level_values('acct_name').isin(model.prmt.ledger_terminal_accts)
+        terminal = model.multiindex_change(snap.loc[terminal_mask, ['quant']].copy(), model.prmt.ledger_fold_levels)
+        snap = pd.concat([snap.loc[~terminal_mask, ['quant']], terminal], sort=False)
+        snap = snap.groupby(level=model.prmt.standard_MI_names).sum()
+        snap['snap_q'] = snap_q
+        folded += [snap]
+
+    return(folded)
+# end of fold_terminal_rows
+
+
+def diff_frames(ref, new, tolerance):
+    """
+    Compares two Series or DataFrames (aligned on index & columns); returns DataFrame of cells that differ,
+    with columns 'ref', 'new', 'diff' (empty if none differ).
+
+    Numerical cells differ if abs(new - ref) > tolerance (or, with tolerance == 0, if not bit-for-bit equal);
+    other cells (e.g., metadata text in export_df) differ if not equal.
+    A cell present in only one of ref & new is treated as missing (NaN) in the other.
+    """
+    if isinstance(ref, pd.Series):
+        ref = ref.to_frame('value')
+    if isinstance(new, pd.Series):
+        new = new.to_frame('value')
+
+    ref, new = ref.align(new, join='outer')
+    ref = ref.stack(dropna=False)
+    new = new.stack(dropna=False)
+
+    ref_num = pd.to_numeric(ref, errors='coerce')
+    new_num = pd.to_numeric(new, errors='coerce')
+    numeric = ref_num.notnull() & new_num.notnull()
+
+    if tolerance == 0:
+        differs = numeric & (ref_num.values != new_num.values)
+    else:
+        differs = numeric & ((new_num - ref_num).abs() > tolerance)
+
+    # non-numerical cells (& cells missing on one side)
+    both_missing = ref.isnull() & new.isnull()
+    differs = differs | (~numeric & ~both_missing & (ref.astype(str) != new.astype(str)))
+
+    diffs = pd.DataFrame({'ref': ref.loc[differs], 'new': new.loc[differs]})
+    diffs['diff'] = new_num.loc[differs] - ref_num.loc[differs]
+
+    return(diffs)
+# end of diff_frames
+
+
+def first_divergent_quarter(ref_snaps, new_snaps, tolerance):
+    """
+    Compares ledgers at end of each quarter, in order; returns (quarter, diffs) for first quarter that differs,
+    or (None, None) if all quarters match.
+    """
+    for i in range(max(len(ref_snaps), len(new_snaps))):
+        if i >= len(new_snaps):
+            return(str(ref_snaps[i]['snap_q'].iat[0]), "quarter missing from new outputs")
+        elif i >= len(ref_snaps):
+            return(str(new_snaps[i]['snap_q'].iat[0]), "quarter missing from golden outputs")
+
+        ref_snap = ref_snaps[i]
+        new_snap = new_snaps[i]
+        quarter = str(ref_snap['snap_q'].iat[0])
+
+        diffs = diff_frames(ref_snap[['quant']], new_snap[['quant']], tolerance)
+        if str(new_snap['snap_q'].iat[0]) != quarter:
+            return(quarter, f"new outputs have quarter {new_snap['snap_q'].iat[0]} instead")
+        elif len(diffs) > 0:
+            return(quarter, diffs)
+
+    return(None, None)
+# end of first_divergent_quarter
+
+
+def first_divergent_step(ref_digests, new_digests, tolerance):
+    """
+    Compares step digests, matched by quarter, step & nth call of step in quarter;
+    returns (quarter, step, diffs) for first step (in golden order) that differs,
+    or (None, None, None) if all match.
+
+    If the new engine doesn't run a step that's in the golden outputs, that step is skipped
+    (so an engine that replaces some steps can still be localized by the steps it shares).
+    """
+    def keyed(digests):
+        counts = {}
+        keyed_digests = {}
+        for digest in digests:
+            n = counts.get((digest['quarter'], digest['step']), 0)
+            counts[(digest['quarter'], digest['step'])] = n + 1
+            keyed_digests[(digest['quarter'], digest['step'], n)] = digest['totals']
+        return(keyed_digests)
+
+    ref_keyed = keyed(ref_digests)
+    new_keyed = keyed(new_digests)
+
+    for key, ref_totals in ref_keyed.items():
+        if key not in new_keyed:
+            continue
+        diffs = diff_frames(ref_totals, new_keyed[key], tolerance)
+        if len(diffs) > 0:
+            return(key[0], key[1], diffs)
+
+    return(None, None, None)
+# end of first_divergent_step
+
+
+def compare_outputs(ref, new, tolerance):
+    """
+    Compares all outputs of scenario; prints report; returns list of names of outputs that differ.
+    """
+    differing = []
+
+    # ledgers: localize to first quarter & step
+    for juris in ['CA', 'QC']:
+        quarter, diffs = first_divergent_quarter(ref[f'snaps_end_{juris}'], new[f'snaps_end_{juris}'], tolerance)
+        if quarter != None:
+            differing += [f'snaps_end_{juris}']
+            print(f"  snaps_end_{juris}: first divergent quarter: {quarter}")
+            if isinstance(diffs, str):
+                print(f"    {diffs}")
+            else:
+                print(f"    {len(diffs)} ledger rows differ; largest differences:")
+                print(diffs.reindex(diffs['diff'].abs().sort_values(ascending=False).index).head(10).to_string())
+
+    quarter, step, diffs = first_divergent_step(ref['step_digests'], new['step_digests'], tolerance)
+    if step != None:
+        differing += ['step_digests']
+        print(f"  first divergent step (rule): {step}, in {quarter}")
+        print(diffs.head(10).to_string())
+
+    # annual metrics, export & model vs. CIR residuals
+    for name in ['supply_ann', 'bank_cumul', 'unsold_auct_hold_cur_sum',
+                 'reserve_accts', 'reserve_sales_excl_PCU', 'PCU_sales_cumul',
+                 'gov_holding', 'gov_plus_private', 'CP_metrics', 'export_df', 'CIR_reconciliation']:
+        if name not in ref:
+            # golden outputs recorded before this output was added
+            print(f"  {name}: not in golden outputs (run with --record to add)")
+            continue
+        diffs = diff_frames(ref[name], new[name], tolerance)
+        if len(diffs) > 0:
+            differing += [name]
+            print(f"  {name}: {len(diffs)} values differ; first:")
+            print(diffs.head(5).to_string())
+
+    return(differing)
+# end of compare_outputs
+
+
+# ## Functions: Harness runner
+# * set_data_dir
+# * import_engine
+# * main
+
+# In[ ]:
+
+
+def set_data_dir(data_dir):
+    """
+    Sets the data the model reads (must be before model is imported); returns label for golden outputs folder.
+
+    data_dir is 'online' (model's default: online versions of input files), or a folder with 
+    data_input_file.xlsx & CIR_file.xlsx (see WCI_RULES_model.use_bundled_data).
+
+    Raises ValueError for the files bundled in folder 'data', which are for model version 1.0.
+    """
+    bundled_dir = f"{os.path.dirname(os.path.abspath(__file__))}/data"
+
+    if data_dir == 'online':
+        os.environ.pop('WCI_RULES_DATA', None)
+        return('online')
+    elif data_dir == 'bundled' or os.path.abspath(data_dir) == bundled_dir:
+        raise ValueError("input files bundled in folder 'data' are for model version 1.0, "
+                         "which the current model can't read; use --data-dir online, "
+                         "or a folder with input files for the current model version")
+    else:
+        # model reads local data, instead of online versions (see WCI_RULES_model.use_bundled_data)
+        os.environ['WCI_RULES_DATA'] = os.path.abspath(data_dir)
+        return(os.path.basename(os.path.abspath(data_dir)))
+# end of set_data_dir
+
+
+def import_engine(engine_name):
+    """
+    Imports engine module (which runs initialization & default run) and waits for the default run to finish.
+    """
+    engine = importlib.import_module(engine_name)
+    engine.finish_default_run()
+
+    return(engine)
+# end of import_engine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Golden-output regression harness for WCI-RULES model.")
+    parser.add_argument('--only', nargs='+', choices=list(SCENARIOS.keys()), default=list(SCENARIOS.keys()))
+    parser.add_argument('--record', action='store_true',
+                        help="save outputs as golden outputs (instead of comparing)")
+    parser.add_argument('--engine', default='WCI_RULES_model',
+                        help="module with same interface as WCI_RULES_model; default WCI_RULES_model")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help=f"absolute tolerance for numerical values; default {DEFAULT_TOLERANCE}")
+    parser.add_argument('--exact', action='store_true', help="require bit-for-bit equality (tolerance 0)")
+    parser.add_argument('--data-dir', required=True,
+                        help="'online' (online input files), or folder with data_input_file.xlsx & CIR_file.xlsx "
+                             "for the current model version")
+    args = parser.parse_args()
+
+    tolerance = 0 if args.exact == True else args.tolerance
+
+    # (must be set before model is imported)
+    try:
+        data_label = set_data_dir(args.data_dir)
+    except ValueError as error:
+        parser.error(str(error))
+
+    engine = import_engine(args.engine)
+    print(f"engine: {args.engine}; data: {data_label}; tolerance: {tolerance}")
+
+    failed = []
+    for scenario in args.only:
+        outputs = run_scenario(engine, SCENARIOS[scenario])
+
+        if args.record == True:
+            path = save_golden_outputs(outputs, data_label, scenario)
+            print(f"{scenario}: saved golden outputs to {path}")
+            continue
+
+        ref = load_golden_outputs(data_label, scenario)
+        if ref is None:
+            print(f"{scenario}: no golden outputs (run with --record first)")
+            failed += [scenario]
+            continue
+
+        print(f"{scenario}:")
+        if ref.get('ledger_compaction') != outputs['ledger_compaction']:
+            # golden outputs recorded with other compaction settings; rerun with --record to update them
+            print(f"  note: golden outputs recorded with ledger compaction {ref.get('ledger_compaction')}; "
+                  f"comparing snaps_end with terminal accounts folded")
+            for juris in ['CA', 'QC']:
+                ref[f'snaps_end_{juris}'] = fold_terminal_rows(engine, ref[f'snaps_end_{juris}'])
+                outputs[f'snaps_end_{juris}'] = fold_terminal_rows(engine, outputs[f'snaps_end_{juris}'])
+        differing = compare_outputs(ref, outputs, tolerance)
+        if differing == []:
+            print("  all outputs match")
+        else:
+            failed += [scenario]
+
+    if failed != []:
+        print(f"scenarios that differ from golden outputs: {', '.join(failed)}")
+
+    return(1 if failed != [] else 0)
+# end of main
+
+
+if __name__ == '__main__':
+    sys.exit(main())
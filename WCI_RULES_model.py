@@ -78,6 +78,19 @@ from datetime import datetime
 import os
 import inspect # for getting name of current function
 import logging
+import sys # for sys._getframe in trace
+import functools # for step profiler
+import tracemalloc # for step profiler (optional allocation tracking)
+
+import threading
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED # for initialization task graph
+import asyncio # for awaiting default run in notebook
+import pickle # for default run artifact
+
+import io
+import json
+import hashlib # for input file hashes
+import urllib.request
 
 
 # In[ ]:
@@ -220,12 +233,23 @@ class Prmt():
         self.model_version = '1.1'
         
         self.run_online_GCP = True # to run model using online version of data input file & CIR, set to True
+        # local versions of input files, used if run_online_GCP == False (see fn use_bundled_data)
+        self.local_input_file_path = '/Users/masoninman/Dropbox/cap_and_trade_active_dev/data/WCI-RULES_data_input_file.xlsx'
+        self.local_CIR_file_path = '/Users/masoninman/Dropbox/cap_and_trade_active_dev/data/Compliance_Instrument_Report.xlsx'
         
         self.years_not_sold_out = () # initialization; value set by user interface
         self.fract_not_sold = float(0) # initialization; value set by user interface
         
         self.run_tests = True
+        # ledger invariant checks; independent of run_tests, so they can stay on when other tests are off
+        # 'sum_per_step': conservation checked after each step (one sum of the quant column per step), 
+        # other invariants once per quarter, with failures reported together at end of quarter; 
+        # 'per_step': all tests after each step (full scans); 'off': no checks
+        self.invariant_checks = 'sum_per_step'
+        self.invariant_state = {} # value set by fns check_ledger_invariants & report_ledger_invariants_quarter
+        self.invariant_failures = [] # all failures in model run; value set by fn report_ledger_invariants_quarter
         self.verbose_log = True
+        self.trace_level = logging.CRITICAL + 1 # tracing off; set by fn update_trace_level
         self.test_failed_msg = 'Test failed!: '   
         
         self.model_results = '/Users/masoninman/Dropbox/cap_and_trade_active_dev_model_results/'
@@ -257,6 +281,19 @@ class Prmt():
         
         self.NaT_proxy = pd.to_datetime('2200Q1').to_period('Q')
         
+        # end-of-quarter compaction of all_accts; see fn compact_ledger
+        self.ledger_compaction = 'fold' # 'fold', 'merge', or 'off'
+        # accounts from which allowances don't move again, except by sum over vintage (e.g., negative QC true-ups)
+        self.ledger_terminal_accts = ['gen_acct', 'retirement']
+        # index levels that rules don't read for rows in terminal accounts; folded to these values
+        self.ledger_fold_levels = {'newness': 'n/a', 'date_level': self.NaT_proxy, 
+                                   'unsold_di': self.NaT_proxy, 'unsold_dl': self.NaT_proxy}
+        # compaction only when it would reduce rows by enough to pay for itself: 
+        # fragmentation ratio (rows / rows after compaction) at least this value
+        self.ledger_compaction_min_ratio = 1.1
+        self.ledger_telemetry_records = [] # value set by fn compact_ledger; reset by fn initialize_all_accts
+        self.ledger_telemetry = '' # value set by fn process_allowance_supply_CA_QC
+        
         self.standard_MI_names = ['acct_name', 'juris', 'auct_type', 'inst_cat', 'vintage', 'newness', 'status', 
                                   'date_level', 'unsold_di', 'unsold_dl', 'units']
         
@@ -270,6 +307,38 @@ class Prmt():
         self.CIR_columns = ['gen_comp', 'limited_use', 'VRE_acct', 'A_I_A', 'retirement', 'APCR_acct', 
                             'env_integrity', 'subtotal']
         
+        # mappings from model to CIR format; see fn turn_snaps_into_CIR
+        # acct_name to CIR column ('A_I_A' is shorthand for CIR column "Auction + Issuance + Allocation")
+        self.CIR_acct_map = {'alloc_hold': 'A_I_A', 'ann_alloc_hold': 'A_I_A', 'auct_hold': 'A_I_A', 
+                             'gen_acct': 'gen_comp', 'comp_acct': 'gen_comp'}
+        # inst_cat to CIR row (other inst_cat use vintage; any inst_cat containing 'APCR' is also row 'APCR')
+        self.CIR_row_map = {'APCR': 'APCR', 'early_action': 'early_action'}
+        # CIR offsets columns to model acct_name
+        self.CIR_offsets_col_map = {'Auction + Issuance + Allocation': 'A_I_A',
+                                    'Compliance': 'comp_acct', 
+                                    'Environmental Integrity (QC)': 'env_integrity', 
+                                    'General': 'gen_acct', 
+                                    'Limited Use Holding Account (CA)': 'limited_use', 
+                                    'Reserve': 'APCR_acct', 
+                                    'Invalidation': 'invalidation',
+                                    'Voluntary Renewable Electricity (CA)': 'VRE_acct', 
+                                    'Retirement': 'retirement'}
+        # CIR allowances columns (prmt.CIR_historical) to CIR format; see fn reconcile_snaps_vs_CIR
+        self.CIR_historical_col_map = {'Auction + Issuance + Allocation': 'A_I_A', 
+                                       'Compliance': 'gen_comp', 
+                                       'General': 'gen_comp', 
+                                       'Environmental Integrity': 'env_integrity', 
+                                       'Limited Use Holding Account': 'limited_use', 
+                                       'Reserve': 'APCR_acct', 
+                                       'Retirement': 'retirement', 
+                                       'Voluntary Renewable Electricity': 'VRE_acct', 
+                                       'subtotal': 'subtotal'}
+        
+        # tolerances for flagging residuals in model vs. CIR; see fn reconcile_snaps_vs_CIR
+        self.CIR_reconciliation_tol_abs = 0.001 # units MMTCO2e
+        self.CIR_reconciliation_tol_rel = 0.001 # fraction of CIR value
+        self.CIR_reconciliation = '' # value set by fn reconcile_snaps_vs_CIR
+        
         # default based on ARB assumption in Post-2020 Caps report; see func offsets_projection for more information
         self.offset_rate_fract_of_limit_default = 0.75
         
@@ -375,6 +444,21 @@ class Prmt():
         self.CA_snaps_end_default_run_CIR = [] # initialize
         self.QC_snaps_end_default_run_CIR = [] # initialize
         
+        # outputs that model runs need to capture snapshots for; see fn snapshot_policy_for_outputs
+        # ('supply_demand': only quarters used by supply_demand_calculations; add 'snaps_end', 'snaps_CIR' or 'all' 
+        # to capture all quarters)
+        self.snapshot_outputs = ['supply_demand']
+        self.snapshot_policy = {'end': 'all', 'CIR': 'all'} # value set by fn initialize_all_accts
+        self.balance_cube = '' # value set by fn create_balance_cube (quarter x acct_name x juris x vintage array)
+        self.snaps_index = {} # keyed by (juris, kind); values set by fn snaps_index
+        self.ensemble_accum = '' # optional; set by user to an Ensemble_accum, fed by fn supply_demand_calculations
+        self.ensemble_summary = '' # optional; set by user to Ensemble_accum.summary(), for fan charts in create_figures
+        
+        # reuse results for historical quarters across model runs with the same data inputs; see fn historical_cache
+        self.memoize_historical = True
+        self.historical_cache = {} # keyed by fn historical_cache_key; values set by fns using historical_cache
+        self.historical_cache_max_entries = 4 # least recently used entries evicted beyond this; see fn historical_cache
+        
         self.snaps_end_Q4 = '' # value filled in by fn load_input_files
         self.snaps_end_Q4_sum = '' # value filled in by fn load_input_files
         
@@ -382,6 +466,77 @@ class Prmt():
         self.error_msg_post_refresh = []
         
         self.data_input_file_version = '' # value set by fn load_input_files
+        self.input_file_hash = '' # value set by fn load_input_file_data
+        self.CIR_file_hash = '' # value set by fn load_input_file_CIR
+        
+        self.input_validation_in_background = True # run tests of input consistency in a background thread
+        self.input_validation_future = '' # value set at start of model run, if validation is in background
+        self.input_validation_outcome = '' # value set by fn run_input_validation
+        
+        self.init_max_workers = 4 # threads for initialization task graph; set to 1 to run tasks one at a time
+        self.init_task_timings = '' # value set by fn run_init_task_graph
+        self.init_critical_path = [] # value set by fn run_init_task_graph
+        
+        # to create interface widgets while default run is processed in background, set to True
+        # notebook then shows figure after awaiting finish_default_run_async
+        # if False, default run and figure are done before model import finishes
+        self.prefetch_default_run = True
+        self.init_future = '' # value set at start of model run
+        self.default_run_future = '' # value set by fn start_default_run_prefetch
+        self.init_produced = {} # prmt attribute name: threading.Event, set when init task producing it finishes
+        self.default_run_finished = False # value set by fn finish_default_run
+        
+        # precomputed default run, saved for each data input file version; see save_default_run_artifact
+        self.use_default_run_artifact = True # to always calculate default run at startup, set to False
+        self.build_default_run_artifact = False # for a new data release, set to True to save artifact at end of import
+        self.default_run_artifact_loaded = False # value set by fn load_default_run_artifact
+        self.default_run_artifact_snaps = ['CA_snaps_end_default_run_end', 'QC_snaps_end_default_run_end', 
+                                           'CA_snaps_end_default_run_CIR', 'QC_snaps_end_default_run_CIR']
+        # attributes set by supply_demand_calculations; includes all data for create_figures
+        self.default_run_artifact_results = [
+            'emissions_ann', 'emissions_ann_CA', 'emissions_ann_QC', 
+            'CA_QC_obligations_fulfilled_hist', 'CA_QC_obligations_fulfilled_hist_proj', 
+            'allow_vint_ann', 'allow_nonvint_ann', 'offsets_supply_q', 'offsets_supply_ann', 'off_proj_first_date', 
+            'supply_ann', 'bank_cumul', 'reserve_PCU_sales_cumul', 'PCU_sales_cumul', 
+            'reserve_accts', 'reserve_sales_excl_PCU', 'unsold_auct_hold_cur_sum', 
+            'gov_holding', 'gov_plus_private', 'excess_offsets', 
+            'export_df', 'js_download_of_csv']
+        
+        # opt-in profiler for quarterly simulation loop; see fn profile_steps_start
+        self.profile_steps = False # to record time, ledger rows (& allocations) per quarter per step, set to True
+        self.profile_allocations = False # if True, also track memory allocations (using tracemalloc; slower)
+        self.profile_dir = os.getcwd() # directory for Chrome trace file
+        self.profile_step_fns = [
+            'process_CA', 'process_QC', 'process_CA_quarterly', 'process_QC_quarterly', 
+            # start-of-quarter & start-of-year steps
+            'retire_for_bankruptcy', 'retire_for_EIM_outstanding', 'transfer_CA_alloc__from_ann_alloc_hold_to_general', 
+            'transfer_cur__from_alloc_hold_to_auct_hold_first_principles', 
+            'cur_upsample_avail_state_owned_first_principles', 'upsample_advance_all_accts', 
+            'convert_QC_alloc_set_aside', 'transfer_QC_alloc_init__from_alloc_hold', 
+            'retire_for_net_flow_from_Ontario', 
+            # make available, redesignate, auction
+            'CA_state_owned_make_available', 'QC_state_owned_make_available', 'consign_make_available_incl_redes', 
+            'redesignate_unsold_advance_as_advance', 'redesignate_unsold_current_auct', 
+            'process_auction_adv_all_accts', 'process_auction_cur_CA_all_accts', 'process_auction_cur_QC_all_accts', 
+            # transfers after auction
+            'transfer_unsold__from_auct_hold_to_APCR', 'transfer_CA_alloc__from_alloc_hold', 
+            'consign_groupby_sum_in_all_accts', 'adv_unsold_to_cur_all_accts', 'process_reserve_sales_historical', 
+            'transfer__from_VRE_acct_to_retirement', 'transfer_consign__from_limited_use_to_auct_hold', 
+            'transfer_QC_alloc_trueups__from_alloc_hold', 'transfer_QC_alloc_trueups_neg__to_reserve', 
+            'QC_early_action_distribution', 
+            # snapshots & tracking
+            'take_snapshot_CIR', 'take_snapshot_end', 'avail_accum_append', 'compact_ledger', 
+            # tests
+            'test_conservation_simple', 'test_for_duplicated_indices', 'test_for_negative_values', 
+            'test_conservation_against_full_budget', 'check_ledger_invariants', 'report_ledger_invariants_quarter']
+        self.step_profile = '' # value set by fn profile_steps_finish
+        self.step_profile_summary = '' # value set by fn profile_steps_finish
+        self.step_profile_trace_path = '' # value set by fn profile_steps_finish
+        
+        # opt-in memory accounting per phase of model run; see fn memory_phase_end
+        self.memory_accounting = False # to record memory per phase (& ledger bytes per step in profiler), set to True
+        self.memory_min_bytes_to_report = 1e6 # prmt frames smaller than this are reported together
+        self.memory_report = {} # value set by fn memory_phase_end; keys are phases
         
         self.save_timestamp = ''
 
@@ -441,14 +596,74 @@ except:
     pass
 
 
+# In[ ]:
+
+
+def update_trace_level():
+    """
+    Sets prmt.trace_level, based on logging configuration and prmt.verbose_log.
+    
+    If no log handler is configured (the normal case, except on developer's local computer), tracing is off.
+    
+    Call again after changing logging configuration or prmt.verbose_log.
+    """
+    root_logger = logging.getLogger()
+    
+    if root_logger.handlers == [] or root_logger.isEnabledFor(logging.INFO) == False:
+        # tracing off
+        prmt.trace_level = logging.CRITICAL + 1
+    elif prmt.verbose_log == True:
+        # also record traces with level=logging.DEBUG
+        prmt.trace_level = logging.DEBUG
+    else:
+        prmt.trace_level = logging.INFO
+# end of update_trace_level
+
+
+def trace(event, level=logging.INFO, **context):
+    """
+    Level-gated, structured tracing of model steps.
+    
+    When level is below prmt.trace_level (always the case when tracing is off), returns immediately, 
+    without looking up the calling function or formatting any message.
+    
+    When tracing is on, logs the calling function's name, the event (e.g., 'start', 'end'), 
+    the current quarter (cq.date), and any context passed as keywords (e.g., juris, quantity moved).
+    
+    Keyword values that are callable are only evaluated when tracing is on;
+    use for quantities that are costly to calculate, e.g., quant=lambda: df['quant'].sum()
+    
+    Use level=logging.DEBUG for traces that should only be recorded when prmt.verbose_log == True.
+    """
+    if level < prmt.trace_level:
+        return
+    
+    fn_name = sys._getframe(1).f_code.co_name
+    
+    msg = f"{fn_name} ({event}); quarter: {cq.date}"
+    for key, value in context.items():
+        if callable(value):
+            value = value()
+        msg += f"; {key}: {value}"
+    
+    logging.info(msg)
+# end of trace
+
+
+update_trace_level()
+
+
 # # START OF FUNCTIONS
 
 # ## Functions: Housekeeping
 # * multiindex_change
+# * create_standard_MI_df
 # * convert_ser_to_df_MI
 # * convert_ser_to_df_MI_CA_alloc
 # * convert_ser_to_df_MI_QC_alloc
 # * quarter_period
+# * model_data_dir
+# * use_bundled_data
 
 # In[ ]:
 
@@ -466,11 +681,7 @@ def multiindex_change(df, mapping_dict):
     mapping_dict is dictionary with each key = level_name & each value = ''
     """
     
-    if prmt.verbose_log == True:
-        try:
-            logging.info(f"{inspect.currentframe().f_code.co_name}")
-        except:
-            logging.info(f"initialization: {inspect.currentframe().f_code.co_name}")
+    trace('run', level=logging.DEBUG)
 
     # get index names before changing anything
     df_index_names = df.index.names
@@ -494,6 +705,50 @@ def multiindex_change(df, mapping_dict):
 # In[ ]:
 
 
+def create_standard_MI_df(quant, level_values):
+    """
+    Housekeeping function: creates df with standard MultiIndex (prmt.standard_MI_names) and column 'quant',
+    building the index directly from arrays (rather than with reset_index & set_index).
+    
+    quant is array-like (or Series) of quantities.
+    
+    level_values is dict with each key = level_name & each value = either a single value for all rows, 
+    or an array-like with one value per row.
+    
+    Levels not in level_values get default values:
+    'n/a' for auct_type, newness, status; prmt.NaT_proxy for date_level, unsold_di, unsold_dl; 'MMTCO2e' for units.
+    """
+    
+    defaults = {'auct_type': 'n/a', 
+                'newness': 'n/a', 
+                'status': 'n/a', 
+                'date_level': prmt.NaT_proxy, 
+                'unsold_di': prmt.NaT_proxy, 
+                'unsold_dl': prmt.NaT_proxy, 
+                'units': 'MMTCO2e'}
+    
+    quant = np.asarray(quant)
+    
+    arrays = []
+    for level_name in prmt.standard_MI_names:
+        value = level_values.get(level_name, defaults.get(level_name))
+        
+        if isinstance(value, (list, tuple, np.ndarray, pd.Series, pd.Index)):
+            arrays += [list(value)]
+        else:
+            # single value for all rows
+            arrays += [[value] * len(quant)]
+    
+    MI = pd.MultiIndex.from_arrays(arrays, names=prmt.standard_MI_names)
+    df = pd.DataFrame({'quant': quant}, index=MI)
+    
+    return(df)
+# end of create_standard_MI_df
+
+
+# In[ ]:
+
+
 def convert_ser_to_df_MI(ser):
     """
     Converts certain Series into MultiIndex df. Works for cap, APCR, advance, VRE.
@@ -503,68 +758,45 @@ def convert_ser_to_df_MI(ser):
     Housekeeping function.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start), for {ser.name}")
-    
-    df = pd.DataFrame(ser)
-    
-    if len(df.columns) == 1:
-        df.columns = ['quant']
-    else:
-        print("Error" + "! In convert_cap_to_MI, len(df.columns==1) was False.")
+    trace('start', series=ser.name)
     
     if ser.name.split('_')[0] in ['CA', 'VRE']:
         juris = 'CA'
     elif ser.name.split('_')[0] == 'QC':
         juris = 'QC'
-        
-    df.index.name = 'vintage'
-    df = df.reset_index()
-
+    
     # default metadata values are for cap
-    df['acct_name'] = 'alloc_hold'
-    df['juris'] = juris # established above
-    df['inst_cat'] = 'cap'
-    # vintage already assigned above
-    df['auct_type'] = 'n/a'
-    df['newness'] = 'n/a'
-    df['status'] = 'n/a'
-    df['date_level'] = prmt.NaT_proxy
-    df['unsold_di'] = prmt.NaT_proxy
-    df['unsold_dl'] = prmt.NaT_proxy
-    df['units'] = 'MMTCO2e'
-
+    level_values = {'acct_name': 'alloc_hold', 
+                    'juris': juris, # established above
+                    'inst_cat': 'cap', 
+                    'vintage': ser.index, 
+                    'auct_type': 'n/a', 
+                    'newness': 'n/a', 
+                    'status': 'n/a'}
+    
     # overwrite metadata for other sets of instruments
     if 'CA_APCR_2013_2020' in ser.name:
-        df['acct_name'] = 'APCR_acct'
-        df['inst_cat'] = 'APCR'
-        df['auct_type'] = 'reserve'    
+        level_values.update({'acct_name': 'APCR_acct', 'inst_cat': 'APCR', 'auct_type': 'reserve'})
     elif 'CA_APCR_2021_2030_Oct2017' in ser.name:
         # retain in alloc_hold
-        df['inst_cat'] = 'APCR'
+        level_values.update({'inst_cat': 'APCR'})
         # retain as auct_type = 'reserve', since these allowances can't be sold until put in reserve account
     elif 'CA_APCR_2021_2030_Apr2019_add_MI' in ser.name:
-        df['acct_name'] = 'APCR_acct'
-        df['inst_cat'] = 'APCR'
-        df['auct_type'] = 'reserve'
+        level_values.update({'acct_name': 'APCR_acct', 'inst_cat': 'APCR', 'auct_type': 'reserve'})
     elif 'QC_APCR' in ser.name:
-        df['acct_name'] = 'APCR_acct'
-        df['inst_cat'] = 'APCR'
-        df['auct_type'] = 'reserve'
+        level_values.update({'acct_name': 'APCR_acct', 'inst_cat': 'APCR', 'auct_type': 'reserve'})
     elif 'advance' in ser.name:
-        df['acct_name'] = 'auct_hold'
-        df['inst_cat'] = ser.name.split('_')[0] # same as juris
-        df['auct_type'] = 'advance'
-        df['newness'] = 'new'
-        df['status'] = 'not_avail'
+        level_values.update({'acct_name': 'auct_hold', 
+                             'inst_cat': ser.name.split('_')[0], # same as juris
+                             'auct_type': 'advance', 
+                             'newness': 'new', 
+                             'status': 'not_avail'})
     elif 'VRE' in ser.name:
-        df['acct_name'] = 'VRE_acct'
-        # df['juris'] = 'CA'
-        df['inst_cat'] = 'VRE_reserve'
-        df['status'] = 'n/a'
+        level_values.update({'acct_name': 'VRE_acct', 'inst_cat': 'VRE_reserve', 'status': 'n/a'})
     else:
         pass
     
-    df = df.set_index(prmt.standard_MI_names)
+    df = create_standard_MI_df(ser.values, level_values)
     return(df)
 
 
@@ -578,49 +810,30 @@ def convert_ser_to_df_MI_CA_alloc(ser):
     Housekeeping function.
     """
     
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name} (start), for series {ser.name}")
-    
-    df = pd.DataFrame(ser)
-    df.index.name = 'vintage'
-    df = df.reset_index()
+    trace('start', series=ser.name, level=logging.DEBUG)
     
     not_consign_list = ['elec_POU_not_consign', 'nat_gas_not_consign', 'industrial_etc_alloc']
 
     if ser.name in not_consign_list:
-        df['acct_name'] = 'ann_alloc_hold'
-        df['auct_type'] = 'n/a'
-        df['juris'] = 'CA'
-        df = df.rename(columns={'alloc': 'quant'})
+        acct_name = 'ann_alloc_hold'
+        auct_type = 'n/a'
 
     elif ser.name in ['consign_elec_IOU', 'consign_elec_POU', 'consign_nat_gas']:
-        df['acct_name'] = 'limited_use'
-        df['auct_type'] = 'current'
-        df['juris'] = 'CA'
-        df = df.rename(columns={'alloc': 'quant'})
+        acct_name = 'limited_use'
+        auct_type = 'current'
         # don't change newness to new, nor status to not_avail, until consign are in auct_hold
         
     else: # closing 'if alloc.name in not_consign_list:'
         print("Error" + "!: Series name is not in either list above.")
-        
-    # acct_name set above
-    df['date_level'] = prmt.NaT_proxy
-    # juris set above
-    # vintage set above
-    df['inst_cat'] = ser.name
-    # auct_type set above
-    df['newness'] = 'n/a'
-    df['status'] = 'n/a'
-    df['unsold_di'] = prmt.NaT_proxy
-    df['unsold_dl'] = prmt.NaT_proxy
-    df['units'] = 'MMTCO2e'
     
-    # rename column with quantities of allowances from ser.name to 'quant'
-    df = df.rename(columns={ser.name: 'quant'})
-    df_MI = df.set_index(prmt.standard_MI_names)
+    # newness, status, date_level, unsold_di, unsold_dl, units have default values
+    df_MI = create_standard_MI_df(ser.values, {'acct_name': acct_name, 
+                                               'juris': 'CA', 
+                                               'auct_type': auct_type, 
+                                               'inst_cat': ser.name, 
+                                               'vintage': ser.index})
 
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name} (end), for series {ser.name}")
+    trace('end', series=ser.name, level=logging.DEBUG)
     
     return(df_MI)
 
@@ -637,7 +850,7 @@ def convert_ser_to_df_MI_QC_alloc(ser, alloc_type):
     Housekeeping function.
     """
     
-    logging.info(f"running {inspect.currentframe().f_code.co_name}")
+    trace('run')
     
     # TEST: check that 'QC_alloc' is in series name
     if 'QC_alloc' in ser.name:
@@ -646,36 +859,25 @@ def convert_ser_to_df_MI_QC_alloc(ser, alloc_type):
         print(f"{prmt.test_failed_msg} Series name doesn't contain 'QC_alloc'. Wrong series passed?") # for UI
     # END OF TEST
     
-    df = pd.DataFrame(ser)
-    df.index.name = 'vintage'
-    df = df.reset_index()
-    
     if alloc_type == 'set_aside':
-        df['acct_name'] = 'alloc_hold'
-        df['inst_cat'] = 'QC_alloc_set_aside'
-        df['date_level'] = prmt.NaT_proxy
+        acct_name = 'alloc_hold'
+        inst_cat = 'QC_alloc_set_aside'
+        date_level = prmt.NaT_proxy
     elif alloc_type == 'initial':
-        df['acct_name'] = 'gen_acct'
-        df['inst_cat'] = f'QC_alloc_{cq.date.year}'
-        df['date_level'] = cq.date
+        acct_name = 'gen_acct'
+        inst_cat = f'QC_alloc_{cq.date.year}'
+        date_level = cq.date
     else:
         print(f"{prmt.test_failed_msg} Conversion was neither alloc_type 'set_aside' nor 'initial'.")
     
-    df['auct_type'] = 'n/a'
-    df['juris'] = 'QC'
-    # vintage set above
-    
-    df['newness'] = 'n/a'
-    df['status'] = 'n/a'
-    df['unsold_di'] = prmt.NaT_proxy
-    df['unsold_dl'] = prmt.NaT_proxy
-    df['units'] = 'MMTCO2e'
-
-    df = df.rename(columns={ser.name: 'quant'})
+    # auct_type, newness, status, unsold_di, unsold_dl, units have default values
+    df = create_standard_MI_df(ser.values, {'acct_name': acct_name, 
+                                            'juris': 'QC', 
+                                            'inst_cat': inst_cat, 
+                                            'vintage': ser.index, 
+                                            'date_level': date_level})
 
-    df = df.set_index(prmt.standard_MI_names)
-
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(df)
 
@@ -687,8 +889,7 @@ def quarter_period(year_quart):
     """
     Converts string year_quart (i.e., '2013Q4') into datetime quarterly period.
     """
-    if prmt.verbose_log == True:
-        logging.info(f"running {inspect.currentframe().f_code.co_name}")
+    trace('run', level=logging.DEBUG)
     
     if isinstance(year_quart, pd.Period) == True:
         # don't need to change; already formatted as period
@@ -700,8 +901,57 @@ def quarter_period(year_quart):
     return(period)
 
 
+# In[ ]:
+
+
+def model_data_dir():
+    """
+    Housekeeping function: path of the folder 'data' next to the model code.
+    
+    Used for files saved by the model that are specific to a data release.
+    """
+    
+    try:
+        model_dir = os.path.dirname(os.path.abspath(__file__))
+    except NameError:
+        # running as notebook, which has no __file__
+        model_dir = os.getcwd()
+    
+    return(f"{model_dir}/data")
+# end of model_data_dir
+
+
+# In[ ]:
+
+
+def use_bundled_data(data_dir='bundled'):
+    """
+    Housekeeping function: run model using the data input file & CIR bundled in folder 'data' (see model_data_dir),
+    instead of the online versions.
+    
+    data_dir can instead be another folder with files of the same names (data_input_file.xlsx & CIR_file.xlsx),
+    such as synthetic input files created by WCI_RULES_synthetic_inputs.py.
+    
+    Applied at start of model run if environment variable WCI_RULES_DATA is set to 'bundled' or to a folder 
+    (e.g., for benchmarks).
+    """
+    
+    if data_dir == 'bundled':
+        data_dir = model_data_dir()
+    
+    prmt.run_online_GCP = False
+    prmt.local_input_file_path = f"{data_dir}/data_input_file.xlsx"
+    prmt.local_CIR_file_path = f"{data_dir}/CIR_file.xlsx"
+    
+    logging.info(f"using local data in {data_dir}")
+# end of use_bundled_data
+
+
 # ## Functions: Initialization steps
 # * load_input_files
+#   * load_input_file_data
+#   * load_input_file_CIR
+#   * read_file_bytes
 # * initialize_CA_cap
 # * initialize_CA_APCR
 # * initialize_CA_advance
@@ -728,6 +978,11 @@ def quarter_period(year_quart):
 #   * calculate_QC_alloc_from_APCR__CIR_and_reserve_sales
 # * read_emissions_historical_data
 # * read_reserve_sales_historical
+# * read_CA_cap_data
+# * read_EIM_and_bankruptcy
+# * set_supply_last_hist_yr
+# * create_CA_alloc_MI_all
+# * set_latest_hist_years
 
 # In[ ]:
 
@@ -740,27 +995,59 @@ def load_input_files():
     
     New with Pandas 0.25: use openpyxl library (instead of xlrd) to read Excel files. 
     (Pandas will make openpyxl the default in the future.)
+    
+    The two files are loaded by separate functions, so that the initialization task graph can download them at the
+    same time (see create_init_task_graph).
+    """
+    
+    trace('start')
+    
+    load_input_file_data() # sets prmt.input_file & prmt.data_input_file_version
+    load_input_file_CIR() # sets prmt.CIR_excel
+    
+    trace('end')
+# end load_input_files
+
+
+# In[ ]:
+
+
+def load_input_file_data():
+    """
+    Load the custom data input file for the model, and check its version against the model version.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
-    progress_bar_loading.wid.value += 1 # for progress_bar_loading
+    if on_main_thread() == True:
+        progress_bar_loading.wid.value += 1 # for progress_bar_loading
     
     input_file_name = 'WCI-RULES_data_input_file.xlsx'
 
     # download input file once from Google Cloud Platform, set as an attribute of object prmt    
     if prmt.run_online_GCP == True:
         input_file_URL = f'https://storage.googleapis.com/wci_model_online_file_hosting/{input_file_name}'
-        prmt.input_file = pd.ExcelFile(input_file_URL)
+        input_file_bytes = read_file_bytes(input_file_URL)
+        prmt.input_file = pd.ExcelFile(io.BytesIO(input_file_bytes))
         logging.info(f"read {input_file_name} from URL {input_file_URL}")
     else:
         print("Using local version of data input file.") # for UI
-        input_file_path = f'/Users/masoninman/Dropbox/cap_and_trade_active_dev/data/{input_file_name}'
-        prmt.input_file = pd.ExcelFile(input_file_path)
+        input_file_path = prmt.local_input_file_path
+        input_file_bytes = read_file_bytes(input_file_path)
+        prmt.input_file = pd.ExcelFile(io.BytesIO(input_file_bytes))
         logging.info(f"read {input_file_name} from path {input_file_path}")
+    
+    # hash of file contents; used to skip input validation when file is unchanged (see run_input_validation)
+    prmt.input_file_hash = hashlib.sha256(input_file_bytes).hexdigest()
           
     # get input file version
     contents_sheet = pd.read_excel(prmt.input_file, sheet_name='contents')
+    
+    # input files for model version 1.0 (such as those bundled in folder 'data') have a different contents sheet
+    if 'WCI-RULES model data input file' not in contents_sheet.columns:
+        raise ValueError(f"data input file ({input_file_name}) isn't for model version {prmt.model_version}; "
+                         f"contents sheet starts with: {list(contents_sheet.columns)[0]}, "
+                         f"{contents_sheet.iat[1, 0] if len(contents_sheet) > 1 else ''}")
 
     data_input_file_version = contents_sheet.at[1, 'WCI-RULES model data input file']
     if "input file version" in data_input_file_version:
@@ -783,27 +1070,65 @@ def load_input_files():
         print(f"Error! (cont.) Currently running model version {prmt.model_version}") # for UI
         logging.info(f"Error! Data input file appears to be for the wrong version of the model.")
     # END OF TEST
+    
+    trace('end')
+# end of load_input_file_data
 
-    # ~~~~~~~~~~~~~
-    # CIR quarterly
+
+# In[ ]:
+
+
+def load_input_file_CIR():
+    """
+    Load CARB's quarterly Compliance Instrument Report (CIR).
+    """
+    
+    trace('start')
+    
     CIR_file_name = 'Compliance_Instrument_Report.xlsx'
     
     # download CIR file once from Google Cloud Platform, set as an attribute of object prmt  
     if prmt.run_online_GCP == True:
         CIR_file_URL = f'https://storage.googleapis.com/wci_model_online_file_hosting/{CIR_file_name}'
-        prmt.CIR_excel = pd.ExcelFile(CIR_file_URL)
+        CIR_file_bytes = read_file_bytes(CIR_file_URL)
+        prmt.CIR_excel = pd.ExcelFile(io.BytesIO(CIR_file_bytes))
         CIR_sheet_name_first = pd.ExcelFile(prmt.CIR_excel).sheet_names[0].replace(" ", "")
         logging.info(f"read {CIR_file_name} from URL {CIR_file_URL}, through {CIR_sheet_name_first}")
 
     else:
         print("Using local version of CIR file.") # for UI
-        CIR_file_path = f'/Users/masoninman/Dropbox/cap_and_trade_active_dev/data/{CIR_file_name}'
-        prmt.CIR_excel = pd.ExcelFile(CIR_file_path)
+        CIR_file_path = prmt.local_CIR_file_path
+        CIR_file_bytes = read_file_bytes(CIR_file_path)
+        prmt.CIR_excel = pd.ExcelFile(io.BytesIO(CIR_file_bytes))
         CIR_sheet_name_first = pd.ExcelFile(prmt.CIR_excel).sheet_names[0].replace(" ", "")
         logging.info(f"read {CIR_file_name} from path {CIR_file_path}, through {CIR_sheet_name_first}")
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
-# end load_input_files
+    # hash of file contents; used to skip input validation when file is unchanged (see run_input_validation)
+    prmt.CIR_file_hash = hashlib.sha256(CIR_file_bytes).hexdigest()
+    
+    trace('end')
+# end of load_input_file_CIR
+
+
+# In[ ]:
+
+
+def read_file_bytes(file_location):
+    """
+    Read contents of a file, from either a URL or a local path.
+    
+    Files are read into memory once, so the contents can be both parsed by pd.ExcelFile and hashed.
+    """
+    
+    if file_location.startswith('https://') or file_location.startswith('http://'):
+        with urllib.request.urlopen(file_location) as response:
+            file_bytes = response.read()
+    else:
+        with open(file_location, 'rb') as file:
+            file_bytes = file.read()
+    
+    return(file_bytes)
+# end of read_file_bytes
 
 
 # In[ ]:
@@ -817,7 +1142,7 @@ def initialize_CA_cap():
     * 2032-2050: equation for post-2031 cap
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     df = prmt.CA_cap_data[prmt.CA_cap_data['name']=='CA_cap']
     df = df.set_index('year')['data']
@@ -830,7 +1155,7 @@ def initialize_CA_cap():
     
     prmt.CA_cap = df
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     # no return
 # end of initialize_CA_cap
 
@@ -853,7 +1178,7 @@ def initialize_CA_APCR():
     so Table 8-2 changed. Quantity was increased by 2% of budgets for 2026-2030, which totaled ~22.7 M.
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
 
     # for 2013-2020: get cap & reserve fraction from input file
     # calculate APCR quantities
@@ -901,7 +1226,7 @@ def initialize_CA_APCR():
     prmt.CA_APCR_2021_2030_Apr2019_add_MI = convert_ser_to_df_MI(ser)  
     # ~~~~~~~~~~~~~~
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     # no return
 # end of initialize_CA_APCR
@@ -919,7 +1244,7 @@ def initialize_CA_advance():
     
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     CA_cap = prmt.CA_cap
     CA_cap_data = prmt.CA_cap_data
@@ -932,7 +1257,7 @@ def initialize_CA_advance():
 
     CA_advance_MI = convert_ser_to_df_MI(CA_advance)
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
 
     prmt.CA_advance_MI = CA_advance_MI
     # no return
@@ -946,7 +1271,7 @@ def initialize_VRE_account():
     """
     Transfers allowances from annual budgets to Voluntary Renewable Electricity (VRE) account.
     """
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     CA_cap = prmt.CA_cap
     CA_cap_data = prmt.CA_cap_data
@@ -963,7 +1288,7 @@ def initialize_VRE_account():
 
     VRE_reserve_MI = convert_ser_to_df_MI(VRE_reserve)
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     prmt.VRE_reserve_MI = VRE_reserve_MI
     # no return
@@ -978,7 +1303,7 @@ def get_qauct_hist():
     Read historical auction data from data input file, for CA and QC.
     """
     
-    logging.info(f"initialize: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     # qauct_hist is a full record of auction data, compiled from csvs using another notebook
     qauct_hist = pd.read_excel(prmt.input_file, sheet_name='quarterly auctions')
@@ -1011,7 +1336,7 @@ def get_qauct_hist():
     # test_consistency_inputs_CIR_vs_qauct, cur_upsample_avail_state_owned_first_principles, create_auction_tabs
     prmt.latest_hist_qauct_date = prmt.qauct_hist['date_level'].max()
     
-    logging.info(f"initialize: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     # no return; function sets object attributes
 # end of get_qauct_hist
@@ -1029,7 +1354,7 @@ def create_qauct_new_avail_consign():
     For consignment, any unsold in one quarter are always redesignated to auction in the following quarter.
     
     """
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     # get historical data for quarterly auctions; 
     # filter to keep only consignment allowances
@@ -1048,25 +1373,21 @@ def create_qauct_new_avail_consign():
 
     # assign redesignated allowances: 
     # all consignment unsold in one quarter are necessarily redesignated to the following quarter's auction
-    new_rows_list = [] # initialize
-    for row in df.index:
-        # write values to dictionary for the next quarter
-        new_row_dict = {
-            'market': df.at[row, 'market'], 
-            'date_level': (pd.to_datetime(df.at[row, 'date_level'].to_timestamp()) + DateOffset(months=3)
-                          ).to_period('Q'), 
-            'auct_type': 'current', 
-            'juris': 'CA', 
-            'inst_cat': 'consign', 
-            'vintage': df.at[row, 'vintage'], 
-            'Available': np.NaN,
-            'Unsold': np.NaN,
-            'Redesignated': df.at[row, 'Unsold']}
-
-        new_rows_list.append(new_row_dict)
-
-    # turn dictionary into a df & append to df of historical data
-    df = df.append(pd.DataFrame(new_rows_list), sort=True)
+    # (build all redesignation rows at once, shifting date_level for every row to the next quarter)
+    next_quarter = (df['date_level'].dt.to_timestamp() + DateOffset(months=3)).dt.to_period('Q')
+    redesignated_rows = pd.DataFrame({
+        'market': df['market'].values, 
+        'date_level': next_quarter.reset_index(drop=True), 
+        'auct_type': 'current', 
+        'juris': 'CA', 
+        'inst_cat': 'consign', 
+        'vintage': df['vintage'].values, 
+        'Available': np.NaN,
+        'Unsold': np.NaN,
+        'Redesignated': df['Unsold'].values})
+
+    # append df of redesignated rows to df of historical data
+    df = pd.concat([df, redesignated_rows], sort=True)
     
     # use groupby sum to combine rows for Available, Unsold, Redesignated; eliminates duplicates within metadata
     df = df.groupby(['market', 'date_level', 'auct_type', 'juris', 'inst_cat', 'vintage']).sum()
@@ -1077,28 +1398,24 @@ def create_qauct_new_avail_consign():
     # calculate newly available allowances: all those available that are not redesignated
     df['Newly available'] = df['Available'] - df['Redesignated']
     
-    # drop extraneous columns
-    df = df.reset_index()
-    df = df.drop(['market', 'Available', 'Sold', 'Unsold', 'Redesignated'], axis=1)
-
-    # set values for additional metadata columns, then set index as standard MI
-    df['acct_name'] = 'limited_use' # consignment temporarily sit in limited_use, between alloc_hold and auct_hold
-    df['newness'] = 'new'
-    df['status'] = 'not_avail'
-    df['unsold_di'] = prmt.NaT_proxy
-    df['unsold_dl'] = prmt.NaT_proxy
-    df['units'] = 'MMTCO2e'
-    df = df.set_index(prmt.standard_MI_names)
-    
-    # change name of column
-    df = df.rename(columns={'Newly available': 'quant'})
+    # set values for additional metadata levels; set index as standard MI, with column 'quant'
+    df = create_standard_MI_df(
+        df['Newly available'].values, 
+        {'acct_name': 'limited_use', # consignment temporarily sit in limited_use, between alloc_hold and auct_hold
+         'juris': df.index.get_level_values('juris'), 
+         'auct_type': df.index.get_level_values('auct_type'), 
+         'inst_cat': df.index.get_level_values('inst_cat'), 
+         'vintage': df.index.get_level_values('vintage'), 
+         'newness': 'new', 
+         'status': 'not_avail', 
+         'date_level': df.index.get_level_values('date_level')})
     
     # sort by index
     df = df.sort_index()
     
     consign_new_avail_hist = df
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     return(consign_new_avail_hist)
 # end of create_qauct_new_avail_consign
@@ -1114,7 +1431,7 @@ def get_compliance_events():
     Note that quantities surrendered are *not* the same as the covered emissions that have related obligations.
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")    
+    trace('start', phase='initialization')
     
     # get record of retirements (by vintage) from annual compliance reports
     df = pd.read_excel(prmt.input_file, sheet_name='annual compliance reports')
@@ -1170,7 +1487,7 @@ def get_compliance_events():
     
     prmt.compliance_events = df
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     # no return; func sets object attribute
 # end of get_compliance_events
@@ -1197,7 +1514,7 @@ def late_surrender_adjustment_of_compliance_events(df):
     and therefore late surrenders don’t affect the banking calculation.
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     # prmt.compliance_events is used only for: 1. calculating if there are excess offsets, 2. CIR comparison
     # late surrender from Comision Federal de Electridad consisted of only allowances
@@ -1220,16 +1537,16 @@ def late_surrender_adjustment_of_compliance_events(df):
     neg_adj['compliance_date'] = quarter_period('2015Q4')
     neg_adj = neg_adj.set_index(['compliance_date', 'vintage'])
 
-    adj_and_neg_adj = adj.append(neg_adj)
+    adj_and_neg_adj = pd.concat([adj, neg_adj], sort=False)
 
     # append adj_and_neg_adj to df (argument)
     # then use groupby sum to add values for 2016Q1 and subtract from 2015Q4
-    df = df.append(adj_and_neg_adj)
+    df = pd.concat([df, adj_and_neg_adj], sort=False)
     df = df.groupby(df.index.names).sum()
 
     df = df.sort_index()
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     return(df)
 # end of late_surrender_adjustment_of_compliance_events
@@ -1247,7 +1564,7 @@ def get_CIR_data_and_clean():
     Function outputs have units MMtCO2e. Units converted in functions clean_CIR_allowances & clean_CIR_offsets.
     """
 
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     CIR_sheet_names = pd.ExcelFile(prmt.CIR_excel).sheet_names
     
@@ -1309,7 +1626,7 @@ def get_CIR_data_and_clean():
     df = df.set_index('date')
     prmt.CIR_offsets_q_sums = df
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     # no return; func sets object attributes prmt.CIR_historical & prmt.CIR_offsets_q_sums
 # end of get_CIR_data_and_clean
@@ -1324,7 +1641,7 @@ def clean_CIR_allowances(df):
     
     Runs within function get_CIR_data_and_clean.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     df = df.reset_index(drop=True) 
 
@@ -1373,7 +1690,7 @@ def clean_CIR_allowances(df):
     # convert units to MMTCO2e
     df = df/1e6
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(df)
 # end of clean_CIR_allowances
@@ -1388,7 +1705,7 @@ def clean_CIR_offsets(df):
     
     Runs within function get_CIR_data_and_clean.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
         
     df = df.reset_index(drop=True) 
 
@@ -1462,7 +1779,7 @@ def clean_CIR_offsets(df):
     df['Vintage'] = 'n/a'
     df = df.set_index([df.index, 'Description', 'Vintage'])
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(df)
 # end clean_CIR_offsets
@@ -1478,7 +1795,7 @@ def get_VRE_retired_from_CIR():
     Quantities retired inferred from quarter-to-quarter decreases in VRE account, as shown in CIR.
     
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # as of the latest data available in the version of the Compliance Instrument Report fed in above
     VRE = prmt.CIR_historical[['Voluntary Renewable Electricity']]
@@ -1507,7 +1824,7 @@ def get_VRE_retired_from_CIR():
     # set object attribute
     prmt.VRE_retired = VRE_retired
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     # no return; func sets object attribute prmt.VRE_retired
 # end of get_VRE_retired_from_CIR
@@ -1520,7 +1837,7 @@ def assign_EIM_outstanding():
     """
     Get historical data for EIM Outstanding Emissions retirements and create projection.
     """
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     # used saved df prmt.EIM_and_bankruptcy
     # (avoids openpyxl problem with reading the same Excel sheet twice)
@@ -1544,7 +1861,7 @@ def assign_EIM_outstanding():
     
     prmt.EIM_outstanding = ser
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     # no return
 # end of assign_EIM_outstanding
 
@@ -1562,7 +1879,7 @@ def assign_bankruptcy_noncompliance():
     "CARB will surrender 3,767,027 compliance instruments...".
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     df = prmt.EIM_and_bankruptcy.copy()
     
@@ -1583,7 +1900,7 @@ def assign_bankruptcy_noncompliance():
     
     prmt.bankruptcy_hist_proj = ser
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     # no return; sets prmt.bankruptcy_hist_proj
 # end of assign_bankruptcy_noncompliance
 
@@ -1601,7 +1918,7 @@ def read_CA_alloc_data():
     
     If need be, can add to input file the non-standard for particular process intensive industries.
     """
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     df = pd.read_excel(prmt.input_file, sheet_name='CA allocations')
 
@@ -1613,7 +1930,7 @@ def read_CA_alloc_data():
 
     CA_alloc_data = df
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     return(CA_alloc_data)
 # end of read_CA_alloc_data
@@ -1635,7 +1952,7 @@ def initialize_elec_alloc():
     (also note this does not go through 2031, as cap does)
     """
 
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     # create elec_alloc_2013_2020
 
@@ -1752,7 +2069,7 @@ def initialize_elec_alloc():
 
     # elec_alloc_IOU and elec_alloc_POU are transferred to appropriate accounts later, in consignment section
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     return(elec_alloc_IOU, elec_alloc_POU)
 # end of initialize_elec_alloc
@@ -1779,7 +2096,7 @@ def initialize_nat_gas_alloc(CA_alloc_data):
     # have to use these historical values to calculate 2011 natural gas supplier emissions
     # once 2011 natural gas supplier emissions has been calculated, can use equation in regulations for projections
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     nat_gas_alloc = CA_alloc_data.copy()[CA_alloc_data['name']=='nat_gas_alloc']
     nat_gas_alloc['year'] = nat_gas_alloc['year'].astype(int)
@@ -1808,7 +2125,7 @@ def initialize_nat_gas_alloc(CA_alloc_data):
 
     nat_gas_alloc.name = 'nat_gas_alloc'
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     return(nat_gas_alloc)
 # end of initialize_nat_gas_alloc
@@ -1825,7 +2142,7 @@ def initialize_industrial_etc_alloc(CA_alloc_data):
     Combines these variable allocations into one data set ("industrial and other allocations").
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     industrial_alloc = CA_alloc_data.copy()[CA_alloc_data['name'].isin(
         ['industrial_alloc', 'industrial_and_legacy_gen_alloc'])]
@@ -1976,7 +2293,7 @@ def initialize_industrial_etc_alloc(CA_alloc_data):
                                      axis=1).sum(axis=1)
     industrial_etc_alloc.name = 'industrial_etc_alloc'
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     return(industrial_etc_alloc)
 # end of initialize_industrial_etc_alloc
@@ -1992,7 +2309,7 @@ def read_annual_auction_notices():
     Currently, model only uses the consignment data.
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     df = pd.read_excel(prmt.input_file, sheet_name='annual auction notices')
     
@@ -2011,7 +2328,7 @@ def read_annual_auction_notices():
     
     prmt.consign_ann_hist = df2
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     # no return
 # end of read_annual_auction_notices
@@ -2027,7 +2344,7 @@ def create_consign_historical_and_projection_annual(elec_alloc_IOU, elec_alloc_P
     Starts projection after the latest historical year with data on annual consignment.
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     # create consign_last_hist_yr, used for defining range to iterate over below
     consign_last_hist_yr = prmt.consign_ann_hist.index.max()
@@ -2108,7 +2425,7 @@ def create_consign_historical_and_projection_annual(elec_alloc_IOU, elec_alloc_P
                       nat_gas_not_consign, elec_POU_not_consign]
     consign_df = pd.concat(consign_series, axis=1)
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     return(consign_df)
 # end of create_consign_historical_and_projection_annual
@@ -2126,7 +2443,7 @@ def consign_upsample_historical_and_projection(consign_ann):
     For projection years, calculate average consignment per quarter.
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
 
     # get historical data for consignment newly available in each quarter
     consign_new_avail_hist = create_qauct_new_avail_consign()
@@ -2135,9 +2452,14 @@ def consign_upsample_historical_and_projection(consign_ann):
     # (later will be set equal to prmt.df)
     df = consign_new_avail_hist.copy()
 
-    # create template row for adding additional rows to df
-    template = df.loc[df.index[-1:]]
-    template.at[template.index, 'quant'] = float(0)
+    # metadata for projection rows are taken from last historical row; 
+    # only date_level, vintage, and quant differ among projection rows
+    template_levels = dict(zip(prmt.standard_MI_names, df.index[-1]))
+    
+    # initialize arrays of values for projection rows
+    proj_dates = []
+    proj_vintages = []
+    proj_quants = []
     
     if prmt.latest_hist_qauct_date.quarter < 4:
         # fill in missing quarters for last historical year
@@ -2159,39 +2481,30 @@ def consign_upsample_historical_and_projection(consign_ann):
         avg_consign = consign_remaining / num_remaining_auct
 
         for proj_q in range(prmt.latest_hist_qauct_date.quarter+1, 4+1):
-            proj_date = quarter_period(f"{prmt.latest_hist_qauct_date.year}Q{proj_q}")
-
-            # create new row; update date_level and quantity
-            consign_new_row = template.copy()
-            mapping_dict = {'date_level': proj_date}
-            consign_new_row = multiindex_change(consign_new_row, mapping_dict)
-            consign_new_row.at[consign_new_row.index, 'quant'] = avg_consign
-            
-            # set new value in df
-            df = df.append(consign_new_row)
+            proj_dates += [quarter_period(f"{prmt.latest_hist_qauct_date.year}Q{proj_q}")]
+            proj_vintages += [template_levels['vintage']] # vintage unchanged from last historical row
+            proj_quants += [avg_consign]
 
-    # for years after last historical data year (prmt.latest_hist_qauct_date.year)    
+    # for years after last historical data year (prmt.latest_hist_qauct_date.year)
     for year in range(prmt.latest_hist_qauct_date.year+1, 2030+1):
         avg_consign = consign_ann.loc[year] / 4
 
         for quarter in [1, 2, 3, 4]:
-            proj_date = quarter_period(f"{year}Q{quarter}")
-
-            # create new row; update date_level and quantity
-            consign_new_row = template.copy()
-            mapping_dict = {'date_level': proj_date, 
-                            'vintage': year}
-            consign_new_row = multiindex_change(consign_new_row, mapping_dict)
-
-            consign_new_row.at[consign_new_row.index, 'quant'] = avg_consign
-            
-            # set new value in df
-            df = df.append(consign_new_row)
+            proj_dates += [quarter_period(f"{year}Q{quarter}")]
+            proj_vintages += [year]
+            proj_quants += [avg_consign]
+    
+    # create all projection rows at once, then append to historical data
+    proj_levels = template_levels.copy()
+    proj_levels.update({'date_level': proj_dates, 'vintage': proj_vintages})
+    consign_proj = create_standard_MI_df(proj_quants, proj_levels)
+    
+    df = pd.concat([df, consign_proj])
             
     # set object attribute
     prmt.consign_hist_proj_new_avail = df
 
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
 
     # no return; func sets object attribute prmt.consign_hist_proj_new_avail
 # end of consign_upsample_historical_and_projection
@@ -2204,7 +2517,7 @@ def get_QC_inputs():
     """
     Get values of parameters from data input file for QC cap, advance auctions, APCR.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # get cap values from input sheet (derived from regs)
     df = pd.read_excel(prmt.input_file, sheet_name='QC cap data')
@@ -2251,7 +2564,7 @@ def get_QC_inputs():
     # assume that QC will *not* increase its APCR
     # (even though CA did raise its APCR for 2021-2030, from the Oct 2017 to the Apr 2019 regulations)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     # no return; sets prmt.QC_cap, prmt.QC_advance_MI, prmt.QC_APCR_MI
 # end of get_QC_inputs
@@ -2268,7 +2581,7 @@ def get_QC_allocation_data():
     
     """
     
-    logging.info(f"initialize: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
 
     # get more detailed allocation data (for hindcast)
     df = pd.read_excel(prmt.input_file, sheet_name='QC allocations')
@@ -2318,7 +2631,7 @@ def get_QC_allocation_data():
         QC_alloc_initial_proj_quant = QC_alloc_initial_last_year * cap_adjustment_ratio
         QC_alloc_initial_proj.at[(year, quarter_period(f'{year}Q1')), 'quant'] = QC_alloc_initial_proj_quant
     
-    QC_alloc_initial = QC_alloc_initial.append(QC_alloc_initial_proj)
+    QC_alloc_initial = pd.concat([QC_alloc_initial, QC_alloc_initial_proj], sort=False)
     QC_alloc_initial = QC_alloc_initial.sort_index()
     # local variable; set equal to object attribute at end of function
     
@@ -2393,7 +2706,7 @@ def get_QC_allocation_data():
     prmt.QC_alloc_trueups_neg = QC_alloc_trueups_neg
     prmt.QC_alloc_full_proj = QC_alloc_full_proj
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     # no return; func sets object attributes
 # end of get_QC_allocation_data
@@ -2411,7 +2724,7 @@ def calculate_QC_alloc_from_APCR__CIR_and_reserve_sales():
     This function subtracts any reserve sales, based on input sheet "reserve sales".
     """
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     # get APCR quantities distributed (from CIRs), either for allocations or reserve sales
     # (values are cumulative; units MMTCO2e)
@@ -2467,7 +2780,7 @@ def calculate_QC_alloc_from_APCR__CIR_and_reserve_sales():
     # ~~~~~~~~~~~~~~
     APCR_alloc_distrib = df
     
-    logging.info(f"initialization: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     
     return(APCR_alloc_distrib)
 # end of calculate_QC_alloc_from_APCR__CIR_and_reserve_sales
@@ -2485,7 +2798,7 @@ def read_emissions_historical_data():
     The data used here for compliance obligations excludes EIM Outstanding Emissions.
     """
     
-    logging.info(f"initialize: {inspect.currentframe().f_code.co_name} (start)")
+    trace('start', phase='initialization')
     
     df = pd.read_excel(prmt.input_file, sheet_name='emissions & obligations')
 
@@ -2510,7 +2823,7 @@ def read_emissions_historical_data():
     # set prmt.emissions_and_obligations for historical data; also used in emissions_projection
     prmt.emissions_and_obligations = df
     
-    logging.info(f"initialize: {inspect.currentframe().f_code.co_name} (end)")
+    trace('end', phase='initialization')
     # no return
 # end of read_emissions_historical_data
 
@@ -2572,99 +2885,657 @@ def read_reserve_sales_historical():
 # end of read_reserve_sales_historical
 
 
-# ## Functions: Tests
-# * test_consistency_inputs_CIR_vs_qauct
-# * test_consistency_inputs_annual_data
-# * test_consistency_CA_alloc
-# * test_cols_and_indexes_before_transfer
-# * test_for_duplicated_indices
-# * test_if_value_is_float_or_np_float64
-# * test_for_negative_values
-# * test_conservation_during_transfer
-# * test_conservation_simple
-# * test_conservation_against_full_budget
-
 # In[ ]:
 
 
-def test_consistency_inputs_CIR_vs_qauct(CA_alloc_latest_yr, QC_alloc_latest_yr):
+def read_CA_cap_data():
     """
-    Checks for consistency of dates in data inputs of Compliance Instrument Reports (CIRs) vs quarterly auction data.
+    Reads input sheet 'CA cap data'; sets prmt.CA_cap_data & prmt.CA_cap_adjustment_factor.
+    
+    Sheet is read once and retained (rather than using read_excel repeatedly on this sheet),
+    because with openpyxl, if the same sheet is read twice, it seems to set the data to be blank.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
-
-    # calculate one quarter difference, for use in comparisons below
-    one_QuarterEnd = quarter_period('2000Q2') - quarter_period('2000Q1')
+    trace('start')
     
-    # get the first CIR sheet name
-    CIR_sheet_name_first = pd.ExcelFile(prmt.CIR_excel).sheet_names[0].replace(" ", "")    
-    CIR_sheet_name_first_date = pd.to_datetime(CIR_sheet_name_first).to_period('Q')
-
-    # get the last CIR sheet name
-    CIR_sheet_name_last = pd.ExcelFile(prmt.CIR_excel).sheet_names[-1].replace(" ", "")
-    CIR_sheet_name_last_date = pd.to_datetime(CIR_sheet_name_last).to_period('Q')
-
-    # check that CIR sheet names are in reverse chronological order
-    if CIR_sheet_name_first_date.year > CIR_sheet_name_last_date.year:
-        pass
-    else:
-        print(f"{prmt.test_failed_msg} Order of CIR sheets need to be in reverse chronological order, but it appears they are not.")
-        print(pd.ExcelFile(prmt.CIR_excel).sheet_names)
+    df = pd.read_excel(prmt.input_file, sheet_name='CA cap data')
 
-    # get the year from CIR_sheet_name_first; compare against prmt.latest_hist_aauct_yr
-    if prmt.latest_hist_aauct_yr - CIR_sheet_name_first_date.year == 1:
-        # this could be the case at the end of a year or beginning of the next year, 
-        # when all annual data is out before the first CIR has been released
-        # check that the latest CIR is from Q4 of previous year
-        if CIR_sheet_name_first_date.quarter == 4:
-            pass
-        else:
-            print(f"{prmt.test_failed_msg} The CIR file appears to be out-of-date.")
-            print(f"Latest CIR date: {CIR_sheet_name_first}. Latest historical allocation-auction data year: {prmt.latest_hist_aauct_yr}")
-            
-    elif prmt.latest_hist_aauct_yr - CIR_sheet_name_first_date.year == 0:
-        if prmt.latest_hist_qauct_date - CIR_sheet_name_first_date == one_QuarterEnd:
-            # CIR is one quarter behind the quarterly auction data
-            pass
-        
-        elif prmt.latest_hist_qauct_date - CIR_sheet_name_first_date == (0 * one_QuarterEnd):
-            # CIR has same date as the quarterly auction data
-            pass
+    # drop all rows completely empty; empty rows may be caused by openpyxl
+    df = df.dropna(how='all')
 
-        else:
-            print(f"{prmt.test_failed_msg} There is a problem with data inputs.")
-            print(f"Latest CIR date: {CIR_sheet_name_first}. Latest quarterly auction data: {prmt.latest_hist_qauct_date}")
+    prmt.CA_cap_data = df
 
-    elif prmt.latest_hist_aauct_yr - CIR_sheet_name_first_date.year == -1:
-        # for latest year, a CIR is out, but one or more annual data points isn't entered yet
-        # by the time of publication of first CIR for a given year (e.g., 2019Q1 in April 2019),
-        # all the annual data for 2019 should be available
-        print(f"{prmt.test_failed_msg} There is a problem with data inputs.")
-        print(f"It may be that some annual data is missing for {CIR_sheet_name_first_date.year} (for auction quantities and/or allocation quantities).")
-        print(f"latest consign year: {prmt.consign_ann_hist.index.max()}, CA_alloc_latest_yr: {CA_alloc_latest_yr}, QC_alloc_latest_yr: {QC_alloc_latest_yr}")
-                
-    else:                  
-        # there is a problem with the data
-        print(f"{prmt.test_failed_msg} There is a problem with data inputs (unknown edge case).")
-        print(f"CIR_sheet_name_first_date.year: {CIR_sheet_name_first_date.year}; prmt.latest_hist_aauct_yr: {prmt.latest_hist_aauct_yr}")
-        print(f"Latest CIR date: {CIR_sheet_name_first}. Latest quarterly auction data: {prmt.latest_hist_qauct_date}")
-        
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    # set CA_cap_adjustment_factor
+    ser = prmt.CA_cap_data[prmt.CA_cap_data['name']=='CA_cap_adjustment_factor'].set_index('year')['data']
+    prmt.CA_cap_adjustment_factor = ser
+    
+    trace('end')
+    
+    # no return; sets prmt.CA_cap_data & prmt.CA_cap_adjustment_factor
+# end of read_CA_cap_data
 
 
 # In[ ]:
 
 
-def test_consistency_inputs_annual_data(CA_alloc_latest_yr, QC_alloc_latest_yr):
+def read_EIM_and_bankruptcy():
     """
-    Checks for consistency of dates in annual data inputs (allocation, consignment, and annual auction data).
+    Reads input sheet 'EIM & bankruptcy'; sets prmt.EIM_and_bankruptcy.
+    
+    Sheet is read once and retained, for the same reason as in read_CA_cap_data.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
-
-    # check whether all three dates match;
-    # if not, will still run, but it may be a sign of a problem with data entered in input file
+    trace('start')
+    
+    df = pd.read_excel(prmt.input_file, sheet_name='EIM & bankruptcy')
+
+    # drop all rows completely empty; empty rows may be caused by openpyxl
+    df = df.dropna(how='all')
+
+    prmt.EIM_and_bankruptcy = df
+    
+    trace('end')
+    
+    # no return; sets prmt.EIM_and_bankruptcy
+# end of read_EIM_and_bankruptcy
+
+
+# In[ ]:
+
+
+def set_supply_last_hist_yr():
+    """
+    Sets prmt.supply_last_hist_yr (integer): the latest year with a Q4 auction in prmt.qauct_hist.
+    """
+    
+    df = prmt.qauct_hist
+    prmt.supply_last_hist_yr = df.loc[df['date_level'].dt.quarter==4]['date_level'].max().year
+    
+    # no return; sets prmt.supply_last_hist_yr
+# end of set_supply_last_hist_yr
+
+
+# In[ ]:
+
+
+def create_CA_alloc_MI_all(consign_df, industrial_etc_alloc):
+    """
+    Convert all CA allocations into MI (for all vintages) & put into one df; sets prmt.CA_alloc_MI_all.
+    """
+    
+    trace('start')
+    
+    CA_alloc_consign_dfs = [consign_df['consign_elec_IOU'], 
+                            consign_df['consign_elec_POU'], 
+                            consign_df['consign_nat_gas']]
+    CA_alloc_dfs_not_consign = [industrial_etc_alloc, 
+                                consign_df['elec_POU_not_consign'], 
+                                consign_df['nat_gas_not_consign']]
+    CA_alloc_dfs = CA_alloc_consign_dfs + CA_alloc_dfs_not_consign
+    CA_alloc_MI_list = []
+    for alloc in CA_alloc_dfs:
+        alloc_MI = convert_ser_to_df_MI_CA_alloc(alloc)
+        CA_alloc_MI_list += [alloc_MI]
+    prmt.CA_alloc_MI_all = pd.concat(CA_alloc_MI_list)
+    
+    trace('end')
+    
+    # no return; sets prmt.CA_alloc_MI_all
+# end of create_CA_alloc_MI_all
+
+
+# In[ ]:
+
+
+def set_latest_hist_years(CA_alloc_data):
+    """
+    Set latest year with auction data, from the latest years in CA consignment data, CA allocation data, 
+    & QC allocation data.
+    
+    Sets prmt.latest_hist_alloc_yr & prmt.latest_hist_aauct_yr.
+    
+    Returns CA_alloc_latest_yr & QC_alloc_latest_yr, which are used in tests of input consistency.
+    """
+    
+    # last year of CA alloc historical data
+    CA_alloc_latest_yr = CA_alloc_data[CA_alloc_data['name'].str.contains('industrial')]['year'].max().astype(int)
+
+    # last year of QC alloc historical data
+    QC_alloc_hist_init = prmt.QC_alloc_hist[prmt.QC_alloc_hist.index.get_level_values('alloc_type')=='initial']
+    QC_alloc_latest_yr = QC_alloc_hist_init.index.get_level_values('emission_year').max()
+
+    # set object attribute prmt.latest_hist_alloc_yr:
+    prmt.latest_hist_alloc_yr = min(CA_alloc_latest_yr, QC_alloc_latest_yr)
+
+    # take minimum of latest year for that set of three
+    # (if don't have all three, can't infer how to split up the auction data by jurisdiction and vintage)
+    prmt.latest_hist_aauct_yr = min(prmt.consign_ann_hist.index.max(), CA_alloc_latest_yr, QC_alloc_latest_yr)
+    
+    return(CA_alloc_latest_yr, QC_alloc_latest_yr)
+# end of set_latest_hist_years
+
+
+# ## Functions: Initialization task graph
+# * create_init_task_graph
+# * run_init_task_graph
+#   * run_init_task
+#   * calculate_init_critical_path
+# * wait_for_init
+# * on_main_thread
+
+# In[ ]:
+
+
+def create_init_task_graph():
+    """
+    Declares the initialization steps as a graph of tasks.
+    
+    Each task is a dict with:
+    * 'fn': initialization function to call
+    * 'args': names of results of other tasks, passed to fn as positional arguments
+    * 'returns': names for the values returned by fn (empty list if fn has no return)
+    * 'consumes': prmt attributes that fn reads
+    * 'produces': prmt attributes that fn sets
+    * 'workbook': the prmt attribute of the Excel file that fn reads from ('' if none)
+    
+    Dependencies between tasks are not listed directly; run_init_task_graph infers them by matching what each task
+    consumes (or takes as args) with what other tasks produce (or return).
+    
+    Tasks reading from the same workbook are run one at a time (see run_init_task), because openpyxl
+    does not support reading the same file from multiple threads.
+    """
+    
+    init_tasks = [
+        {'fn': load_input_file_data, 'args': [], 'returns': [], 
+         'consumes': ['run_online_GCP', 'model_version'], 
+         'produces': ['input_file', 'data_input_file_version'], 
+         'workbook': ''},
+        
+        {'fn': load_input_file_CIR, 'args': [], 'returns': [], 
+         'consumes': ['run_online_GCP'], 
+         'produces': ['CIR_excel'], 
+         'workbook': ''},
+        
+        # ~~~~~~~~~~~~
+        # CA cap, APCR, advance, VRE
+        {'fn': read_CA_cap_data, 'args': [], 'returns': [], 
+         'consumes': ['input_file'], 
+         'produces': ['CA_cap_data', 'CA_cap_adjustment_factor'], 
+         'workbook': 'input_file'},
+        
+        {'fn': initialize_CA_cap, 'args': [], 'returns': [], 
+         'consumes': ['CA_cap_data'], 
+         'produces': ['CA_cap'], 
+         'workbook': ''},
+        
+        {'fn': initialize_CA_APCR, 'args': [], 'returns': [], 
+         'consumes': ['CA_cap_data', 'CA_cap'], 
+         'produces': ['CA_APCR_2013_2020_MI', 'CA_APCR_2021_2030_Oct2017_MI', 'CA_APCR_2021_2030_Apr2019_add_MI'], 
+         'workbook': ''},
+        
+        {'fn': initialize_CA_advance, 'args': [], 'returns': [], 
+         'consumes': ['CA_cap_data', 'CA_cap'], 
+         'produces': ['CA_advance_MI'], 
+         'workbook': ''},
+        
+        {'fn': initialize_VRE_account, 'args': [], 'returns': [], 
+         'consumes': ['CA_cap_data', 'CA_cap'], 
+         'produces': ['VRE_reserve_MI'], 
+         'workbook': ''},
+        
+        # ~~~~~~~~~~~~
+        # historical auctions, compliance events, reserve sales, emissions
+        {'fn': get_qauct_hist, 'args': [], 'returns': [], 
+         'consumes': ['input_file'], 
+         'produces': ['qauct_hist', 'latest_hist_qauct_date'], 
+         'workbook': 'input_file'},
+        
+        {'fn': set_supply_last_hist_yr, 'args': [], 'returns': [], 
+         'consumes': ['qauct_hist'], 
+         'produces': ['supply_last_hist_yr'], 
+         'workbook': ''},
+        
+        {'fn': get_compliance_events, 'args': [], 'returns': [], 
+         'consumes': ['input_file'], 
+         'produces': ['compliance_events', 'CA_surrendered', 'QC_surrendered'], 
+         'workbook': 'input_file'},
+        
+        {'fn': read_reserve_sales_historical, 'args': [], 'returns': [], 
+         'consumes': ['input_file'], 
+         'produces': ['reserve_PCU_sales_q_hist', 'CA_reserve_sales_q_hist', 'QC_reserve_sales_q_hist'], 
+         'workbook': 'input_file'},
+        
+        {'fn': read_emissions_historical_data, 'args': [], 'returns': [], 
+         'consumes': ['input_file'], 
+         'produces': ['emissions_and_obligations'], 
+         'workbook': 'input_file'},
+        
+        # ~~~~~~~~~~~~
+        # CIR
+        {'fn': get_CIR_data_and_clean, 'args': [], 'returns': [], 
+         'consumes': ['CIR_excel'], 
+         'produces': ['CIR_historical', 'CIR_offsets_q_sums'], 
+         'workbook': 'CIR_excel'},
+        
+        {'fn': get_VRE_retired_from_CIR, 'args': [], 'returns': [], 
+         'consumes': ['CIR_historical'], 
+         'produces': ['VRE_retired'], 
+         'workbook': ''},
+        
+        # ~~~~~~~~~~~~
+        # EIM Outstanding Emissions and bankruptcy retirements
+        {'fn': read_EIM_and_bankruptcy, 'args': [], 'returns': [], 
+         'consumes': ['input_file'], 
+         'produces': ['EIM_and_bankruptcy'], 
+         'workbook': 'input_file'},
+        
+        {'fn': assign_EIM_outstanding, 'args': [], 'returns': [], 
+         'consumes': ['EIM_and_bankruptcy'], 
+         'produces': ['EIM_outstanding'], 
+         'workbook': ''},
+        
+        {'fn': assign_bankruptcy_noncompliance, 'args': [], 'returns': [], 
+         'consumes': ['EIM_and_bankruptcy'], 
+         'produces': ['bankruptcy_hist_proj'], 
+         'workbook': ''},
+        
+        # ~~~~~~~~~~~~
+        # CA allocations & consignment
+        {'fn': read_CA_alloc_data, 'args': [], 'returns': ['CA_alloc_data'], 
+         'consumes': ['input_file'], 
+         'produces': [], 
+         'workbook': 'input_file'},
+        
+        # EIM outstanding values modify elec alloc
+        {'fn': initialize_elec_alloc, 'args': [], 'returns': ['elec_alloc_IOU', 'elec_alloc_POU'], 
+         'consumes': ['input_file', 'EIM_outstanding'], 
+         'produces': [], 
+         'workbook': 'input_file'},
+        
+        {'fn': initialize_nat_gas_alloc, 'args': ['CA_alloc_data'], 'returns': ['nat_gas_alloc'], 
+         'consumes': ['CA_cap_adjustment_factor'], 
+         'produces': [], 
+         'workbook': ''},
+        
+        {'fn': initialize_industrial_etc_alloc, 'args': ['CA_alloc_data'], 'returns': ['industrial_etc_alloc'], 
+         'consumes': ['input_file', 'CA_cap_adjustment_factor'], 
+         'produces': [], 
+         'workbook': 'input_file'},
+        
+        {'fn': read_annual_auction_notices, 'args': [], 'returns': [], 
+         'consumes': ['input_file'], 
+         'produces': ['consign_ann_hist'], 
+         'workbook': 'input_file'},
+        
+        {'fn': create_consign_historical_and_projection_annual, 
+         'args': ['elec_alloc_IOU', 'elec_alloc_POU', 'nat_gas_alloc'], 'returns': ['consign_df'], 
+         'consumes': ['input_file', 'consign_ann_hist'], 
+         'produces': [], 
+         'workbook': 'input_file'},
+        
+        {'fn': consign_upsample_historical_and_projection, 'args': ['consign_ann'], 'returns': [], 
+         'consumes': ['qauct_hist', 'latest_hist_qauct_date'], 
+         'produces': ['consign_hist_proj_new_avail'], 
+         'workbook': ''},
+        
+        {'fn': create_CA_alloc_MI_all, 'args': ['consign_df', 'industrial_etc_alloc'], 'returns': [], 
+         'consumes': [], 
+         'produces': ['CA_alloc_MI_all'], 
+         'workbook': ''},
+        
+        # ~~~~~~~~~~~~
+        # QC data
+        {'fn': get_QC_inputs, 'args': [], 'returns': [], 
+         'consumes': ['input_file'], 
+         'produces': ['QC_cap', 'QC_advance_MI', 'QC_APCR_MI'], 
+         'workbook': 'input_file'},
+        
+        {'fn': get_QC_allocation_data, 'args': [], 'returns': [], 
+         'consumes': ['input_file', 'QC_cap', 'CIR_historical', 'reserve_PCU_sales_q_hist'], 
+         'produces': ['QC_alloc_hist', 'QC_alloc_initial', 'QC_alloc_trueups', 'QC_alloc_trueups_non_APCR', 
+                      'QC_alloc_trueups_neg', 'QC_alloc_full_proj'], 
+         'workbook': 'input_file'},
+        
+        # ~~~~~~~~~~~~
+        {'fn': set_latest_hist_years, 'args': ['CA_alloc_data'], 
+         'returns': ['CA_alloc_latest_yr', 'QC_alloc_latest_yr'], 
+         'consumes': ['QC_alloc_hist', 'consign_ann_hist'], 
+         'produces': ['latest_hist_alloc_yr', 'latest_hist_aauct_yr'], 
+         'workbook': ''},
+    ]
+    
+    # name each task after its function
+    for task in init_tasks:
+        task['name'] = task['fn'].__name__
+    
+    # consign_upsample_historical_and_projection only needs column 'consign_ann' of consign_df
+    init_tasks += [
+        {'name': 'select_consign_ann', 'fn': lambda consign_df: consign_df['consign_ann'], 
+         'args': ['consign_df'], 'returns': ['consign_ann'], 
+         'consumes': [], 'produces': [], 'workbook': ''}]
+    
+    return(init_tasks)
+# end of create_init_task_graph
+
+
+# In[ ]:
+
+
+def run_init_task_graph(init_tasks):
+    """
+    Runs the initialization tasks declared in create_init_task_graph.
+    
+    Each task starts as soon as all the tasks it depends on have finished, 
+    using a thread pool with prmt.init_max_workers threads.
+    (With prmt.init_max_workers = 1, tasks run one at a time, in the order in which they become ready.)
+    
+    Returns dict init_results, with the values returned by tasks (keyed by the names in each task's 'returns').
+    
+    Sets prmt.init_task_timings & prmt.init_critical_path.
+    """
+    
+    trace('start')
+    
+    if prmt.memory_accounting == True:
+        memory_phase_start('initialization')
+    
+    # for each prmt attribute or result, find the task that creates it
+    creators = {}
+    for task in init_tasks:
+        for name in task['produces'] + task['returns']:
+            creators[name] = task['name']
+    
+    # dependencies of each task
+    # (prmt attributes consumed but not produced by any task, such as prmt.model_version, are already set)
+    task_deps = {}
+    for task in init_tasks:
+        needs = task['consumes'] + task['args']
+        task_deps[task['name']] = set([creators[name] for name in needs if name in creators])
+        
+        # TEST: args must be returned by some task
+        for name in task['args']:
+            if name not in creators:
+                raise ValueError(f"init task {task['name']} takes arg {name}, which no task returns")
+        # END OF TEST
+    
+    tasks_by_name = {task['name']: task for task in init_tasks}
+    workbook_locks = {task['workbook']: threading.Lock() for task in init_tasks if task['workbook'] != ''}
+    
+    init_results = {}
+    timings = {}
+    t0 = time.perf_counter()
+    
+    pending = list(tasks_by_name.keys())
+    running = {} # maps future to task name
+    
+    with ThreadPoolExecutor(max_workers=prmt.init_max_workers) as executor:
+        while len(pending) > 0 or len(running) > 0:
+            # submit all tasks with dependencies finished
+            ready = [name for name in pending if task_deps[name].issubset(timings.keys())]
+            for name in ready:
+                pending.remove(name)
+                future = executor.submit(run_init_task, tasks_by_name[name], init_results, workbook_locks, t0)
+                running[future] = name
+            
+            if len(running) == 0:
+                # nothing running, and nothing can be started
+                raise ValueError(f"init task graph has a cycle or missing task; could not start: {pending}")
+            
+            done, not_done = wait(list(running.keys()), return_when=FIRST_COMPLETED)
+            
+            for future in done:
+                name = running.pop(future)
+                
+                # re-raises any exception from the task; remaining queued tasks are cancelled on exit
+                timings[name] = future.result()
+    
+    # ~~~~~~~~~~~~
+    df = pd.DataFrame.from_dict(timings, orient='index', columns=['start', 'end'])
+    df['duration'] = df['end'] - df['start']
+    df = df.sort_values(by='start')
+    df.index.name = 'task'
+    
+    critical_path = calculate_init_critical_path(task_deps, df['duration'])
+    df['critical_path'] = df.index.isin(critical_path)
+    
+    prmt.init_task_timings = df
+    prmt.init_critical_path = critical_path
+    
+    logging.info(f"initialization wall time: {df['end'].max():.2f} s, with {prmt.init_max_workers} threads")
+    logging.info(f"initialization sum of task times: {df['duration'].sum():.2f} s")
+    logging.info(f"initialization critical path ({df.loc[critical_path, 'duration'].sum():.2f} s): {critical_path}")
+    
+    if prmt.memory_accounting == True:
+        memory_phase_end('initialization')
+    
+    trace('end')
+    
+    return(init_results)
+# end of run_init_task_graph
+
+
+# In[ ]:
+
+
+def run_init_task(task, init_results, workbook_locks, t0):
+    """
+    Runs a single initialization task, within a thread of run_init_task_graph.
+    
+    Stores values returned by the task's function in init_results.
+    
+    Returns start and end times of the task (in seconds after t0).
+    """
+    
+    args = [init_results[name] for name in task['args']]
+    
+    if task['workbook'] != '':
+        lock = workbook_locks[task['workbook']]
+    else:
+        lock = None
+    
+    if lock != None:
+        lock.acquire()
+    try:
+        start = time.perf_counter() - t0
+        returned = task['fn'](*args)
+        end = time.perf_counter() - t0
+    finally:
+        if lock != None:
+            lock.release()
+    
+    # prmt attributes set by task are ready for the main thread (see wait_for_init)
+    for name in task['produces']:
+        if name in prmt.init_produced.keys():
+            prmt.init_produced[name].set()
+    
+    if len(task['returns']) == 1:
+        init_results[task['returns'][0]] = returned
+    elif len(task['returns']) > 1:
+        for name, value in zip(task['returns'], returned):
+            init_results[name] = value
+    else:
+        # task has no return; it sets prmt attributes
+        pass
+    
+    return((start, end))
+# end of run_init_task
+
+
+def wait_for_init(names):
+    """
+    Waits until the initialization tasks that set the prmt attributes in names have finished, 
+    so that the main thread can use those attributes while the rest of initialization continues.
+    
+    Uses prmt.init_produced (set before initialization starts); if initialization ends without setting 
+    the attributes, re-raises any exception from initialization.
+    """
+    for name in names:
+        event = prmt.init_produced[name]
+        while event.wait(timeout=0.1) == False:
+            if prmt.init_future.done() == True:
+                prmt.init_future.result()
+                break
+# end of wait_for_init
+
+
+def on_main_thread():
+    """
+    Whether the current thread is the main thread. 
+    
+    Output for the user interface (prints for UI, progress bars, displays) only comes from the main thread;
+    runs in the background (initialization, default run) skip it. See finish_default_run.
+    """
+    return(threading.current_thread() is threading.main_thread())
+# end of on_main_thread
+
+
+# In[ ]:
+
+
+def calculate_init_critical_path(task_deps, durations):
+    """
+    Finds the critical path of the initialization task graph: 
+    the chain of dependent tasks with the longest total duration.
+    
+    Even with unlimited threads, initialization can't finish faster than the time for this chain.
+    
+    Returns list of task names, in order of execution.
+    """
+    
+    # longest chain ending at each task, and the task before it in that chain
+    chain_time = {}
+    chain_prev = {}
+    
+    # process tasks in order of their recorded start times, so dependencies are always processed first
+    for name in durations.index:
+        deps = list(task_deps[name])
+        if len(deps) > 0:
+            prev = max(deps, key=lambda dep: chain_time[dep])
+            chain_time[name] = chain_time[prev] + durations.at[name]
+            chain_prev[name] = prev
+        else:
+            chain_time[name] = durations.at[name]
+            chain_prev[name] = None
+    
+    # walk back from the task with the longest chain
+    name = max(chain_time, key=lambda task_name: chain_time[task_name])
+    critical_path = []
+    while name != None:
+        critical_path = [name] + critical_path
+        name = chain_prev[name]
+    
+    return(critical_path)
+# end of calculate_init_critical_path
+
+
+# ## Functions: Tests
+# * test_consistency_inputs_CIR_vs_qauct
+# * test_consistency_inputs_annual_data
+# * test_consistency_CA_alloc
+# * test_cols_and_indexes_before_transfer
+# * test_for_duplicated_indices
+# * test_if_value_is_float_or_np_float64
+# * test_for_negative_values
+# * test_conservation_during_transfer
+# * test_conservation_simple
+# * test_conservation_against_full_budget
+# * ledger_sum_init
+# * check_ledger_invariants
+# * report_ledger_invariants_quarter
+# * run_input_validation
+# * finish_input_validation
+
+# In[ ]:
+
+
+def test_consistency_inputs_CIR_vs_qauct(CA_alloc_latest_yr, QC_alloc_latest_yr):
+    """
+    Checks for consistency of dates in data inputs of Compliance Instrument Reports (CIRs) vs quarterly auction data.
+    
+    Returns list of messages for failed tests (empty if all passed); see run_input_validation.
+    """
+    
+    trace('start')
+    
+    messages = []
+
+    # calculate one quarter difference, for use in comparisons below
+    one_QuarterEnd = quarter_period('2000Q2') - quarter_period('2000Q1')
+    
+    # get the first CIR sheet name
+    CIR_sheet_name_first = pd.ExcelFile(prmt.CIR_excel).sheet_names[0].replace(" ", "")    
+    CIR_sheet_name_first_date = pd.to_datetime(CIR_sheet_name_first).to_period('Q')
+
+    # get the last CIR sheet name
+    CIR_sheet_name_last = pd.ExcelFile(prmt.CIR_excel).sheet_names[-1].replace(" ", "")
+    CIR_sheet_name_last_date = pd.to_datetime(CIR_sheet_name_last).to_period('Q')
+
+    # check that CIR sheet names are in reverse chronological order
+    if CIR_sheet_name_first_date.year > CIR_sheet_name_last_date.year:
+        pass
+    else:
+        messages += [f"{prmt.test_failed_msg} Order of CIR sheets need to be in reverse chronological order, but it appears they are not."]
+        messages += [str(pd.ExcelFile(prmt.CIR_excel).sheet_names)]
+
+    # get the year from CIR_sheet_name_first; compare against prmt.latest_hist_aauct_yr
+    if prmt.latest_hist_aauct_yr - CIR_sheet_name_first_date.year == 1:
+        # this could be the case at the end of a year or beginning of the next year, 
+        # when all annual data is out before the first CIR has been released
+        # check that the latest CIR is from Q4 of previous year
+        if CIR_sheet_name_first_date.quarter == 4:
+            pass
+        else:
+            messages += [f"{prmt.test_failed_msg} The CIR file appears to be out-of-date."]
+            messages += [f"Latest CIR date: {CIR_sheet_name_first}. Latest historical allocation-auction data year: {prmt.latest_hist_aauct_yr}"]
+            
+    elif prmt.latest_hist_aauct_yr - CIR_sheet_name_first_date.year == 0:
+        if prmt.latest_hist_qauct_date - CIR_sheet_name_first_date == one_QuarterEnd:
+            # CIR is one quarter behind the quarterly auction data
+            pass
+        
+        elif prmt.latest_hist_qauct_date - CIR_sheet_name_first_date == (0 * one_QuarterEnd):
+            # CIR has same date as the quarterly auction data
+            pass
+
+        else:
+            messages += [f"{prmt.test_failed_msg} There is a problem with data inputs."]
+            messages += [f"Latest CIR date: {CIR_sheet_name_first}. Latest quarterly auction data: {prmt.latest_hist_qauct_date}"]
+
+    elif prmt.latest_hist_aauct_yr - CIR_sheet_name_first_date.year == -1:
+        # for latest year, a CIR is out, but one or more annual data points isn't entered yet
+        # by the time of publication of first CIR for a given year (e.g., 2019Q1 in April 2019),
+        # all the annual data for 2019 should be available
+        messages += [f"{prmt.test_failed_msg} There is a problem with data inputs."]
+        messages += [f"It may be that some annual data is missing for {CIR_sheet_name_first_date.year} (for auction quantities and/or allocation quantities)."]
+        messages += [f"latest consign year: {prmt.consign_ann_hist.index.max()}, CA_alloc_latest_yr: {CA_alloc_latest_yr}, QC_alloc_latest_yr: {QC_alloc_latest_yr}"]
+                
+    else:                  
+        # there is a problem with the data
+        messages += [f"{prmt.test_failed_msg} There is a problem with data inputs (unknown edge case)."]
+        messages += [f"CIR_sheet_name_first_date.year: {CIR_sheet_name_first_date.year}; prmt.latest_hist_aauct_yr: {prmt.latest_hist_aauct_yr}"]
+        messages += [f"Latest CIR date: {CIR_sheet_name_first}. Latest quarterly auction data: {prmt.latest_hist_qauct_date}"]
+        
+    trace('end')
+    
+    return(messages)
+
+
+# In[ ]:
+
+
+def test_consistency_inputs_annual_data(CA_alloc_latest_yr, QC_alloc_latest_yr):
+    """
+    Checks for consistency of dates in annual data inputs (allocation, consignment, and annual auction data).
+    
+    Returns list of messages for failed tests (empty if all passed); see run_input_validation.
+    """
+    
+    trace('start')
+    
+    messages = []
+
+    # check whether all three dates match;
+    # if not, will still run, but it may be a sign of a problem with data entered in input file
 
     if prmt.consign_ann_hist.index.max() == CA_alloc_latest_yr:
         pass
@@ -2676,7 +3547,7 @@ def test_consistency_inputs_annual_data(CA_alloc_latest_yr, QC_alloc_latest_yr):
                 # all years match
                 pass
             else:
-                print("{prmt.test_failed_msg} In test_consistency_inputs_annual_data, encountered an unexpected edge case (error #1).") # for UI
+                messages += [f"{prmt.test_failed_msg} In test_consistency_inputs_annual_data, encountered an unexpected edge case (error #1)."]
         
         elif CA_alloc_latest_yr == QC_alloc_latest_yr + 1:
             # CA alloc data is one year ahead of QC alloc data
@@ -2684,7 +3555,7 @@ def test_consistency_inputs_annual_data(CA_alloc_latest_yr, QC_alloc_latest_yr):
             pass
         
         else:
-            print("{prmt.test_failed_msg} In test_consistency_inputs_annual_data, encountered an unexpected edge case (error #2).") # for UI
+            messages += [f"{prmt.test_failed_msg} In test_consistency_inputs_annual_data, encountered an unexpected edge case (error #2)."]
 
     elif prmt.consign_ann_hist.index.max() == CA_alloc_latest_yr + 1:
         # consignment data is one year ahead of CA alloc data; this is normal
@@ -2701,18 +3572,20 @@ def test_consistency_inputs_annual_data(CA_alloc_latest_yr, QC_alloc_latest_yr):
             pass
 
         elif CA_alloc_latest_yr < QC_alloc_latest_yr:
-            print("{prmt.test_failed_msg} CA allocation data is behind QC allocation data. There should be CA allocation data available.") # for UI
+            messages += [f"{prmt.test_failed_msg} CA allocation data is behind QC allocation data. There should be CA allocation data available."]
     
         else:
-            print("{prmt.test_failed_msg} In test_consistency_inputs_annual_data, encountered an unexpected edge case (error #3).") # for UI
+            messages += [f"{prmt.test_failed_msg} In test_consistency_inputs_annual_data, encountered an unexpected edge case (error #3)."]
     
     elif prmt.consign_ann_hist.index.max() < CA_alloc_latest_yr:
-        print("{prmt.test_failed_msg} CA consignment data is behind allocation data. There should be consignment data available.") # for UI
+        messages += [f"{prmt.test_failed_msg} CA consignment data is behind allocation data. There should be consignment data available."]
 
     else:
-        print("{prmt.test_failed_msg} In test_consistency_inputs_annual_data, encountered an unexpected edge case (error #4).") # for UI
+        messages += [f"{prmt.test_failed_msg} In test_consistency_inputs_annual_data, encountered an unexpected edge case (error #4)."]
         
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
+    
+    return(messages)
 
 
 # In[ ]:
@@ -2721,9 +3594,13 @@ def test_consistency_inputs_annual_data(CA_alloc_latest_yr, QC_alloc_latest_yr):
 def test_consistency_CA_alloc(CA_alloc_data):
     """
     Test CA allocation data for internal consistency.
+    
+    Returns list of messages for failed tests (empty if all passed); see run_input_validation.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
+    
+    messages = []
     
     df = CA_alloc_data.copy()
     
@@ -2746,9 +3623,11 @@ def test_consistency_CA_alloc(CA_alloc_data):
         # all the years are the same
         pass
     else:
-        print(f"{prmt.test_failed_msg} In test_consistency_CA_alloc, the individual components of the allocation are not all up to the same year.") # for UI
+        messages += [f"{prmt.test_failed_msg} In test_consistency_CA_alloc, the individual components of the allocation are not all up to the same year."]
         
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
+    
+    return(messages)
 
 
 # In[ ]:
@@ -2758,8 +3637,7 @@ def test_cols_and_indexes_before_transfer(to_acct_MI):
     """
     Before transferring instruments from one account to another, check properties of the df to_acct_MI.
     """
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name} (start), for {to_acct_MI}")
+    trace('start', to_acct_MI=to_acct_MI.index.names, level=logging.DEBUG)
     
     # check that to_acct_MI has only 1 column & that it has MultiIndex
     if len(to_acct_MI.columns)==1 and isinstance(to_acct_MI.index, pd.MultiIndex):
@@ -2783,8 +3661,7 @@ def test_cols_and_indexes_before_transfer(to_acct_MI):
         print(f"{prmt.test_failed_msg} Something else going on with df to_acct_MI columns and/or index. Here's to_acct_MI:")
         print(to_acct_MI)
         
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end', level=logging.DEBUG)
 
 
 # In[ ]:
@@ -2795,8 +3672,7 @@ def test_for_duplicated_indices(df, parent_fn):
     Test to check a dataframe (df) for duplicated indices, and if any, to show them (isolated and in context).
     """
     
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name}")
+    trace('run', level=logging.DEBUG)
 
     dups = df.loc[df.index.duplicated(keep=False)]
     
@@ -2813,8 +3689,7 @@ def test_for_duplicated_indices(df, parent_fn):
     else:
         print(f"{prmt.test_failed_msg} During {parent_fn}, test for duplicated indices may not have run.") # for UI
         
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end', level=logging.DEBUG)
 
 
 # In[ ]:
@@ -2822,8 +3697,7 @@ def test_for_duplicated_indices(df, parent_fn):
 
 def test_if_value_is_float_or_np_float64(test_input):
     
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name}")
+    trace('run', level=logging.DEBUG)
 
     if isinstance(test_input, float)==False and isinstance(test_input, np.float64)==False:
         print(f"{prmt.test_failed_msg} Was supposed to be a float or np.float64. Instead was type: %s" % type(test_input))
@@ -2845,8 +3719,7 @@ def test_for_negative_values(df, parent_fn):
     
     if prmt.show_neg_msg == True:
     
-        if prmt.verbose_log == True:
-            logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+        trace('start', level=logging.DEBUG)
 
         neg_cut_off = prmt.neg_cut_off
 
@@ -2880,8 +3753,7 @@ def test_conservation_during_transfer(all_accts, all_accts_sum_init, remove_name
     """
     Test for conservation of allowances after a function has transferred allowances between accounts.
     """
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name}")
+    trace('run', level=logging.DEBUG)
     
     # check for conservation of instruments within all_accts
     all_accts_end_sum = all_accts['quant'].sum()
@@ -2902,8 +3774,7 @@ def test_conservation_simple(df, df_sum_init, parent_fn):
     
     Initial is set as local variable at the start of each function.
     """
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name}")
+    trace('run', level=logging.DEBUG)
     
     df_sum_final = df['quant'].sum()
     diff = df_sum_final - df_sum_init
@@ -2922,8 +3793,7 @@ def test_conservation_against_full_budget(all_accts, juris, parent_fn):
     Additional conservation check, using total allowance budget.
     """
     
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name}")
+    trace('run', level=logging.DEBUG)
     
     if juris == 'CA':
         if cq.date <= quarter_period('2017Q4'):
@@ -2980,69 +3850,288 @@ def test_conservation_against_full_budget(all_accts, juris, parent_fn):
 # end of test_conservation_against_full_budget
 
 
-# ## Functions: Main processes
-# (many also used for QC; however, list below excludes functions unique to QC, which are later in the model)
-# * initialize_CA_auctions
-# * create_annual_budgets_in_alloc_hold
-# * transfer__from_alloc_hold_to_specified_acct
-# * transfer_CA_alloc__from_alloc_hold
-# * consign_groupby_sum_in_all_accts
-# * transfer_consign__from_limited_use_to_auct_hold_2012Q4_and_make_available
-# * process_CA_quarterly
-#   * CA_state_owned_make_available
-#   * redesignate_unsold_advance_as_advance
-#   * process_auction_adv_all_accts
-#   * unsold_update_status
-#   * consign_make_available_incl_redes
-#   * redesignate_unsold_current_auct
-#     * calculate_max_cur_reintro
-#     * reintro_update_unsold_1j
-#   * process_auction_cur_CA_all_accts
-#   * process_reserve_sales_historical
-#   * adv_unsold_to_cur_all_accts
-#   * transfer__from_VRE_acct_to_retirement
-#   * transfer_consign__from_limited_use_to_auct_hold
-# * transfer_CA_alloc__from_ann_alloc_hold_to_general
-# * transfer_cur__from_alloc_hold_to_auct_hold_first_principles
-# * cur_upsample_avail_state_owned_first_principles
-# * upsample_advance_all_accts
-
 # In[ ]:
 
 
-def initialize_CA_auctions(all_accts):
+def ledger_sum_init(all_accts):
     """
-    Initializes first CA auction in 2012Q4 (also first for any juris in WCI market).
+    Total of all_accts at the start of a step, for the conservation check in check_ledger_invariants.
     
-    This auction was anomalous, in that:
-    1. There was only this single auction in 2012.
-    2. The 2012Q4 current auction had available only consignment allowances (and no state-owned), 
-    and they were a vintage ahead (2013).
-    3. The 2012Q4 advance auction had available all vintage 2015 allowances at once.
+    If prmt.invariant_checks == 'sum_per_step' and all_accts is the same df that the previous step returned 
+    (as recorded by check_ledger_invariants), uses the running total from that step, instead of a new scan.
+    Otherwise (such as after allowances are added by a step without checks), sums all_accts.
     
-    This function runs only once in each model run.
+    Note: the running total assumes all_accts isn't modified in place between steps.
     """
+    state = prmt.invariant_state
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    if prmt.invariant_checks == 'sum_per_step' and state.get('frame') is all_accts:
+        return(state['total'])
+    else:
+        return(all_accts['quant'].sum())
+# end of ledger_sum_init
+
+
+def check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, juris=None, remove_name=None):
+    """
+    Checks invariants of all_accts after a step that modified it.
     
-    # create CA allowances v2013-v2020, put into alloc_hold
-    all_accts = create_annual_budgets_in_alloc_hold(all_accts, prmt.CA_cap.loc[2013:2020])
+    If prmt.invariant_checks == 'per_step', runs the full set of tests (each one a scan of all_accts):
+    * test_conservation_during_transfer (if remove_name specified)
+    * test_conservation_simple
+    * test_for_duplicated_indices
+    * test_for_negative_values
+    * test_conservation_against_full_budget (if juris specified)
     
-    # pre-test for conservation of allowances
-    # (sum_init has to be after creation of allowances in previous step)
-    all_accts_sum_init = all_accts['quant'].sum()
+    If prmt.invariant_checks == 'sum_per_step', only checks conservation, by comparing the total after the step 
+    against the total before the step (all_accts_sum_init). This is a full sum of the quant column after each step 
+    (not tracked from the step's delta, since each step returns a new df), but no other scans of all_accts. 
+    The total after the step is kept in prmt.invariant_state, with the df returned by the step, 
+    so that the next step can use it as its initial total (see ledger_sum_init), instead of a second sum. 
+    Failures are recorded in prmt.invariant_state and reported in report_ledger_invariants_quarter, 
+    along with tests that run once per quarter (duplicated indices, negative values, full budget).
     
-    # transfer APCR allowances out of alloc_hold, into APCR_acct (for vintages 2013-2020)
-    logging.info(f"running transfer__from_alloc_hold_to_specified_acct for prmt.CA_APCR_2013_2020_MI")
-    all_accts = transfer__from_alloc_hold_to_specified_acct(
+    Note: in 'sum_per_step' mode, duplicated indices are only found if they remain at the end of the quarter; 
+    duplicates created by a step and then merged by a later groupby sum in the same quarter aren't reported. 
+    Use 'per_step' to check duplicates after each step.
+    """
+    
+    trace('run', level=logging.DEBUG)
+    
+    if prmt.invariant_checks == 'per_step':
+        if remove_name != None:
+            test_conservation_during_transfer(all_accts, all_accts_sum_init, remove_name)
+        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
+        test_for_duplicated_indices(all_accts, parent_fn)
+        test_for_negative_values(all_accts, parent_fn)
+        if juris != None:
+            test_conservation_against_full_budget(all_accts, juris, parent_fn)
+        
+    elif prmt.invariant_checks == 'sum_per_step':
+        state = prmt.invariant_state
+        state.setdefault('steps', [])
+        state.setdefault('failures', [])
+        
+        total = float(all_accts['quant'].values.sum())
+        
+        diff = total - all_accts_sum_init
+        if abs(diff) > 1e-7:
+            failure = f"Simple conservation test for {cq.date}: Allowances not conserved in {parent_fn}. Diff: {diff}"
+            if remove_name != None:
+                failure += f" (for {remove_name})"
+            state['failures'] += [failure]
+        
+        # running total after this step, for the df returned by the step; used by ledger_sum_init in next step
+        state['frame'] = all_accts
+        state['total'] = total
+        state['steps'] += [(parent_fn, len(all_accts))]
+        
+        if juris != None:
+            # step outside of quarterly processing; check against full budget now
+            test_conservation_against_full_budget(all_accts, juris, parent_fn)
+    
+# end of check_ledger_invariants
+
+
+# In[ ]:
+
+
+def report_ledger_invariants_quarter(all_accts, juris, parent_fn):
+    """
+    At end of quarterly processing, runs invariant tests that don't need to run after each step,
+    and reports all failures found during the quarter together 
+    (including those from check_ledger_invariants, duplicated indices, and negative values).
+    
+    Resets prmt.invariant_state for the next quarter (keeping the running total).
+    """
+    
+    trace('run', level=logging.DEBUG)
+    
+    if prmt.invariant_checks == 'per_step':
+        test_conservation_against_full_budget(all_accts, juris, parent_fn)
+        
+    elif prmt.invariant_checks == 'sum_per_step':
+        state = prmt.invariant_state
+        failures = state.get('failures', [])
+        steps = [step for step, rows in state.get('steps', [])]
+        
+        # duplicated indices: one scan for the quarter
+        dup_mask = all_accts.index.duplicated(keep=False)
+        if dup_mask.any():
+            failures += [f"For {cq.date}, duplicated indices in all_accts at end of {parent_fn}; "
+                         f"steps run in quarter: {', '.join(steps)}\n{all_accts.loc[dup_mask]}"]
+        
+        # negative values (other than deficits); see test_for_negative_values
+        if prmt.show_neg_msg == True:
+            non_deficits = all_accts.loc[all_accts.index.get_level_values('status')!='deficit']
+            neg_values = non_deficits.loc[non_deficits['quant']<-abs(prmt.neg_cut_off)]
+            if len(neg_values) > 0:
+                failures += [f"For {cq.date}, negative values in all_accts (other than deficits) "
+                             f"at end of {parent_fn}:\n{neg_values}"]
+        
+        test_conservation_against_full_budget(all_accts, juris, parent_fn)
+        
+        for failure in failures:
+            print(f"{prmt.test_failed_msg} {failure}") # for UI
+        
+        prmt.invariant_failures += failures
+        
+        prmt.invariant_state = {key: state[key] for key in ['frame', 'total'] if key in state}
+    
+# end of report_ledger_invariants_quarter
+
+
+# In[ ]:
+
+
+def run_input_validation(CA_alloc_latest_yr, QC_alloc_latest_yr, CA_alloc_data):
+    """
+    Validation pass for data inputs, which runs the tests of input consistency:
+    * test_consistency_inputs_CIR_vs_qauct
+    * test_consistency_inputs_annual_data
+    * test_consistency_CA_alloc
+    
+    These only need to run when there is a new data input file or CIR. 
+    
+    So the outcome is recorded in the file input_validation_record.json (in model_data_dir), 
+    keyed by model version and the hashes of the data input file and CIR file contents. 
+    If the record already has an outcome for the same key, the tests are skipped, 
+    and any failure messages recorded are shown again.
+    
+    The tests return their failure messages, which are recorded. Messages are shown here if on the main thread; 
+    if run in a background thread (prmt.input_validation_in_background), they're shown by finish_input_validation.
+    
+    Sets prmt.input_validation_outcome.
+    """
+    
+    trace('start')
+    
+    # 'returned': records from before tests returned their messages may include output of other threads; not reused
+    key = f"{prmt.model_version}_{prmt.input_file_hash}_{prmt.CIR_file_hash}_returned"
+    record_path = f"{model_data_dir()}/input_validation_record.json"
+    
+    try:
+        with open(record_path, 'r') as file:
+            record = json.load(file)
+    except (OSError, ValueError):
+        # no record yet, or record unreadable
+        record = {}
+    
+    if key in record:
+        outcome = record[key]
+        logging.info(f"inputs unchanged since validation on {outcome['validated']}; tests skipped")
+        
+    else:
+        # tests only return messages on failure
+        messages = test_consistency_inputs_CIR_vs_qauct(CA_alloc_latest_yr, QC_alloc_latest_yr)
+        messages += test_consistency_inputs_annual_data(CA_alloc_latest_yr, QC_alloc_latest_yr)
+        messages += test_consistency_CA_alloc(CA_alloc_data)
+        
+        outcome = {'passed': len(messages) == 0, 
+                   'messages': messages, 
+                   'data_input_file_version': prmt.data_input_file_version, 
+                   'validated': time.strftime('%Y-%m-%d_%H%M%S', time.localtime())}
+        
+        record[key] = outcome
+        try:
+            with open(record_path, 'w') as file:
+                json.dump(record, file, indent=1)
+        except OSError:
+            # can't save record (e.g., read-only folder); tests will run again next time
+            logging.info(f"could not save input validation record to {record_path}")
+    
+    prmt.input_validation_outcome = outcome
+    
+    if on_main_thread() == True:
+        for message in outcome['messages']:
+            print(message) # for UI
+    
+    trace('end')
+    
+    # no return; sets prmt.input_validation_outcome
+# end of run_input_validation
+
+
+def finish_input_validation():
+    """
+    If input validation is running in the background (see run_input_validation), waits for it to finish; 
+    re-raises any exception from it, and shows its messages on the main thread.
+    """
+    if prmt.input_validation_future == '':
+        # validation not run, or ran on main thread
+        return
+    
+    future = prmt.input_validation_future
+    prmt.input_validation_future = ''
+    
+    # re-raises any exception from input validation
+    future.result()
+    
+    for message in prmt.input_validation_outcome['messages']:
+        print(message) # for UI
+# end of finish_input_validation
+
+
+# ## Functions: Main processes
+# (many also used for QC; however, list below excludes functions unique to QC, which are later in the model)
+# * initialize_CA_auctions
+# * create_annual_budgets_in_alloc_hold
+# * transfer__from_alloc_hold_to_specified_acct
+# * transfer_CA_alloc__from_alloc_hold
+# * consign_groupby_sum_in_all_accts
+# * transfer_consign__from_limited_use_to_auct_hold_2012Q4_and_make_available
+# * process_CA_quarterly
+#   * CA_state_owned_make_available
+#   * redesignate_unsold_advance_as_advance
+#   * process_auction_adv_all_accts
+#   * unsold_update_status
+#   * consign_make_available_incl_redes
+#   * redesignate_unsold_current_auct
+#     * calculate_max_cur_reintro
+#     * reintro_update_unsold_1j
+#   * process_auction_cur_CA_all_accts
+#   * process_reserve_sales_historical
+#   * adv_unsold_to_cur_all_accts
+#   * transfer__from_VRE_acct_to_retirement
+#   * transfer_consign__from_limited_use_to_auct_hold
+# * transfer_CA_alloc__from_ann_alloc_hold_to_general
+# * transfer_cur__from_alloc_hold_to_auct_hold_first_principles
+# * cur_upsample_avail_state_owned_first_principles
+# * upsample_advance_all_accts
+
+# In[ ]:
+
+
+def initialize_CA_auctions(all_accts):
+    """
+    Initializes first CA auction in 2012Q4 (also first for any juris in WCI market).
+    
+    This auction was anomalous, in that:
+    1. There was only this single auction in 2012.
+    2. The 2012Q4 current auction had available only consignment allowances (and no state-owned), 
+    and they were a vintage ahead (2013).
+    3. The 2012Q4 advance auction had available all vintage 2015 allowances at once.
+    
+    This function runs only once in each model run.
+    """
+    
+    trace('start')
+    
+    # create CA allowances v2013-v2020, put into alloc_hold
+    all_accts = create_annual_budgets_in_alloc_hold(all_accts, prmt.CA_cap.loc[2013:2020])
+    
+    # pre-test for conservation of allowances
+    # (sum_init has to be after creation of allowances in previous step)
+    all_accts_sum_init = ledger_sum_init(all_accts)
+    
+    # transfer APCR allowances out of alloc_hold, into APCR_acct (for vintages 2013-2020)
+    all_accts = transfer__from_alloc_hold_to_specified_acct(
         all_accts, prmt.CA_APCR_2013_2020_MI, 2013, 2020)
 
     # transfer advance into auct_hold
-    logging.info(f"running transfer__from_alloc_hold_to_specified_acct for prmt.CA_advance_MI")
     all_accts = transfer__from_alloc_hold_to_specified_acct(all_accts, prmt.CA_advance_MI, 2013, 2020)
 
     # transfer VRE allowances out of alloc_hold, into VRE_acct (for vintages 2013-2020)
-    logging.info(f"running transfer__from_alloc_hold_to_specified_acct for prmt.VRE_reserve_MI")
     all_accts = transfer__from_alloc_hold_to_specified_acct(all_accts, prmt.VRE_reserve_MI, 2013, 2020)
 
     # allocations:
@@ -3085,13 +4174,11 @@ def initialize_CA_auctions(all_accts):
     # recombine to create new version of all_accts
     all_accts = pd.concat([adv_new, all_accts_remainder], sort=True)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of initialize_CA_auctions
@@ -3107,7 +4194,7 @@ def create_annual_budgets_in_alloc_hold(all_accts, ser):
     Does this for each juris.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     df = pd.DataFrame(ser)
     
@@ -3134,9 +4221,9 @@ def create_annual_budgets_in_alloc_hold(all_accts, ser):
     
     df = df.set_index(prmt.standard_MI_names)
     
-    all_accts = all_accts.append(df)
+    all_accts = pd.concat([all_accts, df], sort=False)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of create_annual_budgets_in_alloc_hold
@@ -3154,9 +4241,10 @@ def transfer__from_alloc_hold_to_specified_acct(all_accts, to_acct_MI, vintage_s
     Destination account is contained in to_acct_MI metadata.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start', to_acct=lambda: list(to_acct_MI.index.get_level_values('acct_name').unique()), 
+          vintages=(vintage_start, vintage_end))
     
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     vintage_range = range(vintage_start, vintage_end+1)
     
     # check that to_acct_MI is a df with one column and MultiIndex
@@ -3202,15 +4290,11 @@ def transfer__from_alloc_hold_to_specified_acct(all_accts, to_acct_MI, vintage_s
     all_accts = pd.concat([all_accts, remove, to_acct_MI_in_vintage_range], 
                           sort=True).groupby(level=prmt.standard_MI_names).sum()
     
-    if prmt.run_tests == True:
-        name_of_allowances = to_acct_MI.index.get_level_values('inst_cat').unique().tolist()[0]
-        test_conservation_during_transfer(all_accts, all_accts_sum_init, name_of_allowances)
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, remove_name=to_acct_MI.index.get_level_values('inst_cat').unique().tolist()[0])
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     return(all_accts)
 # end of transfer__from_alloc_hold_to_specified_acct
@@ -3231,9 +4315,9 @@ def transfer_CA_alloc__from_alloc_hold(all_accts, to_acct_MI):
     
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
 
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
 
     if prmt.run_tests == True:
         test_cols_and_indexes_before_transfer(to_acct_MI)
@@ -3271,17 +4355,13 @@ def transfer_CA_alloc__from_alloc_hold(all_accts, to_acct_MI):
     all_accts_pos = all_accts_pos.groupby(level=prmt.standard_MI_names).sum()
     
     # recombine pos & neg
-    all_accts = all_accts_pos.append(all_accts_neg)
+    all_accts = pd.concat([all_accts_pos, all_accts_neg], sort=False)
 
-    if prmt.run_tests == True:
-        inst_cat_to_acct = str(to_acct_MI.index.get_level_values('inst_cat').unique())
-        test_conservation_during_transfer(all_accts, all_accts_sum_init, inst_cat_to_acct)
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, remove_name=str(to_acct_MI.index.get_level_values('inst_cat').unique()))
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # transfer_CA_alloc__from_alloc_hold
@@ -3299,10 +4379,10 @@ def consign_groupby_sum_in_all_accts(all_accts):
     Then this sums across the types of consignment allowances, to get a single annual value for consignment.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     mask1 = all_accts.index.get_level_values('acct_name')=='limited_use'
     mask2 = all_accts['quant'] > 0
@@ -3315,15 +4395,13 @@ def consign_groupby_sum_in_all_accts(all_accts):
     consigned = multiindex_change(consigned, mapping_dict)
     consigned = consigned.groupby(level=prmt.standard_MI_names).sum() 
     
-    all_accts = consigned.append(remainder)
+    all_accts = pd.concat([consigned, remainder], sort=False)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # consign_groupby_sum_in_all_accts
@@ -3339,10 +4417,10 @@ def transfer_consign__from_limited_use_to_auct_hold_2012Q4_and_make_available(al
     Only for anomalous auction 2012Q4 (CA-only), in which vintage 2013 consignment were sold at current auction.
     """       
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # look up quantity consigned in 2012Q4 from historical record (consign_2012Q4_quant)
     # (this anomalous fn runs only when cq.date = 2012Q4)
@@ -3403,13 +4481,11 @@ def transfer_consign__from_limited_use_to_auct_hold_2012Q4_and_make_available(al
     # recombine to get all_accts again
     all_accts = pd.concat([consign_avail, consign_not_avail, all_accts_remainder], sort=True)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('end')
     
     return(all_accts)
 
@@ -3427,10 +4503,10 @@ def process_CA_quarterly(all_accts):
     Order of sales for each jurisdiction set by jurisdiction-specific functions called within process_quarter.
     
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # object "scenario" holds the data for a particular scenario in various attributes (scenario_CA.avail_accum, etc.)
 
@@ -3501,7 +4577,7 @@ def process_CA_quarterly(all_accts):
 
     # ADVANCE AUCTION ********************************************************
     # process advance auctions through vintage 2030, which occur in years through 2027
-    logging.info(f"within {inspect.currentframe().f_code.co_name}, start of advance auction")
+    trace('start of advance auction')
     
     if cq.date.year <= 2027:
         # ADVANCE AUCTION: MAKE AVAILABLE   
@@ -3520,7 +4596,7 @@ def process_CA_quarterly(all_accts):
         pass
     
     # CURRENT AUCTION ********************************************************
-    logging.info("within process_quarter, start of current auction")
+    trace('start of current auction')
     
     # CA state-owned current: make available for cq.date
     all_accts = CA_state_owned_make_available(all_accts, 'current')
@@ -3585,7 +4661,7 @@ def process_CA_quarterly(all_accts):
     if cq.date.quarter == 4:        
         # Q4 PROCESSING AFTER AUCTION **********************************************
         # this includes transfer of consigned portion of alloc into limited_use
-        logging.info(f"for {cq.date}, Q4 processing after auction: start")      
+        trace('Q4 processing after auction: start', juris='CA')
             
         # note: the transfer allocation step below moves annual consigned allowances into limited_use
         # this needs to happen before allowances for Q1 of next year can be moved from limited_use to auct_hold
@@ -3607,14 +4683,14 @@ def process_CA_quarterly(all_accts):
         # end-of-year: move advance unsold to current auction
         all_accts = adv_unsold_to_cur_all_accts(all_accts)  
         
-        logging.info(f"for {cq.date}, Q4 processing after auction: end")
+        trace('Q4 processing after auction: end')
     
     else: 
         # closing "if cq.date.quarter == 4:"
         pass
     
     # END-OF-QUARTER (EVERY QUARTER) *****************************************
-    logging.info("end-of-quarter processing (every quarter) - start")
+    trace('end-of-quarter processing: start')
     
     # process historical reserve sales
     all_accts = process_reserve_sales_historical(all_accts, 'CA')
@@ -3648,11 +4724,8 @@ def process_CA_quarterly(all_accts):
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # CLEANUP OF all_accts (each quarter)
-    # get rid of fractional allowances, zeros, and NaN
-    logging.info("cleanup of all_accts")
-    
-    all_accts = all_accts.loc[(all_accts['quant']>1e-7) | (all_accts['quant']<-1e-7)]
-    all_accts = all_accts.dropna()
+    # get rid of fractional allowances, zeros, and NaN; then compact (see prmt.ledger_compaction)
+    all_accts = compact_ledger(all_accts, 'CA')
     # END OF CLEANUP OF all_accts
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -3661,15 +4734,13 @@ def process_CA_quarterly(all_accts):
         
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)        
-        test_conservation_against_full_budget(all_accts, 'CA', parent_fn)  
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
+        report_ledger_invariants_quarter(all_accts, 'CA', parent_fn)
     
-    logging.info("end-of-quarter processing (every quarter) - end")
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end-of-quarter processing: end')
+    trace('end')
     
     return(all_accts)
 # end of process_CA_quarterly
@@ -3684,10 +4755,10 @@ def CA_state_owned_make_available(all_accts, auct_type):
     
     Works for current auction and advance auction, as specified by argument auct_type.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start), for auct_type {auct_type}")
+    trace('start', auct_type=auct_type)
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # get allowances in auct_hold, for current auction, for date_level == cq.date
     mask1 = all_accts.index.get_level_values('acct_name')=='auct_hold'
@@ -3705,13 +4776,11 @@ def CA_state_owned_make_available(all_accts, auct_type):
     # combine avail with remainder (~mask)
     all_accts = pd.concat([avail, all_accts.loc[~mask]], sort=True)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end), for auct_type {auct_type}")
+    trace('end', auct_type=auct_type)
     
     return(all_accts)
 # end of CA_state_owned_make_available
@@ -3742,7 +4811,7 @@ def redesignate_unsold_advance_as_advance(all_accts, juris):
     
     Therefore the redesignations can only occur in Q4 of any given year.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     if juris == 'CA':
         # check sales pct in Q1 of cq.date.year
@@ -3827,7 +4896,7 @@ def redesignate_unsold_advance_as_advance(all_accts, juris):
         # juris other than CA
         print("Error! redesignate_unsold_advance_as_advance applied to a juris other than CA.")
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of redesignate_unsold_advance_as_advance
@@ -3842,10 +4911,10 @@ def process_auction_adv_all_accts(all_accts, juris):
     
     Calculates quantities sold based on percentages in auction_sales_pcts_all (historical and projected).
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # get allowances available for cq.date auction
     mask1 = all_accts.index.get_level_values('juris') == juris
@@ -3946,13 +5015,11 @@ def process_auction_adv_all_accts(all_accts, juris):
     # clean-up
     all_accts = all_accts.loc[(all_accts['quant']>1e-7) | (all_accts['quant']<-1e-7)]
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of fn process_auction_adv_all_accts
@@ -3968,10 +5035,10 @@ def unsold_update_status(all_accts, auct_type):
     Operates for allowances from both current and advance auctions.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
 
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # for unsold, update metadata:
     # in all_accts, get any allowances remaining in auct_hold with date_level == cq.date
@@ -4014,13 +5081,11 @@ def unsold_update_status(all_accts, auct_type):
     else: # all_accts_unsold['quant'].sum() is neither > 0 nor == 0; is it negative? NaN?
         print("Error" + "! all_accts_unsold['quant'].sum() should be a float that's either zero or positive.")
         
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
         
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
         
     return(all_accts)
 # end of unsold_update_status
@@ -4039,10 +5104,10 @@ def consign_make_available_incl_redes(all_accts):
     
     So if there are unsold from previous quarter, these are redesinated.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # get consigned allowances in auct_hold
     mask1 = all_accts.index.get_level_values('acct_name')=='auct_hold'
@@ -4071,13 +5136,11 @@ def consign_make_available_incl_redes(all_accts):
                            all_accts.loc[~consign_mask]
                           ], sort=False)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
         
     return(all_accts)
 # end of consign_make_available_incl_redes
@@ -4097,10 +5160,10 @@ def redesignate_unsold_current_auct(all_accts, juris):
     (Unsold advance to later advance auctions are redesignated by function redesignate_unsold_advance_as_advance.)
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     previous_q = (pd.to_datetime(f'{cq.date.year}Q{cq.date.quarter}') - DateOffset(months=3)).to_period('Q')
     
@@ -4120,8 +5183,8 @@ def redesignate_unsold_current_auct(all_accts, juris):
     else:
         print("Error" + "! Unknown edge case for value of reintro_eligibility")
     
-    logging.info(f"in {cq.date} juris {juris}, cur_sell_out_counter: {cur_sell_out_counter}")
-    logging.info(f"in {cq.date} juris {juris}, reintro_eligibility: {reintro_eligibility}")
+    trace('sell-out counter', juris=juris, cur_sell_out_counter=cur_sell_out_counter, 
+          reintro_eligibility=reintro_eligibility)
     
     # ~~~~~~~~~~~~~~~~~~
     # run remainder of function only if reintro_eligibility == True
@@ -4176,13 +5239,11 @@ def redesignate_unsold_current_auct(all_accts, juris):
     else: # reintro_eligibility == False; nothing to do
         pass
         
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of redesignate_unsold_current_auct
@@ -4199,7 +5260,7 @@ def calculate_max_cur_reintro(all_accts, juris):
     CA regs: § 95911(f)(3)(D) (in force Apr 2019)
     QC regs: Section 54 (in force date 2014-10-22)
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # select allowances available (state & consign), before redesignation of unsold current state-owned (aka reintro)
     cur_avail_mask1 = all_accts.index.get_level_values('auct_type')=='current'
@@ -4213,7 +5274,7 @@ def calculate_max_cur_reintro(all_accts, juris):
     # calculate maximum reintro quantity for specified juris
     max_cur_reintro_1j_1q = cur_avail_1j_1q_tot * 0.25
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     return(max_cur_reintro_1j_1q)
 # end of calculate_max_cur_reintro
@@ -4231,10 +5292,10 @@ def reintro_update_unsold_1j(all_accts, juris, max_cur_reintro_1j_1q):
     This function is called only when reintro_eligibility == True.
     
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     mask1 = all_accts.index.get_level_values('status')=='unsold'
     mask2 = all_accts.index.get_level_values('acct_name')=='auct_hold'
@@ -4305,7 +5366,7 @@ def reintro_update_unsold_1j(all_accts, juris, max_cur_reintro_1j_1q):
         reintro_1j_1q = reintro_1j_1q.dropna()
         
         # log the quantity reintroduced
-        logging.info(f"in {cq.date} for juris {juris}, quantity reintro: {reintro_1j_1q['quant'].sum()}")
+        trace('reintro', juris=juris, quant=lambda: reintro_1j_1q['quant'].sum())
         
         # don't need to update acct_name; should still be auct_hold
         mapping_dict = {'newness': 'reintro', 
@@ -4325,13 +5386,11 @@ def reintro_update_unsold_1j(all_accts, juris, max_cur_reintro_1j_1q):
     else: # if reintro_eligible_1j['quant'].sum() is not > 0
         pass
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of reintro_update_unsold_1j
@@ -4351,10 +5410,10 @@ def process_auction_cur_CA_all_accts(all_accts):
     4. Newly available state-owned allowances: § 95911(f)(1)(E)
     
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     if prmt.run_tests == True:
         # TEST: check that all available allowances are in auct_hold
@@ -4642,13 +5701,11 @@ def process_auction_cur_CA_all_accts(all_accts):
 
     # end of if-else statement that began "if sales_fract_cur_1j_1q == 1.0)
 
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
         
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     return(all_accts)
 # end of process_auction_cur_CA_all_accts
@@ -4669,7 +5726,7 @@ def process_reserve_sales_historical(all_accts, juris):
     
     The function draws first from the allowances in the main set of reserves (non-vintaged), then vintaged allowances.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     if juris == 'CA':
         reserve_sales_1q = prmt.CA_reserve_sales_q_hist.at[cq.date]
@@ -4677,7 +5734,7 @@ def process_reserve_sales_historical(all_accts, juris):
         reserve_sales_1q = prmt.QC_reserve_sales_q_hist.at[cq.date]
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     if reserve_sales_1q > 0:
         
@@ -4728,13 +5785,11 @@ def process_reserve_sales_historical(all_accts, juris):
     else:
         print(f"Error! Unknown edge case for reserve_sales_1q: {reserve_sales_1q}") # for UI
 
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
         
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
           
     return(all_accts)
 # end of process_reserve_sales_historical
@@ -4758,10 +5813,10 @@ def adv_unsold_to_cur_all_accts(all_accts):
     QC regs: Section 54 (paragraph 2) [in force date 2014-10-22]
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # isolate allowances unsold at advance auctions
     mask1 = all_accts.index.get_level_values('acct_name')=='auct_hold'
@@ -4788,13 +5843,11 @@ def adv_unsold_to_cur_all_accts(all_accts):
     # recombine adv_redes_to_cur with remainder
     all_accts = pd.concat([adv_redes_to_cur, all_accts_remainder], sort=True)
 
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     return(all_accts)
 # end of adv_unsold_to_cur_all_accts
@@ -4812,9 +5865,9 @@ def transfer__from_VRE_acct_to_retirement(all_accts):
     Destination account is contained in to_acct_MI metadata.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
 
     try:
         VRE_retired_1q = prmt.VRE_retired.xs(cq.date, level='CIR_date', drop_level=False)
@@ -4853,24 +5906,20 @@ def transfer__from_VRE_acct_to_retirement(all_accts):
         all_accts_pos = all_accts.loc[all_accts['quant']>0]
         all_accts_pos = pd.concat([all_accts_pos, to_remove, to_transfer], sort=True).groupby(level=prmt.standard_MI_names).sum()
         all_accts_neg = all_accts.loc[all_accts['quant']<0]
-        all_accts = all_accts_pos.append(all_accts_neg)
+        all_accts = pd.concat([all_accts_pos, all_accts_neg], sort=False)
 
-        logging.info(f"VRE retirement of {to_transfer['quant'].sum()} M.")
+        trace('VRE retirement', juris='CA', quant=lambda: to_transfer['quant'].sum())
         
     except:
         # no VRE_retired for given date
         pass
     
     
-    if prmt.run_tests == True:
-        name_of_allowances = 'VRE_reserve'
-        test_conservation_during_transfer(all_accts, all_accts_sum_init, name_of_allowances)
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, remove_name='VRE_reserve')
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of transfer__from_VRE_acct_to_retirement
@@ -4895,10 +5944,10 @@ def transfer_consign__from_limited_use_to_auct_hold(all_accts):
     Since this is for consignment, which are only in CA, it doesn't apply to QC.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # get quantity newly consigned in next_q (consign_next_q_quant)
     # vintage of these allowances will always be next_q.year 
@@ -4980,13 +6029,11 @@ def transfer_consign__from_limited_use_to_auct_hold(all_accts):
                            all_accts_remainder], 
                           sort=False)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of transfer_consign__from_limited_use_to_auct_hold
@@ -5005,10 +6052,10 @@ def transfer_CA_alloc__from_ann_alloc_hold_to_general(all_accts):
     So CIRs for Q4 include these Jan 1 tranfers of CA allocations out of government accounts and into private accounts.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # get all allowances in acct_name == 'ann_alloc_hold' & juris == 'CA'
     mask1 = all_accts.index.get_level_values('acct_name') == 'ann_alloc_hold'
@@ -5024,13 +6071,11 @@ def transfer_CA_alloc__from_ann_alloc_hold_to_general(all_accts):
     # recombine dfs
     all_accts = pd.concat([to_transfer, remainder])
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of transfer_CA_alloc__from_ann_alloc_hold_to_general
@@ -5051,10 +6096,10 @@ def cur_upsample_avail_state_owned_first_principles(all_accts, juris):
     
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # ~~~~~~~~~~~~~~~
     # get auct_hold, state-owned, specified juris, with auct_type=='current'
@@ -5103,16 +6148,13 @@ def cur_upsample_avail_state_owned_first_principles(all_accts, juris):
         all_accts_pos = all_accts.loc[all_accts['quant']>1e-7]
         all_accts_pos = all_accts_pos.groupby(level=prmt.standard_MI_names).sum()
         all_accts_neg = all_accts.loc[all_accts['quant']>-1e-7]
-        all_accts = all_accts_pos.append(all_accts_neg)
+        all_accts = pd.concat([all_accts_pos, all_accts_neg], sort=False)
         
-    if prmt.run_tests == True:        
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_conservation_against_full_budget(all_accts, juris, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, juris=juris)
         
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # cur_upsample_avail_state_owned_first_principles
@@ -5128,10 +6170,10 @@ def upsample_advance_all_accts(all_accts):
     Specifies date_level for each quarter, but does *not* assign status 'available'.
     """
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # select advance allowances to be upsampled
     # when cq.date.year >= 2013, 
@@ -5166,13 +6208,11 @@ def upsample_advance_all_accts(all_accts):
             print(f"{prmt.test_failed_msg} Allowances not conserved in upsample_advance_all_accts.")
         # END OF TEST
         
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
         
     return(all_accts)
 # end of upsample_advance_all_accts
@@ -5199,10 +6239,10 @@ def transfer_cur__from_alloc_hold_to_auct_hold_first_principles(all_accts, juris
     
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # get all allowances in alloc_hold, inst_cat=='cap', for specified vintage and juris
     mask1 = all_accts.index.get_level_values('acct_name')=='alloc_hold'
@@ -5231,16 +6271,13 @@ def transfer_cur__from_alloc_hold_to_auct_hold_first_principles(all_accts, juris
         # there are duplicated indices; need to do groupby sum
         all_accts_pos = all_accts.loc[all_accts['quant']>1e-7].groupby(level=prmt.standard_MI_names).sum()
         all_accts_neg = all_accts.loc[all_accts['quant']<-1e-7].groupby(level=prmt.standard_MI_names).sum()
-        all_accts = all_accts_pos.append(all_accts_neg)
+        all_accts = pd.concat([all_accts_pos, all_accts_neg], sort=False)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_conservation_against_full_budget(all_accts, juris, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, juris=juris)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     return(all_accts)
 # end of transfer_cur__from_alloc_hold_to_auct_hold_first_principles
@@ -5272,7 +6309,7 @@ def initialize_QC_auctions_2013Q4(all_accts):
     4. The 2013Q4 advance auction had available all vintage 2016 allowances at once.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # all_accts (for QC) starts empty
     
@@ -5280,7 +6317,7 @@ def initialize_QC_auctions_2013Q4(all_accts):
     all_accts = create_annual_budgets_in_alloc_hold(all_accts, prmt.QC_cap.loc[2013:2020])
 
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     logging.info(f"total allowances created: {all_accts_sum_init}")
     
@@ -5344,14 +6381,11 @@ def initialize_QC_auctions_2013Q4(all_accts):
 
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_conservation_against_full_budget(all_accts, 'QC', parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, juris='QC')
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of initialize_QC_auctions_2013Q4
@@ -5367,9 +6401,9 @@ def convert_QC_alloc_set_aside(all_accts):
     This is a bookkeeping device for separating allowances so that they will not be auctioned.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # use QC_alloc_initial (df) to create QC_alloc_full_est (ser)
     df = (prmt.QC_alloc_initial.copy())/0.75
@@ -5410,13 +6444,11 @@ def convert_QC_alloc_set_aside(all_accts):
     # recombine pos & neg
     all_accts = pd.concat([all_accts_pos, all_accts_neg], sort=False)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of convert_QC_alloc_set_aside
@@ -5435,9 +6467,9 @@ def transfer_QC_alloc_init__from_alloc_hold(all_accts):
     
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
 
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # convert QC_alloc_initial (df) into QC_alloc_i (ser)
     QC_alloc_i = prmt.QC_alloc_initial.copy()
@@ -5474,15 +6506,13 @@ def transfer_QC_alloc_init__from_alloc_hold(all_accts):
     all_accts_pos = all_accts_pos.groupby(level=prmt.standard_MI_names).sum()
     
     # recombine pos & neg
-    all_accts = all_accts_pos.append(all_accts_neg)
+    all_accts = pd.concat([all_accts_pos, all_accts_neg], sort=False)
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of transfer_QC_alloc_init__from_alloc_hold
@@ -5501,10 +6531,10 @@ def process_QC_quarterly(all_accts):
     Order of sales for each jurisdiction set by jurisdiction-specific functions called within process_quarter.
     
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # object "scenario" holds the data for a particular scenario in various attributes 
     # (scenario_QC.avail_accum, etc.)
@@ -5557,7 +6587,7 @@ def process_QC_quarterly(all_accts):
     
     # ADVANCE AUCTIONS ********************************************************
     # process advance auctions through vintage 2030, which occur in years through 2027
-    logging.info(f"within {inspect.currentframe().f_code.co_name}, start of advance auction")
+    trace('start of advance auction')
     
     if cq.date.year <= 2027:
         # ADVANCE AUCTION: MAKE AVAILABLE     
@@ -5575,7 +6605,7 @@ def process_QC_quarterly(all_accts):
         pass
     
     # CURRENT AUCTION ********************************************************
-    logging.info("within process_quarter, start of current auction")
+    trace('start of current auction')
     
     # QC state-owned current: make available for cq.date
     all_accts = QC_state_owned_make_available(all_accts, 'current')         
@@ -5593,19 +6623,19 @@ def process_QC_quarterly(all_accts):
     if cq.date.quarter == 4:        
         # Q4 PROCESSING AFTER AUCTION **********************************************
         # this includes transfer of consigned portion of alloc into limited_use
-        logging.info(f"for {cq.date}, for QC, Q4 processing after auction: start")
+        trace('Q4 processing after auction: start', juris='QC')
         
         # end-of-year: move advance unsold to current auction
         all_accts = adv_unsold_to_cur_all_accts(all_accts)
 
-        logging.info(f"for {cq.date}, Q4 processing after auction: end")
+        trace('Q4 processing after auction: end')
     
     else: 
         # closing "if cq.date.quarter == 4:"
         pass
     
     # END-OF-QUARTER (EVERY QUARTER) *****************************************
-    logging.info("end-of-quarter processing (every quarter) - start")
+    trace('end-of-quarter processing: start')
     
     # process historical reserve sales
     all_accts = process_reserve_sales_historical(all_accts, 'QC')
@@ -5624,11 +6654,8 @@ def process_QC_quarterly(all_accts):
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # CLEANUP OF all_accts (each quarter)
-    # get rid of fractional allowances, zeros, and NaN
-    logging.info("cleanup of all_accts")
-    
-    all_accts = all_accts.loc[(all_accts['quant']>1e-7) | (all_accts['quant']<-1e-7)]
-    all_accts = all_accts.dropna()
+    # get rid of fractional allowances, zeros, and NaN; then compact (see prmt.ledger_compaction)
+    all_accts = compact_ledger(all_accts, 'QC')
     # END OF CLEANUP OF all_accts
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -5638,16 +6665,14 @@ def process_QC_quarterly(all_accts):
         
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     
-    logging.info("end-of-quarter processing (every quarter) - end")
+    trace('end-of-quarter processing: end')
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)        
-        test_conservation_against_full_budget(all_accts, 'QC', parent_fn)  
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
+        report_ledger_invariants_quarter(all_accts, 'QC', parent_fn)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of process_QC_quarterly
@@ -5667,10 +6692,10 @@ def QC_state_owned_make_available(all_accts, auct_type):
     Need to rework the function to work for linked auctions.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
   
     # pre-test: conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     if auct_type in ['advance', 'current']:        
         # get allowances in auct_hold, for specified auct_type, for date_level == cq.date
@@ -5687,7 +6712,7 @@ def QC_state_owned_make_available(all_accts, auct_type):
         avail_1q = multiindex_change(avail_1q, mapping_dict)
 
         # combine avail with remainder (~mask)
-        all_accts = avail_1q.append(all_accts.loc[~mask])
+        all_accts = pd.concat([avail_1q, all_accts.loc[~mask]], sort=False)
         
     else: # auct_type not 'advance' or 'current'
         print("Error! In QC_state_owned_make_available, auct_type was neither 'current' nor 'advance';") # for UI
@@ -5704,14 +6729,11 @@ def QC_state_owned_make_available(all_accts, auct_type):
             pass
         # END OF TEST
 
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_conservation_against_full_budget(all_accts, 'QC', parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, juris='QC')
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of QC_state_owned_make_available
@@ -5734,10 +6756,10 @@ def transfer_QC_alloc_trueups__from_alloc_hold(all_accts):
     
     (True-ups from APCR are handled by _________.)
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test: conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # get all the allocation true-ups that occur in a particular quarter
     # (these are only positive true-ups)
@@ -5924,7 +6946,7 @@ def transfer_QC_alloc_trueups__from_alloc_hold(all_accts):
             # do groupby sum of pos & neg, recombine
             all_accts_pos = all_accts.loc[all_accts['quant']>1e-7].groupby(level=prmt.standard_MI_names).sum()
             all_accts_neg = all_accts.loc[all_accts['quant']<-1e-7].groupby(level=prmt.standard_MI_names).sum()
-            all_accts = all_accts_pos.append(all_accts_neg)
+            all_accts = pd.concat([all_accts_pos, all_accts_neg], sort=False)
 
         # end of "for emission_year in all_emissions_years:"
     
@@ -5932,14 +6954,11 @@ def transfer_QC_alloc_trueups__from_alloc_hold(all_accts):
         # closing "if len(QC_alloc_trueup_1q) > 0:"
         pass
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_during_transfer(all_accts, all_accts_sum_init, 'QC_alloc')
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, remove_name='QC_alloc')
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of transfer_QC_alloc_trueups__from_alloc_hold
@@ -5957,7 +6976,7 @@ def transfer_QC_alloc_trueups__from_APCR(all_accts, trueup_remaining, emission_y
     Modifies remaining true-ups for a given emission year. 
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # ***** SPECIAL CASES *****
     QC_alloc_trueups_from_APCR = prmt.QC_alloc_trueups_non_APCR.dropna(subset=['quant_APCR'])
@@ -5996,7 +7015,7 @@ def transfer_QC_alloc_trueups__from_APCR(all_accts, trueup_remaining, emission_y
             all_accts_pos = pd.concat([all_accts_pos, trueup_transfers, remove], sort=True)
             all_accts_pos = all_accts_pos.groupby(level=prmt.standard_MI_names).sum()
             all_accts_neg = all_accts.loc[all_accts['quant']<-1e-7]
-            all_accts = all_accts_pos.append(all_accts_neg)
+            all_accts = pd.concat([all_accts_pos, all_accts_neg], sort=False)
 
             # update trueup_remaining, for use in regular processing below
             
@@ -6012,7 +7031,7 @@ def transfer_QC_alloc_trueups__from_APCR(all_accts, trueup_remaining, emission_y
     else: # not cq.date == quarter
         pass
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     return(all_accts, trueup_remaining)
 # end of transfer_QC_alloc_trueups__from_APCR
@@ -6032,10 +7051,10 @@ def transfer_QC_alloc_trueups_neg__to_reserve(all_accts):
     Given the scale of negative true-ups and APCR distributions for allocations, it seems unlikely full replenishment
     will occur through this mechanism.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test: conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     neg_q = prmt.QC_alloc_trueups_neg.loc[
         prmt.QC_alloc_trueups_neg.index.get_level_values('allocation_quarter')==cq.date]
@@ -6080,14 +7099,11 @@ def transfer_QC_alloc_trueups_neg__to_reserve(all_accts):
             all_accts = pd.concat([all_accts, trueup_neg_to_subtract, trueup_neg_to_reserve], sort=True)
             # no need to do groupby sums; metadata distinct for each set of allowances   
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_during_transfer(all_accts, all_accts_sum_init, 'QC_alloc')
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, remove_name='QC_alloc')
         
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of transfer_QC_alloc_trueups_neg__to_reserve
@@ -6101,7 +7117,7 @@ def QC_early_action_distribution(all_accts):
     Create Early Action allowances and distribute them to gen_acct.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # for Early Action, use vintage 2199 as proxy non-vintage allowances
     # this keeps Early Action separate from APCR (vintage 2200)
@@ -6133,9 +7149,9 @@ def QC_early_action_distribution(all_accts):
 
     QC_early_action = df 
     
-    all_accts = all_accts.append(QC_early_action)
+    all_accts = pd.concat([all_accts, QC_early_action], sort=False)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of QC_early_action_distribution
@@ -6144,7 +7160,18 @@ def QC_early_action_distribution(all_accts):
 # ## Functions: Tracking (within master function)
 # * avail_accum_append [tracking]
 # * take_snapshot_end [tracking]
+# * compact_ledger [tracking]
 # * take_snapshot_CIR [tracking]
+# * snapshot_policy_for_outputs
+# * snapshot_wanted
+# * get_snapshots
+#   * rerun_with_all_snapshots
+#   * rerun_default_with_all_snapshots
+# * snaps_index
+#   * snaps_frame
+# * query_snaps
+# * diff_snaps
+#   * diff_vs_default_run
 
 # In[ ]:
 
@@ -6154,8 +7181,7 @@ def avail_accum_append(all_accts, avail_accum, auct_type_specified):
     Append allowances available at auction to avail_accum. Runs for advance and current auctions.
     """
     
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name}")
+    trace('run', level=logging.DEBUG)
     
     # record allowances available in each auction
     avail_1q = all_accts.loc[(all_accts.index.get_level_values('status')=='available') & 
@@ -6183,15 +7209,23 @@ def avail_accum_append(all_accts, avail_accum, auct_type_specified):
         pass
     # END OF TEST
             
-    avail_accum = avail_accum.append(avail_1q)
-    
     if prmt.run_tests == True:
+        # avail_1q all have date_level == cq.date (test above), so can't duplicate rows from earlier quarters; 
+        # test the new chunk together with rows of the same date_level in the previous chunk 
+        # (advance & current auctions in the same quarter)
+        if len(avail_accum.chunks) > 0:
+            prev_chunk = avail_accum.chunks[-1]
+            prev_same_q = prev_chunk.loc[prev_chunk.index.get_level_values('date_level')==cq.date]
+        else:
+            prev_same_q = prmt.standard_MI_empty
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_for_duplicated_indices(avail_accum, parent_fn)
-        test_for_negative_values(avail_accum, parent_fn)
+        test_for_duplicated_indices(pd.concat([prev_same_q, avail_1q], sort=False), parent_fn)
+        test_for_negative_values(avail_1q, parent_fn)
+    
+    # avail_accum is a Chunk_accum; appending doesn't copy earlier auctions
+    avail_accum = avail_accum.append(avail_1q)
         
-    if prmt.verbose_log == True:
-        logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end', level=logging.DEBUG)
 
     return(avail_accum)
 # end of avail_accum_append
@@ -6207,7 +7241,12 @@ def take_snapshot_end(all_accts, juris):
     This is to enable later start of a scenario from any given ending point.
     
     """    
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
+    
+    if snapshot_wanted('end', cq.date) == False:
+        # not needed for requested outputs (prmt.snapshot_outputs)
+        trace('end')
+        return
     
     snap_end = all_accts.copy()
     snap_end['snap_q'] = cq.date
@@ -6217,7 +7256,7 @@ def take_snapshot_end(all_accts, juris):
     elif juris == 'QC':
         scenario_QC.snaps_end += [snap_end]
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     # no return; updates object attributes
 # end of take_snapshot_end
@@ -6226,35 +7265,514 @@ def take_snapshot_end(all_accts, juris):
 # In[ ]:
 
 
-def take_snapshot_CIR(all_accts, juris):
+def compact_ledger(all_accts, juris):
     """
-    Take a snapshot of all_accts, which is later modified for comparison with Compliance Instrument Report (CIR).
+    End-of-quarter cleanup & compaction of all_accts, with telemetry on ledger fragmentation.
     
-    snap_CIR labeled with a particular quarter is actually taken early in the following quarter.
-    (Example: 2014Q4 snap_CIR is taken in early 2015Q1)
+    Cleanup (always): removes fractional allowances, zeros, and NaN.
     
-    This is following regulators' practice in CIR.
+    Compaction, as set by prmt.ledger_compaction:
+    * 'fold': for rows in terminal accounts (prmt.ledger_terminal_accts), sets the index levels that no rule reads 
+      for those accounts (prmt.ledger_fold_levels) to their default values, then merges equivalent rows
+    * 'merge': only merges equivalent rows (same index), with groupby sum
+    * 'off': no compaction
     
-    So a snap_CIR taken early in cq.date is labeled as from previous_q (1 quarter before cq.date).
+    Scope of 'fold': only rows in gen_acct & retirement (default prmt.ledger_terminal_accts) are changed; 
+    rows in all other accounts keep their full index, so rules that read newness, date_level, unsold_di, 
+    or unsold_dl see the same rows as without compaction. Totals by account, vintage & status are unchanged, 
+    but snaps_end rows for terminal accounts are folded (fewer rows, with default values in folded levels); 
+    outputs recorded without compaction differ in row layout only (see WCI_RULES_golden_outputs.py).
+    
+    Compaction runs only if the measured fragmentation ratio (rows / rows after compaction) is at least 
+    prmt.ledger_compaction_min_ratio; otherwise the groupby costs more than the rows it saves.
+    
+    For each quarter, appends telemetry to prmt.ledger_telemetry_records:
+    * rows: number of rows after cleanup
+    * distinct_keys: number of distinct indices (rows - distinct_keys = rows that could be merged)
+    * terminal_rows: number of rows in terminal accounts
+    * fragmentation_ratio: rows / rows after compaction (for prmt.ledger_compaction; 1.0 for 'off')
+    * rows_compacted: number of rows after compaction (equal to rows if compaction skipped)
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
-    previous_q = (pd.to_datetime(f'{cq.date.year}Q{cq.date.quarter}') - DateOffset(months=3)).to_period('Q')
+    all_accts = all_accts.loc[(all_accts['quant']>1e-7) | (all_accts['quant']<-1e-7)]
+    all_accts = all_accts.dropna()
     
-    snap_CIR = all_accts.copy()
-    snap_CIR['snap_q'] = previous_q
+    record = {'quarter': cq.date, 
+              'juris': juris, 
+              'rows': len(all_accts), 
+              'distinct_keys': all_accts.index.nunique()}
+    
+    terminal_mask = all_accts.index.get_level_values('acct_name').isin(prmt.ledger_terminal_accts)
+    record['terminal_rows'] = int(terminal_mask.sum())
+    
+    # measure fragmentation: number of rows there would be after compaction
+    if prmt.ledger_compaction == 'fold' and terminal_mask.any():
+        # distinct keys in terminal accounts, without levels that fold would overwrite
+        terminal_keys = all_accts.loc[terminal_mask].index.droplevel(list(prmt.ledger_fold_levels.keys()))
+        non_terminal_keys = all_accts.loc[~terminal_mask].index
+        rows_after = terminal_keys.nunique() + non_terminal_keys.nunique()
+    elif prmt.ledger_compaction in ['fold', 'merge']:
+        rows_after = record['distinct_keys']
+    else:
+        # prmt.ledger_compaction == 'off'
+        rows_after = record['rows']
+    record['fragmentation_ratio'] = record['rows'] / max(rows_after, 1)
+    
+    if prmt.ledger_compaction == 'off' or record['fragmentation_ratio'] < prmt.ledger_compaction_min_ratio:
+        # no compaction, or not fragmented enough to be worth compacting
+        pass
+    
+    elif prmt.ledger_compaction == 'fold' and terminal_mask.any():
+        terminal = multiindex_change(all_accts.loc[terminal_mask], prmt.ledger_fold_levels)
+        all_accts = pd.concat([all_accts.loc[~terminal_mask], terminal], sort=False)
+        all_accts = all_accts.groupby(level=prmt.standard_MI_names).sum()
+    
+    else:
+        # 'merge' (or 'fold' with no terminal rows)
+        all_accts = all_accts.groupby(level=prmt.standard_MI_names).sum()
+    
+    record['rows_compacted'] = len(all_accts)
+    prmt.ledger_telemetry_records += [record]
+    
+    trace('end', rows=record['rows'], rows_compacted=record['rows_compacted'])
+    
+    return(all_accts)
+# end of compact_ledger
+
+
+# In[ ]:
+
+
+def take_snapshot_CIR(all_accts, juris):
+    """
+    Take a snapshot of all_accts, which is later modified for comparison with Compliance Instrument Report (CIR).
+    
+    snap_CIR labeled with a particular quarter is actually taken early in the following quarter.
+    (Example: 2014Q4 snap_CIR is taken in early 2015Q1)
+    
+    This is following regulators' practice in CIR.
+    
+    So a snap_CIR taken early in cq.date is labeled as from previous_q (1 quarter before cq.date).
+    """
+    trace('start')
+    
+    previous_q = (pd.to_datetime(f'{cq.date.year}Q{cq.date.quarter}') - DateOffset(months=3)).to_period('Q')
+    
+    if snapshot_wanted('CIR', previous_q) == False:
+        # not needed for requested outputs (prmt.snapshot_outputs)
+        trace('end', named=previous_q)
+        return
+    
+    snap_CIR = all_accts.copy()
+    snap_CIR['snap_q'] = previous_q
     
     if juris == 'CA':
         scenario_CA.snaps_CIR += [snap_CIR]
     elif juris == 'QC':
         scenario_QC.snaps_CIR += [snap_CIR]
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} named {previous_q} (end)")
+    trace('end', named=previous_q)
 
     # no return; updates object attributes
 # end of take_snapshot_CIR
 
 
+# In[ ]:
+
+
+def snapshot_policy_for_outputs(outputs):
+    """
+    Returns snapshot policy (dict with keys 'end' & 'CIR') needed for the requested outputs (list).
+    
+    For each kind of snapshot, the policy is one of:
+    * 'all': every quarter
+    * 'metrics': quarters used by supply_demand_calculations; for snaps_end, Q4 (create_balance_cube); 
+      for snaps_CIR, Q4 (private_bank_annual_metric_paper_method) 
+      & Q3 before final compliance events (compliance_period_metrics_historical & _projection)
+    * 'none': no snapshots
+    
+    Outputs can be:
+    * 'supply_demand': supply-demand calculations & export (default)
+    * 'snaps_end' or 'snaps_CIR': all quarters of that kind of snapshot
+    * 'all': all quarters of both kinds
+    
+    Trade-off of the default ('supply_demand'): runs hold fewer snapshots, but functions that need other quarters 
+    (query_snaps, diff_snaps, reconcile_snaps_vs_CIR) rerun the model with all snapshots on first use 
+    (see get_snapshots). The default run artifact stores all snapshots (see save_default_run_artifact).
+    """
+    policy = {'end': 'none', 'CIR': 'none'}
+    
+    if 'supply_demand' in outputs:
+        policy = {'end': 'metrics', 'CIR': 'metrics'}
+    
+    if 'snaps_end' in outputs or 'all' in outputs:
+        policy['end'] = 'all'
+    
+    if 'snaps_CIR' in outputs or 'all' in outputs:
+        policy['CIR'] = 'all'
+    
+    return(policy)
+# end of snapshot_policy_for_outputs
+
+
+def snapshot_wanted(kind, quarter):
+    """
+    Whether a snapshot of kind ('end' or 'CIR') is taken for quarter, given prmt.snapshot_policy.
+    """
+    policy = prmt.snapshot_policy[kind]
+    
+    if policy == 'all':
+        return(True)
+    elif policy == 'metrics':
+        if quarter.quarter == 4:
+            return(True)
+        elif kind == 'CIR' and quarter.quarter == 3 and quarter.year >= 2015 and (quarter.year - 2015) % 3 == 0:
+            # Q3 before final compliance event for a compliance period (2015, 2018, ... 2030)
+            return(True)
+        else:
+            return(False)
+    else: # policy == 'none'
+        return(False)
+# end of snapshot_wanted
+
+
+def get_snapshots(juris, kind, quarters):
+    """
+    Returns list of snapshots of kind ('end' or 'CIR') for juris, for the quarters specified (list of Periods).
+    
+    If any of the quarters weren't captured (because of prmt.snapshot_policy), reruns the model 
+    with all snapshots, then returns the snapshots from that run.
+    """
+    trace('start')
+    
+    def select():
+        scenario = scenario_CA if juris == 'CA' else scenario_QC
+        snaps = scenario.snaps_end if kind == 'end' else scenario.snaps_CIR
+        return([snap for snap in snaps if len(snap) > 0 and snap['snap_q'].iat[0] in quarters])
+    
+    snaps = select()
+    captured = [snap['snap_q'].iat[0] for snap in snaps]
+    missing = [quarter for quarter in quarters if quarter not in captured]
+    
+    if len(missing) > 0:
+        logging.info(f"snapshots not captured for {juris} {kind}: {missing}; rerunning with all snapshots")
+        rerun_with_all_snapshots()
+        snaps = select()
+    
+    trace('end')
+    
+    return(snaps)
+# end of get_snapshots
+
+
+def rerun_with_all_snapshots():
+    """
+    Reruns auctions with current settings, taking snapshots in all quarters (lazy fallback for get_snapshots).
+    
+    If the current settings are the default run, the saved default run is replaced by the new run.
+    """
+    trace('start')
+    
+    snapshot_outputs = prmt.snapshot_outputs
+    saved_auction_run_default = prmt.saved_auction_run_default
+    
+    prmt.snapshot_outputs = snapshot_outputs + ['all']
+    prmt.saved_auction_run_default = False
+    try:
+        process_allowance_supply_CA_QC()
+    finally:
+        prmt.snapshot_outputs = snapshot_outputs
+        prmt.saved_auction_run_default = saved_auction_run_default
+    
+    if prmt.years_not_sold_out == () or prmt.fract_not_sold == float(0):
+        # rerun used default settings (all auctions sell out); decided from the settings the rerun used, 
+        # not from auction_tabs, which can differ from those settings until the next run (see supply_demand_button_on_click)
+        # save snaps, so that later runs using saved default run also have all snapshots
+        prmt.CA_snaps_end_default_run_end = scenario_CA.snaps_end
+        prmt.QC_snaps_end_default_run_end = scenario_QC.snaps_end
+        prmt.CA_snaps_end_default_run_CIR = scenario_CA.snaps_CIR
+        prmt.QC_snaps_end_default_run_CIR = scenario_QC.snaps_CIR
+    
+    trace('end')
+    
+    # no return; updates scenario_CA & scenario_QC
+# end of rerun_with_all_snapshots
+
+
+def rerun_default_with_all_snapshots():
+    """
+    Reruns the default run (all auctions sell out) with all snapshots, using the default run's own settings, 
+    so that the saved default run has all quarters (see rerun_with_all_snapshots).
+    
+    Afterward, restores the settings, snapshots & auction results of the latest run.
+    """
+    trace('start')
+    
+    settings = (prmt.years_not_sold_out, prmt.fract_not_sold)
+    scenarios = {scenario: (scenario.avail_accum, scenario.snaps_end, scenario.snaps_CIR) 
+                 for scenario in [scenario_CA, scenario_QC]}
+    run_attrs = {attr: getattr(prmt, attr) for attr in ['auction_sales_pcts_all', 'CA_cur_sell_out_counter', 
+                                                        'QC_cur_sell_out_counter', 'ledger_telemetry']}
+    
+    prmt.years_not_sold_out = ()
+    prmt.fract_not_sold = float(0)
+    try:
+        # saves snaps as the default run, since settings are the default run's
+        rerun_with_all_snapshots()
+    finally:
+        prmt.years_not_sold_out, prmt.fract_not_sold = settings
+        for scenario, (avail_accum, snaps_end, snaps_CIR) in scenarios.items():
+            scenario.avail_accum = avail_accum
+            scenario.snaps_end = snaps_end
+            scenario.snaps_CIR = snaps_CIR
+        for attr, value in run_attrs.items():
+            setattr(prmt, attr, value)
+    
+    trace('end')
+    
+    # no return; updates saved default run snapshots (prmt.CA_snaps_end_default_run_end etc.)
+# end of rerun_default_with_all_snapshots
+
+
+def snaps_index(juris, kind):
+    """
+    Returns df of all snapshots of kind ('end' or 'CIR') for juris, concatenated once, 
+    with index snap_q & prmt.standard_MI_names (sorted) and column 'quant'.
+    
+    Kept in prmt.snaps_index until the snapshots list for juris & kind changes (new model run, or more snapshots).
+    """
+    scenario = scenario_CA if juris == 'CA' else scenario_QC
+    snaps = scenario.snaps_end if kind == 'end' else scenario.snaps_CIR
+    
+    cached = prmt.snaps_index.get((juris, kind))
+    if cached is not None and cached[0] is snaps and cached[1] == len(snaps):
+        return(cached[2])
+    
+    df = snaps_frame(snaps)
+    
+    prmt.snaps_index[(juris, kind)] = (snaps, len(snaps), df)
+    
+    return(df)
+# end of snaps_index
+
+
+def snaps_frame(snaps):
+    """
+    Concatenates list of snapshots into df with index snap_q & prmt.standard_MI_names (sorted) and column 'quant'.
+    """
+    snaps_nonempty = [snap for snap in snaps if len(snap) > 0]
+    
+    if len(snaps_nonempty) == 0:
+        df = prmt.standard_MI_empty.copy()
+        df['snap_q'] = pd.Series(dtype=object)
+    else:
+        df = pd.concat(snaps_nonempty, sort=False)
+    
+    df = df.set_index('snap_q', append=True).reorder_levels(['snap_q'] + prmt.standard_MI_names)
+    df = df[['quant']].sort_index()
+    
+    return(df)
+# end of snaps_frame
+
+
+def query_snaps(juris='CA-QC', kind='end', quarters=None, by=None, **filters):
+    """
+    Query snapshots from the latest model run: select quarters, filter by any of prmt.standard_MI_names, 
+    and sum over the others. Uses snaps_index, so snapshots are concatenated only once per run.
+    
+    Arguments:
+    * juris: 'CA', 'QC', or 'CA-QC'
+    * kind: 'end' (snaps_end) or 'CIR' (snaps_CIR)
+    * quarters: None for all; a quarter (str such as '2024Q2', or Period); a list of quarters; 
+      or a tuple (first, last) for a range, inclusive
+    * by: list of names in prmt.standard_MI_names to keep; None to sum over all; 'all' to keep all
+    * filters: for names in prmt.standard_MI_names, value or list of values to keep
+    
+    If any quarters requested weren't captured (because of prmt.snapshot_policy), reruns the model 
+    with all snapshots (see rerun_with_all_snapshots).
+    
+    Returns Series of quant, indexed by snap_q & names in by.
+    
+    Example: unsold CA state-owned current allowances by unsold_di at 2024Q2:
+    query_snaps('CA', quarters='2024Q2', by=['unsold_di'], inst_cat='CA', auct_type='current', status='unsold')
+    
+    Raises ValueError if a filter isn't one of prmt.standard_MI_names.
+    """
+    # check filters before any (costly) snapshot concat or rerun
+    for name in filters.keys():
+        if name not in prmt.standard_MI_names:
+            raise ValueError(f"query_snaps: filter {name} is not one of prmt.standard_MI_names")
+    
+    trace('start')
+    
+    if juris == 'CA-QC':
+        juris_list = ['CA', 'QC']
+    else:
+        juris_list = [juris]
+    
+    # quarters requested, as list of Periods (None for all)
+    if quarters is None:
+        quarters_list = None
+    elif isinstance(quarters, tuple):
+        quarters_list = list(pd.period_range(start=str(quarters[0]), end=str(quarters[1]), freq='Q'))
+    elif isinstance(quarters, list):
+        quarters_list = [quarter_period(str(quarter)) for quarter in quarters]
+    else:
+        quarters_list = [quarter_period(str(quarters))]
+    
+    def select(df):
+        snap_qs = df.index.get_level_values('snap_q')
+        if quarters_list is None:
+            return(df)
+        else:
+            return(df.loc[snap_qs.isin(quarters_list)])
+    
+    dfs = []
+    for juris_1 in juris_list:
+        df = snaps_index(juris_1, kind)
+        
+        # quarters within the range of the model run, but not captured
+        captured = df.index.get_level_values('snap_q').unique()
+        if len(captured) == 0:
+            missing = []
+        elif quarters_list is None:
+            in_range = pd.period_range(start=captured.min(), end=captured.max(), freq='Q')
+            missing = [quarter for quarter in in_range if quarter not in captured]
+        else:
+            missing = [quarter for quarter in quarters_list 
+                       if quarter >= captured.min() and quarter <= captured.max() and quarter not in captured]
+        
+        if len(missing) > 0:
+            logging.info(f"snapshots not captured for {juris_1} {kind}: {missing}; rerunning with all snapshots")
+            rerun_with_all_snapshots()
+            df = snaps_index(juris_1, kind)
+        
+        dfs += [select(df)]
+    
+    df = pd.concat(dfs, sort=False)
+    
+    # filter
+    mask = np.ones(len(df), dtype=bool)
+    for name, values in filters.items():
+        if not isinstance(values, list):
+            values = [values]
+        mask &= df.index.get_level_values(name).isin(values)
+    df = df.loc[mask]
+    
+    # aggregate
+    if by == 'all':
+        result = df['quant']
+    elif by is None:
+        result = df['quant'].groupby(level='snap_q').sum()
+    else:
+        result = df['quant'].groupby(level=['snap_q'] + list(by)).sum()
+    
+    trace('end')
+    
+    return(result)
+# end of query_snaps
+
+
+def diff_snaps(snaps_a, snaps_b, by=('juris', 'acct_name', 'status', 'vintage'), shared_through=None):
+    """
+    Per-quarter differences between snapshots of two model runs (lists of snapshots, such as snaps_end).
+    
+    Snapshots are aligned by snap_q; quantities are summed by snap_q & names in by (from prmt.standard_MI_names), 
+    and the differences are for each of those keys. 
+    
+    Quarters in the shared historical prefix (through shared_through; default prmt.latest_hist_qauct_date) 
+    are skipped, since both runs use the same historical data for those quarters. 
+    Quarters in which both runs have the same snapshot (such as when both use the saved default run) are also skipped.
+    
+    Only quarters captured in both runs can be compared; if a quarter after the shared prefix is in only one run, 
+    shows a warning. (To capture all quarters, see get_snapshots & diff_vs_default_run.)
+    
+    Returns df with columns 'run_a', 'run_b', 'delta' (run_b - run_a), only for keys with delta not 0.
+    """
+    trace('start')
+    
+    if shared_through is None:
+        shared_through = prmt.latest_hist_qauct_date
+    
+    snaps_a_dict = {snap['snap_q'].iat[0]: snap for snap in snaps_a if len(snap) > 0}
+    snaps_b_dict = {snap['snap_q'].iat[0]: snap for snap in snaps_b if len(snap) > 0}
+    
+    # quarters after shared prefix that were captured in only one of the runs
+    quarters_one_run = sorted(set(snaps_a_dict.keys()) ^ set(snaps_b_dict.keys()))
+    quarters_one_run = [quarter for quarter in quarters_one_run if quarter > shared_through]
+    if len(quarters_one_run) > 0:
+        warning_msg = ("Warning" + f"! diff_snaps: quarters captured in only one of the runs weren't compared: "
+                       f"{[str(quarter) for quarter in quarters_one_run]}")
+        print(warning_msg) # for UI
+        logging.info(warning_msg)
+    
+    quarters = [quarter for quarter in snaps_a_dict.keys() 
+                if quarter in snaps_b_dict.keys() 
+                and quarter > shared_through 
+                and snaps_a_dict[quarter] is not snaps_b_dict[quarter]]
+    quarters = sorted(quarters)
+    
+    levels = ['snap_q'] + list(by)
+    sum_a = snaps_frame([snaps_a_dict[quarter] for quarter in quarters])['quant'].groupby(level=levels).sum()
+    sum_b = snaps_frame([snaps_b_dict[quarter] for quarter in quarters])['quant'].groupby(level=levels).sum()
+    
+    df = pd.concat([sum_a.rename('run_a'), sum_b.rename('run_b')], axis=1, sort=True).fillna(0)
+    df['delta'] = df['run_b'] - df['run_a']
+    
+    df = df.loc[(df['delta']>1e-7) | (df['delta']<-1e-7)]
+    
+    trace('end')
+    
+    return(df)
+# end of diff_snaps
+
+
+def diff_vs_default_run(kind='end', by=('juris', 'acct_name', 'status', 'vintage')):
+    """
+    Per-quarter differences between the latest model run and the default run (all auctions sell out), 
+    for CA & QC, for snapshots of kind ('end' or 'CIR'). See diff_snaps.
+    
+    Compares every quarter after the latest historical auction (prmt.latest_hist_qauct_date). 
+    Snapshots of the latest run come from get_snapshots, which reruns the model with all snapshots 
+    if any of those quarters weren't captured (and if the latest run is the default run, that also updates 
+    the saved default run). If the saved default run is still missing any of those quarters 
+    (such as when it was calculated at startup, with only the snapshots for supply-demand calculations), 
+    the default run is rerun with all snapshots (see rerun_default_with_all_snapshots).
+    """
+    trace('start')
+    
+    # quarters after shared historical prefix; 
+    # snaps_CIR labeled with a quarter are taken early in the following quarter, so they end one quarter earlier
+    if kind == 'end':
+        last_q = prmt.model_end_date
+    else:
+        last_q = prmt.model_end_date - 1
+    quarters = list(pd.period_range(start=prmt.latest_hist_qauct_date + 1, end=last_q, freq='Q'))
+    
+    # CA & QC have separate snapshots for each quarter; diff each juris, then combine
+    dfs = []
+    for juris in ['CA', 'QC']:
+        # get snaps of latest run first, because a rerun of the default run would update saved default run
+        snaps_latest = get_snapshots(juris, kind, quarters)
+        
+        default_attr = f'{juris}_snaps_end_default_run_end' if kind == 'end' else f'{juris}_snaps_end_default_run_CIR'
+        captured = [snap['snap_q'].iat[0] for snap in getattr(prmt, default_attr) if len(snap) > 0]
+        if any(quarter not in captured for quarter in quarters):
+            logging.info(f"default run snapshots not captured for all quarters; rerunning default run with all snapshots")
+            rerun_default_with_all_snapshots()
+        snaps_default = getattr(prmt, default_attr)
+        
+        dfs += [diff_snaps(snaps_default, snaps_latest, by=by)]
+    
+    df = pd.concat(dfs, sort=False)
+    
+    trace('end')
+    
+    return(df)
+# end of diff_vs_default_run
+
+
 # ## Functions: Miscellaneous other
 # * net_flow_from_Ontario_add_to_all_accts
 # * retire_for_net_flow_from_Ontario
@@ -6277,7 +7795,7 @@ def net_flow_from_Ontario_add_to_all_accts(all_accts, juris):
     and vice versa.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # As noted in 2018Q2 CIR:
     # "As of that date, there are 13,186,967 more compliance instruments held in California and Québec accounts 
@@ -6338,7 +7856,7 @@ def net_flow_from_Ontario_add_to_all_accts(all_accts, juris):
         net_flow_from_ON_CA = multiindex_change(net_flow_from_ON_CA, mapping_dict)
         
         # add allowances to all_accts
-        all_accts = all_accts.append(net_flow_from_ON_CA)
+        all_accts = pd.concat([all_accts, net_flow_from_ON_CA], sort=False)
         
     elif juris == 'QC':
         # then actually modifying all_accts_QC; all_accts is local variable name
@@ -6349,12 +7867,12 @@ def net_flow_from_Ontario_add_to_all_accts(all_accts, juris):
         net_flow_from_ON_QC = multiindex_change(net_flow_from_ON_QC, mapping_dict)
         
         # add allowances to all_accts
-        all_accts = all_accts.append(net_flow_from_ON_QC)
+        all_accts = pd.concat([all_accts, net_flow_from_ON_QC], sort=False)
         
     else:
         print(f'net_flow_from_Ontario_add_to_all_accts encountered unknown case for juris: {juris}') # for UI
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of net_flow_from_Ontario_add_to_all_accts
@@ -6376,10 +7894,10 @@ def retire_for_net_flow_from_Ontario(all_accts, juris):
     Values set in initialization as prmt.CA_cap_adj_for_ON_net_flow & prmt.QC_cap_adj_for_ON_net_flow.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
         
     # pre-test: conservation of allowances
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     if juris == 'CA':
         # calculate annual quantity for adjustment
@@ -6457,15 +7975,11 @@ def retire_for_net_flow_from_Ontario(all_accts, juris):
     else:
         print(f"Other juris specified that model is not set up to handle: {juris}") # for UI
     
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_against_full_budget(all_accts, juris, parent_fn)
-        test_conservation_during_transfer(all_accts, all_accts_sum_init, 'CA cap adjustment for net flow from ON') 
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, juris=juris, remove_name='CA cap adjustment for net flow from ON')
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of retire_for_net_flow_from_Ontario
@@ -6506,10 +8020,10 @@ def retire_for_EIM_outstanding(all_accts):
     * incurred after 2028: no retirement unless cap-and-trade program is extended beyond 2030
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     if cq.date.year in range(2018, 2029+1):
         # there are EIM outstanding to process
@@ -6653,7 +8167,7 @@ def retire_for_EIM_outstanding(all_accts):
             to_retire.at[row, 'quant'] = to_retire_quant
             
             # vintage_to_retire = to_retire.loc[row].index.get_level_values('vintage') # for logging
-            logging.info(f"for EIM Outstanding Emissions, in {cq.date}, retired {to_retire_quant} M of vintage {vintage_to_retire}")
+            trace('retired for EIM Outstanding Emissions', juris='CA', quant=to_retire_quant, vintage=vintage_to_retire)
 
         # what remains in retire_potential is not retired; to be concat with other pieces below
         
@@ -6708,7 +8222,8 @@ def retire_for_EIM_outstanding(all_accts):
                 # update to_retire
                 to_retire.at[row, 'quant'] = to_retire_quant
                 
-                logging.info(f"in {cq.date}: retired {to_retire['quant'].sum()} M of vintage {vintage_to_retire} for EIM Outstanding Emissions")
+                trace('retired for EIM Outstanding Emissions', juris='CA', quant=lambda: to_retire['quant'].sum(), 
+                      vintage=vintage_to_retire)
             
             # what remains in retire_potential is not retired; to be concat with other pieces below
 
@@ -6722,20 +8237,16 @@ def retire_for_EIM_outstanding(all_accts):
             all_accts = all_accts.groupby(level=prmt.standard_MI_names).sum()
         # ~~~~~~~~~~~~~
 
-        if prmt.run_tests == True:
-            name_of_allowances = 'EIM retirement'
-            test_conservation_during_transfer(all_accts, all_accts_sum_init, name_of_allowances)
+        if prmt.invariant_checks != 'off':
             parent_fn = str(inspect.currentframe().f_code.co_name)
-            test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-            test_for_duplicated_indices(all_accts, parent_fn)
-            test_for_negative_values(all_accts, parent_fn)
+            check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, remove_name='EIM retirement')
 
     else:
         # year not in range(2018, 2030+1)
         # no EIM Outstanding to process
         pass
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
                              
     return(all_accts)
 # end of retire_for_EIM_outstanding
@@ -6758,7 +8269,7 @@ def retire_for_bankruptcy(all_accts):
     but not in 2029 or beyond, because the program is not authorized beyond 2030.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     process_bankruptcy_for_present_yr = False # initialize
     
@@ -6812,7 +8323,7 @@ def retire_for_bankruptcy(all_accts):
         # no bankruptcy retirement to process in this year
         pass
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts)
 # end of retire_for_bankruptcy
@@ -6839,10 +8350,10 @@ def transfer_unsold__from_auct_hold_to_APCR(all_accts):
 
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test for conservation
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     # cut-off date: if allowances with unsold_di of this date or earlier remain unsold, they roll over to APCR
     # this function runs after current auction in cq.date, 
@@ -6876,16 +8387,12 @@ def transfer_unsold__from_auct_hold_to_APCR(all_accts):
     # concat unsold_to_transfer with all_accts remainder
     all_accts = pd.concat([all_accts.loc[~mask], unsold_to_transfer], sort=True)
     
-    if prmt.run_tests == True:
-        name_of_allowances = 'unsold transfer to APCR'
-        test_conservation_during_transfer(all_accts, all_accts_sum_init, name_of_allowances)
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, remove_name='unsold transfer to APCR')
     
-    logging.info(f"in {cq.date}: transferred {unsold_to_transfer['quant'].sum()} M unsold to APCR")
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('transferred unsold to APCR', quant=lambda: unsold_to_transfer['quant'].sum())
+    trace('end')
     
     return(all_accts)
 # end of transfer_unsold__from_auct_hold_to_APCR
@@ -6907,10 +8414,10 @@ def process_auction_cur_QC_all_accts(all_accts):
     QC does not have consigned allowances, so there are not complicating factors due to that.
     """
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # pre-test
-    all_accts_sum_init = all_accts['quant'].sum()
+    all_accts_sum_init = ledger_sum_init(all_accts)
     
     if prmt.run_tests == True:
         # TEST: check that all available allowances are in auct_hold
@@ -6956,13 +8463,9 @@ def process_auction_cur_QC_all_accts(all_accts):
         # recombine
         all_accts = pd.concat([cur_sold_QC_1q, not_cur_avail_QC_1q])
         
-        if prmt.run_tests == True:
-            name_of_allowances = 'after QC sell-out'
-            test_conservation_during_transfer(all_accts, all_accts_sum_init, name_of_allowances)
+        if prmt.invariant_checks != 'off':
             parent_fn = str(inspect.currentframe().f_code.co_name)
-            test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-            test_for_duplicated_indices(all_accts, parent_fn)
-            test_for_negative_values(all_accts, parent_fn)
+            check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn, remove_name='after QC sell-out')
         
     else: # sales_fract_cur_1j_1q != 1.0:
         # calculate quantity of QC allowances sold (and test that variable is a float)
@@ -7032,13 +8535,9 @@ def process_auction_cur_QC_all_accts(all_accts):
         # clean-up
         all_accts = all_accts.loc[(all_accts['quant']>1e-7) | (all_accts['quant']<-1e-7)]
 
-        if prmt.run_tests == True:
-            name_of_allowances = 'after reintro sold'
-            test_conservation_during_transfer(all_accts, all_accts_sum_init, name_of_allowances)
+        if prmt.invariant_checks != 'off':
             parent_fn = str(inspect.currentframe().f_code.co_name)
-            test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-            test_for_duplicated_indices(all_accts, parent_fn)
-            test_for_negative_values(all_accts, parent_fn)
+            check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -7103,13 +8602,9 @@ def process_auction_cur_QC_all_accts(all_accts):
         # clean-up
         all_accts = all_accts.loc[(all_accts['quant']>1e-7) | (all_accts['quant']<-1e-7)]
 
-        if prmt.run_tests == True:
-            name_of_allowances = 'after newly available sold'
-            test_conservation_during_transfer(all_accts, all_accts_sum_init, name_of_allowances)
+        if prmt.invariant_checks != 'off':
             parent_fn = str(inspect.currentframe().f_code.co_name)
-            test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-            test_for_duplicated_indices(all_accts, parent_fn)
-            test_for_negative_values(all_accts, parent_fn)
+            check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
         
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
@@ -7118,27 +8613,22 @@ def process_auction_cur_QC_all_accts(all_accts):
 
         # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
 
-        if prmt.run_tests == True:
-            name_of_allowances = 'after update sold'
-            test_conservation_during_transfer(all_accts, all_accts_sum_init, name_of_allowances)
+        if prmt.invariant_checks != 'off':
             parent_fn = str(inspect.currentframe().f_code.co_name)
-            test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-            test_for_duplicated_indices(all_accts, parent_fn)
-            test_for_negative_values(all_accts, parent_fn)
-
+            check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
+        
+        if prmt.run_tests == True:
             # filter out rows with zero or fractional allowances (or NaN)
             all_accts = all_accts.loc[(all_accts['quant']>1e-7) | (all_accts['quant']<-1e-7)].dropna()
             all_accts = all_accts.dropna()
 
     # end of if-else statement that began "if sales_fract_cur_1j_1q == 1.0)
 
-    if prmt.run_tests == True:
+    if prmt.invariant_checks != 'off':
         parent_fn = str(inspect.currentframe().f_code.co_name)
-        test_conservation_simple(all_accts, all_accts_sum_init, parent_fn)
-        test_for_duplicated_indices(all_accts, parent_fn)
-        test_for_negative_values(all_accts, parent_fn)
+        check_ledger_invariants(all_accts, all_accts_sum_init, parent_fn)
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     return(all_accts)
 # end of process_auction_cur_QC_all_accts
@@ -7168,70 +8658,93 @@ def process_allowance_supply_CA_QC():
     Key step is to run sub-functions process_CA & process_QC.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
-
-    if prmt.saved_auction_run_default == False:        
-        print("Processing quarterly data:", end=' ') # for UI
-        
-        # get input: historical + projected quarterly auction data
-        # sets object attribute prmt.auction_sales_pcts_all
-        get_auction_sales_pcts_all()
-
-        # calculate sell out counters (for CA & QC) based on prmt.auction_sales_pcts_all (from get_auction_sales_pcts_all)
-        # sets prmt.CA_cur_sell_out_counter & prmt.QC_cur_sell_out_counter
-        calculate_sell_out_counters()
-
-        # initialize all_accts for both CA & QC
-        all_accts_CA, all_accts_QC = initialize_all_accts()
-
-        # create progress bars using updated start dates and quarters
-        progress_bars_initialize_and_display()
-        
-        # process quarters for CA & QC
-        all_accts_CA = process_CA(all_accts_CA)
-        all_accts_QC = process_QC(all_accts_QC)
+    trace('start')
+    
+    # profile_steps_finish restores step functions, even if the run fails (see finally below)
+    profiling = prmt.profile_steps
+    if profiling == True:
+        # wrap step functions to record timing per quarter per step
+        profile_steps_start()
 
-    elif prmt.saved_auction_run_default == True and auction_tabs.selected_index == 0:        
-        # there is a saved run default, and the choice for a new run is default auction behavior        
-        # use values for default run, as set by earlier run (when prmt.saved_auction_run_default == False)
-        # snaps_end:
-        scenario_CA.snaps_end = prmt.CA_snaps_end_default_run_end
-        scenario_QC.snaps_end = prmt.QC_snaps_end_default_run_end
-        
-        # snaps_CIR:
-        scenario_CA.snaps_CIR = prmt.CA_snaps_end_default_run_CIR
-        scenario_QC.snaps_CIR = prmt.QC_snaps_end_default_run_CIR
-        
-        # clear all_accts_CA & all_accts_QC, to avoid them accidentally being used
-        # instead used saved runs in scenario object attributes above
-        all_accts_CA = prmt.standard_MI_empty.copy()
-        all_accts_QC = prmt.standard_MI_empty.copy()
+    try:
+        if prmt.saved_auction_run_default == False:        
+            if on_main_thread() == True:
+                print("Processing quarterly data:", end=' ') # for UI
+        
+            # get input: historical + projected quarterly auction data
+            # sets object attribute prmt.auction_sales_pcts_all
+            get_auction_sales_pcts_all()
+
+            # calculate sell out counters (for CA & QC) based on prmt.auction_sales_pcts_all (from get_auction_sales_pcts_all)
+            # sets prmt.CA_cur_sell_out_counter & prmt.QC_cur_sell_out_counter
+            calculate_sell_out_counters()
+
+            # initialize all_accts for both CA & QC
+            all_accts_CA, all_accts_QC = initialize_all_accts()
+
+            # create progress bars using updated start dates and quarters
+            # (not for a run in the background, such as the default run; see run_default_auctions)
+            if on_main_thread() == True:
+                progress_bars_initialize_and_display()
+        
+            # process quarters for CA & QC
+            all_accts_CA = process_CA(all_accts_CA)
+            all_accts_QC = process_QC(all_accts_QC)
+
+        elif prmt.saved_auction_run_default == True and auction_tabs.selected_index == 0:        
+            # there is a saved run default, and the choice for a new run is default auction behavior        
+            # use values for default run, as set by earlier run (when prmt.saved_auction_run_default == False)
+            # snaps_end:
+            scenario_CA.snaps_end = prmt.CA_snaps_end_default_run_end
+            scenario_QC.snaps_end = prmt.QC_snaps_end_default_run_end
+        
+            # snaps_CIR:
+            scenario_CA.snaps_CIR = prmt.CA_snaps_end_default_run_CIR
+            scenario_QC.snaps_CIR = prmt.QC_snaps_end_default_run_CIR
+        
+            # clear all_accts_CA & all_accts_QC, to avoid them accidentally being used
+            # instead used saved runs in scenario object attributes above
+            all_accts_CA = prmt.standard_MI_empty.copy()
+            all_accts_QC = prmt.standard_MI_empty.copy()
 
-    else:
-        # auction_tabs.selected_index is not 0, 
-        # or there's a problem with prmt.saved_auction_run_default (neither True nor False)
-        # either way, need to run auctions
-        print("Processing quarterly data:", end=' ') # for UI
+        else:
+            # auction_tabs.selected_index is not 0, 
+            # or there's a problem with prmt.saved_auction_run_default (neither True nor False)
+            # either way, need to run auctions
+            if on_main_thread() == True:
+                print("Processing quarterly data:", end=' ') # for UI
         
-        # get input: historical + projected quarterly auction data
-        # sets object attribute prmt.auction_sales_pcts_all
-        get_auction_sales_pcts_all()
+            # get input: historical + projected quarterly auction data
+            # sets object attribute prmt.auction_sales_pcts_all
+            get_auction_sales_pcts_all()
 
-        # calculate sell out counters (for CA & QC) based on prmt.auction_sales_pcts_all (from get_auction_sales_pcts_all)
-        # sets prmt.CA_cur_sell_out_counter & prmt.QC_cur_sell_out_counter
-        calculate_sell_out_counters()
+            # calculate sell out counters (for CA & QC) based on prmt.auction_sales_pcts_all (from get_auction_sales_pcts_all)
+            # sets prmt.CA_cur_sell_out_counter & prmt.QC_cur_sell_out_counter
+            calculate_sell_out_counters()
 
-        # initialize all_accts for both CA & QC
-        all_accts_CA, all_accts_QC = initialize_all_accts()
+            # initialize all_accts for both CA & QC
+            all_accts_CA, all_accts_QC = initialize_all_accts()
 
-        # create progress bars using updated start dates and quarters
-        progress_bars_initialize_and_display()
+            # create progress bars using updated start dates and quarters
+            # (not for a run in the background, such as the default run; see run_default_auctions)
+            if on_main_thread() == True:
+                progress_bars_initialize_and_display()
         
-        # process quarters for CA & QC
-        all_accts_CA = process_CA(all_accts_CA)    
-        all_accts_QC = process_QC(all_accts_QC)
+            # process quarters for CA & QC
+            all_accts_CA = process_CA(all_accts_CA)    
+            all_accts_QC = process_QC(all_accts_QC)
+    
+    finally:
+        if profiling == True:
+            # restore step functions; create table & Chrome trace file
+            profile_steps_finish()
+    
+    # ledger fragmentation & compaction per quarter (from fn compact_ledger)
+    prmt.ledger_telemetry = pd.DataFrame(prmt.ledger_telemetry_records, 
+                                         columns=['quarter', 'juris', 'rows', 'distinct_keys', 
+                                                  'terminal_rows', 'fragmentation_ratio', 'rows_compacted'])
         
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")   
+    trace('end')
 
     return(all_accts_CA, all_accts_QC)
 # end of process_allowance_supply_CA_QC
@@ -7245,7 +8758,7 @@ def get_auction_sales_pcts_all():
     Combines sales percentages from historical sales data with those from projected sales data.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # call functions to get historical and projection data
     auction_sales_pcts_historical = get_auction_sales_pcts_historical()
@@ -7259,12 +8772,12 @@ def get_auction_sales_pcts_all():
     df = df.loc[df.index.get_level_values('date_level') > auction_sales_last_historical_q]
     
     # append remaining projection to historical
-    df = auction_sales_pcts_historical.append(df)
+    df = pd.concat([auction_sales_pcts_historical, df], sort=False)
     df = df.astype(float)
     
     prmt.auction_sales_pcts_all = df
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     # no return; func sets object attribute
 # end of get_auction_sales_pcts_all
@@ -7281,7 +8794,7 @@ def get_auction_sales_pcts_historical():
     the function calculates separate sales percentages for each market.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # create record of auction sales percentages (from qauct_hist)
     df = prmt.qauct_hist.copy()
@@ -7291,7 +8804,7 @@ def get_auction_sales_pcts_historical():
 
     auction_sales_pcts_historical = df['sold_pct']
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(auction_sales_pcts_historical)
 # end of get_auction_sales_pcts_historical
@@ -7305,7 +8818,7 @@ def get_auction_sales_pcts_projection_from_user_settings():
     Read values for auction sales percentages in projection, as specified by user interface.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
 
     proj = []
     market = 'CA-QC'
@@ -7338,7 +8851,7 @@ def get_auction_sales_pcts_projection_from_user_settings():
     ser = ser.sort_index()
     auction_sales_pcts_projection = ser
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
     return(auction_sales_pcts_projection)
 # end of get_auction_sales_pcts_projection_from_user_settings
@@ -7357,7 +8870,7 @@ def calculate_sell_out_counters():
     
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     df = prmt.auction_sales_pcts_all.copy()
     
@@ -7401,7 +8914,7 @@ def calculate_sell_out_counters():
         else:
             pass
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     # no return
 # end of calculate_sell_out_counters
 
@@ -7416,7 +8929,10 @@ def process_CA(all_accts_CA):
     Regular steps are within the sub-function process_CA_quarterly.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
+    
+    if prmt.memory_accounting == True:
+        memory_phase_start('process_CA')
     
     # set cq for CA
     # in initialize_all_accts, if online user settings, then sets new value for CA_start_date 
@@ -7424,7 +8940,7 @@ def process_CA(all_accts_CA):
     cq.date = prmt.CA_start_date
 
     for quarter_year in prmt.CA_quarters:
-        logging.info(f"******** start of {quarter_year} ********")
+        trace('start of quarter', juris='CA')
 
         # ONE-OFF STEPS:
         # PREP FOR process_CA_quarterly
@@ -7491,18 +9007,20 @@ def process_CA(all_accts_CA):
         # ***** PROCESS QUARTER FOR cq.date (END) *****
         
         # update progress bar
-        if progress_bar_CA.wid.value <= len(prmt.CA_quarters):
+        if on_main_thread() == True and progress_bar_CA.wid.value <= len(prmt.CA_quarters):
             progress_bar_CA.wid.value += 1
                     
-        logging.info(f"******** end of {cq.date} ********")
-        logging.info("------------------------------------")
+        trace('end of quarter', juris='CA')
                 
         # at end of each quarter, step cq.date to next quarter
         cq.step_to_next_quarter()
         
     # end of loop "for quarter_year in prmt.CA_quarters:"
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    if prmt.memory_accounting == True:
+        memory_phase_end('process_CA', {'all_accts_CA': all_accts_CA})
+    
+    trace('end')
     
     return(all_accts_CA)
 # end of process_CA
@@ -7518,7 +9036,10 @@ def process_QC(all_accts_QC):
     Regular steps are within the sub-function process_QC_quarterly.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
+    
+    if prmt.memory_accounting == True:
+        memory_phase_start('process_QC')
     
     # initialize cq.date to QC_start_date
     # in initialize_all_accts, if online user settings, then sets new value for QC_start_date 
@@ -7526,7 +9047,7 @@ def process_QC(all_accts_QC):
     cq.date = prmt.QC_start_date
     
     for quarter_year in prmt.QC_quarters:
-        logging.info(f"******** start of {cq.date} ********")
+        trace('start of quarter', juris='QC')
 
         # one-off steps before main quarterly steps (and before CIR snapshot) **************************
         if cq.date == quarter_period('2013Q4'):
@@ -7572,18 +9093,20 @@ def process_QC(all_accts_QC):
 
         
         # update progress bar
-        if progress_bar_QC.wid.value <= len(prmt.QC_quarters):
+        if on_main_thread() == True and progress_bar_QC.wid.value <= len(prmt.QC_quarters):
             progress_bar_QC.wid.value += 1
         
         # at end of each quarter, move cq.date to next quarter
         cq.step_to_next_quarter()
             
-        logging.info(f"******** end of {cq.date} ********")
-        logging.info("------------------------------------")
+        trace('end of quarter', juris='QC')
         
     # end of loops "for quarter_year in prmt.QC_quarters:"
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    if prmt.memory_accounting == True:
+        memory_phase_end('process_QC', {'all_accts_QC': all_accts_QC})
+    
+    trace('end')
     
     return(scenario_QC, all_accts_QC)
 # end of process QC quarters
@@ -7605,7 +9128,7 @@ def initialize_all_accts():
     Or model may run as hindcast + forecast, in which case it repeats historical steps.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # for initial conditions of market, set attributes of objects scenario_CA and scenario_QC
     # note that scenario attribute snaps_end is a *list* of dfs
@@ -7613,12 +9136,17 @@ def initialize_all_accts():
     # clear out values, even when using saved default run;
     # these will be reset in process_allowance_supply_CA_QC
 
-    scenario_CA.avail_accum = prmt.standard_MI_empty.copy()
+    scenario_CA.avail_accum = Chunk_accum(prmt.standard_MI_empty)
     scenario_CA.snaps_CIR = []
     scenario_CA.snaps_end = []
     logging.info("initialized scenario_CA attributes for hindcast")
+    
+    # snapshots to take in this run
+    prmt.snapshot_policy = snapshot_policy_for_outputs(prmt.snapshot_outputs)
+    
+    prmt.ledger_telemetry_records = []
 
-    scenario_QC.avail_accum = prmt.standard_MI_empty.copy()
+    scenario_QC.avail_accum = Chunk_accum(prmt.standard_MI_empty)
     scenario_QC.snaps_CIR = []
     scenario_QC.snaps_end = []
     logging.info("initialized scenario_QC attributes for hindcast")
@@ -7627,7 +9155,7 @@ def initialize_all_accts():
     all_accts_CA = prmt.standard_MI_empty.copy()
     all_accts_QC = prmt.standard_MI_empty.copy()
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(all_accts_CA, all_accts_QC)
 # end of initialize_all_accts
@@ -7637,15 +9165,24 @@ def initialize_all_accts():
 # * supply_demand_calculations
 #   * emissions_projection
 #   * obligations_fulfilled_historical_calculation
-#   * create_snaps_CAQC_toward_bank
+#   * create_balance_cube
+#   * balance_cube_from_snaps
+#   * balance_cube_concat
+#   * balance_cube_sum_by_year
 #   * create_allow_vint_ann
 #   * create_allow_nonvint_ann
 #   * offsets_projection
+#     * offset_rates_pct_of_limit
+#     * offset_rates_user_settings
+#     * offsets_projection_batch
 #   * private_bank_annual_metric_model_method [code in following section]
 #   * private_bank_annual_metric_paper_method [code in following section]
 #   * calculate_reserve_account_metric_and_related [code in following section]
 #   * calculate_government_holding_metric [code in following section]
 #   * excess_offsets_calc
+#     * excess_offsets_batch
+# * historical_cache_key
+# * historical_cache
 
 # In[ ]:
 
@@ -7656,7 +9193,10 @@ def supply_demand_calculations():
     
     For auctions, use object attributes scenario_CA.snaps_end & scenario_QC.snaps_end, as calculated in model run.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
+    
+    if prmt.memory_accounting == True:
+        memory_phase_start('supply_demand_calculations')
     
     # ~~~~~~~~~~~~~~~~~~
     # EMISSIONS
@@ -7670,19 +9210,20 @@ def supply_demand_calculations():
     # with projections from emissions_projection()
     emissions_ann_proj = prmt.emissions_ann.loc[prmt.CA_QC_obligations_fulfilled_hist.index.max()+1:]
     
-    prmt.CA_QC_obligations_fulfilled_hist_proj = prmt.CA_QC_obligations_fulfilled_hist.append(emissions_ann_proj)
+    prmt.CA_QC_obligations_fulfilled_hist_proj = pd.concat([prmt.CA_QC_obligations_fulfilled_hist, emissions_ann_proj], 
+                                                         sort=False)
     # to calculate private bank below, prmt.CA_QC_obligations_fulfilled_hist_proj is subtracted from private holdings
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # GATHER ALL SUPPLY DATA
-    snaps_end_Q4_CA_QC, snaps_CAQC_toward_bank = create_snaps_CAQC_toward_bank(scenario_CA, scenario_QC)
+    create_balance_cube() # sets prmt.balance_cube, from snaps_end for Q4
     
     # VINTAGED ALLOWANCES
-    create_allow_vint_ann(snaps_CAQC_toward_bank) # sets prmt.allow_vint_ann
+    create_allow_vint_ann() # sets prmt.allow_vint_ann
     
     # NON-VINTAGED ALLOWANCES
-    create_allow_nonvint_ann(snaps_CAQC_toward_bank) # sets prmt.allow_nonvint_ann
+    create_allow_nonvint_ann() # sets prmt.allow_nonvint_ann
     
     # OFFSET SUPPLY
     offsets_projection() # sets prmt.offsets_supply_q & prmt.offsets_supply_ann
@@ -7717,23 +9258,17 @@ def supply_demand_calculations():
       
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # RESERVE ACCOUNT METRIC:
-    calculate_reserve_account_metric_and_related(snaps_end_Q4_CA_QC)
+    calculate_reserve_account_metric_and_related()
     # sets prmt.reserve_accts & prmt.reserve_sales_excl_PCU
         
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # UNSOLD METRIC: allowances unsold at current auction and retained in government holding accounts
-    df = snaps_end_Q4_CA_QC.copy()
-    
-    mask1 = df.index.get_level_values('acct_name') == 'auct_hold'
-    mask2 = df.index.get_level_values('auct_type') == 'current' # to exclude advance
-    mask3 = df.index.get_level_values('status') == 'unsold'
-    mask = (mask1) & (mask2) & (mask3)
-    df = df.loc[mask]
-    prmt.unsold_auct_hold_cur_sum = df.groupby('snap_yr')['quant'].sum()
+    # (unsold_cur: auct_type 'current' & status 'unsold'; excludes advance)
+    prmt.unsold_auct_hold_cur_sum = balance_cube_sum_by_year(['auct_hold'], unsold_cur=True)
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # GOVERNMENT HOLDING METRIC:
-    calculate_government_holding_metric(snaps_end_Q4_CA_QC)
+    calculate_government_holding_metric()
     # sets prmt.gov_holding & prmt.gov_plus_private
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
@@ -7749,7 +9284,14 @@ def supply_demand_calculations():
     create_export_df()
     # modifies attributes prmt.export_df & prmt.js_download_of_csv
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    # if collecting an ensemble of runs, add metrics of this run (see Ensemble_accum)
+    if isinstance(prmt.ensemble_accum, Ensemble_accum):
+        prmt.ensemble_accum.add_run()
+    
+    if prmt.memory_accounting == True:
+        memory_phase_end('supply_demand_calculations')
+    
+    trace('end')
     
     # no return
 # end of supply_demand_calculations
@@ -7758,6 +9300,55 @@ def supply_demand_calculations():
 # In[ ]:
 
 
+def historical_cache_key():
+    """
+    Key for historical_cache: model version, hashes of data input file & CIR file, and latest historical year; 
+    also settings that change historical snaps (ledger compaction, see compact_ledger; snapshot policy).
+    """
+    key = f"{prmt.model_version}_{prmt.input_file_hash}_{prmt.CIR_file_hash}_{prmt.supply_last_hist_yr}"
+    key += f"_{prmt.ledger_compaction}_{prmt.ledger_compaction_min_ratio}"
+    key += f"_{sorted(prmt.snapshot_policy.items())}"
+    
+    return(key)
+# end of historical_cache_key
+
+
+def historical_cache():
+    """
+    Returns dict of results for historical quarters, for the data inputs in use (see historical_cache_key).
+    
+    Historical quarters are the same in every scenario (user settings only affect projection quarters), 
+    so results calculated from them in one model run are reused in later runs with the same data inputs:
+    * 'balance_cube': part of balance cube for historical years (create_balance_cube)
+    * 'private_bank_paper': before fill-in of obligations from user input (private_bank_annual_metric_paper_method)
+    * 'CP_metrics_hist': before adjustment for reserve sales (compliance_period_metrics_historical)
+    
+    If prmt.memoize_historical == False, returns a new empty dict, so results are calculated in each run.
+    
+    Keeps at most prmt.historical_cache_max_entries keys; the least recently used are evicted.
+    """
+    if prmt.memoize_historical == False:
+        return({})
+    
+    key = historical_cache_key()
+    if key in prmt.historical_cache:
+        # move to end (most recently used)
+        prmt.historical_cache[key] = prmt.historical_cache.pop(key)
+    else:
+        prmt.historical_cache[key] = {}
+        
+        # dict keeps insertion order, so first keys are least recently used
+        while len(prmt.historical_cache) > prmt.historical_cache_max_entries:
+            oldest_key = next(iter(prmt.historical_cache))
+            del prmt.historical_cache[oldest_key]
+    
+    return(prmt.historical_cache[key])
+# end of historical_cache
+
+
+# In[ ]:
+
+
 def emissions_projection():
     """
     Calculate projection for covered emissions based on user settings.
@@ -7778,9 +9369,10 @@ def emissions_projection():
     Note that the default projection in this model may differ from that in the Near Zero banking note (2019),
     leading to differences in the calculation of the private bank.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
-    progress_bar_loading.wid.value += 1
+    if on_main_thread() == True:
+        progress_bar_loading.wid.value += 1
 
     # use prmt.emissions_and_obligations, set by read_emissions_historical_data
     # convert each into Series
@@ -7915,7 +9507,7 @@ def emissions_projection():
     prmt.emissions_ann_CA.name = 'emissions_ann_CA'
     prmt.emissions_ann_QC.name = 'emissions_ann_QC'
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     # no returns; sets attributes
 # end of emissions_projection
@@ -7943,7 +9535,7 @@ def obligations_fulfilled_historical_calculation():
     
     The model uses this data to calculate retirements from private holdings, and thus the remaining private bank.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # get compliance obligations from input sheet 'emissions & obligations'
     # index is for years obligations incurred
@@ -8021,7 +9613,7 @@ def obligations_fulfilled_historical_calculation():
     # used to calculate annual bank, by subtracting from private holdings
     prmt.CA_QC_obligations_fulfilled_hist = ser
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     # no return
 # end of obligations_fulfilled_historical_calculation
 
@@ -8029,74 +9621,173 @@ def obligations_fulfilled_historical_calculation():
 # In[ ]:
 
 
-def create_snaps_CAQC_toward_bank(scenario_CA, scenario_QC):
+def create_balance_cube():
     """
-    Create local variable snaps_end_Q4_CA_QC; use different source depending on scenario/settings
-    Use copy to avoid modifying object attributes.
+    Creates balance cube from end-of-year snapshots (Q4 of scenario_CA.snaps_end & scenario_QC.snaps_end): 
+    a dense array of quantities summed over ledger rows, with labeled axes:
+    * snap_yr: year of snap (Q4)
+    * acct_name
+    * juris
+    * vintage (including non-vintage codes: 2199 for Early Action, 2200 for APCR)
+    * unsold_cur: True for allowances unsold at current auction (auct_type 'current' & status 'unsold')
+    
+    Sets prmt.balance_cube, a dict with:
+    * 'quant': array of quantities
+    * 'rows': array of number of ledger rows in each cell (to distinguish a sum of zero from no allowances)
+    * 'axes': dict of labels for each axis, in the order of the array dimensions
+    
+    Annual metrics are then sums over slices of the cube (see balance_cube_sum_by_year).
+    
+    The part of the cube for historical years (up to prmt.supply_last_hist_yr) is the same in every scenario, 
+    so it is reused from historical_cache, and only projection years are built from the snaps.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
-
-    # use full auction results generated on initialization
-    # stored as scenario_CA.snaps_end & scenario_QC.snaps_end
-    # (those are lists of dfs; need to add the lists to concat all dfs in the combined list)
-    df = pd.concat(scenario_CA.snaps_end + scenario_QC.snaps_end, axis=0, sort=False)
-
-    # convert to period
-    df['snap_q'] = pd.to_datetime(df['snap_q'].astype(str)).dt.to_period('Q')
-
-    # keep only Q4
-    snaps_end_Q4_CA_QC = df.loc[df['snap_q'].dt.quarter==4].copy()
+    trace('start')
     
-    # create col 'snap_yr' to replace col 'snap_q'
-    snaps_end_Q4_CA_QC['snap_yr'] = snaps_end_Q4_CA_QC['snap_q'].dt.year
-    snaps_end_Q4_CA_QC = snaps_end_Q4_CA_QC.drop(columns=['snap_q'])
-
-    # select only the allowances in private accounts (general account and compliance account)
-    private_acct_mask = snaps_end_Q4_CA_QC.index.get_level_values('acct_name').isin(['gen_acct', 'comp_acct'])
-    snaps_CAQC_toward_bank = snaps_end_Q4_CA_QC.loc[private_acct_mask]
+    snaps_hist = []
+    snaps_proj = []
+    for snap in scenario_CA.snaps_end + scenario_QC.snaps_end:
+        if len(snap) == 0:
+            continue
+        snap_q = quarter_period(str(snap['snap_q'].iat[0]))
+        if snap_q.quarter == 4:
+            if snap_q.year <= prmt.supply_last_hist_yr:
+                snaps_hist += [(snap_q.year, snap)]
+            else:
+                snaps_proj += [(snap_q.year, snap)]
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    cache = historical_cache()
+    if 'balance_cube' not in cache:
+        cache['balance_cube'] = balance_cube_from_snaps(snaps_hist)
     
-    return(snaps_end_Q4_CA_QC, snaps_CAQC_toward_bank)
-# end of create_snaps_CAQC_toward_bank
-
-
-# In[ ]:
+    cubes = [cache['balance_cube'], balance_cube_from_snaps(snaps_proj)]
+    prmt.balance_cube = balance_cube_concat([cube for cube in cubes if cube != None])
+    
+    trace('end')
+    
+    # no return; sets prmt.balance_cube
+# end of create_balance_cube
 
 
-def create_allow_vint_ann(snaps_CAQC_toward_bank):
+def balance_cube_from_snaps(snaps_with_yrs):
     """
-    From snaps at end of each year, collect and sum all vintaged allowances in private accounts.
+    Creates balance cube (see create_balance_cube) from list of tuples (snap_yr, snap).
     
-    These are allowances sold at auction or distributed as allocations.
+    Returns dict with 'quant', 'rows' & 'axes'; returns None if list is empty.
+    """
+    if snaps_with_yrs == []:
+        return(None)
     
-    The values are prior to any retirements for compliance obligations.
+    df = pd.concat([snap for snap_yr, snap in snaps_with_yrs], sort=False)
     
-    The totals are only those vintages up to the year of the banking metric.
+    level_values = {
+        'snap_yr': np.concatenate([np.full(len(snap), snap_yr) for snap_yr, snap in snaps_with_yrs]), 
+        'acct_name': df.index.get_level_values('acct_name'), 
+        'juris': df.index.get_level_values('juris'), 
+        'vintage': df.index.get_level_values('vintage'), 
+        'unsold_cur': ((df.index.get_level_values('auct_type')=='current') & 
+                       (df.index.get_level_values('status')=='unsold')), 
+    }
     
-    The values exclude VRE allowances (which are in VRE account, or transferred to retirement).
+    codes = []
+    axes = {}
+    for name, values in level_values.items():
+        codes_level, labels = pd.factorize(values, sort=True)
+        codes += [codes_level]
+        axes[name] = np.asarray(labels)
     
-    """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    shape = tuple([len(labels) for labels in axes.values()])
+    quant = np.zeros(shape)
+    rows = np.zeros(shape, dtype=int)
+    np.add.at(quant, tuple(codes), df['quant'].values)
+    np.add.at(rows, tuple(codes), 1)
+    
+    return({'quant': quant, 'rows': rows, 'axes': axes})
+# end of balance_cube_from_snaps
 
-    df = snaps_CAQC_toward_bank.copy()
 
-    mask1 = df.index.get_level_values('vintage') <= df['snap_yr']
-    mask2 = df.index.get_level_values('acct_name').isin(['gen_acct', 'comp_acct'])
-    # note that mask2 will get vintages up to banking metric year, and also filter out non-vintage allowances
-    mask = (mask1) & (mask2)
-    df = df.loc[mask]
+def balance_cube_concat(cubes):
+    """
+    Combines balance cubes (see create_balance_cube) into one, with axes that are the union of their axes.
+    """
+    axes = {}
+    for name in cubes[0]['axes']:
+        axes[name] = np.unique(np.concatenate([cube['axes'][name] for cube in cubes]))
     
-    # ~~~~~~~~~~~~~~~~
+    shape = tuple([len(labels) for labels in axes.values()])
+    quant = np.zeros(shape)
+    rows = np.zeros(shape, dtype=int)
+    for cube in cubes:
+        # positions of each cube's labels within the combined axes
+        positions = np.ix_(*[np.searchsorted(axes[name], cube['axes'][name]) for name in axes])
+        quant[positions] += cube['quant']
+        rows[positions] += cube['rows']
+    
+    return({'quant': quant, 'rows': rows, 'axes': axes})
+# end of balance_cube_concat
 
-    # result contains allowances sold at advance and current auctions, as well as allowances freely allocated
-    # (returns to using df derived from snaps_CAQC_toward_bank)
-    df = df.groupby('snap_yr').sum()
-    df.index.name = 'snap_yr'
+
+def balance_cube_sum_by_year(acct_names, vintages='all', unsold_cur='all'):
+    """
+    From prmt.balance_cube, sums quantities for each snap_yr, for:
+    * acct_names: list of acct_name
+    * vintages: 'all', 'up_to_year' (vintage <= snap_yr), or 'non-vintage' (vintage >= 2199)
+    * unsold_cur: 'all', True, or False
+    
+    Returns Series with index snap_yr; like a groupby sum, only includes years with ledger rows in the selection.
+    """
+    axes = prmt.balance_cube['axes']
+    
+    # dimensions: snap_yr, acct_name, juris, vintage, unsold_cur
+    acct_mask = np.isin(axes['acct_name'], acct_names)
+    if unsold_cur == 'all':
+        unsold_mask = np.full(len(axes['unsold_cur']), True)
+    else:
+        unsold_mask = axes['unsold_cur'] == unsold_cur
+    
+    # sum over acct_name, juris & unsold_cur; leaves dimensions snap_yr & vintage
+    quant = prmt.balance_cube['quant'][:, acct_mask][..., unsold_mask].sum(axis=(1, 2, 4))
+    rows = prmt.balance_cube['rows'][:, acct_mask][..., unsold_mask].sum(axis=(1, 2, 4))
+    
+    if vintages == 'up_to_year':
+        vintage_mask = axes['vintage'][np.newaxis, :] <= axes['snap_yr'][:, np.newaxis]
+    elif vintages == 'non-vintage':
+        # APCR assigned vintage 2200; Early Action assigned vintage 2199
+        vintage_mask = np.broadcast_to(axes['vintage'] >= 2199, quant.shape)
+    else: # vintages == 'all'
+        vintage_mask = np.full(quant.shape, True)
+    
+    quant = (quant * vintage_mask).sum(axis=1)
+    rows = (rows * vintage_mask).sum(axis=1)
+    
+    ser = pd.Series(quant[rows > 0], index=pd.Index(axes['snap_yr'][rows > 0], name='snap_yr'))
+    
+    return(ser)
+# end of balance_cube_sum_by_year
+
+
+# In[ ]:
+
+
+def create_allow_vint_ann():
+    """
+    From snaps at end of each year, collect and sum all vintaged allowances in private accounts.
+    
+    These are allowances sold at auction or distributed as allocations.
     
-    # convert to Series by only selecting ['quant']; give Series a name
-    allow_vintaged_cumul = df['quant']
+    The values are prior to any retirements for compliance obligations.
+    
+    The totals are only those vintages up to the year of the banking metric.
+    
+    The values exclude VRE allowances (which are in VRE account, or transferred to retirement).
+    
+    """
+    trace('start')
+
+    # private accounts (general account and compliance account), for vintages up to banking metric year
+    # (which also filters out non-vintage allowances)
+    # result contains allowances sold at advance and current auctions, as well as allowances freely allocated
+    allow_vintaged_cumul = balance_cube_sum_by_year(['gen_acct', 'comp_acct'], vintages='up_to_year')
     allow_vintaged_cumul.name = 'allow_vintaged_cumul'
     
     # ~~~~~~~~~~~~~~
@@ -8109,7 +9800,7 @@ def create_allow_vint_ann(snaps_CAQC_toward_bank):
     
     prmt.allow_vint_ann = allow_vint_ann
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('end')
     # no return
 # end of create_allow_vint_ann
 
@@ -8117,7 +9808,7 @@ def create_allow_vint_ann(snaps_CAQC_toward_bank):
 # In[ ]:
 
 
-def create_allow_nonvint_ann(snaps_CAQC_toward_bank):
+def create_allow_nonvint_ann():
     """
     From snaps at end of each year, collect and sum all non-vintaged allowances in private accounts.
     
@@ -8129,19 +9820,10 @@ def create_allow_nonvint_ann(snaps_CAQC_toward_bank):
     Does *not* include projected reserve sales; those are handled later in supply_demand_calculations.
     
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
-
-    df = snaps_CAQC_toward_bank.copy()
+    trace('start')
 
     # note: APCR assigned vintage 2200; Early Action assigned vintage 2199
-    mask1 = df.index.get_level_values('vintage') >= 2199
-    mask2 = df.index.get_level_values('acct_name').isin(['gen_acct', 'comp_acct'])
-    mask = (mask1) & (mask2)
-    df = df.loc[mask]
-    
-    df = df.groupby('snap_yr').sum()
-    df.index.name = 'snap_yr'
-    allow_nonvint_cumul = df['quant']
+    allow_nonvint_cumul = balance_cube_sum_by_year(['gen_acct', 'comp_acct'], vintages='non-vintage')
     allow_nonvint_cumul.name = 'allow_nonvint_cumul'
 
     # insert value for initial quarter (since diff turns that into NaN)
@@ -8153,7 +9835,7 @@ def create_allow_nonvint_ann(snaps_CAQC_toward_bank):
     prmt.allow_nonvint_ann = allow_nonvint_ann
     # no return
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 # end of create_allow_nonvint_ann
 
 
@@ -8169,10 +9851,118 @@ def offsets_projection():
     That is, user settings for rate of offset issuance will apply to all quarters without historical data.
     
     For CA, limits for each period based on § 95854(b) and § 95854(c).
+    
+    Gets offset rates from user settings (offset_rates_user_settings), 
+    and calculates supply using offsets_projection_batch, with the emissions projection of the current run.
+    """
+    
+    trace('start')
+    
+    offsets_supply_q, offsets_supply_ann = offsets_projection_batch(
+        offset_rates_user_settings(), prmt.emissions_ann_CA.to_frame(), prmt.emissions_ann_QC.to_frame())
+    
+    # single scenario; use first (only) column
+    offsets_supply_q = offsets_supply_q.iloc[:, 0]
+    offsets_supply_q.name = 'offsets_supply_q'
+    offsets_supply_ann = offsets_supply_ann.iloc[:, 0]
+    offsets_supply_ann.name = 'offsets_supply_ann'
+    
+    prmt.offsets_supply_ann = offsets_supply_ann
+    prmt.offsets_supply_q = offsets_supply_q
+    # no return
+    
+    trace('end')
+    
+# end of offsets_projection
+
+
+def offset_rates_pct_of_limit(pct_of_limit):
+    """
+    Offset rates (offsets as fraction of emissions) for offset supply as a fraction of the limits (pct_of_limit), 
+    for CA & QC, for each period (2013-2020, 2021-2025, 2026-2030).
+    
+    For CA, limits for each period based on § 95854(b) and § 95854(c): 8%, 4%, 6%; for QC, limit is 8%.
+    
+    pct_of_limit can be scalar, or array with one value for each scenario.
+    
+    Returns dict with keys 'CA' & 'QC', with arrays of rates (periods, or scenarios x periods); 
+    see offsets_projection_batch.
     """
+    pct_of_limit = np.asarray(pct_of_limit, dtype=float)[..., np.newaxis]
+    
+    offset_rates = {'CA': pct_of_limit * np.array([0.08, 0.04, 0.06]), 
+                    'QC': pct_of_limit * np.array([0.08, 0.08, 0.08])}
+    
+    return(offset_rates)
+# end of offset_rates_pct_of_limit
+
+
+def offset_rates_user_settings():
+    """
+    Gets offset rates from user settings (offsets tabs): 
+    * simple: offsets as % of limit, same for all periods (off_pct_of_limit_CAQC)
+    * advanced: offsets as % of emissions, for CA & QC separately, for each period (off_pct_CA_adv1, etc.)
+    
+    Before user does first interaction, simple setting is based on prmt.offset_rate_fract_of_limit_default.
+    
+    Returns dict of offset rates; see offsets_projection_batch.
+    """
+    if offsets_tabs.selected_index == 0:
+        # simple settings
+        logging.info("using offsets settings (simple)")
+        offset_rates = offset_rates_pct_of_limit(off_pct_of_limit_CAQC.slider.value)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    elif offsets_tabs.selected_index == 1:
+        # advanced settings
+        logging.info("using offsets settings (advanced)")
+        offset_rates = {'CA': [off_pct_CA_adv1.slider.value, off_pct_CA_adv2.slider.value, off_pct_CA_adv3.slider.value], 
+                        'QC': [off_pct_QC_adv1.slider.value, off_pct_QC_adv2.slider.value, off_pct_QC_adv3.slider.value]}
+    
+    else:
+        # offsets_tabs.selected_index is not 0 or 1
+        print("Error" + "! offsets_tabs.selected_index was not one of the expected values (0 or 1).")
+    
+    return(offset_rates)
+# end of offset_rates_user_settings
+
 
+def offsets_projection_batch(offset_rates, emissions_ann_CA, emissions_ann_QC):
+    """
+    Calculates offset supply (historical, and projection based on offset rates), for many scenarios at once.
+    
+    Arguments:
+    * offset_rates: dict with keys 'CA' & 'QC'; each is offset rate (offsets as fraction of emissions), either:
+      * scalar: same for all periods & scenarios
+      * list or array of 3 values: for each period (2013-2020, 2021-2025, 2026-2030), same for all scenarios
+      * array (scenarios x 3 periods); for a different scalar for each scenario, use shape (scenarios x 1)
+    * emissions_ann_CA & emissions_ann_QC: DataFrames indexed by year, with one column for each scenario
+    
+    Offset rates apply to all quarters without historical data: 
+    remainder of a year with partial historical data, and years after the latest historical data.
+    
+    Also sets prmt.off_proj_first_date.
+    
+    Returns tuple (offsets_supply_q, offsets_supply_ann) of DataFrames, with same columns as emissions_ann_CA; 
+    offsets_supply_q indexed by quarter, offsets_supply_ann indexed by year.
+    """
+    
+    trace('start')
+    
+    columns = emissions_ann_CA.columns
+    
+    # rates for each scenario & period: array (scenarios x 3 periods)
+    rates = {}
+    for juris in ['CA', 'QC']:
+        rate = np.asarray(offset_rates[juris], dtype=float)
+        rates[juris] = np.broadcast_to(rate, (len(columns), 3))
+    
+    def offsets_for_years(years):
+        # offsets from rates & emissions; array (years x scenarios)
+        period = np.digitize(years, [2021, 2026]) # 0 for 2013-2020, 1 for 2021-2025, 2 for 2026-2030
+        offsets_CA = emissions_ann_CA.reindex(years).values * rates['CA'][:, period].T
+        offsets_QC = emissions_ann_QC.reindex(years).values * rates['QC'][:, period].T
+        return(offsets_CA + offsets_QC)
+    
     offsets_priv_hist = prmt.CIR_offsets_q_sums[['General', 'Compliance']].sum(axis=1)
     offsets_priv_hist.name = 'offsets_priv_hist'
     
@@ -8184,11 +9974,11 @@ def offsets_projection():
 
     # calculate cumulative offsets added to supply
     # (excludes any offsets that were retired anomalously--that is, not for compliance obligations)
-    df = pd.concat([offsets_priv_hist, offsets_compl_oblig_hist_cumul], axis=1)
+    priv_compl = pd.concat([offsets_priv_hist, offsets_compl_oblig_hist_cumul], axis=1)
     
     # exclude any rows in which there's a mismatch between CIR and compliance data
     # (that is, compliance data is ahead of CIR)
-    df = df.dropna(subset=['offsets_priv_hist'])
+    df = priv_compl.dropna(subset=['offsets_priv_hist'])
     df = df.ffill()
     offsets_supply_hist_cumul = df.sum(axis=1)
 
@@ -8199,9 +9989,13 @@ def offsets_projection():
     # HISTORICAL 
     # get quarterly values derived from CIR and annual compliance reports
     # insert value for initial quarter (since diff turns that into NaN)
-    offsets_supply_q = offsets_supply_hist_cumul.diff()
-    first_q = offsets_supply_q.index.min()
-    offsets_supply_q.at[first_q] = offsets_supply_hist_cumul.at[first_q]
+    offsets_supply_q_hist = offsets_supply_hist_cumul.diff()
+    first_q = offsets_supply_q_hist.index.min()
+    offsets_supply_q_hist.at[first_q] = offsets_supply_hist_cumul.at[first_q]
+    
+    # same for all scenarios
+    offsets_supply_q = pd.DataFrame(np.repeat(offsets_supply_q_hist.values[:, np.newaxis], len(columns), axis=1), 
+                                    index=offsets_supply_q_hist.index, columns=columns)
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # PROJECTION TO FILL OUT REMAINING QUARTERS IN YEAR WITH PARTIAL DATA
@@ -8210,59 +10004,12 @@ def offsets_projection():
     prmt.off_proj_first_date = pd.to_datetime(off_hist_latest_date.to_timestamp() + DateOffset(months=3)).to_period('Q')
 
     if off_hist_latest_date.quarter < 4:
-        
         # then there is a partial year of data
-        # create projection for remainder of year, based on user setting
-        # get user specified offsets use rate, as % of limit (same rate for all periods)    
-        if offsets_tabs.selected_index == 0:
-            # simple version of user settings
-            if prmt.off_proj_first_date.year in range(2013, 2020+1):
-                offset_rate_CA = off_pct_of_limit_CAQC.slider.value * 0.08
-            elif prmt.off_proj_first_date.year in range(2021, 2025+1):
-                offset_rate_CA = off_pct_of_limit_CAQC.slider.value * 0.04
-            elif prmt.off_proj_first_date.year in range(2026, 2030+1):
-                offset_rate_CA = off_pct_of_limit_CAQC.slider.value * 0.06
-            else:
-                pass
-            offset_rate_QC = off_pct_of_limit_CAQC.slider.value * 0.08
-            
-            # fill in any remaining quarters using quarterly emissions & the user-specified offset rate
-            offset_supply_user_q_avg_CA = (prmt.emissions_ann_CA.at[off_hist_latest_date.year]/4) * offset_rate_CA
-            offset_supply_user_q_avg_QC = (prmt.emissions_ann_QC.at[off_hist_latest_date.year]/4) * offset_rate_QC
-            offset_supply_user_q_avg = offset_supply_user_q_avg_CA + offset_supply_user_q_avg_QC
-            
-            for quarter in range(prmt.off_proj_first_date.quarter, 4+1):
-                year_q = quarter_period(f'{off_hist_latest_date.year}Q{quarter}')
-                offsets_supply_q.at[year_q] = offset_supply_user_q_avg
-            
-        elif offsets_tabs.selected_index == 1:
-            # advanced version of user settings
-            if prmt.off_proj_first_date.year in range(2013, 2020+1):
-                # for CA & QC separately, using period 1 sliders
-                offset_rate_CA = off_pct_CA_adv1.slider.value
-                offset_rate_QC = off_pct_QC_adv1.slider.value
-
-            elif prmt.off_proj_first_date.year in range(2021, 2025+1):
-                # for CA & QC separately, using period 2 sliders
-                offset_rate_CA = off_pct_CA_adv2.slider.value
-                offset_rate_QC = off_pct_QC_adv2.slider.value
-
-            elif prmt.off_proj_first_date.year in range(2026, 2030+1):
-                # for CA & QC separately, for period 3 sliders
-                offset_rate_CA = off_pct_CA_adv3.slider.value
-                offset_rate_QC = off_pct_QC_adv3.slider.value
-                
-            else:
-                print("Error" + "! Edge case within 'elif offsets_tabs.selected_index == 1'")
-            
-            offset_supply_user_q_avg_CA = prmt.emissions_ann_CA.at[off_hist_latest_date.year] * offset_rate_CA / 4
-            offset_supply_user_q_avg_QC = prmt.emissions_ann_QC.at[off_hist_latest_date.year] * offset_rate_QC / 4
-            offset_supply_user_q_avg = offset_supply_user_q_avg_CA + offset_supply_user_q_avg_QC
-            
-            # fill in df        
-            for quarter in range(off_hist_latest_date.quarter+1, 4+1):
-                year_q = quarter_period(f'{off_hist_latest_date.year}Q{quarter}')
-                offsets_supply_q.at[year_q] = offset_supply_user_q_avg
+        # fill in any remaining quarters using quarterly emissions & the offset rate for that year
+        offset_supply_q_avg = offsets_for_years([off_hist_latest_date.year])[0] / 4
+        
+        for quarter in range(off_hist_latest_date.quarter+1, 4+1):
+            offsets_supply_q.loc[quarter_period(f'{off_hist_latest_date.year}Q{quarter}')] = offset_supply_q_avg
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # COMPARE COMPLIANCE DATA VS PROJECTION
@@ -8271,9 +10018,7 @@ def offsets_projection():
     # if compliance surrender was larger than projected supply, there must have been addition to supply
     # that occurred in Oct prior to compliance event
     
-    # create df as above; get final row; check whether value for CIR is NaN
-    priv_compl = pd.concat([offsets_priv_hist, offsets_compl_oblig_hist_cumul], axis=1)
-    
+    # check whether value for CIR is NaN in final row
     latest_priv_hist_quant = priv_compl.loc[priv_compl.index[-1]].loc['offsets_priv_hist']
     
     if pd.isna(latest_priv_hist_quant) == True and priv_compl.index[-1].quarter == 4:
@@ -8286,30 +10031,17 @@ def offsets_projection():
         if compl_latest_year > Q3_priv_hist_quant:
             # there must have been additional offset issuance in October prior to compliance event
             # this is the minimum gross addition to private accounts in Q4
-            # compare against projection from above to see if projection was enough
+            # compare against projection from above to see if projection was enough; 
+            # where it wasn't, update projection quantity to be inferred_min_issuance
             inferred_min_issuance = compl_latest_year - Q3_priv_hist_quant
             
             proj_Q4 = offsets_supply_q.loc[priv_compl.index[-1]]
             
-            if proj_Q4 < inferred_min_issuance:
-                # update projection quantity to be add_issuance
-                offsets_supply_q.at[priv_compl.index[-1]] = inferred_min_issuance
+            if (proj_Q4 < inferred_min_issuance).any() == True:
+                offsets_supply_q.loc[priv_compl.index[-1]] = np.maximum(proj_Q4, inferred_min_issuance)
                 
                 logging.info(f"User setting for offset projection was overridden, based on historical compliance;")
                 logging.info(f"inferred minimum issuance in {priv_compl.index[-1]}Q4 was {inferred_min_issuance} M.")
-            
-            else:
-                # then we don't have any reason to infer additional offsets issued in October before compliance event
-                # will use Q4 projection as calculated in initial projection
-                pass
-
-        else:
-            # then we don't have any reason to infer additional offsets issued in October before compliance event
-            # will use Q4 projection as calculated in initial projection
-            pass
-    else:
-        # compliance data is not ahead of CIR data, so there is no additional data to draw on
-        pass
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # CALCULATE ANNUAL OFFSETS
@@ -8333,138 +10065,30 @@ def offsets_projection():
     # and that's the same as ARB's assumption (although ARB didn't state a rationale)
     
     # the offset_rate_fract_of_limit_default sets the default value in offset sliders
-
-    # ~~~~~~~~~
     
-    # get values from sliders 
-    # (before user does first interaction, will be based on default set above)
-
-    if offsets_tabs.selected_index == 0:
-        # simple settings
-        logging.info("using offsets settings (simple)")
-        
-        # get user specified offsets use rate, as % of limit (same rate for all periods)
-        if prmt.off_proj_first_date.year+1 <= 2020:
-            for year in range(max(2020, off_hist_latest_date.year+1), 2020+1):
-                # for CA & QC together
-                offset_rate_ann_CAQC = off_pct_of_limit_CAQC.slider.value * 0.08    
-                offsets_supply_ann.at[year] = prmt.emissions_ann.at[year] * offset_rate_ann_CAQC
-                
-        else:
-            # don't create this slider for period < 2020
-            pass
-        
-        if prmt.off_proj_first_date.year+1 <= 2025:
-            for year in range(max(2021, off_hist_latest_date.year+1), 2025+1):
-                # for CA & QC separately
-                offset_rate_CA = off_pct_of_limit_CAQC.slider.value * 0.04
-                offset_rate_QC = off_pct_of_limit_CAQC.slider.value * 0.08
-
-                offsets_supply_ann_CA_1y = prmt.emissions_ann_CA.at[year] * offset_rate_CA
-                offsets_supply_ann_QC_1y = prmt.emissions_ann_QC.at[year] * offset_rate_QC
-
-                # combine CA & QC
-                offsets_supply_ann.at[year] = offsets_supply_ann_CA_1y + offsets_supply_ann_QC_1y
-        else:
-            # don't create this slider
-            pass
-
-        if prmt.off_proj_first_date.year+1 <= 2030:
-            for year in range(max(2026, off_hist_latest_date.year+1), 2030+1):
-                # for CA & QC separately
-                offset_rate_CA = off_pct_of_limit_CAQC.slider.value * 0.06
-                offset_rate_QC = off_pct_of_limit_CAQC.slider.value * 0.08
-
-                offsets_supply_ann_CA_1y = prmt.emissions_ann_CA.at[year] * offset_rate_CA
-                offsets_supply_ann_QC_1y = prmt.emissions_ann_QC.at[year] * offset_rate_QC
-
-                # combine CA & QC
-                offsets_supply_ann.at[year] = offsets_supply_ann_CA_1y + offsets_supply_ann_QC_1y
-        else:
-            # don't create this slider
-            pass
-
-    elif offsets_tabs.selected_index == 1:
-        # advanced settings
-        logging.info("using offsets settings (advanced)")
-        
-        if off_hist_latest_date.year+1 <= 2020:
-            for year in range(max(2020, off_hist_latest_date.year+1), 2020+1):
-                # for CA & QC separately, using period 1 sliders
-                offset_rate_CA = off_pct_CA_adv1.slider.value
-                offset_rate_QC = off_pct_QC_adv1.slider.value
-
-                offsets_supply_ann_CA_1y = prmt.emissions_ann_CA.at[year] * offset_rate_CA
-                offsets_supply_ann_QC_1y = prmt.emissions_ann_QC.at[year] * offset_rate_QC
-
-                # combine CA & QC
-                offsets_supply_ann.at[year] = offsets_supply_ann_CA_1y + offsets_supply_ann_QC_1y
-        else:
-            # don't calculate offsets_supply_ann for this range
-            pass
-
-        if off_hist_latest_date.year+1 <= 2025:
-            for year in range(max(2021, off_hist_latest_date.year+1), 2025+1):
-                # for CA & QC separately, using period 2 sliders
-                offset_rate_CA = off_pct_CA_adv2.slider.value
-                offset_rate_QC = off_pct_QC_adv2.slider.value
-
-                offsets_supply_ann_CA_1y = prmt.emissions_ann_CA.at[year] * offset_rate_CA
-                offsets_supply_ann_QC_1y = prmt.emissions_ann_QC.at[year] * offset_rate_QC
-
-                # combine CA & QC
-                offsets_supply_ann.at[year] = offsets_supply_ann_CA_1y + offsets_supply_ann_QC_1y
-        else:
-            # don't calculate offsets_supply_ann for this range
-            pass
-
-        if off_hist_latest_date.year+1 <= 2030:
-            for year in range(max(2026, off_hist_latest_date.year+1), 2030+1):
-                # for CA & QC separately, for period 3 sliders
-                offset_rate_CA = off_pct_CA_adv3.slider.value
-                offset_rate_CA = off_pct_CA_adv3.slider.value
-                offset_rate_QC = off_pct_QC_adv3.slider.value
-
-                offsets_supply_ann_CA_1y = prmt.emissions_ann_CA.at[year] * offset_rate_CA
-                offsets_supply_ann_QC_1y = prmt.emissions_ann_QC.at[year] * offset_rate_QC
-
-                # combine CA & QC
-                offsets_supply_ann.at[year] = offsets_supply_ann_CA_1y + offsets_supply_ann_QC_1y
-        else:
-            # don't calculate offsets_supply_ann for this range
-            pass
-
-    else:
-        # offsets_tabs.selected_index is not 0 or 1
-        print("Error" + "! offsets_tabs.selected_index was not one of the expected values (0 or 1).")
-
-    offsets_supply_ann.name = 'offsets_supply_ann'
+    # projection for all years after latest historical data, from 2020 through 2030
+    proj_years = np.arange(max(2020, off_hist_latest_date.year+1), 2030+1)
     
-    # calculate quarterly values for all years
-    # first get all annual supply full year projections
-    df = offsets_supply_ann.loc[offsets_supply_q.index.year.max()+1:]
+    if len(proj_years) > 0:
+        offsets_supply_ann_proj = pd.DataFrame(offsets_for_years(proj_years), index=proj_years, columns=columns)
+        offsets_supply_ann = pd.concat([offsets_supply_ann, offsets_supply_ann_proj], sort=False)
 
-    # divide by 4, reassign index to quarterly, fill in missing data
-    # (have to put in 2031 value as placeholder, so that resample will go through end of 2030)
-    df = df / 4
-    df.at[2031] = 0
-    df.index = pd.to_datetime(df.index.astype(str) + 'Q1').to_period('Q')
-    df = df.resample('Q').ffill()
-    df = df.drop(quarter_period('2031Q1'))
+        # calculate quarterly values for projection years: divide annual by 4, for each quarter
+        proj_quarters = pd.period_range(start=f'{proj_years.min()}Q1', end='2030Q4', freq='Q')
+        offsets_supply_q_proj = pd.DataFrame(np.repeat(offsets_supply_ann_proj.values / 4, 4, axis=0), 
+                                             index=proj_quarters, columns=columns)
 
-    # append the quarterly projections to the quarterly data 
-    # (historical data; also, if latest historical year has only partial data, projection for remainder of year)
-    offsets_supply_q = offsets_supply_q.append(df)
-
-    offsets_supply_q.name = 'offsets_supply_q'
-    
-    prmt.offsets_supply_ann = offsets_supply_ann
-    prmt.offsets_supply_q = offsets_supply_q
-    # no return
+        # append the quarterly projections to the quarterly data 
+        # (historical data; also, if latest historical year has only partial data, projection for remainder of year)
+        offsets_supply_q = pd.concat([offsets_supply_q, offsets_supply_q_proj], sort=False)
+    else:
+        # historical data through 2030; no projection needed
+        pass
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
-# end of offsets_projection
+    return(offsets_supply_q, offsets_supply_ann)
+# end of offsets_projection_batch
 
 
 # In[ ]:
@@ -8474,212 +10098,18 @@ def excess_offsets_calc():
     """
     Calculate whether the offset supply (as specified by user) exceeds what could be used through 2030.
     
-    For all compliance periods *except* period #5 (for emissions 2024-2026):
-    assume ARB allows emitters to go up to max for whole compliance period, 
-    regardless of offset use in annual compliance events during that compliance period.
-    
-    For compliance period #5, for CA, max offsets are applied separately to emissions 2024-2025 and emissions 2026,
-    based on CA regulations adopted by ARB Dec 2018.
+    Uses excess_offsets_batch for the current run (prmt.offsets_supply_q & emissions projection), 
+    and shows warning if the excess is significant.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
-
-    # get historical record of offsets used for compliance
-    offsets_used_hist = prmt.compliance_events.loc[
-        prmt.compliance_events.index.get_level_values('vintage or type')=='offsets']
+    trace('start')
     
-    # get the latest year with compliance event data
-    latest_comp_y = prmt.compliance_events.index.get_level_values('compliance_date').max().year
+    excess_offsets = excess_offsets_batch(
+        prmt.offsets_supply_q.to_frame(), prmt.emissions_ann_CA.to_frame(), prmt.emissions_ann_QC.to_frame())
     
-    # initialize offsets_avail (value is then iteratively updated below)
-    # offsets used in CP1
-    offsets_used_in_completed_periods = offsets_used_hist[
-        offsets_used_hist.index.get_level_values('compliance_date').year.isin([2014, 2015])]['quant'].sum()
-
-    # initialize first_em_year, which is first year of emissions for each compliance period
-    # (starting with the first 3-year compliance period, Compliance Period 2, 2015-2017)
-    first_em_year = 2015
+    # single scenario; use first (only) value
+    offsets_avail = excess_offsets.iloc[0]
     
-    # compliance period #2 obligations for emissions 2015-2017 (due Nov 1, 2018)
-    if latest_comp_y < first_em_year+3:
-        # latest CIR data is before 2018Q4, so simulate compliance period #2 obligations
-        
-        # offsets available for use in compliance period #2
-        # Q3 and Q4 below refer to year of compliance event (first_em_year+3)
-        offsets_supply_at_end_Q3 = prmt.offsets_supply_q.loc[:quarter_period(f'{first_em_year+3}Q3')].sum()
-        offsets_supply_Q4_first_mo = prmt.offsets_supply_q.at[quarter_period(f'{first_em_year+3}Q4')] / 3
-        # Q4 first month above is an approximation
-        offsets_supply_at_event = offsets_supply_at_end_Q3 + offsets_supply_Q4_first_mo
-        offsets_avail = offsets_supply_at_event - offsets_used_in_completed_periods
-        
-        # max offsets are 8% for both CA & QC; 
-        max_off_p2_CA = prmt.emissions_ann_CA.loc[first_em_year:first_em_year+2].sum() * 0.08
-        max_off_p2_QC = prmt.emissions_ann_QC.loc[first_em_year:first_em_year+2].sum() * 0.08
-        
-        # CA + QC: calculate the max offsets that could be used, given the offsets projection (prmt.offsets_supply_q)
-        # minimum of: max that could be used in p2 & offsets available at time of p2
-        max_off_p2_given_off_proj = min((max_off_p2_CA + max_off_p2_QC), offsets_avail)
-
-        # update offsets_avail to remove max offset use
-        offsets_avail += -1 * max_off_p2_given_off_proj
-        offsets_used_in_completed_periods += max_off_p2_given_off_proj
-
-    else:
-        pass
-
-    # ~~~~~~~~~~~~~~~~~~~~
-    
-    # add to offsets_used_in_completed_periods, to reflect actual use
-    offsets_used_in_completed_periods += offsets_used_hist[
-        offsets_used_hist.index.get_level_values('compliance_date').year.isin(
-            list(range(first_em_year+1, first_em_year+4)))]['quant'].sum()
-
-    first_em_year += 3 # step forward 3 years
-    
-    # compliance period #3 obligations for emissions 2018-2020 (due Nov 1, 2021)
-    if latest_comp_y < first_em_year+3:
-        # latest CIR data is before 2021Q4, so simulate compliance period #3 obligations
-        
-        # offsets available for use in compliance period #3
-        # Q3 and Q4 below refer to year of compliance event (first_em_year+3)
-        offsets_supply_at_end_Q3 = prmt.offsets_supply_q.loc[:quarter_period(f'{first_em_year+3}Q3')].sum()
-        offsets_supply_Q4_first_mo = prmt.offsets_supply_q.at[quarter_period(f'{first_em_year+3}Q4')] / 3
-        # Q4 first month above is an approximation
-
-        offsets_supply_at_event = offsets_supply_at_end_Q3 + offsets_supply_Q4_first_mo
-        offsets_avail = offsets_supply_at_event - offsets_used_in_completed_periods 
-        
-        # max offsets are 8% for CA & QC
-        max_off_p3_CA = prmt.emissions_ann_CA.loc[first_em_year:first_em_year+2].sum() * 0.08
-        max_off_p3_QC = prmt.emissions_ann_QC.loc[first_em_year:first_em_year+2].sum() * 0.08
-            
-        # CA + QC: calculate the max offsets that could be used, given the offsets projection (prmt.offsets_supply_q)
-        # minimum of: max that could be used in p3 & offsets available at time of p3
-        max_off_p3_given_off_proj = min((max_off_p3_CA + max_off_p3_QC), offsets_avail)
-
-        # update offsets_avail to remove max offset use
-        offsets_avail += -1 * max_off_p3_given_off_proj
-        offsets_used_in_completed_periods += max_off_p3_given_off_proj
-        
-    else:
-        pass
-
-    # ~~~~~~~~~~~~~~~~~~~~
-    
-    offsets_used_in_completed_periods += offsets_used_hist[
-        offsets_used_hist.index.get_level_values('compliance_date').year.isin(
-            list(range(first_em_year+1, first_em_year+4)))]['quant'].sum()
-
-    first_em_year += 3 # step forward 3 years
-
-    # compliance period #4 obligations for emissions 2021-2023 (due Nov 1, 2024)
-    if latest_comp_y < first_em_year+3:
-        # latest CIR data is before 2021Q4, so simulate compliance period #4 obligations
-        
-        # offsets available for use in compliance period #4
-        # Q3 and Q4 below refer to year of compliance event (first_em_year+3)
-        offsets_supply_at_end_Q3 = prmt.offsets_supply_q.loc[:quarter_period(f'{first_em_year+3}Q3')].sum()
-        offsets_supply_Q4_first_mo = prmt.offsets_supply_q.at[quarter_period(f'{first_em_year+3}Q4')] / 3
-        # Q4 first month above is an approximation
-        offsets_supply_at_event = offsets_supply_at_end_Q3 + offsets_supply_Q4_first_mo
-        offsets_avail = offsets_supply_at_event - offsets_used_in_completed_periods 
-        
-        # max offsets are 4% for CA & 8% for QC
-        max_off_p4_CA = prmt.emissions_ann_CA.loc[first_em_year:first_em_year+2].sum() * 0.04
-        max_off_p4_QC = prmt.emissions_ann_QC.loc[first_em_year:first_em_year+2].sum() * 0.08
-        
-        # CA + QC: calculate the max offsets that could be used, given the offsets projection (prmt.offsets_supply_q)
-        # minimum of: max that could be used in p4 & offsets available at time of p4
-        max_off_p4_given_off_proj = min((max_off_p4_CA + max_off_p4_QC), offsets_avail)
-
-        # update offsets_avail to remove max offset use
-        offsets_avail += -1 * max_off_p4_given_off_proj
-        offsets_used_in_completed_periods += max_off_p4_given_off_proj
-        
-    else:
-        pass
-
-    # ~~~~~~~~~~~~~~~~~~~~
-    offsets_used_in_completed_periods += offsets_used_hist[
-        offsets_used_hist.index.get_level_values('compliance_date').year.isin(
-            list(range(first_em_year+1, first_em_year+4)))]['quant'].sum()
-
-    first_em_year += 3 # step forward 3 years
-
-    # compliance period #5 obligations for emissions 2024-2026 (due in full Nov 1, 2027)
-
-    # ***IMPORTANT NOTE***
-    # this compliance period is anomalous for CA because of change in offset max use under AB 398 from 4% to 6%,
-    # which doesn't match with timing of compliance period deadline
-
-    if latest_comp_y < first_em_year+3:
-        # latest CIR data is before 2021Q4, so simulate compliance period #5 obligations
-        
-        # offsets available for use in compliance period #5
-        # Q3 and Q4 below refer to year of compliance event (first_em_year+3)
-        offsets_supply_at_end_Q3 = prmt.offsets_supply_q.loc[:quarter_period(f'{first_em_year+3}Q3')].sum()
-        offsets_supply_Q4_first_mo = prmt.offsets_supply_q.at[quarter_period(f'{first_em_year+3}Q4')] / 3
-        # Q4 first month above is an approximation
-        offsets_supply_at_event = offsets_supply_at_end_Q3 + offsets_supply_Q4_first_mo
-        offsets_avail = offsets_supply_at_event - offsets_used_in_completed_periods 
-        
-        # for CA, max offsets are 4% for emissions incurred in 2024-2025, 6% for emissions incurred in 2026
-        # for QC, max offsets are 8% of emissions for all years 2024-2026
- 
-        max_off_CA_2024_2025 = prmt.emissions_ann_CA.loc[first_em_year:first_em_year+1].sum() * 0.04
-        max_off_CA_2026 = prmt.emissions_ann_CA.loc[first_em_year+2].sum() * 0.06
-        max_off_p5_QC = prmt.emissions_ann_QC.loc[first_em_year:first_em_year+2].sum() * 0.08
-
-        max_off_p5 = max_off_CA_2024_2025 + max_off_CA_2026 + max_off_p5_QC
-        
-        # CA + QC: calculate the max offsets that could be used, given the offsets projection (prmt.offsets_supply_q)
-        # minimum of: max that could be used in p5 & offsets available at time of p5
-        max_off_p5_given_off_proj = min((max_off_p5), offsets_avail)
-
-        # update offsets_avail to remove max offset use
-        offsets_avail += -1 * max_off_p5_given_off_proj
-        offsets_used_in_completed_periods += max_off_p5_given_off_proj
-        
-    else:
-        pass
-
-    # ~~~~~~~~~~~~~~~~~~~~
-    
-    offsets_used_in_completed_periods += offsets_used_hist[
-        offsets_used_hist.index.get_level_values('compliance_date').year.isin(
-            list(range(first_em_year+1, first_em_year+4)))]['quant'].sum()
-
-    first_em_year += 3 # step forward 3 years
-    
-    # compliance period #6 obligations for emissions 2027-2029 (due Nov 1, 2030)
-
-    if latest_comp_y < first_em_year+3:
-        # latest CIR data is before 2021Q4, so simulate compliance period #6 obligations
-        
-        # offsets available for use in compliance period #6
-        # Q3 and Q4 below refer to year of compliance event (first_em_year+3)
-        offsets_supply_at_end_Q3 = prmt.offsets_supply_q.loc[:quarter_period(f'{first_em_year+3}Q3')].sum()
-        offsets_supply_Q4_first_mo = prmt.offsets_supply_q.at[quarter_period(f'{first_em_year+3}Q4')] / 3
-        # Q4 first month above is an approximation
-        offsets_supply_at_event = offsets_supply_at_end_Q3 + offsets_supply_Q4_first_mo
-        offsets_avail = offsets_supply_at_event - offsets_used_in_completed_periods 
-        
-        # max offsets are 6% for CA & 8% for QC
-        max_off_p6_CA = prmt.emissions_ann_CA.loc[first_em_year:first_em_year+2].sum() * 0.06
-        max_off_p6_QC = prmt.emissions_ann_QC.loc[first_em_year:first_em_year+2].sum() * 0.08
-        
-        # CA + QC: calculate the max offsets that could be used, given the offsets projection (prmt.offsets_supply_q)
-        # minimum of: max that could be used in p6 & offsets available at time of p6
-        max_off_p6_given_off_proj = min((max_off_p6_CA + max_off_p6_QC), offsets_avail)
-
-        # update offsets_avail to remove max offset use
-        offsets_avail += -1 * max_off_p6_given_off_proj
-        offsets_used_in_completed_periods += max_off_p6_given_off_proj
-        
-    else:
-        pass
-
-    # ~~~~~~~~~~~~~~~~~~~~
     # after assuming max offset use, see if any offsets remaining in offsets_avail
     # if so, these are excess offsets
     # show warning only if the excess is significant (> 5 MMTCO2e)
@@ -8704,19 +10134,109 @@ def excess_offsets_calc():
         pass
     
     # no return; set object attribute above
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 
 # end of excess_offsets_calc
 
 
+def excess_offsets_batch(offsets_supply_q, emissions_ann_CA, emissions_ann_QC):
+    """
+    Calculate offsets remaining after maximum offset use through 2030, for many scenarios at once.
+    
+    Arguments are DataFrames with one column for each scenario:
+    * offsets_supply_q: indexed by quarter (see offsets_projection_batch)
+    * emissions_ann_CA & emissions_ann_QC: indexed by year
+    
+    For all compliance periods:
+    assume ARB allows emitters to go up to max for whole compliance period, 
+    regardless of offset use in annual compliance events during that compliance period.
+    
+    Max offsets are calculated for each emissions year, using limits from offset_rates_pct_of_limit;
+    so for compliance period #5 (for emissions 2024-2026), for CA, max offsets are 4% for emissions 2024-2025 
+    and 6% for emissions 2026, based on CA regulations adopted by ARB Dec 2018.
+    
+    Compliance periods with historical compliance data use actual offsets surrendered; 
+    later compliance periods are simulated.
+    
+    Returns Series of offsets remaining after compliance period #6 (emissions 2027-2029), for each scenario.
+    """
+    
+    trace('start')
+    
+    columns = emissions_ann_CA.columns
+    
+    # first year of emissions for each compliance period #2 to #6 (3-year periods, 2015-2029)
+    # compliance event for each period is Nov 1 of year after period ends
+    first_em_years = np.arange(2015, 2027+1, 3)
+    event_years = first_em_years + 3
+    
+    # get historical record of offsets used for compliance
+    offsets_used_hist = prmt.compliance_events.xs('offsets', level='vintage or type')['quant']
+    offsets_used_hist = offsets_used_hist.groupby(offsets_used_hist.index.year).sum()
+    
+    # get the latest year with compliance event data
+    latest_comp_y = prmt.compliance_events.index.get_level_values('compliance_date').max().year
+    
+    # offsets used in compliance events up to the first year of emissions of each period
+    # (actual use; zero for years without compliance data)
+    offsets_used_hist_cumul = offsets_used_hist.cumsum().reindex(first_em_years, method='ffill').fillna(0).values
+    
+    # offsets available at each compliance event (periods x scenarios)
+    # Q3 and Q4 below refer to year of compliance event
+    # Q4 first month (Q4 / 3) is an approximation
+    offsets_supply_cumul = offsets_supply_q.cumsum()
+    Q3s = [quarter_period(f'{year}Q3') for year in event_years]
+    Q4s = [quarter_period(f'{year}Q4') for year in event_years]
+    offsets_supply_at_event = offsets_supply_cumul.loc[Q3s].values + offsets_supply_q.loc[Q4s].values / 3
+    
+    # max offsets for each emissions year, for CA + QC (years x scenarios)
+    em_years = np.arange(first_em_years.min(), event_years.max())
+    period = np.digitize(em_years, [2021, 2026]) # 0 for 2013-2020, 1 for 2021-2025, 2 for 2026-2030
+    limits = offset_rates_pct_of_limit(1)
+    max_off_ann = (emissions_ann_CA.reindex(em_years).fillna(0).values * limits['CA'][period][:, np.newaxis] 
+                   + emissions_ann_QC.reindex(em_years).fillna(0).values * limits['QC'][period][:, np.newaxis])
+    
+    # sum over years in each compliance period (periods x scenarios)
+    max_off = max_off_ann.reshape(len(first_em_years), 3, len(columns)).sum(axis=1)
+    
+    # simulate periods with compliance event after the latest compliance data
+    # offsets available at each event depend on simulated use in earlier periods, so step through periods;
+    # calculations within each period are for all scenarios at once
+    max_off_used_simulated = np.zeros(len(columns))
+    offsets_avail = np.zeros(len(columns))
+    
+    for period_num in range(len(first_em_years)):
+        if latest_comp_y < event_years[period_num]:
+            offsets_avail = (offsets_supply_at_event[period_num] 
+                             - offsets_used_hist_cumul[period_num] - max_off_used_simulated)
+            
+            # CA + QC: max offsets that could be used, given the offsets projection
+            # minimum of: max that could be used in period & offsets available at time of period
+            max_off_given_off_proj = np.minimum(max_off[period_num], offsets_avail)
+            
+            # update offsets_avail to remove max offset use
+            offsets_avail = offsets_avail - max_off_given_off_proj
+            max_off_used_simulated = max_off_used_simulated + max_off_given_off_proj
+        else:
+            pass
+    
+    excess_offsets = pd.Series(offsets_avail, index=columns, name='excess_offsets')
+    
+    trace('end')
+    
+    return(excess_offsets)
+# end of excess_offsets_batch
+
+
 # ## Functions: Calculate metrics & compare with CIR
 # * private_bank_annual_metric_model_method
-# * turn_snap_into_CIR
-# * turn_snap_into_CIR_for_private_bank_metric
-# * turn_snap_into_CIR_for_private_bank_metric_projection
+# * turn_snaps_into_CIR
+# * reconcile_snaps_vs_CIR
 # * private_bank_annual_metric_paper_method
 # * compliance_period_metrics_historical
 # * compliance_period_metrics_projection
+#   * compliance_surrenders_projection
+#   * compliance_period_metrics_projection_batch
 # * compile_annual_metrics_for_export
 # * compile_compliance_period_metrics_for_export
 
@@ -8733,7 +10253,7 @@ def private_bank_annual_metric_model_method(supply_ann_df):
     For all projection years, the method in this function is used for calculating the Private Bank.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # modify supply_ann_df to include additional columns, including cumulative values
     df = supply_ann_df.copy()
@@ -8838,14 +10358,14 @@ def private_bank_annual_metric_model_method(supply_ann_df):
     prmt.reserve_PCU_sales_cumul = df['reserve_PCU_cumul']
     
     # no return
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 # end of private_bank_annual_metric_model_method
 
 
 # In[ ]:
 
 
-def calculate_reserve_account_metric_and_related(snaps_end_Q4_CA_QC):
+def calculate_reserve_account_metric_and_related():
     """
     Calculates the reserve account metric (Cullenward et al., 2019).
     
@@ -8860,9 +10380,7 @@ def calculate_reserve_account_metric_and_related(snaps_end_Q4_CA_QC):
     # APCR removals for allocations and historical reserve sales
     # but do not include APCR removals for *projected* reserve sales
     # *projected* reserve sales are handled here, after end of processing main supply functions
-    df = snaps_end_Q4_CA_QC.copy()
-    df = df.loc[df.index.get_level_values('acct_name')=='APCR_acct']
-    reserve_accts_before_sales = df.groupby('snap_yr')['quant'].sum()
+    reserve_accts_before_sales = balance_cube_sum_by_year(['APCR_acct'])
     
     # drop the value for 2012; none of the other metrics are being calculated for that year
     reserve_accts_before_sales = reserve_accts_before_sales.drop(2012)
@@ -8877,478 +10395,233 @@ def calculate_reserve_account_metric_and_related(snaps_end_Q4_CA_QC):
             reserve_shortfall.at[year] = 0
         elif reserve_balance.at[year] < 0:
             reserve_shortfall.at[year] = -1 * reserve_balance.at[year]
-            # shortfall is a positive value
-        
-    # assume PCU sales will fill in for any reserve shortfall
-    PCU_sales_cumul = reserve_shortfall
-    PCU_sales_cumul.name = 'PCU_sales_cumul'
-    
-    # create reserve_accts: balance + PCU sales; minimum should be zero
-    reserve_accts = reserve_balance.add(PCU_sales_cumul)
-    reserve_accts.name = 'reserve_accts'
-
-    # calculate reserve sales alone (excluding PCU from reserve_PCU_sales_cumul)
-    reserve_sales_excl_PCU_cumul = prmt.reserve_PCU_sales_cumul.sub(PCU_sales_cumul)
-    
-    # set object attributes
-    prmt.PCU_sales_cumul = PCU_sales_cumul
-    prmt.reserve_accts = reserve_accts
-    prmt.reserve_sales_excl_PCU = reserve_sales_excl_PCU_cumul
-    
-    # no return
-# end of calculate_reserve_account_metric_and_related
-
-
-# In[ ]:
-
-
-def turn_snap_into_CIR(yr_quart_period, snaps_CAQC):
-    """
-    Takes model results and reformats for comparison against Compliance Instrument Report (CIR) for historical data.
-    
-    Date of snap, as labeled by regulators, saved as yr_quart_period; formatted as quarterly period.
-       
-    Note that snaps are actually taken early in the following quarter, e.g., 2014Q4 snap is taken in early 2015Q1.
-    """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
-    
-    # select particular quarter to convert to CIR
-    df = snaps_CAQC[snaps_CAQC.index.get_level_values('snap_q')==yr_quart_period]
-    
-    # APCR: change vintage to 'APCR'
-    mask = df.index.get_level_values('inst_cat').str.contains('APCR') # also selects e.g., 'alloc_2016_APCR'
-    APCR = df.loc[mask]
-    mapping_dict = {'vintage': 'APCR'}
-    APCR = multiindex_change(APCR, mapping_dict)
-    
-    # recombine APCR & non-APCR
-    df = df.loc[~mask].append(APCR)
-    
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # Early Action (aka Early Reduction): change vintage to be 'early_action'
-    mask = df.index.get_level_values('inst_cat')=='early_action'
-    early_action = df.loc[mask]
-    mapping_dict = {'vintage': 'early_action'}
-    early_action = multiindex_change(early_action, mapping_dict)
-    
-    # recombine Early Action and non-Early Action
-    df = df.loc[~mask].append(early_action)
-
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # "non-vintage allowances" are only APCR: change vintage to be 'APCR'
-    mask = df.index.get_level_values('inst_cat')=='APCR'
-    APCR_allowances = df.loc[mask]
-    mapping_dict = {'vintage': 'APCR'}
-    APCR_allowances = multiindex_change(APCR_allowances, mapping_dict)
-    
-    # recombine APCR allowances and non-APCR
-    df = df.loc[~mask].append(APCR_allowances)
-
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # combine alloc_hold, ann_alloc_hold, and auct_hold into one group ('A_I_A')
-    # ('A_I_A' is shorthand for column in Compliance Instrument Report "Auction + Issuance + Allocation")
-    # note: issuance account is only for offsets, which are not in snaps
-    mask = df.index.get_level_values('acct_name').isin(['alloc_hold', 'ann_alloc_hold', 'auct_hold'])
-    A_I_A = df.loc[mask]
-    mapping_dict = {'acct_name': 'A_I_A'}
-    A_I_A = multiindex_change(A_I_A, mapping_dict)
-    
-    # recombine A_I_A and rest
-    df = df.loc[~mask].append(A_I_A)
-    
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # combine gen_acct & comp_acct, because we can't identify a priori reasons for moves
-    # can only recreate observed moves
-    # so it is useful to compare total of gen_acct + comp_acct in historical record vs. model
-    mask = df.index.get_level_values('acct_name').isin(['gen_acct', 'comp_acct'])
-    gen_comp = df.loc[mask]
-    mapping_dict = {'acct_name': 'gen_comp'}
-    gen_comp = multiindex_change(gen_comp, mapping_dict)
-    
-    # append gen_comp to the rest
-    df = df.loc[~mask].append(gen_comp)
-    
-    # groupby sum to combine all allowances of a particular vintage, or particular type of non-vintage (i.e., APCR)
-    df = df.groupby(['acct_name', 'vintage']).sum()
-    
-    # reshape
-    df = df.unstack(0)
-    df.columns = df.columns.droplevel(0)
-    
-    allowances_modeled = df
-
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # OFFSETS: HISTORICAL
-    # add historical offset data from CIR of specified quarter
-
-    if yr_quart_period.year == 2013:
-        print("This function doesn't yet handle year 2013.") 
-        
-    if yr_quart_period.year > 2013:
-        df2 = prmt.CIR_offsets_q_sums.loc[prmt.CIR_offsets_q_sums.index==yr_quart_period]
-
-        # TEST: should only be a single row
-        if prmt.run_tests == True:
-            if len(df2) != 1:
-                print(f"{prmt.test_failed_msg} Selection of offsets did not return a single row.")
-                if len(df2) == 0:
-                    print(f"{prmt.test_failed_msg} Selection of offsets returned zero rows.")
-                elif len(df2) > 1:
-                    print(f"{prmt.test_failed_msg} Selection of offsets returned more than 1 row.")
-                else:
-                    print(f"{prmt.test_failed_msg} Selection of offsets had some other error; check into it.")
-            else:
-                pass
-            # END OF TEST
-
-        if len(df2) == 1:
-            df2 = df2.drop('subtotal', axis=1)
-            df2 = df2.rename(columns={'Auction + Issuance + Allocation': 'A_I_A',
-                                      'Compliance': 'comp_acct', 
-                                      'Environmental Integrity (QC)': 'env_integrity', 
-                                      'General': 'gen_acct', 
-                                      'Limited Use Holding Account (CA)': 'limited_use', 
-                                      'Reserve': 'APCR_acct', 
-                                      'Invalidation': 'invalidation',
-                                      'Voluntary Renewable Electricity (CA)': 'VRE_acct', 
-                                      'Retirement': 'retirement'})
-
-            # change index that is date of CIR report into metadata indicating that these are offsets
-            df2.index = ['offsets']
-
-            df2['gen_comp'] = df2[['gen_acct', 'comp_acct']].sum(axis=1)
-            df2 = df2.drop(['gen_acct', 'comp_acct'], axis=1)
-
-            offsets_hist = df2
-
-        else:
-            # don't create offsets_hist; line below will hit error, because offsets_hist not defined
-            pass
-
-    
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # RECOMBINE:
-    CIR_snap = pd.concat([allowances_modeled, offsets_hist], sort=True)
-    
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    
-    CIR_snap['subtotal'] = CIR_snap.sum(axis=1)
-    
-    # add columns with NaN (if any are missing from list above)
-    for col in prmt.CIR_columns:
-        if col not in CIR_snap.columns:
-            CIR_snap[col] = np.NaN
-    
-    # reorder columns & change index type to str
-    CIR_snap = CIR_snap.reindex(columns=prmt.CIR_columns)
-    CIR_snap.index = CIR_snap.index.astype(str)
-    
-    # fill all NaN with zeros
-    CIR_snap = CIR_snap.fillna(0.0)
-    
-    # name index
-    CIR_snap.index.name = 'vintage/type'
-    
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # RETIREMENTS 
-    # only for allowances
-    # (would be redundant to do similar comparison for offsets, 
-    # because data for offsets is drawn from CIR, so comparison wouldn't tell us anything)
-    
-    df = prmt.compliance_events.copy()
-    df = df.loc[df.index.get_level_values('vintage or type')!='offsets']
-    df = df.loc[df.index.get_level_values('compliance_date')<=yr_quart_period]
-    
-    for row in df.index:
-        # get vintage and quantity
-        vintage = row[1]
-        
-        retired = df.at[row, 'quant']
+            # shortfall is a positive value
         
-        # for specified vintage, transfer that quantity from gen_comp to retirement
-        CIR_snap.at[vintage, 'gen_comp'] = CIR_snap.at[vintage, 'gen_comp'] - retired
-        CIR_snap.at[vintage, 'retirement'] = CIR_snap.at[vintage, 'retirement'] + retired
+    # assume PCU sales will fill in for any reserve shortfall
+    PCU_sales_cumul = reserve_shortfall
+    PCU_sales_cumul.name = 'PCU_sales_cumul'
     
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # create reserve_accts: balance + PCU sales; minimum should be zero
+    reserve_accts = reserve_balance.add(PCU_sales_cumul)
+    reserve_accts.name = 'reserve_accts'
+
+    # calculate reserve sales alone (excluding PCU from reserve_PCU_sales_cumul)
+    reserve_sales_excl_PCU_cumul = prmt.reserve_PCU_sales_cumul.sub(PCU_sales_cumul)
     
-    # calculate totals
-    for col in CIR_snap.columns:
-        CIR_snap.at['totals (incl. offsets)', col] = CIR_snap[col].sum()
-        
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    # set object attributes
+    prmt.PCU_sales_cumul = PCU_sales_cumul
+    prmt.reserve_accts = reserve_accts
+    prmt.reserve_sales_excl_PCU = reserve_sales_excl_PCU_cumul
     
-    return(CIR_snap)
-# end of turn_snap_into_CIR
+    # no return
+# end of calculate_reserve_account_metric_and_related
 
 
 # In[ ]:
 
 
-def turn_snap_into_CIR_for_private_bank_metric(yr_quart_period, snaps_CAQC):
+def turn_snaps_into_CIR(snaps_CIR, offsets=True, retirements=True):
     """
-    Takes model results and reformats for comparison against Compliance Instrument Report (CIR) for historical data.
+    Takes model results and reformats for comparison against Compliance Instrument Report (CIR), 
+    for all quarters at once.
     
-    Date of snap, as labeled by regulators, saved as yr_quart_period; formatted as quarterly period.
+    Argument snaps_CIR is a list of snaps (e.g., scenario_CA.snaps_CIR + scenario_QC.snaps_CIR).
+    
+    Date of snap, as labeled by regulators, is in column 'snap_q'; formatted as quarterly period.
     
     Note that snaps are actually taken early in the following quarter, e.g., 2014Q4 snap is taken in early 2015Q1.
-    """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
     
-    # select particular quarter to convert to CIR
-    df = snaps_CAQC[snaps_CAQC.index.get_level_values('snap_q')==yr_quart_period]
+    Uses mappings prmt.CIR_acct_map (acct_name to CIR column) & prmt.CIR_row_map (inst_cat to CIR row), 
+    so that the whole history is grouped in one pass, instead of one quarter at a time.
     
-    # APCR: change vintage to 'APCR'
-    mask = df.index.get_level_values('inst_cat').str.contains('APCR') # also selects e.g., 'alloc_2016_APCR'
-    APCR = df.loc[mask]
-    mapping_dict = {'vintage': 'APCR'}
-    APCR = multiindex_change(APCR, mapping_dict)
+    If offsets == True, adds historical offsets from the CIR of each quarter (prmt.CIR_offsets_q_sums).
     
-    # recombine APCR & non-APCR
-    df = df.loc[~mask].append(APCR)
+    If retirements == True, moves allowances retired in compliance events (up to each quarter) 
+    from gen_comp to retirement.
     
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # Early Action (aka Early Reduction): change vintage to be 'early_action'
-    mask = df.index.get_level_values('inst_cat')=='early_action'
-    early_action = df.loc[mask]
-    mapping_dict = {'vintage': 'early_action'}
-    early_action = multiindex_change(early_action, mapping_dict)
+    Returns df with MultiIndex ['snap_q', 'vintage/type'] and columns prmt.CIR_columns.
     
-    # recombine Early Action and non-Early Action
-    df = df.loc[~mask].append(early_action)
-
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # "non-vintage allowances" are only APCR: change vintage to be 'APCR'
-    mask = df.index.get_level_values('inst_cat')=='APCR'
-    APCR_allowances = df.loc[mask]
-    mapping_dict = {'vintage': 'APCR'}
-    APCR_allowances = multiindex_change(APCR_allowances, mapping_dict)
+    For every quarter, includes rows 'APCR' & 'early_action' (and 'offsets'), with zeros if none in snaps.
+    """
+    trace('start')
     
-    # recombine APCR allowances and non-APCR
-    df = df.loc[~mask].append(APCR_allowances)
-
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # combine alloc_hold, ann_alloc_hold, and auct_hold into one group ('A_I_A')
-    # ('A_I_A' is shorthand for column in Compliance Instrument Report "Auction + Issuance + Allocation")
-    # note: issuance account is only for offsets, which are not in snaps
-    mask = df.index.get_level_values('acct_name').isin(['alloc_hold', 'ann_alloc_hold', 'auct_hold'])
-    A_I_A = df.loc[mask]
-    mapping_dict = {'acct_name': 'A_I_A'}
-    A_I_A = multiindex_change(A_I_A, mapping_dict)
+    df = pd.concat(snaps_CIR, sort=False)
     
-    # recombine A_I_A and rest
-    df = df.loc[~mask].append(A_I_A)
+    # map inst_cat to CIR rows (vintage/type); only the unique values of inst_cat are mapped
+    # APCR: also selects e.g., 'alloc_2016_APCR'
+    # "non-vintage allowances" are only APCR, and Early Action (aka Early Reduction)
+    inst_cat_codes, inst_cats = pd.factorize(df.index.get_level_values('inst_cat'))
+    inst_cat_rows = pd.Series(inst_cats).map(prmt.CIR_row_map)
+    inst_cat_rows.loc[inst_cats.str.contains('APCR')] = 'APCR'
+    CIR_rows = inst_cat_rows.values[inst_cat_codes]
     
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # combine gen_acct & comp_acct, because we can't identify a priori reasons for moves
-    # can only recreate observed moves
-    # so it is useful to compare total of gen_acct + comp_acct in historical record vs. model
-    mask = df.index.get_level_values('acct_name').isin(['gen_acct', 'comp_acct'])
-    gen_comp = df.loc[mask]
-    mapping_dict = {'acct_name': 'gen_comp'}
-    gen_comp = multiindex_change(gen_comp, mapping_dict)
+    # for all other inst_cat, CIR row is vintage
+    vintaged = pd.isnull(CIR_rows)
+    CIR_rows[vintaged] = df.index.get_level_values('vintage')[vintaged].astype(str)
     
-    # append gen_comp to the rest
-    df = df.loc[~mask].append(gen_comp)
+    # map acct_name to CIR columns; 
+    # alloc_hold, ann_alloc_hold, and auct_hold combined into 'A_I_A' (note: issuance account only for offsets)
+    # gen_acct & comp_acct combined into 'gen_comp', because we can't identify a priori reasons for moves
+    acct_codes, acct_names = pd.factorize(df.index.get_level_values('acct_name'))
+    CIR_cols = pd.Series(acct_names).replace(prmt.CIR_acct_map).values[acct_codes]
     
     # groupby sum to combine all allowances of a particular vintage, or particular type of non-vintage (i.e., APCR)
-    df = df.groupby(['acct_name', 'vintage']).sum()
+    df = pd.DataFrame({'snap_q': df['snap_q'].values, 
+                       'vintage/type': CIR_rows, 
+                       'acct_name': CIR_cols, 
+                       'quant': df['quant'].values})
+    df = df.groupby(['snap_q', 'vintage/type', 'acct_name'])['quant'].sum()
     
     # reshape
-    df = df.unstack(0)
-    df.columns = df.columns.droplevel(0)
+    allowances_modeled = df.unstack('acct_name')
+    allowances_modeled.columns.name = None
+    
+    quarters = pd.PeriodIndex(allowances_modeled.index.get_level_values('snap_q').unique(), freq='Q')
     
-    allowances_modeled = df
-
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # OFFSETS: HISTORICAL
-    # add historical offset data from CIR of specified quarter
-      
-    if yr_quart_period.year == 2013:
-        # no record of offsets issued in 2013; assume they are zero
-        pass
-    
-    elif yr_quart_period.year > 2013:
-        df2 = prmt.CIR_offsets_q_sums.loc[prmt.CIR_offsets_q_sums.index==yr_quart_period]
-
-        # TEST: should only be a single row
+    # add historical offset data from CIR of each quarter (no record of offsets issued in 2013; assume zero)
+    if offsets == True:
+        df2 = prmt.CIR_offsets_q_sums.loc[prmt.CIR_offsets_q_sums.index.isin(quarters)]
+        
+        # TEST: should be a single row for each quarter after 2013
         if prmt.run_tests == True:
-            if len(df2) != 1:
-                print(f"{prmt.test_failed_msg} Selection of offsets did not return a single row.")
-                if len(df2) == 0:
-                    print(f"{prmt.test_failed_msg} Selection of offsets returned zero rows.")
-                    pass
-                elif len(df2) > 1:
-                    print(f"{prmt.test_failed_msg} Selection of offsets returned more than 1 row.")
-                else:
-                    print(f"{prmt.test_failed_msg} Selection of offsets had some other error; check into it.")
-            else:
-                pass
+            quarters_offsets = df2.index.value_counts()
+            for quarter in quarters[quarters.year > 2013]:
+                if quarter not in quarters_offsets.index:
+                    print(f"{prmt.test_failed_msg} Selection of offsets for {quarter} returned zero rows.")
+                elif quarters_offsets.at[quarter] > 1:
+                    print(f"{prmt.test_failed_msg} Selection of offsets for {quarter} returned more than 1 row.")
         # END OF TEST
-
-        if len(df2) == 1:
-            df2 = df2.drop('subtotal', axis=1)
-            df2 = df2.rename(columns={'Auction + Issuance + Allocation': 'A_I_A',
-                                      'Compliance': 'comp_acct', 
-                                      'Environmental Integrity (QC)': 'env_integrity', 
-                                      'General': 'gen_acct', 
-                                      'Limited Use Holding Account (CA)': 'limited_use', 
-                                      'Reserve': 'APCR_acct', 
-                                      'Invalidation': 'invalidation',
-                                      'Voluntary Renewable Electricity (CA)': 'VRE_acct', 
-                                      'Retirement': 'retirement'})
-
-            # change index that is date of CIR report into metadata indicating that these are offsets
-            df2.index = ['offsets']
-            df2['gen_comp'] = df2[['gen_acct', 'comp_acct']].sum(axis=1)
-            df2 = df2.drop(['gen_acct', 'comp_acct'], axis=1)
-            offsets_hist = df2
-
-        else:
-            # don't create offsets_hist; line below will hit error, because offsets_hist not defined
-            pass
-    
-    
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # RECOMBINE:
-    if yr_quart_period.year == 2013:
-        CIR_snap = allowances_modeled
         
-    elif yr_quart_period.year > 2013:
-        CIR_snap = pd.concat([allowances_modeled, offsets_hist], sort=True)
+        df2 = df2.drop('subtotal', axis=1)
+        df2 = df2.rename(columns=prmt.CIR_offsets_col_map)
+        df2['gen_comp'] = df2[['gen_acct', 'comp_acct']].sum(axis=1)
+        df2 = df2.drop(['gen_acct', 'comp_acct'], axis=1)
+        
+        # change index that is date of CIR report into metadata indicating that these are offsets
+        df2.index = pd.MultiIndex.from_arrays([df2.index, ['offsets']*len(df2)], names=['snap_q', 'vintage/type'])
+        
+        offsets_hist = df2
+        required_rows = ['APCR', 'early_action', 'offsets']
+    else:
+        offsets_hist = pd.DataFrame()
+        required_rows = ['APCR', 'early_action']
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # RECOMBINE:
+    CIR_snaps = pd.concat([allowances_modeled, offsets_hist], sort=True)
     
-    CIR_snap['subtotal'] = CIR_snap.sum(axis=1)
+    CIR_snaps['subtotal'] = CIR_snaps.sum(axis=1)
     
-    # add columns with NaN (if any are missing from list above)
-    for col in prmt.CIR_columns:
-        if col not in CIR_snap.columns:
-            CIR_snap[col] = np.NaN
+    # reorder columns, adding any missing (columns not in prmt.CIR_columns are dropped)
+    CIR_snaps = CIR_snaps.reindex(columns=prmt.CIR_columns)
     
-    # reorder columns & change index type to str
-    CIR_snap = CIR_snap.reindex(columns=prmt.CIR_columns)
-    CIR_snap.index = CIR_snap.index.astype(str)
+    # fill in rows for non-vintage types & offsets, for quarters without them (e.g., 2013)
+    required_index = pd.MultiIndex.from_product([quarters, required_rows], names=['snap_q', 'vintage/type'])
+    CIR_snaps = CIR_snaps.reindex(CIR_snaps.index.union(required_index))
     
     # fill all NaN with zeros
-    CIR_snap = CIR_snap.fillna(0.0)
+    CIR_snaps = CIR_snaps.fillna(0.0)
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # RETIREMENTS
-    # note: offsets_hist used above is only for private holdings; already accounts for retirements
-    # therefore only retirements of allowances are calculated below; offsets not included
-    df = prmt.compliance_events.copy()
-    df = df.loc[df.index.get_level_values('vintage or type')!='offsets']
-    df = df.loc[df.index.get_level_values('compliance_date')<=yr_quart_period]
-    
-    for row in df.index:
-        # get vintage and quantity
-        vintage = row[1]
+    # only for allowances
+    # (offsets_hist above is only for private holdings; already accounts for retirements)
+    if retirements == True:
+        df = prmt.compliance_events.copy()
+        df = df.loc[df.index.get_level_values('vintage or type')!='offsets']
+        
+        # cumulative retirements for each vintage, as of each quarter
+        df = df.groupby(['compliance_date', 'vintage or type'])['quant'].sum().unstack('vintage or type')
+        df = df.reindex(df.index.union(quarters)).fillna(0.0).cumsum()
+        df = df.reindex(quarters).stack()
+        df.index.names = ['snap_q', 'vintage/type']
+        
+        # TEST: retired vintages should be in snaps
+        if prmt.run_tests == True:
+            missing = df.loc[(df > 0) & (~df.index.isin(CIR_snaps.index))]
+            if len(missing) > 0:
+                print(f"{prmt.test_failed_msg} Retirements for vintages not in snaps: {missing.index.tolist()}")
+        # END OF TEST
         
-        retired = df.at[row, 'quant']
+        retired = df.reindex(CIR_snaps.index).fillna(0.0)
         
-        # for specified vintage, transfer that quantity from gen_comp to retirement
-        CIR_snap.at[vintage, 'gen_comp'] = CIR_snap.at[vintage, 'gen_comp'] - retired
-        CIR_snap.at[vintage, 'retirement'] = CIR_snap.at[vintage, 'retirement'] + retired
+        # for each vintage, transfer that quantity from gen_comp to retirement
+        CIR_snaps['gen_comp'] = CIR_snaps['gen_comp'] - retired
+        CIR_snaps['retirement'] = CIR_snaps['retirement'] + retired
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
-    return(CIR_snap)
-# end of turn_snap_into_CIR_for_private_bank_metric
+    return(CIR_snaps)
+# end of turn_snaps_into_CIR
 
 
 # In[ ]:
 
 
-def turn_snap_into_CIR_for_private_bank_metric_projection(yr_quart_period, snaps_CAQC):
-    """
-    Takes model results and reformats for comparison against Compliance Instrument Report (CIR) for historical data.
-    
-    Date of snap, as labeled by regulators, saved as yr_quart_period; formatted as quarterly period.
-    
-    Note that snaps are actually taken early in the following quarter, e.g., 2014Q4 snap is taken in early 2015Q1.
+def reconcile_snaps_vs_CIR():
     """
+    Compares model against historical Compliance Instrument Reports (prmt.CIR_historical), 
+    for all quarters with a CIR, and all accounts & vintages, at once.
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
-    
-    # select particular quarter to convert to CIR
-    df = snaps_CAQC[snaps_CAQC.index.get_level_values('snap_q')==yr_quart_period]
+    Model values are snaps_CIR converted to CIR format by turn_snaps_into_CIR (with retirements for compliance events).
+    If any quarters weren't captured in snaps_CIR (because of prmt.snapshot_policy), model reruns (see get_snapshots).
     
-    # APCR: change vintage to 'APCR'
-    mask = df.index.get_level_values('inst_cat').str.contains('APCR') # also selects e.g., 'alloc_2016_APCR'
-    APCR = df.loc[mask]
-    mapping_dict = {'vintage': 'APCR'}
-    APCR = multiindex_change(APCR, mapping_dict)
+    Allowances only; offsets in model are taken from CIR, so comparison wouldn't tell us anything.
     
-    # recombine APCR & non-APCR
-    df = df.loc[~mask].append(APCR)
+    Returns residual table (also sets prmt.CIR_reconciliation), with index ['snap_q', 'vintage/type', 'CIR_column'],
+    for all cells that are non-zero in model or CIR; columns:
+    * 'model' & 'CIR': quantities (MMTCO2e)
+    * 'residual': model - CIR
+    * 'flag': True if abs(residual) is greater than tolerance 
+      (larger of prmt.CIR_reconciliation_tol_abs, and prmt.CIR_reconciliation_tol_rel times abs(CIR))
+    """
+    trace('start')
     
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # Early Action (aka Early Reduction): change vintage to be 'early_action'
-    mask = df.index.get_level_values('inst_cat')=='early_action'
-    early_action = df.loc[mask]
-    mapping_dict = {'vintage': 'early_action'}
-    early_action = multiindex_change(early_action, mapping_dict)
+    # CIR: allowances only (vintaged & non-vintage)
+    df = prmt.CIR_historical
+    descriptions = df.index.get_level_values('Description').astype(str)
+    mask = (descriptions == 'vintaged allowances') | (descriptions.str.startswith('Non-Vintage'))
+    df = df.loc[mask]
     
-    # recombine Early Action and non-Early Action
-    df = df.loc[~mask].append(early_action)
-
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # "non-vintage allowances" are only APCR: change vintage to be 'APCR'
-    mask = df.index.get_level_values('inst_cat')=='APCR'
-    APCR_allowances = df.loc[mask]
-    mapping_dict = {'vintage': 'APCR'}
-    APCR_allowances = multiindex_change(APCR_allowances, mapping_dict)
+    # map CIR columns to model's CIR format; columns not in mapping (e.g., Invalidation) are dropped
+    df = df.groupby(prmt.CIR_historical_col_map, axis=1).sum()
     
-    # recombine APCR allowances and non-APCR
-    df = df.loc[~mask].append(APCR_allowances)
-
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # combine alloc_hold, ann_alloc_hold, and auct_hold into one group ('A_I_A')
-    # ('A_I_A' is shorthand for column in Compliance Instrument Report "Auction + Issuance + Allocation")
-    # note: issuance account is only for offsets, which are not in snaps
-    mask = df.index.get_level_values('acct_name').isin(['alloc_hold', 'ann_alloc_hold', 'auct_hold'])
-    A_I_A = df.loc[mask]
-    mapping_dict = {'acct_name': 'A_I_A'}
-    A_I_A = multiindex_change(A_I_A, mapping_dict)
+    # vintages as str, to match model's CIR format (non-vintage are already 'APCR' & 'early_action')
+    vintages = df.index.get_level_values('Vintage').map(
+        lambda vintage: str(int(vintage)) if isinstance(vintage, (int, float, np.integer)) else str(vintage))
+    df.index = pd.MultiIndex.from_arrays([df.index.get_level_values('date'), vintages], 
+                                         names=['snap_q', 'vintage/type'])
+    CIR = df.groupby(level=['snap_q', 'vintage/type']).sum()
+    CIR = CIR.reindex(columns=prmt.CIR_columns)
     
-    # recombine A_I_A and rest
-    df = df.loc[~mask].append(A_I_A)
+    # model: snaps_CIR for all quarters with a CIR
+    quarters = CIR.index.get_level_values('snap_q').unique().tolist()
+    snaps_CIR = get_snapshots('CA', 'CIR', quarters) + get_snapshots('QC', 'CIR', quarters)
+    model = turn_snaps_into_CIR(snaps_CIR, offsets=False)
     
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # combine gen_acct & comp_acct, because we can't identify a priori reasons for moves
-    # can only recreate observed moves
-    # so it is useful to compare total of gen_acct + comp_acct in historical record vs. model
-    mask = df.index.get_level_values('acct_name').isin(['gen_acct', 'comp_acct'])
-    gen_comp = df.loc[mask]
-    mapping_dict = {'acct_name': 'gen_comp'}
-    gen_comp = multiindex_change(gen_comp, mapping_dict)
-    
-    # append gen_comp to the rest
-    df = df.loc[~mask].append(gen_comp)
-    
-    # groupby sum to combine all allowances of a particular vintage, or particular type of non-vintage (i.e., APCR)
-    df = df.groupby(['acct_name', 'vintage']).sum()
-    
-    # reshape
-    df = df.unstack(0)
-    df.columns = df.columns.droplevel(0)
+    # align all quarters, vintages & accounts; cells missing on one side are zero
+    df = pd.concat([model.stack().rename('model'), CIR.stack().rename('CIR')], axis=1, sort=True)
+    df = df.fillna(0.0)
+    df.index.names = ['snap_q', 'vintage/type', 'CIR_column']
+    df = df.loc[df.index.get_level_values('snap_q').isin(quarters)]
+    df = df.loc[(df['model'] != 0) | (df['CIR'] != 0)]
     
-    allowances_modeled = df
+    df['residual'] = df['model'] - df['CIR']
+    tolerance = np.maximum(prmt.CIR_reconciliation_tol_abs, prmt.CIR_reconciliation_tol_rel * df['CIR'].abs())
+    df['flag'] = df['residual'].abs() > tolerance
     
-    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-    # rename:
-    CIR_snap = allowances_modeled
-    
-    # calculate sums
-    CIR_snap['subtotal'] = CIR_snap.sum(axis=1)
+    logging.info(f"CIR reconciliation: {df['flag'].sum()} of {len(df)} values outside tolerance, "
+                 f"for {len(quarters)} quarters")
     
-    # make a copy (perhaps to avoid copy of a slice warning)
-    CIR_snap_allowances_before_retirements = CIR_snap.copy()
+    prmt.CIR_reconciliation = df
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
-    return(CIR_snap_allowances_before_retirements)
-# end of turn_snap_into_CIR_for_private_bank_metric_projection
+    return(df)
+# end of reconcile_snaps_vs_CIR
 
 
 # In[ ]:
@@ -9360,92 +10633,82 @@ def private_bank_annual_metric_paper_method():
     ("Tracking banking in the Western Climate Initiative cap-and-trade program")
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
-    # concat the snaps_CIR for each juris:
-    # scenario_CA.snaps_CIR and scenario_QC.snaps_CIR are lists of dfs;
-    # combine the two lists, then concat all dfs in the combined list.
-    # note: snaps have standard_MI index, and additional data column 'snap_q' (in addition to 'quant');
-    # snap_q gets moved into index in the groupby step below
-
-    df = pd.concat(scenario_CA.snaps_CIR + scenario_QC.snaps_CIR, sort=False)
-    mapping_dict = {'juris': 'CA-QC'}
-    df = multiindex_change(df, mapping_dict)
-    df = df.groupby(['snap_q'] + prmt.standard_MI_names).sum()
-    snaps_CIR_CAQC_grouped = df
-
-    supply_last_hist_yr_Q4 = str(prmt.supply_last_hist_yr)+'Q4'
+    # results for historical data are the same in every scenario, so are reused from historical_cache
+    cache = historical_cache()
+    
+    if 'private_bank_paper' not in cache:
+        # convert snaps_CIR for each juris into CIR format, for all quarters:
+        # scenario_CA.snaps_CIR and scenario_QC.snaps_CIR are lists of dfs; combine the two lists
+        CIR_snaps = turn_snaps_into_CIR(scenario_CA.snaps_CIR + scenario_QC.snaps_CIR)
 
-    Q4_historical_quarters = pd.date_range(
-        start=quarter_period('2013Q4').to_timestamp(),
-        end=quarter_period(supply_last_hist_yr_Q4).to_timestamp() + DateOffset(years=1), 
-        freq='A').to_period('Q')
+        supply_last_hist_yr_Q4 = str(prmt.supply_last_hist_yr)+'Q4'
 
-    private_bank_paper = pd.Series()
+        Q4_historical_quarters = pd.date_range(
+            start=quarter_period('2013Q4').to_timestamp(),
+            end=quarter_period(supply_last_hist_yr_Q4).to_timestamp() + DateOffset(years=1), 
+            freq='A').to_period('Q')
 
-    for quarter_year_period in Q4_historical_quarters:
+        private_bank_paper = pd.Series()
 
-        CIR_snap_q = turn_snap_into_CIR_for_private_bank_metric(quarter_year_period, snaps_CIR_CAQC_grouped)    
-        
-        if quarter_year_period.year == 2013:
-            # fill in rows for offsets & early_action
-            for column in CIR_snap_q.columns:
-                CIR_snap_q.at['offsets', column] = float(0)
-                CIR_snap_q.at['early_action', column] = float(0)
+        for quarter_year_period in Q4_historical_quarters:
 
-        else:
-            # df already has row for offsets
-            pass
+            # (for 2013, rows for offsets & early_action are zero)
+            CIR_snap_q = CIR_snaps.xs(quarter_year_period, level='snap_q')
 
-        priv_offsets = CIR_snap_q.at['offsets', 'gen_comp']
+            priv_offsets = CIR_snap_q.at['offsets', 'gen_comp']
         
-        # sum non-vintaged allowances
-        priv_nonvintage = sum([CIR_snap_q.at['APCR', 'gen_comp'], 
-                               CIR_snap_q.at['early_action', 'gen_comp']])
+            # sum non-vintaged allowances
+            priv_nonvintage = sum([CIR_snap_q.at['APCR', 'gen_comp'], 
+                                   CIR_snap_q.at['early_action', 'gen_comp']])
         
-        # sum vintaged allowances, of vintages <= year of metric
-        df = CIR_snap_q.drop(['offsets', 'APCR', 'early_action'])
-        df.index = df.index.astype(int)
-        ser = df['gen_comp'].loc[:quarter_year_period.year]
-        priv_vintaged = ser.sum()
+            # sum vintaged allowances, of vintages <= year of metric
+            df = CIR_snap_q.drop(['offsets', 'APCR', 'early_action'])
+            df.index = df.index.astype(int)
+            ser = df['gen_comp'].loc[:quarter_year_period.year]
+            priv_vintaged = ser.sum()
         
-        supply_toward_bank = sum([priv_vintaged, 
-                                  priv_nonvintage,
-                                  priv_offsets
-                                 ])
+            supply_toward_bank = sum([priv_vintaged, 
+                                      priv_nonvintage,
+                                      priv_offsets
+                                     ])
 
-        # fill in one year of obligations after end of historical data, based on user input
-        # latest year with full historical supply data is usually 1 year ahead of latest year with emissions data
-        # (full supply data known by following Jan., whereas covered emissions data not known until following Nov.)
-        total_obligations_toward_bank = prmt.emissions_and_obligations.loc[:quarter_year_period.year][
-            ['CA obligations', 'QC covered emissions']].sum(axis=1).sum()
-
-        if quarter_year_period.year == prmt.supply_last_hist_yr:
-            total_obligations_toward_bank += prmt.emissions_ann.loc[prmt.supply_last_hist_yr]
-        else:
-            # don't need to fill in banking metric for years that use historical emissions data
-            pass
+            # obligations from historical data
+            # (one year of obligations after end of historical data is from user input; filled in below)
+            total_obligations_toward_bank = prmt.emissions_and_obligations.loc[:quarter_year_period.year][
+                ['CA obligations', 'QC covered emissions']].sum(axis=1).sum()
         
-        # note: prmt.compliance_events is the actual quantities surrendered
-        mask = prmt.compliance_events.index.get_level_values('compliance_date').year <= quarter_year_period.year
-        fulfilled_toward_bank = prmt.compliance_events.loc[mask]['quant'].sum()
+            # note: prmt.compliance_events is the actual quantities surrendered
+            mask = prmt.compliance_events.index.get_level_values('compliance_date').year <= quarter_year_period.year
+            fulfilled_toward_bank = prmt.compliance_events.loc[mask]['quant'].sum()
 
-        # hard-coded: permanently_unfulfilled
-        permanently_unfulfilled_dict = {2014: 0.029906, # for Lake Shore Mojave, LLC 
-                                        2017: 3.767027, # for La Paloma bankruptcy
-                                       }
-        permanently_unfulfilled = pd.Series(permanently_unfulfilled_dict)
-        permanently_unfulfilled_toward_bank = permanently_unfulfilled.loc[:quarter_year_period.year].sum()
+            # hard-coded: permanently_unfulfilled
+            permanently_unfulfilled_dict = {2014: 0.029906, # for Lake Shore Mojave, LLC 
+                                            2017: 3.767027, # for La Paloma bankruptcy
+                                           }
+            permanently_unfulfilled = pd.Series(permanently_unfulfilled_dict)
+            permanently_unfulfilled_toward_bank = permanently_unfulfilled.loc[:quarter_year_period.year].sum()
 
-        outstanding_obligations = sum([total_obligations_toward_bank, 
-                                       -1 * fulfilled_toward_bank, 
-                                       -1 * permanently_unfulfilled_toward_bank])
+            outstanding_obligations = sum([total_obligations_toward_bank, 
+                                           -1 * fulfilled_toward_bank, 
+                                           -1 * permanently_unfulfilled_toward_bank])
 
-        private_bank_1y = supply_toward_bank - outstanding_obligations
+            private_bank_1y = supply_toward_bank - outstanding_obligations
+        
+            private_bank_paper.at[quarter_year_period.year] = private_bank_1y
         
-        private_bank_paper.at[quarter_year_period.year] = private_bank_1y
+        cache['private_bank_paper'] = private_bank_paper
+    
+    private_bank_paper = cache['private_bank_paper'].copy()
+    
+    # fill in one year of obligations after end of historical data, based on user input
+    # latest year with full historical supply data is usually 1 year ahead of latest year with emissions data
+    # (full supply data known by following Jan., whereas covered emissions data not known until following Nov.)
+    if prmt.supply_last_hist_yr in private_bank_paper.index:
+        private_bank_paper.at[prmt.supply_last_hist_yr] += -1 * prmt.emissions_ann.loc[prmt.supply_last_hist_yr]
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(private_bank_paper)
 # end of private_bank_annual_metric_paper_method
@@ -9454,21 +10717,16 @@ def private_bank_annual_metric_paper_method():
 # In[ ]:
 
 
-def calculate_government_holding_metric(snaps_end_Q4_CA_QC):
+def calculate_government_holding_metric():
     """
     Matches the method in the banking paper (Cullenward et al. 2019),
     
     Includes all allowances in government holding accounts, of vintages up to current year.
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
-    df = snaps_end_Q4_CA_QC.copy()
-    gov_hold_mask1 = df.index.get_level_values('acct_name').isin(['auct_hold', 'alloc_hold'])
-    gov_hold_mask2 = df.index.get_level_values('vintage') <= df['snap_yr']
-    gov_hold_mask = (gov_hold_mask1) & (gov_hold_mask2)
-    df = df.loc[gov_hold_mask]
-    df = df.groupby('snap_yr')['quant'].sum()
+    df = balance_cube_sum_by_year(['auct_hold', 'alloc_hold'], vintages='up_to_year')
     df.name = 'gov_holding_allow'
 
     # for gov_holding, also get offsets in government holding accounts at the end of each year
@@ -9486,7 +10744,7 @@ def calculate_government_holding_metric(snaps_end_Q4_CA_QC):
     
     # no return
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 # end of calculate_government_holding_metric
 
 
@@ -9506,7 +10764,7 @@ def compliance_period_metrics_historical():
     
     The function compliance_period_metrics_historical processes year > compliance_latest_year.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # initialization steps
     CP_metrics_hist = pd.DataFrame() # initialization
@@ -9526,156 +10784,156 @@ def compliance_period_metrics_historical():
         else:
             pass
     
-    # create snaps_CIR_CAQC_grouped, used to convert to CIR_snap_q 
-    df = pd.concat(scenario_CA.snaps_CIR + scenario_QC.snaps_CIR, sort=False)
-    mapping_dict = {'juris': 'CA-QC'}
-    df = multiindex_change(df, mapping_dict)
-    df = df.groupby(['snap_q'] + prmt.standard_MI_names).sum()
-    snaps_CIR_CAQC_grouped = df
-
-    # iterate for each historical compliance period
-    for quarter_year in Q3_before_final_compliance_events_historical:
+    # results for historical data are the same in every scenario, so are reused from historical_cache
+    # (except for adjustment for reserve sales, which depends on projection)
+    cache = historical_cache()
+    
+    if 'CP_metrics_hist' not in cache:
+        # convert snaps into CIR format, for all quarters
+        CIR_snaps = turn_snaps_into_CIR(scenario_CA.snaps_CIR + scenario_QC.snaps_CIR)
 
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # formatting steps
+        # iterate for each historical compliance period
+        for quarter_year in Q3_before_final_compliance_events_historical:
 
-        # convert to Period format
-        quarter_year_period = quarter_period(quarter_year)
+            # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+            # formatting steps
 
-        # convert snaps into CIR format
-        CIR_snap_q = turn_snap_into_CIR_for_private_bank_metric(quarter_year_period, snaps_CIR_CAQC_grouped)
+            # convert to Period format
+            quarter_year_period = quarter_period(quarter_year)
 
-        # for 2013, fill in rows for offsets & early_action
-        if quarter_year_period.year == 2013:
-            # fill in rows for offsets & early_action
-            for column in CIR_snap_q.columns:
-                CIR_snap_q.at['offsets', column] = float(0)
-                CIR_snap_q.at['early_action', column] = float(0)
-        else:
-            # df already has rows for offsets & early_action
-            pass
+            # select quarter from snaps in CIR format
+            # (for 2013, rows for offsets & early_action are zero)
+            CIR_snap_q = CIR_snaps.xs(quarter_year_period, level='snap_q')
 
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Private Allowances CP metric
+            # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+            # Private Allowances CP metric
 
-        # sum non-vintaged allowances
-        priv_nonvintage = sum([CIR_snap_q.at['APCR', 'gen_comp'], 
-                               CIR_snap_q.at['early_action', 'gen_comp']])
+            # sum non-vintaged allowances
+            priv_nonvintage = sum([CIR_snap_q.at['APCR', 'gen_comp'], 
+                                   CIR_snap_q.at['early_action', 'gen_comp']])
 
-        # sum vintaged allowances, up to vintage 1 less than year of final compliance event
-        ser = CIR_snap_q.drop(['offsets', 'APCR', 'early_action'], axis=0)
-        ser.index = ser.index.astype(int) 
-        ser = ser['gen_comp'].loc[:quarter_year_period.year-1]
-        priv_vintaged = ser.sum()
+            # sum vintaged allowances, up to vintage 1 less than year of final compliance event
+            ser = CIR_snap_q.drop(['offsets', 'APCR', 'early_action'], axis=0)
+            ser.index = ser.index.astype(int) 
+            ser = ser['gen_comp'].loc[:quarter_year_period.year-1]
+            priv_vintaged = ser.sum()
 
-        # Current and historical year allowances in private accounts, as of Q3 CIR 
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 37)
-        allow_curr = priv_vintaged + priv_nonvintage
+            # Current and historical year allowances in private accounts, as of Q3 CIR 
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 37)
+            allow_curr = priv_vintaged + priv_nonvintage
 
-        Q4_event = quarter_period(str(quarter_period(quarter_year).year)+'Q4')
+            Q4_event = quarter_period(str(quarter_period(quarter_year).year)+'Q4')
 
-        # calculate allowances surrendered in final compliance events
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 38)
-        event = events.loc[events.index.get_level_values('compliance_date')==Q4_event]
-        event_allow = event.loc[event.index.get_level_values('vintage or type')!='offsets']
-        event_allow_sum = event_allow['quant'].sum()
+            # calculate allowances surrendered in final compliance events
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 38)
+            event = events.loc[events.index.get_level_values('compliance_date')==Q4_event]
+            event_allow = event.loc[event.index.get_level_values('vintage or type')!='offsets']
+            event_allow_sum = event_allow['quant'].sum()
 
-        # calculate future vintage allowances surrendered in final compliance events
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 39)
-        mask1 = event_allow.index.get_level_values('vintage or type') != 'offsets'
-        mask2 = event_allow.index.get_level_values('vintage or type') != 'early_action'
-        mask3 = event_allow.index.get_level_values('vintage or type') != 'APCR'
-        mask = (mask1) & (mask2) & (mask3)
-        df2 = event_allow.loc[mask]
-        df2.index = df2.index.droplevel('compliance_date').astype(int)
-        event_allow_future = df2.loc[Q4_event.year:]
-        event_allow_future_sum = event_allow_future['quant'].sum()
+            # calculate future vintage allowances surrendered in final compliance events
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 39)
+            mask1 = event_allow.index.get_level_values('vintage or type') != 'offsets'
+            mask2 = event_allow.index.get_level_values('vintage or type') != 'early_action'
+            mask3 = event_allow.index.get_level_values('vintage or type') != 'APCR'
+            mask = (mask1) & (mask2) & (mask3)
+            df2 = event_allow.loc[mask]
+            df2.index = df2.index.droplevel('compliance_date').astype(int)
+            event_allow_future = df2.loc[Q4_event.year:]
+            event_allow_future_sum = event_allow_future['quant'].sum()
 
-        # Private Allowances CP metric
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 41)
-        private_allow = allow_curr - (event_allow_sum - event_allow_future_sum)
+            # Private Allowances CP metric
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 41)
+            private_allow = allow_curr - (event_allow_sum - event_allow_future_sum)
 
-        CP_metrics_hist.at[quarter_year_period.year, 'Private Allowances'] = private_allow
+            CP_metrics_hist.at[quarter_year_period.year, 'Private Allowances'] = private_allow
 
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Private Offsets CP metric
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 46)
+            # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+            # Private Offsets CP metric
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 46)
 
-        # Offsets in private accounts, as of Q3 CIR
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 44)
-        priv_offsets = CIR_snap_q.at['offsets', 'gen_comp']
+            # Offsets in private accounts, as of Q3 CIR
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 44)
+            priv_offsets = CIR_snap_q.at['offsets', 'gen_comp']
 
-        # calculate offsets surrendered in final compliance events
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 45)
-        event_offsets_sum = event.loc[event.index.get_level_values('vintage or type')=='offsets']['quant'].sum()
+            # calculate offsets surrendered in final compliance events
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 45)
+            event_offsets_sum = event.loc[event.index.get_level_values('vintage or type')=='offsets']['quant'].sum()
 
-        private_offsets = priv_offsets - event_offsets_sum
+            private_offsets = priv_offsets - event_offsets_sum
 
-        CP_metrics_hist.at[quarter_year_period.year, 'Private Offsets'] = private_offsets
+            CP_metrics_hist.at[quarter_year_period.year, 'Private Offsets'] = private_offsets
 
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Private Instruments CP metric
-        # (not included in banking paper)
+            # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+            # Private Instruments CP metric
+            # (not included in banking paper)
         
-        private_inst = private_allow + private_offsets
+            private_inst = private_allow + private_offsets
         
-        CP_metrics_hist.at[quarter_year_period.year, 'Private Instruments'] = private_inst
+            CP_metrics_hist.at[quarter_year_period.year, 'Private Instruments'] = private_inst
         
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Government Allowances CP metric
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 55)
-
-        # sum vintaged allowances, up to vintage 1 less than year of final compliance event
-        ser = CIR_snap_q.drop(['offsets', 'APCR', 'early_action'], axis=0)
-        ser.index = ser.index.astype(int) 
-        ser = ser['A_I_A'].loc[:quarter_year_period.year-1]
-        gov_vintaged = ser.sum()
+            # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+            # Government Allowances CP metric
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 55)
 
-        # exclude gov nonvintaged; nonvintaged are generally only temporarily held, prior to transferring elsewhere
+            # sum vintaged allowances, up to vintage 1 less than year of final compliance event
+            ser = CIR_snap_q.drop(['offsets', 'APCR', 'early_action'], axis=0)
+            ser.index = ser.index.astype(int) 
+            ser = ser['A_I_A'].loc[:quarter_year_period.year-1]
+            gov_vintaged = ser.sum()
 
-        CP_metrics_hist.at[quarter_year_period.year, 'Government Allowances'] = gov_vintaged
+            # exclude gov nonvintaged; nonvintaged are generally only temporarily held, prior to transferring elsewhere
 
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Government Offsets CP metric
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 58)
-        gov_offsets = CIR_snap_q.at['offsets', 'A_I_A']
+            CP_metrics_hist.at[quarter_year_period.year, 'Government Allowances'] = gov_vintaged
 
-        CP_metrics_hist.at[quarter_year_period.year, 'Government Offsets'] = gov_offsets
+            # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+            # Government Offsets CP metric
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 58)
+            gov_offsets = CIR_snap_q.at['offsets', 'A_I_A']
 
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Reserve Accounts CP metric
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 65)
+            CP_metrics_hist.at[quarter_year_period.year, 'Government Offsets'] = gov_offsets
 
-        # sum all instruments in APCR account
-        APCR_tot = CIR_snap_q['APCR_acct'].sum()
+            # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+            # Reserve Accounts CP metric
+            # (banking paper spreadsheet, sheet 'Metrics - CP', row 65)
 
-        APCR_tot_mod = APCR_tot # initialization; will be modified below
+            # sum all instruments in APCR account
+            APCR_tot = CIR_snap_q['APCR_acct'].sum()
 
-        # if prior to 2021, exclude APCR allowances from post-2020 budgets
+            APCR_tot_mod = APCR_tot # initialization; will be modified below
 
-        # for QC APCR:
-        if quarter_year_period > quarter_period('2018Q1') and quarter_year_period < quarter_period('2021Q1'):
-            # subtract QC APCR from budgets 2021-2030
-            QC_APCR_2021_2030 = prmt.QC_APCR_MI.loc[prmt.QC_APCR_MI.index.get_level_values('vintage')>2020]['quant'].sum()
-            APCR_tot_mod += -1 * QC_APCR_2021_2030
-        else:
-            pass
+            # if prior to 2021, exclude APCR allowances from post-2020 budgets
 
-        # adjustment for APCR allowances temporarily held in government holding accounts
-        if quarter_year_period == quarter_period('2018Q3'):
-            # In 2018Q3 CIR, there was an anomaly in which 47,454 QC APCR allowances were temporarily stored 
-            # in Gov Holding, on the way to being transferred to private accounts.
-            # In the banking paper, these are attributed to the Reserve Accounts CP metric.
-            APCR_tot_mod += 0.047454 # units MMTCO2e
+            # for QC APCR:
+            if quarter_year_period > quarter_period('2018Q1') and quarter_year_period < quarter_period('2021Q1'):
+                # subtract QC APCR from budgets 2021-2030
+                QC_APCR_2021_2030 = prmt.QC_APCR_MI.loc[prmt.QC_APCR_MI.index.get_level_values('vintage')>2020]['quant'].sum()
+                APCR_tot_mod += -1 * QC_APCR_2021_2030
+            else:
+                pass
 
+            # adjustment for APCR allowances temporarily held in government holding accounts
+            if quarter_year_period == quarter_period('2018Q3'):
+                # In 2018Q3 CIR, there was an anomaly in which 47,454 QC APCR allowances were temporarily stored 
+                # in Gov Holding, on the way to being transferred to private accounts.
+                # In the banking paper, these are attributed to the Reserve Accounts CP metric.
+                APCR_tot_mod += 0.047454 # units MMTCO2e
+        
+            # before adjustment for reserve sales (below)
+            CP_metrics_hist.at[quarter_year_period.year, 'Reserve Accounts'] = APCR_tot_mod
+        
+        cache['CP_metrics_hist'] = CP_metrics_hist
+    
+    CP_metrics_hist = cache['CP_metrics_hist'].copy()
+    
+    for year in CP_metrics_hist.index:
         # adjust reserve accounts for reserve sales
         # Reserve Accounts CP metric based on quantity in the account as of Q3,
         # in a year with a final compliance event (e.g., 2021).
         # If we assume that reserve sales occur in Q4 (reserve sales held at end of December),
         # to make up for any deficit in normal instrument supplies, 
         # then the CP metric would be affected only by reserve sales up to the prior year (e.g., 2020Q4).
-        reserve_sales_as_of_prior_yr = prmt.reserve_sales_excl_PCU.loc[quarter_year_period.year]
-        APCR_tot_mod = APCR_tot_mod - reserve_sales_as_of_prior_yr
+        reserve_sales_as_of_prior_yr = prmt.reserve_sales_excl_PCU.loc[year]
+        APCR_tot_mod = CP_metrics_hist.at[year, 'Reserve Accounts'] - reserve_sales_as_of_prior_yr
         
         if APCR_tot_mod < 0:
             PCU_sales_cumul = -1 * APCR_tot_mod
@@ -9687,14 +10945,14 @@ def compliance_period_metrics_historical():
         # CP metrics for PCU_sales_cumul and reserve_sales_as_of_prior_yr 
         # are not currently included in export_df
        
-        CP_metrics_hist.at[quarter_year_period.year, 'Reserve Accounts'] = APCR_tot_mod
+        CP_metrics_hist.at[year, 'Reserve Accounts'] = APCR_tot_mod
 
     CP_metrics_hist = CP_metrics_hist.T
 
     CP_metrics_hist = CP_metrics_hist.rename(columns={2015: '2013-2014', 
                                             2018: '2015-2017'})
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(CP_metrics_hist)
 # end of compliance_period_metrics_historical
@@ -9711,197 +10969,17 @@ def compliance_period_metrics_projection():
         
     This function processes year > compliance_latest_year.
     
-    The function compliance_period_metrics_historical processes year <= compliance_latest_year.    
+    The function compliance_period_metrics_historical processes year <= compliance_latest_year.
+    
+    Uses compliance_period_metrics_projection_batch, with the emissions projection of the current run.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
-    # initialization steps
-    CP_metrics_proj = pd.DataFrame() # initialization
-    events = prmt.compliance_events.copy() # historical only; used in later steps
-
-    # use prmt.compliance_events to determine what compliance events have occurred historically at time of model run
-    compliance_latest_year = prmt.compliance_events.index.get_level_values('compliance_date').unique().year.max()
-
-    # create lists of final compliance events 
-    # (the compliance events that, for CA, require satisfying all remaining obligations for a compliance period)
-    Q3_before_final_compliance_events_projection = [] # initialize as empty list
-
-    final_compliance_years = [2015, 2018, 2021, 2024, 2027, 2030]
-    for year in final_compliance_years:
-        if year > compliance_latest_year:
-            # add to list Q3_before_final_compliance_events_projection
-            Q3_before_final_compliance_events_projection += [str(year) + 'Q3']
-        else:
-            pass
+    CP_metrics_proj = compliance_period_metrics_projection_batch(
+        prmt.emissions_ann_CA.to_frame(), prmt.emissions_ann_QC.to_frame())
     
-    events_proj = pd.DataFrame() # initialize
-
-    # calculate compliance surrenders for projection
-    for year in range(2019, 2030+1):
-        if year > compliance_latest_year:
-            if year not in final_compliance_years:
-                # for CA, annual obligation due
-                CA_ann_surr = 0.3 * prmt.emissions_ann_CA.loc[year-1]
-                events_proj.at[str(year)+'Q4', 'CA'] = CA_ann_surr
-
-            else:
-                # for CA, remainder of obligation due
-                # for QC, total obligation due
-                CA_final_surr = sum([0.7 * prmt.emissions_ann_CA.loc[year-3], 
-                                     0.7 * prmt.emissions_ann_CA.loc[year-2], 
-                                     1.0 * prmt.emissions_ann_CA.loc[year-1]])
-                events_proj.at[str(year)+'Q4', 'CA'] = CA_final_surr
-
-                QC_final_surr = sum([prmt.emissions_ann_QC.loc[year-3], 
-                                     prmt.emissions_ann_QC.loc[year-2], 
-                                     prmt.emissions_ann_QC.loc[year-1]])
-                events_proj.at[str(year)+'Q4', 'QC'] = QC_final_surr
-    events_proj['CA-QC'] = events_proj.sum(axis=1)
-    
-    # set index to use Period format
-    events_proj.index = pd.to_datetime(events_proj.index).to_period('Q')
-
-    # ------------------    
-    # create snaps_CIR_CAQC_grouped
-    df = pd.concat(scenario_CA.snaps_CIR + scenario_QC.snaps_CIR, sort=False)
-    mapping_dict = {'juris': 'CA-QC'}
-    df = multiindex_change(df, mapping_dict)
-    df = df.groupby(['snap_q'] + prmt.standard_MI_names).sum()
-    snaps_CIR_CAQC_grouped = df
-
-    # iterate for each projection compliance period
-    for quarter_year in Q3_before_final_compliance_events_projection:
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # formatting steps
-
-        # convert to Period format
-        quarter_year_period = quarter_period(quarter_year)
-
-        # convert snaps into CIR format
-        CIR_snap_allowances_before_retirements = turn_snap_into_CIR_for_private_bank_metric_projection(
-            quarter_year_period, snaps_CIR_CAQC_grouped)
-
-        # for 2013, fill in rows for early_action
-        if quarter_year_period.year == 2013:
-            for column in CIR_snap_allowances_before_retirements.columns:
-                CIR_snap_allowances_before_retirements.at['early_action', column] = float(0)
-        else:
-            # df already has row for early_action
-            pass
-        
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # separate allowances into vintaged and non-vintaged
-
-        df = CIR_snap_allowances_before_retirements.copy()
-        df_vint = df.drop(['APCR', 'early_action'])
-        df_vint.index = df_vint.index.astype(int)
-            
-        df_vint_up_to_prev_yr = df_vint.loc[:quarter_year_period.year-1]
-        
-        df_non_vint = df.loc[df.index.isin(['APCR', 'early_action'])]
-        
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        
-        # PRIVATE INSTRUMENTS:
-        # total allowances in gen_comp, up to Q3 before compliance event of interest
-        # (factors in historical retirements)
-        
-        priv_allow_vint = df_vint_up_to_prev_yr['gen_comp'].sum()
-        
-        priv_allow_nonvint = df_non_vint['gen_comp'].sum()
-        
-        private_allow_before_retirements_sum = priv_allow_vint + priv_allow_nonvint
-        
-        # allowances retired in all historical compliance events
-        # (exclude offsets; remainder are allowances, vintaged and non-vintaged)
-        allow_retired_hist_sum = events.loc[
-            events.index.get_level_values('vintage or type')!='offsets']['quant'].sum()
-        
-        private_allow_after_hist_retire = private_allow_before_retirements_sum - allow_retired_hist_sum
-        
-        # total offsets in prmt.offsets_supply_q, up to Q3 before compliance event of interest
-        # (does not factor in historical retirements)
-        df = prmt.offsets_supply_q.copy()
-        df = df.loc[df.index <= quarter_year_period]
-        offsets_issued_sum = df.sum()
-        
-        # offsets surrendered in all historical compliance events
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 45)
-        offsets_retired_hist_sum = events.loc[
-            events.index.get_level_values('vintage or type')=='offsets']['quant'].sum()
-        
-        private_offsets_after_hist_retire = offsets_issued_sum - offsets_retired_hist_sum
-        
-        # combine allowances and offsets
-        private_inst_after_hist_retire = private_allow_after_hist_retire + private_offsets_after_hist_retire
-        
-        # calculate projected retirements (of allowances + offsets) through the final compliance event (Q4)
-        compliance_cut_off = quarter_period(pd.to_datetime(quarter_year) + DateOffset(months=3))
-        proj_retire = events_proj.loc[events_proj.index <= compliance_cut_off]['CA-QC']
-        proj_retire_sum = proj_retire.sum()
-        
-        private_inst_bank = private_inst_after_hist_retire - proj_retire_sum
-        
-        CP_metrics_proj.at[quarter_year_period.year, 'Private Bank'] = private_inst_bank
-        
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Government Allowances CP metric
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 55)
-        
-        # note: these should not change over time, because in the idealization of projections, 
-        # for scenarios in which all auctions sell out,
-        # then all later allowances that could count toward this CP metric are already allocated or sold at auction
-
-        # sum vintaged allowances, up to vintage 1 less than year of final compliance event
-        gov_vintaged = df_vint_up_to_prev_yr['A_I_A'].sum()
-
-        # exclude gov nonvintaged; nonvintaged are generally only temporarily held, prior to transferring elsewhere
-
-        CP_metrics_proj.at[quarter_year_period.year, 'Government Allowances'] = gov_vintaged
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Government Offsets CP metric
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 58)
-        
-        # assume it is zero for future years 
-        # (that is, offsets are not stored temporarily in government holding accounts)
-        gov_offsets = float(0)
-        
-        CP_metrics_proj.at[quarter_year_period.year, 'Government Offsets'] = gov_offsets
-
-        # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
-        # Reserve Accounts CP metric
-        # (banking paper spreadsheet, sheet 'Metrics - CP', row 65)
-
-        # sum all instruments in APCR account
-        APCR_tot = CIR_snap_allowances_before_retirements['APCR_acct'].sum()
-
-        APCR_tot_mod = APCR_tot # initialization; will be modified below
-
-        # adjust reserve accounts for reserve sales
-        # Reserve Accounts CP metric based on quantity in the account as of Q3,
-        # in a year with a final compliance event (e.g., 2021).
-        # If we assume that reserve sales occur in Q4 (reserve sales held at end of December),
-        # to make up for any deficit in normal instrument supplies, 
-        # then the CP metric would be affected only by reserve sales up to the prior year (e.g., 2020Q4).       
-        prior_yr = quarter_year_period.year - 1
-        reserve_sales_as_of_prior_yr = prmt.reserve_sales_excl_PCU.loc[prior_yr]
-        APCR_tot_mod = APCR_tot_mod - reserve_sales_as_of_prior_yr
-        
-        # if reserve sales (cumul.) exceed reserves, zero out reserves
-        # if reserve sales (cumul.) exceed reserves, create price ceiling unit sales
-        if APCR_tot_mod < 0:
-            PCU_sales_cumul = -1 * APCR_tot_mod
-            APCR_tot_mod = float(0)
-        else:
-            pass       
-            
-        # note: 
-        # CP metrics for PCU_sales_cumul and reserve_sales_as_of_prior_yr 
-        # are not currently included in export_df
-            
-        CP_metrics_proj.at[quarter_year_period.year, 'Reserve Accounts'] = APCR_tot_mod
+    # single emissions trajectory; use first (only) column of each metric
+    CP_metrics_proj = pd.DataFrame({metric: df.iloc[:, 0] for metric, df in CP_metrics_proj.items()})
 
     CP_metrics_proj = CP_metrics_proj.T
 
@@ -9910,12 +10988,202 @@ def compliance_period_metrics_projection():
                                                       2027: '2024-2026', 
                                                       2030: '2027-2029'})
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(CP_metrics_proj)
 # end of compliance_period_metrics_projection
 
 
+def compliance_surrenders_projection(emissions_ann_CA, emissions_ann_QC):
+    """
+    Calculates projected compliance surrenders for CA & QC, for years after the latest historical compliance event.
+    
+    Emissions are DataFrames indexed by year, with one column for each emissions trajectory (in a batch); 
+    emissions_ann_CA & emissions_ann_QC have the same trajectories, in the same order.
+    
+    Surrenders in Q4 of each year:
+    * CA: annual obligation due (30% of prior year emissions); 
+      in years with a final compliance event, remainder of obligation for the compliance period
+      (70% of emissions in the first two years, 100% of emissions in the last year)
+    * QC: only in years with a final compliance event, total obligation for the compliance period
+    
+    Returns dict with keys 'CA', 'QC', 'CA-QC'; each a DataFrame of surrenders, 
+    with index of quarters (Q4 of each year) and same columns as emissions_ann_CA.
+    """
+    compliance_latest_year = prmt.compliance_events.index.get_level_values('compliance_date').year.max()
+    
+    years = np.arange(max(2019, compliance_latest_year + 1), 2030+1)
+    final = np.isin(years, [2015, 2018, 2021, 2024, 2027, 2030])[:, np.newaxis]
+    
+    def lag(emissions, n):
+        # emissions n years before each year; array (years x trajectories)
+        return(emissions.reindex(years - n).values)
+    
+    CA_surr = np.where(final, 
+                       0.7 * lag(emissions_ann_CA, 3) + 0.7 * lag(emissions_ann_CA, 2) + 1.0 * lag(emissions_ann_CA, 1), 
+                       0.3 * lag(emissions_ann_CA, 1))
+    
+    QC_surr = np.where(final, 
+                       lag(emissions_ann_QC, 3) + lag(emissions_ann_QC, 2) + lag(emissions_ann_QC, 1), 
+                       0.0)
+    
+    index = pd.PeriodIndex([f"{year}Q4" for year in years], freq='Q')
+    
+    surrenders = {'CA': pd.DataFrame(CA_surr, index=index, columns=emissions_ann_CA.columns), 
+                  'QC': pd.DataFrame(QC_surr, index=index, columns=emissions_ann_CA.columns)}
+    surrenders['CA-QC'] = surrenders['CA'] + surrenders['QC']
+    
+    return(surrenders)
+# end of compliance_surrenders_projection
+
+
+def compliance_period_metrics_projection_batch(emissions_ann_CA, emissions_ann_QC, 
+                                               offsets_supply_q=None, reserve_sales_excl_PCU=None):
+    """
+    Calculates Compliance Period metrics for projection (see compliance_period_metrics_projection), 
+    for all compliance periods at once, and for a batch of emissions trajectories 
+    (DataFrames indexed by year, with one column for each trajectory; see compliance_surrenders_projection).
+    
+    Offset supply depends on emissions, so it's an input for each trajectory:
+    * offsets_supply_q: DataFrame indexed by quarter, with the same columns as emissions_ann_CA 
+      (such as offsets_supply_q returned by offsets_projection_batch); or Series, same for all trajectories; 
+      default prmt.offsets_supply_q (current model run)
+    * reserve_sales_excl_PCU: cumulative reserve sales, DataFrame indexed by year, with the same columns; 
+      or Series, same for all trajectories; default prmt.reserve_sales_excl_PCU (current model run)
+    
+    Snaps are from the current model run; compliance surrenders are calculated for each emissions trajectory.
+    
+    Returns dict of DataFrames (index: year of final compliance event; columns: trajectories), with keys:
+    'Private Bank', 'Government Allowances', 'Government Offsets', 'Reserve Accounts'.
+    """
+    trace('start')
+    
+    events = prmt.compliance_events # historical only
+    
+    # use prmt.compliance_events to determine what compliance events have occurred historically at time of model run
+    compliance_latest_year = events.index.get_level_values('compliance_date').year.max()
+    
+    # years of final compliance events in projection 
+    # (the compliance events that, for CA, require satisfying all remaining obligations for a compliance period)
+    CP_years = [year for year in [2015, 2018, 2021, 2024, 2027, 2030] if year > compliance_latest_year]
+    columns = emissions_ann_CA.columns
+    
+    if CP_years == []:
+        trace('end')
+        return({metric: pd.DataFrame(columns=columns) for metric in 
+                ['Private Bank', 'Government Allowances', 'Government Offsets', 'Reserve Accounts']})
+    
+    # inputs for each trajectory, as DataFrames with columns of emissions trajectories
+    def per_trajectory_input(obj):
+        if isinstance(obj, pd.Series):
+            return(pd.DataFrame(np.repeat(obj.values[:, np.newaxis], len(columns), axis=1), 
+                                index=obj.index, columns=columns))
+        else:
+            return(obj[columns])
+    
+    if offsets_supply_q is None:
+        offsets_supply_q = prmt.offsets_supply_q
+    offsets_supply_q = per_trajectory_input(offsets_supply_q)
+    
+    if reserve_sales_excl_PCU is None:
+        reserve_sales_excl_PCU = prmt.reserve_sales_excl_PCU
+    reserve_sales_excl_PCU = per_trajectory_input(reserve_sales_excl_PCU)
+    
+    # metrics use Q3 before each final compliance event
+    Q3_quarters = pd.PeriodIndex([f"{year}Q3" for year in CP_years], freq='Q')
+    Q4_quarters = pd.PeriodIndex([f"{year}Q4" for year in CP_years], freq='Q')
+    
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # convert snaps into CIR format (allowances only, before retirements), only for the Q3 quarters
+    snaps_CIR = [snap for snap in scenario_CA.snaps_CIR + scenario_QC.snaps_CIR 
+                 if len(snap) > 0 and snap['snap_q'].iat[0] in Q3_quarters]
+    df = turn_snaps_into_CIR(snaps_CIR, offsets=False, retirements=False).reset_index()
+    df['CP_year'] = pd.PeriodIndex(df['snap_q'].values, freq='Q').year
+    
+    # separate allowances into vintaged (up to vintage 1 less than year of final compliance event) & non-vintaged
+    vintage = pd.to_numeric(df['vintage/type'], errors='coerce')
+    vint_up_to_prev_yr = vintage <= df['CP_year'] - 1
+    non_vint = df['vintage/type'].isin(['APCR', 'early_action'])
+    
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # PRIVATE INSTRUMENTS:
+    # total allowances in gen_comp, up to Q3 before compliance event of interest
+    priv_allow = df.loc[vint_up_to_prev_yr | non_vint].groupby('CP_year')['gen_comp'].sum()
+    priv_allow = priv_allow.reindex(CP_years).fillna(0.0)
+    
+    # allowances & offsets retired in all historical compliance events
+    # (banking paper spreadsheet, sheet 'Metrics - CP', row 45, for offsets)
+    offsets_mask = events.index.get_level_values('vintage or type')=='offsets'
+    allow_retired_hist_sum = events.loc[~offsets_mask]['quant'].sum()
+    offsets_retired_hist_sum = events.loc[offsets_mask]['quant'].sum()
+    
+    # total offsets in offsets_supply_q, up to Q3 before compliance event of interest, for each trajectory
+    # (does not factor in historical retirements)
+    offsets_cumul = offsets_supply_q.sort_index().cumsum()
+    offsets_issued_sum = offsets_cumul.reindex(offsets_cumul.index.union(Q3_quarters)).ffill()
+    offsets_issued_sum = offsets_issued_sum.reindex(Q3_quarters).fillna(0.0).values # CP_years x trajectories
+    
+    private_inst_after_hist_retire = pd.DataFrame(
+        (priv_allow.values - allow_retired_hist_sum)[:, np.newaxis] + offsets_issued_sum - offsets_retired_hist_sum, 
+        index=CP_years, columns=columns)
+    
+    # projected retirements (of allowances + offsets) through the final compliance event (Q4), for each trajectory
+    surrenders = compliance_surrenders_projection(emissions_ann_CA, emissions_ann_QC)['CA-QC']
+    proj_retire_sum = surrenders.cumsum().reindex(Q4_quarters)
+    proj_retire_sum.index = CP_years
+    
+    private_inst_bank = private_inst_after_hist_retire - proj_retire_sum[columns]
+    
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # Government Allowances CP metric
+    # (banking paper spreadsheet, sheet 'Metrics - CP', row 55)
+    # sum vintaged allowances, up to vintage 1 less than year of final compliance event
+    # exclude gov nonvintaged; nonvintaged are generally only temporarily held, prior to transferring elsewhere
+    gov_vintaged = df.loc[vint_up_to_prev_yr].groupby('CP_year')['A_I_A'].sum()
+    gov_vintaged = gov_vintaged.reindex(CP_years).fillna(0.0)
+    
+    # Government Offsets CP metric
+    # (banking paper spreadsheet, sheet 'Metrics - CP', row 58)
+    # assume it is zero for future years (that is, offsets are not stored temporarily in government holding accounts)
+    gov_offsets = pd.Series(float(0), index=CP_years)
+    
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # Reserve Accounts CP metric
+    # (banking paper spreadsheet, sheet 'Metrics - CP', row 65)
+    # sum all instruments in APCR account
+    APCR_tot = df.groupby('CP_year')['APCR_acct'].sum()
+    APCR_tot = APCR_tot.reindex(CP_years).fillna(0.0)
+    
+    # adjust reserve accounts for reserve sales
+    # Reserve Accounts CP metric based on quantity in the account as of Q3,
+    # in a year with a final compliance event (e.g., 2021).
+    # If we assume that reserve sales occur in Q4 (reserve sales held at end of December),
+    # to make up for any deficit in normal instrument supplies, 
+    # then the CP metric would be affected only by reserve sales up to the prior year (e.g., 2020Q4).
+    reserve_sales_as_of_prior_yr = reserve_sales_excl_PCU.reindex(np.array(CP_years) - 1).values # CP_years x trajectories
+    
+    # if reserve sales (cumul.) exceed reserves, zero out reserves 
+    # (and the difference would be price ceiling unit sales; not currently included in export_df)
+    APCR_tot_mod = pd.DataFrame(APCR_tot.values[:, np.newaxis] - reserve_sales_as_of_prior_yr, 
+                                index=CP_years, columns=columns).clip(lower=0)
+    
+    # ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    # government metrics are the same for all trajectories
+    def per_trajectory(ser):
+        return(pd.DataFrame(np.repeat(ser.values[:, np.newaxis], len(columns), axis=1), 
+                            index=CP_years, columns=columns))
+    
+    CP_metrics_proj = {'Private Bank': private_inst_bank, 
+                       'Government Allowances': per_trajectory(gov_vintaged), 
+                       'Government Offsets': per_trajectory(gov_offsets), 
+                       'Reserve Accounts': APCR_tot_mod}
+    
+    trace('end')
+    
+    return(CP_metrics_proj)
+# end of compliance_period_metrics_projection_batch
+
+
 # In[ ]:
 
 
@@ -9928,7 +11196,7 @@ def compile_annual_metrics_for_export():
     
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # create empty DataFrame (which will be filled in with data by this function)
     empty_index = list(range(2013, 2030+1))
@@ -9987,7 +11255,7 @@ def compile_annual_metrics_for_export():
     # transpose df
     annual_metrics = annual_metrics.T
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(annual_metrics)
 # end of compile_annual_metrics_for_export
@@ -10004,7 +11272,7 @@ def compile_compliance_period_metrics_for_export():
     
     Runs within function create_export_df.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
 
     # historical
     CP_metrics_hist = compliance_period_metrics_historical()
@@ -10076,7 +11344,7 @@ def compile_compliance_period_metrics_for_export():
     df = df.reindex(['   ', 'Compliance Period banking metrics'])
     
     # put data from above into empty df
-    df = df.append(CP_metrics_all, sort=False)
+    df = pd.concat([df, CP_metrics_all], sort=False)
     
     # place each CP metric under the year in which the final compliance event occurred for that period
     # (e.g., final compliance event for CP2 (2015-2017) was Nov 1, 2018)
@@ -10091,7 +11359,7 @@ def compile_compliance_period_metrics_for_export():
     
     CP_metrics = df   
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     return(CP_metrics)
 # end of compile_compliance_period_metrics_for_export
 
@@ -10105,7 +11373,7 @@ def progress_bars_initialize_and_display():
     """
     Sets initial value of progress bars that show model processing quarters for CA & QC, then displays the bars.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # for CA, create progress bar using iPython widget IntProgress
     # at end of each quarter, value increases by 1
@@ -10125,7 +11393,7 @@ def progress_bars_initialize_and_display():
     
     # note: bars' values are updated at end of each step through loop
             
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 # end of progress_bars_initialize_and_display
 
 
@@ -10136,7 +11404,7 @@ def create_emissions_pct_sliders():
     """
     Create sliders that are used for user inputs of parameters for emissions projections.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # extract each juris as a Series
     CA_em_hist = prmt.emissions_and_obligations['CA covered emissions'].dropna()
@@ -10231,7 +11499,7 @@ def create_emissions_pct_sliders():
                                                 continuous_update=False, 
                                                 readout_format='.1%')
     # no return
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
 # end of create_emissions_pct_sliders
 
@@ -10243,7 +11511,7 @@ def parse_emissions_text(text_input):
     """
     If user inputs custom emissions pathway, this function parses the text pasted in.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # strip spaces from ends of text input:
     text_input = text_input.strip()
@@ -10345,7 +11613,7 @@ def parse_emissions_text(text_input):
         # override text_input value, for triggering default calculation in fn emissions_projection
         custom = 'missing_slash_t'
 
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(custom)
 # end of parse_emissions_text
@@ -10364,7 +11632,7 @@ def create_offsets_pct_sliders():
     In advanced settings, Period 1: 2019-2020; Period 2: 2021-2025; Period 3: 2026-2030
     
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # calculate first projection quarter for offsets
     offset_last_hist_q = prmt.CIR_historical.index.get_level_values('date').max().to_timestamp()
@@ -10467,7 +11735,7 @@ def create_offsets_pct_sliders():
         description=description_off3, readout_format='.1%', continuous_update=False)
     
     # no return
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 # end of create_offsets_pct_sliders
 
 
@@ -10479,8 +11747,10 @@ def create_figures():
     Creates the two figures shown in the user interface:
     * 'Emissions & instrument supplies (annual)'
     * 'Private Bank & Government Holdings (cumulative)'
+    
+    If prmt.ensemble_summary is set (see Ensemble_accum), the second figure also shows fan charts for the ensemble.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # ~~~~~~~~~~~~~~~~~~~~~
     
@@ -10544,16 +11814,26 @@ def create_figures():
     # set values of y_max & y_min:
     # create default values, and change if plotted values would go off the chart  
     
+    # if plotting fan charts for ensemble, use upper end of fans
+    gov_plus_private_max = prmt.gov_plus_private.max()
+    reserve_PCU_sales_cumul_max = prmt.reserve_PCU_sales_cumul.max()
+    if isinstance(prmt.ensemble_summary, dict):
+        if 'gov_plus_private' in prmt.ensemble_summary.keys():
+            gov_plus_private_max = max(gov_plus_private_max, prmt.ensemble_summary['gov_plus_private']['p95'].max())
+        if 'reserve_PCU_sales_cumul' in prmt.ensemble_summary.keys():
+            reserve_PCU_sales_cumul_max = max(reserve_PCU_sales_cumul_max, 
+                                              prmt.ensemble_summary['reserve_PCU_sales_cumul']['p95'].max())
+    
     # set y_max using gov_plus_private
-    if prmt.gov_plus_private.max() > 700:
-        y_max = (int(prmt.gov_plus_private.max() / 100) + 1) * 100
+    if gov_plus_private_max > 700:
+        y_max = (int(gov_plus_private_max / 100) + 1) * 100
     else:
         y_max = 700 # default    
     
     # set y_min using prmt.reserve_PCU_sales_cumul
     # note: prmt.reserve_PCU_sales_cumul.min() is positive
-    if prmt.reserve_PCU_sales_cumul.max() > 300:
-        y_min = -1*(int(prmt.reserve_PCU_sales_cumul.max() / 100) + 1) * 100
+    if reserve_PCU_sales_cumul_max > 300:
+        y_min = -1*(int(reserve_PCU_sales_cumul_max / 100) + 1) * 100
     else:
         y_min = -300 # default
         
@@ -10600,6 +11880,24 @@ def create_figures():
         color='tomato',
         line_width=1, line_color='dimgray'
     )
+    
+    # ~~~~~~~~~~~~
+    # fan charts for ensemble of runs, if any (prmt.ensemble_summary; see Ensemble_accum)
+    # bands for 5th-95th & 25th-75th percentiles, and line for median
+    if isinstance(prmt.ensemble_summary, dict):
+        fan_colors = {'gov_plus_private': 'SteelBlue', 'bank_cumul': 'Navy', 'reserve_PCU_sales_cumul': 'DarkRed'}
+        
+        for metric, df in prmt.ensemble_summary.items():
+            # reserve_PCU_sales_cumul plotted as negative values, as above
+            sign = -1 if metric == 'reserve_PCU_sales_cumul' else 1
+            color = fan_colors.get(metric, 'gray')
+            
+            for low, high in [('p05', 'p95'), ('p25', 'p75')]:
+                p2.patch(list(df.index) + list(df.index[::-1]), 
+                         list(sign * df[low]) + list(sign * df[high])[::-1], 
+                         color=color, alpha=0.2, line_width=0)
+            
+            p2.line(df.index, sign * df['p50'], color=color, line_width=2)
 
     # ~~~~~~~~~~~~
     # Annotations:
@@ -10675,7 +11973,7 @@ def create_figures():
                                 merge_tools=True,
                                )
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     # no returns; sets object attribute prmt.fig_em_bank
 # end of create_figures
 
@@ -10687,7 +11985,7 @@ def create_emissions_tabs():
     """
     Creates tabs for user interface for choosing type of input for emissions.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # create the widgets (as attributes of objects)
     create_emissions_pct_sliders()
@@ -10784,7 +12082,7 @@ def create_emissions_tabs():
     
     emissions_tabs = tab
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(emissions_tabs)
 # end of create_emissions_tabs
@@ -10797,7 +12095,7 @@ def create_auction_tabs():
     """
     Creates tabs for user interface for choosing type of input for auctions.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # create auction settings: simple
     
@@ -10850,7 +12148,7 @@ def create_auction_tabs():
     
     auction_tabs = tab
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(auction_tabs)
 # end of create_auction_tabs
@@ -10863,7 +12161,7 @@ def create_offsets_tabs():
     """
     Creates tabs for user interface for choosing type of input for offsets.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     # create the sliders (as attributes of objects)
     create_offsets_pct_sliders()
@@ -10930,7 +12228,7 @@ def create_offsets_tabs():
     
     offsets_tabs = tab
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(offsets_tabs) 
 # end of create_offsets_tabs
@@ -10947,7 +12245,7 @@ def compile_metadata_for_export():
     * warning messages
     
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     
     descrip_list = [] # initialize    
     metadata_list = [] # initialize
@@ -11088,9 +12386,9 @@ def compile_metadata_for_export():
     
     metadata_data = pd.DataFrame(metadata_list_of_tuples, columns=['year', 2013])
     metadata_data = metadata_data.set_index('year')
-    metadata_df = metadata_df.append(metadata_data)
+    metadata_df = pd.concat([metadata_df, metadata_data], sort=False)
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
     
     return(metadata_df)
 # end of compile_metadata_for_export
@@ -11109,7 +12407,7 @@ def create_export_df():
     * user settings that characterize the scenario
     """
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
        
     # ~~~~~~~~~~~~~~~~~~~~~~~~~~~
     # compile annual metrics 
@@ -11153,7 +12451,7 @@ def create_export_df():
            f'WCI-RULES_cap_and_trade_model_results_{prmt.save_timestamp}.csv')
 
     # no return
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
+    trace('end')
 # end of create_export_df
 
 
@@ -11166,10 +12464,13 @@ def supply_demand_button_on_click(b):
     
     The function is run (the button is "clicked") in initializing model, then runs again when user clicks button.
     """
+    # make sure the default run is done before starting a new run
+    finish_default_run()
+    
     # set new value of prmt.save_timestamp
     prmt.save_timestamp = time.strftime('%Y-%m-%d_%H%M%S', time.localtime())
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (start)")
+    trace('start')
     logging.info("***********************************************")
     logging.info("start of new model run, with user settings")
     logging.info(f"prmt.save_timestamp: {prmt.save_timestamp}")
@@ -11256,213 +12557,785 @@ def supply_demand_button_on_click(b):
     save_csv_button.style.button_color = 'PowderBlue'
     save_csv_button.disabled = False
     
-    # display buttons again
-    display(widgets.HBox([supply_demand_button, save_csv_button]))
+    # display buttons again
+    display(widgets.HBox([supply_demand_button, save_csv_button]))
+    
+    if prmt.error_msg_post_refresh != []:
+        for element in prmt.error_msg_post_refresh:
+            print(element) # for UI
+    
+    trace('end')
+# end of supply_demand_button_on_click
+
+
+# In[ ]:
+
+
+def save_csv_on_click(b):
+    """
+    Defines behavior when user clicks "Save results & settings (csv)" button.
+    """
+    trace('run')
+    
+    save_csv_button.style.button_color = '#A9A9A9'
+    save_csv_button.disabled = True
+
+    display(Javascript(prmt.js_download_of_csv))
+# end of save_csv_on_click
+
+
+# ## Functions: Default run artifact
+# * default_run_artifact_path
+# * save_default_run_artifact
+# * default_run_artifact_key
+#   * model_code_hash
+# * load_default_run_artifact
+
+# In[ ]:
+
+
+def default_run_artifact_path():
+    """
+    Path of the file with precomputed results for the default scenario, for the data input file version loaded.
+    
+    The file is saved in the folder 'data' next to the model code, so it's included with each data release.
+    """
+    
+    file_name = f"WCI-RULES_default_run_{prmt.data_input_file_version}.pkl"
+    
+    return(f"{model_data_dir()}/{file_name}")
+# end of default_run_artifact_path
+
+
+# In[ ]:
+
+
+def save_default_run_artifact():
+    """
+    Build step for a new data release: saves results of the default scenario to a file, 
+    which load_default_run_artifact can use on later startups instead of running the default scenario.
+    
+    Default scenario: all auctions after historical data sell out, emissions -2%/year, 
+    offsets at prmt.offset_rate_fract_of_limit_default of limits.
+    
+    Must run after the default run and before any run with user settings. 
+    (Set prmt.build_default_run_artifact = True to do this at the end of model import.)
+    
+    File contents:
+    * 'key': versions of model and inputs, used to check whether the file is stale
+    * 'snaps': default run snapshots (snaps_end & snaps_CIR for CA & QC), for all quarters
+    * 'results': prmt attributes set by supply_demand_calculations (annual metrics, export_df, and figure data)
+    """
+    
+    trace('start')
+    
+    # wait for default run, if still in progress
+    finish_default_run()
+    
+    # the default run only captures the snapshots that supply_demand_calculations uses (see snapshot_wanted);
+    # store all quarters in the artifact, so that later queries, diffs & reconciliation against the default run 
+    # don't each need a full rerun (see get_snapshots)
+    if prmt.snapshot_policy != {'end': 'all', 'CIR': 'all'}:
+        rerun_with_all_snapshots()
+    
+    artifact = {
+        'key': default_run_artifact_key(), 
+        'snaps': {attr: getattr(prmt, attr) for attr in prmt.default_run_artifact_snaps}, 
+        'results': {attr: getattr(prmt, attr) for attr in prmt.default_run_artifact_results}, 
+    }
+    
+    path = default_run_artifact_path()
+    with open(path, 'wb') as file:
+        pickle.dump(artifact, file, protocol=pickle.HIGHEST_PROTOCOL)
     
-    if prmt.error_msg_post_refresh != []:
-        for element in prmt.error_msg_post_refresh:
-            print(element) # for UI
+    logging.info(f"saved default run artifact to {path}")
     
-    logging.info(f"{inspect.currentframe().f_code.co_name} (end)")
-# end of supply_demand_button_on_click
+    trace('end')
+    
+    # no return
+# end of save_default_run_artifact
 
 
 # In[ ]:
 
 
-def save_csv_on_click(b):
+def default_run_artifact_key():
     """
-    Defines behavior when user clicks "Save results & settings (csv)" button.
+    Everything the default run depends on: 
+    model version, model code, data input file version, latest CIR included, content of input files, 
+    default offset rate, and settings that change what the run keeps (ledger compaction & snapshots).
+    
+    If any of these differ from what's in the artifact file, the file is stale.
+    
+    Content hashes (set by load_input_file_data & load_input_file_CIR) catch edits to the input files 
+    that don't change the version or the CIR sheet names; the model code hash (see model_code_hash) catches 
+    rule changes that don't bump prmt.model_version.
     """
-    logging.info(f"{inspect.currentframe().f_code.co_name}")
     
-    save_csv_button.style.button_color = '#A9A9A9'
-    save_csv_button.disabled = True
-
-    display(Javascript(prmt.js_download_of_csv))
-# end of save_csv_on_click
+    key = {
+        'model_version': prmt.model_version, 
+        'model_code_hash': model_code_hash(), 
+        'data_input_file_version': prmt.data_input_file_version, 
+        'CIR_sheet_name_first': prmt.CIR_excel.sheet_names[0], 
+        'input_file_hash': prmt.input_file_hash, 
+        'CIR_file_hash': prmt.CIR_file_hash, 
+        'offset_rate_fract_of_limit_default': prmt.offset_rate_fract_of_limit_default, 
+        'ledger_compaction': prmt.ledger_compaction, 
+        'ledger_compaction_min_ratio': prmt.ledger_compaction_min_ratio, 
+        'snapshot_outputs': sorted(prmt.snapshot_outputs), 
+    }
+    
+    return(key)
+# end of default_run_artifact_key
 
 
-# #### end of functions
+def model_code_hash():
+    """
+    Returns hash (sha256) of the model code.
+    
+    Run as a script or module, that's the source file; run as a notebook (which has no __file__), 
+    it's the source of all functions & classes defined in the notebook, in order of definition.
+    """
+    
+    try:
+        with open(os.path.abspath(__file__), 'rb') as f:
+            code_bytes = f.read()
+    except NameError:
+        # running as notebook, which has no __file__
+        code_sources = []
+        for obj in list(globals().values()):
+            if (inspect.isfunction(obj) or inspect.isclass(obj)) and obj.__module__ == __name__:
+                try:
+                    code_sources += [inspect.getsource(obj)]
+                except (OSError, TypeError):
+                    # source not available (e.g., defined in a cell no longer in history)
+                    pass
+        code_bytes = '\n'.join(code_sources).encode('utf-8')
+    
+    return(hashlib.sha256(code_bytes).hexdigest())
+# end of model_code_hash
 
-# # START OF MODEL RUN
 
 # In[ ]:
 
 
-logging.info("WCI-RULES model log")
-logging.info("***********************************************")
-logging.info("start of new model run, with default settings")
-logging.info(f"prmt.save_timestamp: {prmt.save_timestamp}")
-logging.info("***********************************************")
-
-# run functions to download files
-load_input_files()
+def load_default_run_artifact():
+    """
+    At startup, loads results of the default scenario saved by save_default_run_artifact, if available and not stale.
+    
+    If loaded, sets default run snapshots & results, and sets prmt.default_run_artifact_loaded to True; 
+    then run_default_auctions doesn't need to run auctions, and finish_default_run doesn't need to run 
+    supply_demand_calculations.
+    
+    If file is missing or stale, model falls back to calculating the default run.
+    """
+    
+    trace('start')
+    
+    prmt.default_run_artifact_loaded = False # initialize
+    
+    path = default_run_artifact_path()
+    
+    if os.path.isfile(path) == False:
+        logging.info(f"no default run artifact at {path}; will calculate default run")
+        return
+    
+    try:
+        with open(path, 'rb') as file:
+            artifact = pickle.load(file)
+    except Exception as e:
+        logging.info(f"could not read default run artifact at {path} ({e}); will calculate default run")
+        return
+    
+    if artifact['key'] != default_run_artifact_key():
+        logging.info(f"default run artifact is stale: {artifact['key']}; will calculate default run")
+        return
+    
+    for attr, value in artifact['snaps'].items():
+        setattr(prmt, attr, value)
+    for attr, value in artifact['results'].items():
+        setattr(prmt, attr, value)
+    
+    # set scenario attributes the same as after a default run
+    scenario_CA.snaps_end = prmt.CA_snaps_end_default_run_end
+    scenario_QC.snaps_end = prmt.QC_snaps_end_default_run_end
+    scenario_CA.snaps_CIR = prmt.CA_snaps_end_default_run_CIR
+    scenario_QC.snaps_CIR = prmt.QC_snaps_end_default_run_CIR
+    
+    prmt.saved_auction_run_default = True
+    prmt.default_run_artifact_loaded = True
+    
+    logging.info(f"loaded default run artifact from {path}")
+    
+    trace('end')
+    
+    # no return; sets prmt attributes
+# end of load_default_run_artifact
 
-# set CA_cap_data
-# retain this (rather than using read_excel repeatedly on this sheet) 
-# because with openpyxl, if the same sheet is read twice, it seems to set the data to be blank
-df = pd.read_excel(prmt.input_file, sheet_name='CA cap data')
 
-# drop all rows completely empty; empty rows may be caused by openpyxl
-df = df.dropna(how='all')
+# ## Functions: Prefetch of default run
+# * start_default_run_prefetch
+#   * run_default_auctions
+# * finish_default_run
+# * finish_default_run_async
 
-prmt.CA_cap_data = df
+# In[ ]:
 
-logging.info("read input sheet 'CA cap data'")
 
-# set CA_cap_adjustment_factor
-ser = prmt.CA_cap_data[prmt.CA_cap_data['name']=='CA_cap_adjustment_factor'].set_index('year')['data']
-prmt.CA_cap_adjustment_factor = ser
+def run_default_auctions():
+    """
+    Run hindcast from the start of the WCI system, with default settings (all auctions after historical data sell out).
+    
+    Then save the results as the default run, which later runs can reuse (see process_allowance_supply_CA_QC).
+    """
+    
+    trace('start')
+    
+    if prmt.saved_auction_run_default == False and prmt.use_default_run_artifact == True:
+        if prmt.build_default_run_artifact == False:
+            # if there's a precomputed default run for this data input file version, use it
+            # sets prmt.saved_auction_run_default to True if loaded
+            load_default_run_artifact()
+        else:
+            # building new artifact; calculate default run
+            pass
+    
+    if prmt.saved_auction_run_default == False:
+        # run hindcast from the start of the WCI system
+        all_accts_CA, all_accts_QC = process_allowance_supply_CA_QC()
 
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+        # after processing auctions, save the results for default run
+        # snaps_end:
+        prmt.CA_snaps_end_default_run_end = scenario_CA.snaps_end
+        prmt.QC_snaps_end_default_run_end = scenario_QC.snaps_end
 
-# set prmt.EIM_and_bankruptcy
-# added this (rather than using read_excel repeatedly on this sheet) 
-# because with openpyxl, if the same sheet is read twice, it seems to set the data to be blank
-df = pd.read_excel(prmt.input_file, sheet_name='EIM & bankruptcy')
+        # snaps_CIR:
+        prmt.CA_snaps_end_default_run_CIR = scenario_CA.snaps_CIR
+        prmt.QC_snaps_end_default_run_CIR = scenario_QC.snaps_CIR
 
-# drop all rows completely empty; empty rows may be caused by openpyxl
-df = df.dropna(how='all')
+        # since values saved above, set new value for prmt.saved_auction_run_default
+        prmt.saved_auction_run_default = True
+    else:
+        # will use saved run for default auction settings
+        pass
+    
+    trace('end')
+    
+    # no return; sets prmt default run attributes
+# end of run_default_auctions
 
-prmt.EIM_and_bankruptcy = df
 
-logging.info("read input sheet 'EIM & bankruptcy'")
+# In[ ]:
 
-# ~~~~~~~~~~~~~~~~~~~~~~~~~~~
-read_reserve_sales_historical() # sets prmt.reserve_PCU_sales_q_hist & prmt.reserve_sale_latest_date
 
+def start_default_run_prefetch():
+    """
+    Starts the default run (run_default_auctions) in the background, on prefetch_executor.
+    
+    The default run is queued after initialization (prmt.init_future), which runs on the same single-thread executor.
+    
+    Meanwhile, the interface widgets can be created in the main thread.
+    
+    Sets prmt.default_run_future, a concurrent.futures.Future; to wait for it, use finish_default_run, 
+    or in a notebook, await finish_default_run_async.
+    """
+    
+    trace('start')
+    
+    prmt.default_run_finished = False
+    prmt.default_run_future = prefetch_executor.submit(run_default_auctions)
+    
+    trace('end')
+    
+    # no return; sets prmt.default_run_future
+# end of start_default_run_prefetch
 
-# # Create scenarios
 
 # In[ ]:
 
 
-# update values in object prmt using functions
+def finish_default_run():
+    """
+    Waits for the default run started by start_default_run_prefetch, 
+    then does supply-demand calculations and creates figures for the default graph.
+    
+    Enables supply_demand_button & save_csv_button, which are disabled while the default run is in progress.
+    
+    Only does the calculations once; later calls return right away.
+    """
+    
+    if prmt.default_run_finished == True:
+        return
+    
+    trace('start')
+    
+    # re-raises any exception from the default run
+    prmt.default_run_future.result()
+    
+    # re-raises any exception from input validation, if in background, & shows its messages
+    finish_input_validation()
+    
+    # UI output for initialization & default run, which ran in the background (see on_main_thread)
+    progress_bar_loading.wid.value = progress_bar_loading.wid.max
+    
+    if prmt.default_run_artifact_loaded == False:
+        # prepare data for default graph
+        supply_demand_calculations()
+    else:
+        # data for default graph loaded from artifact (see load_default_run_artifact)
+        pass
+    
+    create_figures()
+    
+    prmt.default_run_finished = True
+    
+    # enable run button and change color
+    supply_demand_button.style.button_color = 'PowderBlue'
+    supply_demand_button.disabled = False
 
-progress_bar_loading.wid.value += 1
-# print("Initializing data... " , end='') # for UI
+    # enable save button and change color
+    save_csv_button.style.button_color = 'PowderBlue'
+    save_csv_button.disabled = False
+    
+    trace('end')
+    
+    # no return; sets prmt.fig_em_bank & prmt.export_df
+# end of finish_default_run
 
-initialize_CA_cap() # sets prmt.CA_cap
 
-initialize_CA_APCR() 
-# sets prmt.CA_APCR_2013_2020_MI, prmt.CA_APCR_2021_2030_Oct2017_MI, prmt.CA_APCR_2021_2030_Apr2019_add_MI
+# In[ ]:
 
-initialize_CA_advance() # sets prmt.CA_advance_MI
-initialize_VRE_account() # sets prmt.VRE_reserve_MI
 
-# get input: historical quarterly auction data
-get_qauct_hist()
+async def finish_default_run_async():
+    """
+    Version of finish_default_run for use in the notebook interface, which doesn't block the kernel.
+    
+    Widgets remain usable while the default run is in progress; the notebook shows the figure after this resolves.
+    """
+    
+    await asyncio.wrap_future(prmt.default_run_future)
+    
+    # default run is done; remaining steps run in the main thread
+    finish_default_run()
+    
+    # no return
+# end of finish_default_run_async
 
-# set object attribute prmt.supply_last_hist_yr (integer), based on prmt.qauct_hist
-prmt.supply_last_hist_yr = prmt.qauct_hist.loc[prmt.qauct_hist['date_level'].dt.quarter==4]['date_level'].max().year
 
-# set compliance_events; sets object attribute prmt.compliance_events
-get_compliance_events()
+# ## Functions: Step profiler
+# * profile_steps_start
+#   * profile_step_wrapper
+# * profile_steps_finish
+#   * write_step_profile_chrome_trace
 
-# ~~~~~~~~~~~~
-# sets object attributes prmt.CIR_historical & prmt.CIR_offsets_q_sums
-get_CIR_data_and_clean()
+# In[ ]:
 
-# get historical data for VRE; assume no more retirements
-# sets object attribute prmt.VRE_retired
-get_VRE_retired_from_CIR()
 
-# ~~~~~~~~~~~~
-# initialization of details for EIM Outstanding Emissions and bankruptcy retirements
-assign_EIM_outstanding() 
-# sets value prmt.EIM_outstanding; used for modifying consignment
-# must run before initialize_elec_alloc, because EIM outstanding values modify elec alloc
+# state of step profiler, while profiling is on (see profile_steps_start)
+profile_state = {'t0': 0, 'stack': [], 'records': [], 'tracemalloc_started': False}
 
-assign_bankruptcy_noncompliance() # sets value of prmt.bankruptcy_hist_proj
 
+def profile_steps_start():
+    """
+    Opt-in profiler for the quarterly simulation loop (prmt.profile_steps = True).
+    
+    Replaces each function named in prmt.profile_step_fns with a wrapped version (see profile_step_wrapper), 
+    which records wall time, ledger rows, and (if prmt.profile_allocations == True) memory allocations, 
+    for each call, along with the quarter and juris.
+    
+    Functions are wrapped only while profiling; when prmt.profile_steps == False, there is no overhead.
+    """
+    trace('start')
+    
+    profile_state['t0'] = time.perf_counter()
+    profile_state['stack'] = []
+    profile_state['records'] = []
+    
+    if prmt.profile_allocations == True and tracemalloc.is_tracing() == False:
+        tracemalloc.start()
+        profile_state['tracemalloc_started'] = True
+    
+    for fn_name in prmt.profile_step_fns:
+        fn = globals()[fn_name]
+        if hasattr(fn, '__wrapped__') == False:
+            globals()[fn_name] = profile_step_wrapper(fn)
+    
+    trace('end')
+# end of profile_steps_start
 
-# In[ ]:
 
+def profile_step_wrapper(fn):
+    """
+    Returns version of fn that records one profile record per call (in profile_state['records']).
+    
+    Record includes:
+    * step (fn name), quarter (cq.date), juris, depth (nesting of profiled steps)
+    * start & duration (wall time, in seconds), and self_time (duration excluding nested profiled steps)
+    * rows_in & rows_out: length of ledger (first df argument, and df returned)
+    * ledger_bytes: memory of df returned (only if prmt.memory_accounting == True)
+    * alloc_bytes: net memory allocated during call (only if prmt.profile_allocations == True)
+    """
+    @functools.wraps(fn)
+    def profiled_step(*args, **kwargs):
+        stack = profile_state['stack']
+        
+        # juris: from argument 'CA' or 'QC', if any; otherwise from fn name or from enclosing step
+        juris = [arg for arg in args if isinstance(arg, str) and arg in ['CA', 'QC']]
+        if juris != []:
+            juris = juris[0]
+        elif fn.__name__ in ['process_CA', 'process_CA_quarterly']:
+            juris = 'CA'
+        elif fn.__name__ in ['process_QC', 'process_QC_quarterly']:
+            juris = 'QC'
+        elif stack != []:
+            juris = stack[-1]['juris']
+        else:
+            juris = 'n/a'
+        
+        ledgers_in = [arg for arg in args if isinstance(arg, pd.DataFrame)]
+        
+        record = {'step': fn.__name__, 
+                  'quarter': str(cq.date), 
+                  'juris': juris, 
+                  'depth': len(stack), 
+                  'rows_in': len(ledgers_in[0]) if ledgers_in != [] else np.NaN, 
+                  'child_time': 0}
+        stack.append(record)
+        
+        if tracemalloc.is_tracing() == True:
+            mem_start = tracemalloc.get_traced_memory()[0]
+        start = time.perf_counter()
+        
+        try:
+            result = fn(*args, **kwargs)
+        finally:
+            end = time.perf_counter()
+            stack.pop()
+        
+        record['start'] = start - profile_state['t0']
+        record['duration'] = end - start
+        record['self_time'] = record['duration'] - record.pop('child_time')
+        if stack != []:
+            stack[-1]['child_time'] += record['duration']
+        
+        # process_QC returns tuple (scenario_QC, all_accts_QC); use last df returned
+        ledgers_out = [obj for obj in (result if isinstance(result, tuple) else (result,)) 
+                       if isinstance(obj, pd.DataFrame)]
+        record['rows_out'] = len(ledgers_out[-1]) if ledgers_out != [] else np.NaN
+        
+        # memory of ledger returned (see memory_bytes); only with memory accounting, since it's slower
+        if prmt.memory_accounting == True and ledgers_out != []:
+            record['ledger_bytes'] = memory_bytes(ledgers_out[-1])
+        else:
+            record['ledger_bytes'] = np.NaN
+        
+        if tracemalloc.is_tracing() == True:
+            record['alloc_bytes'] = tracemalloc.get_traced_memory()[0] - mem_start
+        else:
+            record['alloc_bytes'] = np.NaN
+        
+        profile_state['records'].append(record)
+        
+        return(result)
+    
+    return(profiled_step)
+# end of profile_step_wrapper
 
-# read CA data
-# initialization of allocations
-CA_alloc_data = read_CA_alloc_data()
-elec_alloc_IOU, elec_alloc_POU = initialize_elec_alloc()
-nat_gas_alloc = initialize_nat_gas_alloc(CA_alloc_data)
-industrial_etc_alloc = initialize_industrial_etc_alloc(CA_alloc_data)
 
-# ~~~~~~~~~~~~
-read_annual_auction_notices() # sets prmt.consign_ann_hist
+def profile_steps_finish():
+    """
+    Restores the original step functions, then creates the profile outputs:
+    * prmt.step_profile: df with one row per call of a profiled step
+    * prmt.step_profile_summary: df with totals per step & juris, sorted by self_time (largest first);
+      with memory accounting on, also memory for the juris's phase (process_CA or process_QC; see memory_phase_end)
+    * Chrome trace file (see write_step_profile_chrome_trace), with path prmt.step_profile_trace_path
+    """
+    trace('start')
+    
+    for fn_name in prmt.profile_step_fns:
+        fn = globals()[fn_name]
+        if hasattr(fn, '__wrapped__') == True:
+            globals()[fn_name] = fn.__wrapped__
+    
+    if profile_state['tracemalloc_started'] == True:
+        tracemalloc.stop()
+        profile_state['tracemalloc_started'] = False
+    
+    columns = ['step', 'juris', 'quarter', 'depth', 'start', 'duration', 'self_time', 
+               'rows_in', 'rows_out', 'ledger_bytes', 'alloc_bytes']
+    df = pd.DataFrame(profile_state['records'], columns=columns)
+    df = df.sort_values(by='start').reset_index(drop=True)
+    prmt.step_profile = df
+    
+    if len(df) == 0:
+        # no steps run (e.g., used saved default run)
+        trace('end')
+        return
+    
+    summary = df.groupby(['step', 'juris']).agg({'duration': ['count', 'sum', 'max'], 
+                                                 'self_time': 'sum', 
+                                                 'rows_out': 'max', 
+                                                 'ledger_bytes': 'max', 
+                                                 'alloc_bytes': 'sum'})
+    summary.columns = ['calls', 'duration_sum', 'duration_max', 'self_time_sum', 'rows_out_max', 'ledger_bytes_max', 
+                       'alloc_bytes_sum']
+    
+    # quarter in which each step took longest
+    summary['quarter_of_max'] = df.loc[df.groupby(['step', 'juris'])['duration'].idxmax()].set_index(
+        ['step', 'juris'])['quarter']
+    
+    # memory for each juris's phase (from prmt.memory_report), alongside ledger bytes per step
+    if prmt.memory_accounting == True:
+        for col in ['tracemalloc_peak', 'alloc_bytes', 'structures_total']:
+            phase_values = {juris: prmt.memory_report[f"process_{juris}"][col] 
+                            for juris in ['CA', 'QC'] if f"process_{juris}" in prmt.memory_report}
+            summary[f"phase_{col}"] = summary.index.get_level_values('juris').map(
+                lambda juris: phase_values.get(juris, np.NaN))
+    
+    prmt.step_profile_summary = summary.sort_values(by='self_time_sum', ascending=False)
+    
+    timestamp = time.strftime('%Y-%m-%d_%H%M%S', time.localtime())
+    prmt.step_profile_trace_path = f"{prmt.profile_dir}/WCI-RULES_step_profile_{timestamp}.json"
+    write_step_profile_chrome_trace(df, prmt.step_profile_trace_path)
+    
+    trace('end')
+    
+    # no return; sets prmt.step_profile, prmt.step_profile_summary, prmt.step_profile_trace_path
+# end of profile_steps_finish
 
-# initialization of consignment vs. non-consignment
-# run fn create_consign_historical_and_projection_annual
-consign_df = create_consign_historical_and_projection_annual(elec_alloc_IOU, elec_alloc_POU, nat_gas_alloc)
 
-# upsample consignment; sets object attribute prmt.consign_hist_proj_new_avail
-consign_upsample_historical_and_projection(consign_df['consign_ann'])
+def write_step_profile_chrome_trace(df, path):
+    """
+    Writes step profile in Chrome trace format (JSON), for viewing in chrome://tracing or Perfetto.
+    
+    Each call is a complete event ('ph': 'X'), with one row (tid) per juris; 
+    quarter, ledger rows, and allocations are in event args.
+    """
+    tid_map = {'CA': 1, 'QC': 2}
+    
+    events = []
+    for row in df.itertuples():
+        args = {'quarter': row.quarter, 'self_time_ms': round(row.self_time * 1e3, 3)}
+        for key in ['rows_in', 'rows_out', 'ledger_bytes', 'alloc_bytes']:
+            if pd.isnull(getattr(row, key)) == False:
+                args[key] = int(getattr(row, key))
+        
+        events += [{'name': row.step, 
+                    'cat': row.juris, 
+                    'ph': 'X', 
+                    'ts': round(row.start * 1e6, 1), # units microseconds
+                    'dur': round(row.duration * 1e6, 1), 
+                    'pid': 1, 
+                    'tid': tid_map.get(row.juris, 0), 
+                    'args': args}]
+    
+    try:
+        with open(path, 'w') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+        logging.info(f"saved step profile Chrome trace to {path}")
+    except OSError:
+        logging.info(f"could not save step profile Chrome trace to {path}")
+    
+    # no return
+# end of write_step_profile_chrome_trace
 
-# ~~~~~~~~~~~~
-# convert all allocations into MI (for all vintages) & put into one df; 
-# set as object attribute prmt.CA_alloc_MI_all
-CA_alloc_consign_dfs = [consign_df['consign_elec_IOU'], 
-                        consign_df['consign_elec_POU'], 
-                        consign_df['consign_nat_gas']]
-CA_alloc_dfs_not_consign = [industrial_etc_alloc, 
-                            consign_df['elec_POU_not_consign'], 
-                            consign_df['nat_gas_not_consign']]
-CA_alloc_dfs = CA_alloc_consign_dfs + CA_alloc_dfs_not_consign
-CA_alloc_MI_list = []
-for alloc in CA_alloc_dfs:
-    alloc_MI = convert_ser_to_df_MI_CA_alloc(alloc)
-    CA_alloc_MI_list += [alloc_MI]
-prmt.CA_alloc_MI_all = pd.concat(CA_alloc_MI_list)
 
+# ## Functions: Memory accounting
+# * memory_phase_start
+# * memory_phase_end
+#   * memory_bytes
+#   * memory_structure_sizes
 
 # In[ ]:
 
 
-# read QC data
-get_QC_inputs() # sets prmt.QC_cap, prmt.QC_advance, prmt.QC_APCR
+# state of memory accounting, for phase in progress (see memory_phase_start)
+memory_state = {'phase': '', 'tracemalloc_started': False}
+
 
-get_QC_allocation_data()
-# sets object attributes:
-# prmt.QC_alloc_hist, prmt.QC_alloc_initial, 
-# prmt.QC_alloc_trueups, prmt.QC_alloc_trueups_non_APCR, prmt.QC_alloc_trueups_neg, 
-# prmt.QC_alloc_full_proj
+def memory_phase_start(phase):
+    """
+    Opt-in memory accounting (prmt.memory_accounting = True); starts tracking allocations for a phase of the model run.
+    
+    Phases are: initialization, process_CA, process_QC, supply_demand_calculations.
+    
+    Uses tracemalloc; if it isn't already running (e.g., for the step profiler), it's started here and stopped 
+    at the end of the phase.
+    """
+    trace('start', phase=phase)
+    
+    if tracemalloc.is_tracing() == False:
+        tracemalloc.start()
+        memory_state['tracemalloc_started'] = True
+    elif hasattr(tracemalloc, 'reset_peak'):
+        # peak is then the peak during this phase
+        tracemalloc.reset_peak()
+    else:
+        # Python < 3.9: peak is since tracemalloc was started (e.g., by step profiler)
+        pass
+    
+    memory_state['phase'] = phase
+    memory_state['current_start'] = tracemalloc.get_traced_memory()[0]
+    
+    trace('end', phase=phase)
+# end of memory_phase_start
 
 
-# In[ ]:
+def memory_phase_end(phase, ledgers=None):
+    """
+    Records memory for phase in prmt.memory_report[phase], a dict with:
+    * tracemalloc_current & tracemalloc_peak: bytes allocated (by Python & numpy) at end of phase, and peak during phase
+    * alloc_bytes: net bytes allocated during phase
+    * structures: dict of bytes for each structure (see memory_structure_sizes)
+    * structures_total: sum of structures
+    
+    Arg ledgers is a dict of ledgers (such as all_accts_CA) that are local variables in the phase, keyed by name.
+    
+    If there was no matching memory_phase_start (e.g., memory accounting was switched on during the phase), 
+    nothing is recorded for the phase.
+    """
+    trace('start', phase=phase)
+    
+    if memory_state['phase'] != phase or 'current_start' not in memory_state:
+        logging.info(f"memory for phase {phase}: not recorded; phase wasn't started with memory accounting on")
+        # remove any record for phase from an earlier run, so it isn't mistaken for this run
+        prmt.memory_report.pop(phase, None)
+        trace('end', phase=phase)
+        return
+    
+    if ledgers is None:
+        ledgers = {}
+    
+    current, peak = tracemalloc.get_traced_memory()
+    
+    if memory_state['tracemalloc_started'] == True:
+        tracemalloc.stop()
+        memory_state['tracemalloc_started'] = False
+    
+    structures = memory_structure_sizes(ledgers)
+    
+    prmt.memory_report[phase] = {
+        'tracemalloc_current': current, 
+        'tracemalloc_peak': peak, 
+        'alloc_bytes': current - memory_state['current_start'], 
+        'structures': structures, 
+        'structures_total': sum(structures.values()), 
+    }
+    
+    logging.info(f"memory for phase {phase}: peak {peak/1e6:.1f} MB; "
+                 f"structures {sum(structures.values())/1e6:.1f} MB")
+    
+    memory_state['phase'] = ''
+    del memory_state['current_start']
+    
+    trace('end', phase=phase)
+    
+    # no return; sets prmt.memory_report[phase]
+# end of memory_phase_end
 
 
-read_emissions_historical_data() 
-# sets prmt.emissions_and_obligations, used in create_emissions_pct_sliders & emissions_projection
+def memory_bytes(obj):
+    """
+    Returns memory (bytes) of a DataFrame or Series (including index & contents of object columns), 
+    or of a list, tuple, or Chunk_accum of them; 0 for other objects.
+    """
+    if isinstance(obj, pd.DataFrame):
+        return(int(obj.memory_usage(index=True, deep=True).sum()))
+    elif isinstance(obj, pd.Series):
+        return(int(obj.memory_usage(index=True, deep=True)))
+    elif isinstance(obj, (list, tuple)):
+        return(sum([memory_bytes(item) for item in obj]))
+    elif isinstance(obj, Chunk_accum):
+        return(memory_bytes(obj.chunks))
+    else:
+        return(0)
+# end of memory_bytes
+
+
+def memory_structure_sizes(ledgers):
+    """
+    Returns dict of memory (bytes) of the model's large structures:
+    * ledgers (arg ledgers), such as all_accts_CA
+    * for scenario_CA & scenario_QC: snaps_end, snaps_CIR, avail_accum
+    * prmt frames (DataFrames & Series, and lists of them) of at least prmt.memory_min_bytes_to_report each; 
+      smaller ones are summed as 'prmt (other frames)'
+    
+    Objects referred to by more than one name (e.g., saved default run & scenario snaps_end) are counted once.
+    """
+    sizes = {}
+    counted = set()
+    
+    def add(name, obj):
+        if id(obj) in counted:
+            return
+        counted.add(id(obj))
+        size = memory_bytes(obj)
+        if size > 0:
+            sizes[name] = size
+    
+    for name, ledger in ledgers.items():
+        add(name, ledger)
+    
+    for juris, scenario in [('CA', scenario_CA), ('QC', scenario_QC)]:
+        add(f'scenario_{juris}.snaps_end', scenario.snaps_end)
+        add(f'scenario_{juris}.snaps_CIR', scenario.snaps_CIR)
+        add(f'scenario_{juris}.avail_accum', scenario.avail_accum)
+    
+    other = 0
+    for name, obj in vars(prmt).items():
+        if id(obj) in counted:
+            continue
+        size = memory_bytes(obj)
+        if size >= prmt.memory_min_bytes_to_report:
+            add(f'prmt.{name}', obj)
+        else:
+            counted.add(id(obj))
+            other += size
+    sizes['prmt (other frames)'] = other
+    
+    return(sizes)
+# end of memory_structure_sizes
 
 
-# In[ ]:
+# #### end of functions
 
+# # START OF MODEL RUN
+
+# In[ ]:
 
-# set latest year with auction data
-# get latest year in CA consignment data, CA allocation data, & QC allocation data
 
-# last year of CA alloc historical data
-CA_alloc_latest_yr = CA_alloc_data[CA_alloc_data['name'].str.contains('industrial')]['year'].max().astype(int)
+logging.info("WCI-RULES model log")
+logging.info("***********************************************")
+logging.info("start of new model run, with default settings")
+logging.info(f"prmt.save_timestamp: {prmt.save_timestamp}")
+logging.info("***********************************************")
 
-# last year of QC alloc historical data
-QC_alloc_hist_init = prmt.QC_alloc_hist[prmt.QC_alloc_hist.index.get_level_values('alloc_type')=='initial']
-QC_alloc_latest_yr = QC_alloc_hist_init.index.get_level_values('emission_year').max()
+# run initialization steps as a task graph; independent steps run at the same time
+# see create_init_task_graph for the prmt attributes that each step sets
+progress_bar_loading.wid.value += 1
+# print("Initializing data... " , end='') # for UI
 
-# set object attribute prmt.latest_hist_alloc_yr:
-prmt.latest_hist_alloc_yr = min(CA_alloc_latest_yr, QC_alloc_latest_yr)
+# to run with data input file & CIR in folder 'data' or another local folder (instead of online versions)
+if os.environ.get('WCI_RULES_DATA', '') != '':
+    use_bundled_data(os.environ['WCI_RULES_DATA'])
 
-# take minimum of latest year for that set of three
-# (if don't have all three, can't infer how to split up the auction data by jurisdiction and vintage)
-prmt.latest_hist_aauct_yr = min(prmt.consign_ann_hist.index.max(), CA_alloc_latest_yr, QC_alloc_latest_yr)
+# to record memory per phase from the start of initialization (see memory_phase_end)
+if os.environ.get('WCI_RULES_MEMORY_ACCOUNTING', '') != '':
+    prmt.memory_accounting = True
 
-# test data for internal consistency
-if prmt.run_tests == True:
-    test_consistency_inputs_CIR_vs_qauct(CA_alloc_latest_yr, QC_alloc_latest_yr)
-    test_consistency_inputs_annual_data(CA_alloc_latest_yr, QC_alloc_latest_yr)
-    test_consistency_CA_alloc(CA_alloc_data)
+# start initialization in background, so that objects below can be created at the same time
+# initialization and default run are queued on the same executor, so they run in sequence
+prefetch_executor = ThreadPoolExecutor(max_workers=1)
+init_tasks = create_init_task_graph()
+prmt.init_produced = {name: threading.Event() for task in init_tasks for name in task['produces']}
+prmt.init_future = prefetch_executor.submit(run_init_task_graph, init_tasks)
 
 
 # ## Create classes and objects
 # * Scenario_juris
+# * Chunk_accum
+# * Quantile_sketch
+# * Ensemble_accum
 # * Em_pct
 # * Em_text_input_CAQC
 # * Years_not_sold_out
@@ -11488,9 +13361,165 @@ class Scenario_juris:
         self.snaps_CIR = snaps_CIR # initialize as empty
         self.snaps_end = snaps_end # initialize as empty
 
+# ~~~~~~~~~~~
+class Chunk_accum:
+    """
+    Accumulates dfs (chunks) with the same columns, such as allowances available in each auction (avail_accum).
+    
+    Appending a chunk doesn't copy the chunks accumulated so far (unlike DataFrame.append, which is O(n) per append, 
+    so O(n^2) for the whole model run). Chunks are concatenated once, when the accumulated df is read (fn frame); 
+    the result is kept until the next append.
+    """
+    def __init__(self, empty):
+        self.empty = empty # df returned by fn frame if no chunks
+        self.chunks = []
+        
+    def append(self, chunk):
+        self.chunks += [chunk]
+        return(self)
+    
+    def frame(self):
+        if len(self.chunks) == 0:
+            return(self.empty.copy())
+        elif len(self.chunks) > 1:
+            # materialize once; keep as single chunk
+            self.chunks = [pd.concat(self.chunks, sort=False)]
+        return(self.chunks[0])
+    
+    def __len__(self):
+        return(sum([len(chunk) for chunk in self.chunks]))
+
+# ~~~~~~~~~~~
+class Quantile_sketch:
+    """
+    Streaming quantile sketch for many series at once (such as one series for each year), 
+    with memory bounded by about k values per level (compactor levels, as in KLL sketch).
+    
+    Values are added in batches: array (values x series). When a level has more than k values, 
+    each series is sorted, and every other value is promoted to the next level (with twice the weight). 
+    Rank error is about (number of levels) / k.
+    """
+    def __init__(self, n_series, k=200, seed=0):
+        self.n_series = n_series
+        self.k = k
+        self.levels = [] # arrays (values x series); values in level h have weight 2**h
+        self.random = np.random.RandomState(seed) # for choice of values promoted; fixed seed for repeatable results
+        
+    def update(self, values):
+        values = np.asarray(values, dtype=float).reshape(-1, self.n_series)
+        if len(self.levels) == 0:
+            self.levels = [values]
+        else:
+            self.levels[0] = np.concatenate([self.levels[0], values])
+        self.compress()
+        return(self)
+    
+    def compress(self):
+        h = 0
+        while h < len(self.levels):
+            if len(self.levels[h]) > self.k:
+                level = np.sort(self.levels[h], axis=0)
+                n_pairs = len(level) // 2
+                promoted = level[self.random.randint(2):2*n_pairs:2]
+                
+                # if odd number of values, the largest stays in this level
+                self.levels[h] = level[2*n_pairs:]
+                if h+1 == len(self.levels):
+                    self.levels += [promoted]
+                else:
+                    self.levels[h+1] = np.concatenate([self.levels[h+1], promoted])
+            h += 1
+    
+    def quantiles(self, qs):
+        # returns array (quantiles x series)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2**h) for h, level in enumerate(self.levels)])
+        
+        order = np.argsort(values, axis=0)
+        values_sorted = np.take_along_axis(values, order, axis=0)
+        weights_cumul = np.cumsum(weights[order], axis=0)
+        
+        result = []
+        for q in qs:
+            idx = np.minimum((weights_cumul < q * weights.sum()).sum(axis=0), len(values)-1)
+            result += [values_sorted[idx, np.arange(self.n_series)]]
+        return(np.array(result))
+
+# ~~~~~~~~~~~
+class Ensemble_accum:
+    """
+    Online summary of annual metrics over an ensemble of model runs (such as a Monte Carlo sweep), 
+    without holding all results: for each metric & year, count, mean & variance (Welford / Chan et al.), 
+    and quantiles (Quantile_sketch).
+    
+    Results are added as they arrive (fn add): Series indexed by year (one run), 
+    or DataFrame indexed by year with one column for each run (batch). Years are set by the first result added.
+    
+    fn add_run adds the metrics of the latest model run (prmt attributes). 
+    If prmt.ensemble_accum is set to an Ensemble_accum, supply_demand_calculations calls its add_run at the end 
+    of each run; otherwise callers feed it with add or add_run. (Set it after the default run, to leave that out.)
+    fn summary returns fan-chart-ready DataFrames; set prmt.ensemble_summary to this for create_figures to plot.
+    """
+    def __init__(self, metrics=('bank_cumul', 'reserve_PCU_sales_cumul', 'gov_plus_private'), k=200):
+        self.metrics = tuple(metrics)
+        self.k = k
+        self.years = None
+        self.count = 0
+        self.mean = {}
+        self.M2 = {}
+        self.sketch = {}
+    
+    def add(self, results):
+        # results: dict with keys in self.metrics
+        for metric in self.metrics:
+            df = results[metric]
+            if isinstance(df, pd.Series):
+                df = df.to_frame()
+            
+            if self.years is None:
+                self.years = df.index
+            if metric not in self.mean.keys():
+                self.mean[metric] = np.zeros(len(self.years))
+                self.M2[metric] = np.zeros(len(self.years))
+                self.sketch[metric] = Quantile_sketch(len(self.years), k=self.k)
+            
+            values = df.reindex(self.years).fillna(0).values.T # runs x years
+            
+            # merge mean & M2 of batch with accumulated (parallel algorithm of Chan et al.)
+            n_batch = len(values)
+            n_total = self.count + n_batch
+            mean_batch = values.mean(axis=0)
+            delta = mean_batch - self.mean[metric]
+            self.mean[metric] = self.mean[metric] + delta * n_batch / n_total
+            self.M2[metric] = (self.M2[metric] + ((values - mean_batch)**2).sum(axis=0) 
+                               + delta**2 * self.count * n_batch / n_total)
+            
+            self.sketch[metric].update(values)
+        
+        self.count += n_batch
+        return(self)
+    
+    def add_run(self):
+        # metrics from latest model run (set by supply_demand_calculations)
+        return(self.add({metric: getattr(prmt, metric) for metric in self.metrics}))
+    
+    def summary(self, quantiles=(0.05, 0.25, 0.5, 0.75, 0.95)):
+        # returns dict of DataFrames for each metric, indexed by year, 
+        # with columns count, mean, std, and quantiles (p05, p25, p50, etc.)
+        summaries = {}
+        for metric in self.metrics:
+            df = pd.DataFrame(index=self.years)
+            df['count'] = self.count
+            df['mean'] = self.mean[metric]
+            df['std'] = np.sqrt(self.M2[metric] / max(self.count - 1, 1))
+            for q, values in zip(quantiles, self.sketch[metric].quantiles(quantiles)):
+                df[f'p{int(round(q*100)):02d}'] = values
+            summaries[metric] = df
+        return(summaries)
+
 # make an instance of Scenario for CA hindcast starting in 2012Q4
 scenario_CA = Scenario_juris(
-    avail_accum=prmt.standard_MI_empty.copy(),
+    avail_accum=Chunk_accum(prmt.standard_MI_empty),
     snaps_CIR=[],
     snaps_end=[],
 )
@@ -11498,7 +13527,7 @@ logging.info("created object scenario_CA")
 
 # make an instance of Scenario for QC hindcast starting in 2013Q4
 scenario_QC = Scenario_juris(
-    avail_accum=prmt.standard_MI_empty.copy(),
+    avail_accum=Chunk_accum(prmt.standard_MI_empty),
     snaps_CIR=[],
     snaps_end=[],
 )
@@ -11606,24 +13635,11 @@ progress_bar_QC = Progress_bar_auction.create_progress_bar(
 # In[ ]:
 
 
-if prmt.saved_auction_run_default == False:
-    # run hindcast from the start of the WCI system
-    all_accts_CA, all_accts_QC = process_allowance_supply_CA_QC()
-    
-    # after processing auctions, save the results for default run
-    # snaps_end:
-    prmt.CA_snaps_end_default_run_end = scenario_CA.snaps_end
-    prmt.QC_snaps_end_default_run_end = scenario_QC.snaps_end
-    
-    # snaps_CIR:
-    prmt.CA_snaps_end_default_run_CIR = scenario_CA.snaps_CIR
-    prmt.QC_snaps_end_default_run_CIR = scenario_QC.snaps_CIR
+# start default run in background (after initialization); sets prmt.default_run_future
+start_default_run_prefetch()
 
-    # since values saved above, set new value for prmt.saved_auction_run_default
-    prmt.saved_auction_run_default = True
-else:
-    # will use saved run for default auction settings
-    pass
+# widgets below are created while initialization continues; 
+# each waits only for the initialization steps whose results it uses (see wait_for_init)
 
 
 # In[ ]:
@@ -11633,6 +13649,8 @@ figure_explainer_text = "<p>Above, the figure on the left shows covered emission
 # changed text to "Above" when moving the accordion to below the figure
 # ~~~~~~~~~~~~~~~~~~
 
+wait_for_init(['emissions_and_obligations', 'CIR_historical'])
+
 latest_emissions_data_year = prmt.emissions_and_obligations.dropna(how='all').index.max()
 
 em_explainer_text = f"<p>The WCI cap-and-trade program covers emissions from electricity suppliers, large industrial facilities, and natural gas and transportation fuel distributors.</p><br><p>By default, the model uses a projection in which covered emissions decrease 2% per year, starting from emissions in {latest_emissions_data_year} (the latest year with official reporting data). Users can specify higher or lower emissions scenarios using the available settings.</p><br><p>A 2% rate of decline follows ARB's 2017 Scoping Plan scenario for California emissions, which includes the effects of prescriptive policy measures (e.g., the Renewables Portfolio Standard for electricity), but does not incorporate effects of the cap-and-trade program.</p><br><p>Note that PATHWAYS, the model ARB used to generate the Scoping Plan scenario, does not directly project covered emissions in California. Instead, the PATHWAYS model tracks emissions from four economic sectors called “covered sectors,” which together constitute about ~10% more emissions than the “covered emissions” that are actually subject to the cap-and-trade program in California. For more information, see Near Zero's May 2018 <a href='http://www.nearzero.org/wp/2018/05/07/ready-fire-aim-arbs-overallocation-report-misses-its-target/' target='_blank'>report on this discrepancy</a href>. Users can define their own emission projections to explore any scenario they like, as the model makes no assumptions about future emissions aside from what the user provides.</p>"
@@ -11673,11 +13691,14 @@ figure_explainer_accord.selected_index = None
 
 # create tabs for emissions, auction, offsets
 emissions_tabs = create_emissions_tabs()
+
+wait_for_init(['latest_hist_qauct_date'])
 auction_tabs = create_auction_tabs()
+
+wait_for_init(['CIR_offsets_q_sums'])
 offsets_tabs = create_offsets_tabs()
 
-# prepare data for default graph
-supply_demand_calculations()
+# data for default graph prepared in finish_default_run (below), after default run is done
 
 
 # In[ ]:
@@ -11733,13 +13754,32 @@ offsets_title = widgets.HTML(value="<h4>Supply projection: offsets sales</h4>")
 offsets_tabs_explainer_title = widgets.VBox([offsets_title, offsets_tabs_explainer])
 
 
+# In[ ]:
+
+
+# wait for rest of initialization
+init_results = prmt.init_future.result()
+
+# results used below in tests
+CA_alloc_data = init_results['CA_alloc_data']
+CA_alloc_latest_yr = init_results['CA_alloc_latest_yr']
+QC_alloc_latest_yr = init_results['QC_alloc_latest_yr']
+
+# test data for internal consistency; skipped if inputs unchanged since last validation
+if prmt.run_tests == True:
+    if prmt.input_validation_in_background == True:
+        validation_executor = ThreadPoolExecutor(max_workers=1)
+        prmt.input_validation_future = validation_executor.submit(
+            run_input_validation, CA_alloc_latest_yr, QC_alloc_latest_yr, CA_alloc_data)
+    else:
+        run_input_validation(CA_alloc_latest_yr, QC_alloc_latest_yr, CA_alloc_data)
+
+
 # #### create figures & display them
 
 # In[ ]:
 
 
-create_figures()
-
 # create_button_supply_demand()
 # create supply-demand button (but don't show it until display step below)
 supply_demand_button = widgets.Button(description="Run supply-demand calculations", 
@@ -11758,6 +13798,29 @@ save_csv_button.style.button_color = 'PowderBlue' # '#A9A9A9'
 
 save_csv_button.on_click(save_csv_on_click)
 
+# ~~~~~~~~~~~~~
+if prmt.prefetch_default_run == True:
+    # disable buttons until default run is done; they're enabled by finish_default_run
+    # (notebook awaits finish_default_run_async, then shows figure)
+    supply_demand_button.style.button_color = '#A9A9A9'
+    supply_demand_button.disabled = True
+    save_csv_button.style.button_color = '#A9A9A9'
+    save_csv_button.disabled = True
+else:
+    # wait for default run, then do supply-demand calculations & create figures
+    finish_default_run()
+
+# build step for a new data release
+if prmt.build_default_run_artifact == True:
+    save_default_run_artifact()
+    
+    # check model against CIRs in new data (after saving artifact, as this may rerun default run with all snaps_CIR)
+    CIR_reconciliation = reconcile_snaps_vs_CIR()
+    CIR_reconciliation_flagged = CIR_reconciliation.loc[CIR_reconciliation['flag']]
+    print(f"CIR reconciliation: {len(CIR_reconciliation_flagged)} values outside tolerance")
+    if len(CIR_reconciliation_flagged) > 0:
+        print(CIR_reconciliation_flagged.groupby(level='CIR_column')['residual'].describe().to_string())
+
 
 # In[ ]:
 
@@ -11765,6 +13828,9 @@ save_csv_button.on_click(save_csv_on_click)
 if __name__ == '__main__': 
     # show content that is cleared when user chooses to re-run the model 
     
+    # wait for default run, if still in progress
+    finish_default_run()
+    
     # show figures
     show(prmt.fig_em_bank)
     
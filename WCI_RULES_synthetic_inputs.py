@@ -0,0 +1,360 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+# # WCI-RULES model: synthetic input files
+#
+# Creates a data input file & CIR with the same structure as the real ones, but with a different problem size,
+# for scaling benchmarks (see WCI_RULES_benchmarks.py, option --data-dir).
+#
+# Starts from real input files (the current online versions, or local copies), then:
+# * extends the horizon to end_year (e.g., 2050), for all series in the input file that run through 2030:
+#   * caps (CA_cap, QC_cap): after the last year in the input file, continue the average annual decline of
+#     the last ten years, as an approximation of the equation for the post-2031 cap (§ 95841; see initialize_CA_cap)
+#   * fractions & factors (e.g., CA_cap_adjustment_factor, QC_advance_fraction): hold at last value
+#   * other quantities (e.g., APCR, allocations): scale last value by the jurisdiction's cap in each year
+#   * vintages follow the horizon, since the model creates one vintage of allowances for each year of cap
+# * shortens the auction history to end in last_hist_quarter (e.g., 2016Q4), by dropping later historical data
+#   and later CIR sheets, so that more quarters are projected rather than read from history
+#
+# Limit: the model's horizon is fixed at 2030 (prmt.model_end_date, and 2030 limits in many initialization steps,
+# e.g. initialize_CA_cap), so data after 2030 would be ignored and a 2050 input set would run exactly like 2030.
+# So --end-year beyond MODEL_END_YEAR is rejected; for now, problem size can only be varied with --last-hist-quarter.
+# Extending the horizon (extend_horizon) is kept for when the model's end year becomes a setting;
+# then raise MODEL_END_YEAR to match.
+#
+# Output is saved in out_dir, with file names used by WCI_RULES_model.use_bundled_data:
+# * data_input_file.xlsx
+# * CIR_file.xlsx
+#
+# Usage:
+# * python WCI_RULES_synthetic_inputs.py --last-hist-quarter 2016Q4 --out-dir data/synthetic_hist_2016Q4
+# * python WCI_RULES_synthetic_inputs.py --end-year 2050 --out-dir data/synthetic_2050
+#   (only once the model supports a horizon to 2050; see MODEL_END_YEAR)
+
+# In[ ]:
+
+
+import os
+import io
+import argparse
+import urllib.request
+
+import pandas as pd
+import numpy as np
+
+ONLINE_FILE_HOSTING = 'https://storage.googleapis.com/wci_model_online_file_hosting'
+INPUT_FILE_NAME = 'WCI-RULES_data_input_file.xlsx'
+CIR_FILE_NAME = 'Compliance_Instrument_Report.xlsx'
+
+# last year of series in the real input files; series that end in or after this year are extended
+REAL_END_YEAR = 2030
+
+# last year the model projects (prmt.model_end_date); later years in input files are ignored by the model
+MODEL_END_YEAR = 2030
+
+
+# ## Functions: Read & write workbooks
+# * read_workbook
+# * write_workbook
+
+# In[ ]:
+
+
+def read_workbook(file_location, header=0):
+    """
+    Reads all sheets of an Excel file (from URL or local path) into a dict of dfs, in sheet order.
+    """
+    if file_location.startswith('http'):
+        with urllib.request.urlopen(file_location) as response:
+            file_bytes = response.read()
+    else:
+        with open(file_location, 'rb') as f:
+            file_bytes = f.read()
+
+    sheets = pd.read_excel(io.BytesIO(file_bytes), sheet_name=None, header=header)
+
+    return(sheets)
+# end of read_workbook
+
+
+def write_workbook(sheets, path, header=True):
+    """
+    Writes dict of dfs to an Excel file, one sheet per df, in dict order.
+    """
+    with pd.ExcelWriter(path, engine='openpyxl') as writer:
+        for sheet_name, df in sheets.items():
+            df.to_excel(writer, sheet_name=sheet_name, index=False, header=header)
+# end of write_workbook
+
+
+# ## Functions: Extend horizon
+# * extend_horizon
+#   * get_caps
+#   * extend_cap
+#   * extend_long_format_sheet
+#   * extend_elec_alloc_sheet
+#   * extend_year_rows
+
+# In[ ]:
+
+
+def get_caps(sheets):
+    """
+    Returns dict {juris: Series of cap by year}, from sheets 'CA cap data' & 'QC cap data'.
+    """
+    caps = {}
+    for juris in ['CA', 'QC']:
+        df = sheets[f'{juris} cap data'].dropna(how='all')
+        caps[juris] = df[df['name']==f'{juris}_cap'].set_index('year')['data'].astype(float)
+
+    return(caps)
+# end of get_caps
+
+
+def extend_cap(cap, end_year):
+    """
+    Extends cap after its last year, continuing the average annual decline of the last ten years (floor of zero).
+    """
+    last_year = int(cap.index.max())
+    annual_decline = (cap.loc[last_year-10] - cap.loc[last_year]) / 10
+
+    for year in range(last_year+1, end_year+1):
+        cap.loc[year] = max(cap.loc[year-1] - annual_decline, 0)
+
+    return(cap)
+# end of extend_cap
+
+
+def extend_long_format_sheet(df, caps, end_year):
+    """
+    For sheets with columns 'name', 'year', 'data' (e.g., 'CA cap data'), adds rows for each year through end_year,
+    for each name with data through REAL_END_YEAR or later.
+    """
+    df = df.dropna(how='all')
+
+    new_rows = []
+    for name, group in df.dropna(subset=['year']).groupby('name', sort=False):
+        group = group.set_index('year')
+        last_year = int(group.index.max())
+        if last_year < REAL_END_YEAR:
+            # historical series or series with fixed end date; leave as is
+            continue
+
+        juris = 'QC' if str(name).startswith('QC') else 'CA'
+        last_row = group.loc[last_year]
+
+        for year in range(last_year+1, end_year+1):
+            new_row = last_row.copy()
+            new_row['name'] = name
+            new_row['year'] = year
+
+            if name == f'{juris}_cap':
+                new_row['data'] = caps[juris].loc[year]
+            elif 'fraction' in name or 'factor' in name:
+                # hold at last value
+                pass
+            else:
+                # scale by cap
+                new_row['data'] = last_row['data'] * caps[juris].loc[year] / caps[juris].loc[last_year]
+
+            if 'status' in new_row.index:
+                new_row['status'] = 'synthetic'
+            new_rows += [new_row]
+
+    if new_rows != []:
+        df = pd.concat([df, pd.DataFrame(new_rows)], sort=False)
+
+    return(df)
+# end of extend_long_format_sheet
+
+
+def extend_elec_alloc_sheet(df, caps, end_year):
+    """
+    For sheet 'CA elec alloc 2021-2030' (one column per year, with values formatted as text, e.g., '79,765\xa0'),
+    adds columns for each year through end_year, scaling last year's values by CA cap.
+    """
+    year_cols = [col for col in df.columns if str(col).strip('\xa0').isdigit()]
+    last_col = year_cols[-1]
+    last_year = int(str(last_col).strip('\xa0'))
+
+    last_values = pd.to_numeric(df[last_col].astype(str).str.replace('\xa0', '').str.replace(',', ''),
+                                errors='coerce')
+
+    for year in range(last_year+1, end_year+1):
+        scaled = last_values * caps['CA'].loc[year] / caps['CA'].loc[last_year]
+        df[f'{year}\xa0'] = scaled.map(lambda x: '' if pd.isnull(x) else f'{int(round(x)):,}\xa0')
+
+    # keep other columns (e.g., 'units') after year columns
+    other_cols = [col for col in df.columns if str(col).strip('\xa0').isdigit() == False]
+    year_cols = [col for col in df.columns if str(col).strip('\xa0').isdigit() == True]
+    df = df[[other_cols[0]] + year_cols + other_cols[1:]]
+
+    return(df)
+# end of extend_elec_alloc_sheet
+
+
+def extend_year_rows(df, caps, end_year, scale_cols=[]):
+    """
+    For sheets with one row per year in column 'year' (e.g., 'emissions & obligations'), adds rows through end_year.
+
+    Columns in scale_cols are scaled by CA cap; other columns are left empty (i.e., to be projected by model).
+    """
+    df = df.dropna(how='all')
+    last_year = int(df['year'].max())
+    last_row = df.loc[df['year']==last_year].iloc[0]
+
+    new_rows = []
+    for year in range(last_year+1, end_year+1):
+        new_row = pd.Series(np.NaN, index=df.columns)
+        new_row['year'] = year
+        for col in scale_cols:
+            new_row[col] = last_row[col] * caps['CA'].loc[year] / caps['CA'].loc[last_year]
+        if 'units' in df.columns:
+            new_row['units'] = last_row['units']
+        new_rows += [new_row]
+
+    if new_rows != []:
+        df = pd.concat([df, pd.DataFrame(new_rows)], sort=False)
+
+    return(df)
+# end of extend_year_rows
+
+
+def extend_horizon(sheets, end_year):
+    """
+    Extends all series in input file that run through REAL_END_YEAR, so that they run through end_year.
+    """
+    caps = get_caps(sheets)
+    for juris in caps:
+        caps[juris] = extend_cap(caps[juris], end_year)
+
+    for sheet_name, df in sheets.items():
+        if set(['name', 'year', 'data']).issubset(df.columns):
+            sheets[sheet_name] = extend_long_format_sheet(df, caps, end_year)
+
+        elif sheet_name == 'CA elec alloc 2021-2030':
+            sheets[sheet_name] = extend_elec_alloc_sheet(df, caps, end_year)
+
+        elif sheet_name == 'CA allocations projection':
+            scale_cols = [col for col in df.columns if col not in ['year', 'units', 'source', 'notes']]
+            sheets[sheet_name] = extend_year_rows(df, caps, end_year, scale_cols)
+
+        elif sheet_name == 'emissions & obligations':
+            # projection years are empty; model projects emissions from user settings
+            sheets[sheet_name] = extend_year_rows(df, caps, end_year)
+
+        else:
+            # historical data only
+            pass
+
+    return(sheets)
+# end of extend_horizon
+
+
+# ## Functions: Shorten history
+# * shorten_history
+
+# In[ ]:
+
+
+def shorten_history(sheets, CIR_sheets, last_hist_quarter):
+    """
+    Drops historical data after last_hist_quarter (e.g., '2016Q4') from input file, and later CIR sheets.
+    """
+    last_q = pd.Period(last_hist_quarter, freq='Q')
+
+    # historical data with dates in a column
+    date_cols = {'quarterly auctions': 'Auction date',
+                 'QC allocations': 'allocation date',
+                 'reserve & PCU sales': 'date of sale'}
+    for sheet_name, col in date_cols.items():
+        if sheet_name in sheets:
+            df = sheets[sheet_name].dropna(how='all')
+            quarters = pd.to_datetime(df[col]).dt.to_period('Q')
+            sheets[sheet_name] = df.loc[quarters <= last_q]
+
+    # historical data by year
+    if 'annual auction notices' in sheets:
+        df = sheets['annual auction notices'].dropna(how='all')
+        sheets['annual auction notices'] = df.loc[(df['vintage'] <= last_q.year) | df['data'].isnull()]
+
+    if 'annual compliance reports' in sheets:
+        df = sheets['annual compliance reports'].dropna(how='all')
+        # first column is year of compliance event
+        sheets['annual compliance reports'] = df.loc[df[df.columns[0]] <= last_q.year]
+
+    if 'emissions & obligations' in sheets:
+        df = sheets['emissions & obligations'].copy()
+        data_cols = [col for col in df.columns if col not in ['year', 'units', 'source', 'notes']]
+        df.loc[df['year'] > last_q.year - 1, data_cols] = np.NaN
+        sheets['emissions & obligations'] = df
+
+    # CIR sheets named like '2018 Q3'; latest first
+    CIR_sheets = {sheet_name: df for sheet_name, df in CIR_sheets.items()
+                  if pd.Period(sheet_name.replace(' ', ''), freq='Q') <= last_q}
+
+    return(sheets, CIR_sheets)
+# end of shorten_history
+
+
+# ## Functions: Main
+# * create_synthetic_inputs
+# * main
+
+# In[ ]:
+
+
+def create_synthetic_inputs(input_file, CIR_file, out_dir, end_year=None, last_hist_quarter=None):
+    """
+    Creates synthetic data input file & CIR in out_dir (see notes at top of file).
+
+    Raises ValueError if end_year is beyond the model's horizon (MODEL_END_YEAR).
+    """
+    if end_year != None and end_year > MODEL_END_YEAR:
+        raise ValueError(f"end_year {end_year} is beyond the model's horizon ({MODEL_END_YEAR}); "
+                         f"the model would ignore data after {MODEL_END_YEAR}")
+
+    sheets = read_workbook(input_file)
+    CIR_sheets = read_workbook(CIR_file, header=None)
+
+    if end_year != None and end_year > REAL_END_YEAR:
+        sheets = extend_horizon(sheets, end_year)
+
+    if last_hist_quarter != None:
+        sheets, CIR_sheets = shorten_history(sheets, CIR_sheets, last_hist_quarter)
+
+    # record settings in contents sheet (after rows read by model for file version)
+    contents = sheets['contents']
+    note = pd.DataFrame({contents.columns[0]: [
+        f"synthetic input file: end_year {end_year}, last_hist_quarter {last_hist_quarter}"]})
+    sheets['contents'] = pd.concat([contents, note], sort=False)
+
+    os.makedirs(out_dir, exist_ok=True)
+    write_workbook(sheets, f"{out_dir}/data_input_file.xlsx")
+    write_workbook(CIR_sheets, f"{out_dir}/CIR_file.xlsx", header=False)
+
+    print(f"saved synthetic input files to {out_dir}")
+# end of create_synthetic_inputs
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Create synthetic input files for WCI-RULES scaling benchmarks.")
+    parser.add_argument('--input-file', default=f'{ONLINE_FILE_HOSTING}/{INPUT_FILE_NAME}')
+    parser.add_argument('--CIR-file', default=f'{ONLINE_FILE_HOSTING}/{CIR_FILE_NAME}')
+    parser.add_argument('--end-year', type=int, default=None,
+                        help=f"last year of input series; at most {MODEL_END_YEAR} (model's horizon)")
+    parser.add_argument('--last-hist-quarter', default=None)
+    parser.add_argument('--out-dir', required=True)
+    args = parser.parse_args()
+
+    if args.end_year != None and args.end_year > MODEL_END_YEAR:
+        parser.error(f"--end-year {args.end_year} is beyond the model's horizon ({MODEL_END_YEAR}); "
+                     f"the model would ignore data after {MODEL_END_YEAR}")
+
+    create_synthetic_inputs(args.input_file, args.CIR_file, args.out_dir,
+                            end_year=args.end_year, last_hist_quarter=args.last_hist_quarter)
+# end of main
+
+
+if __name__ == '__main__':
+    main()